@@ -0,0 +1,473 @@
+"""
+Benchmark del motor de backup y de la subida a Drive.
+
+Genera los datasets sintéticos (benchmarks/dataset.py) y ejecuta cada
+combinación de dataset, modo del motor, nivel de compresión y encriptación
+en un proceso nuevo, para que el pico de memoria sea solo el de ese caso.
+De cada caso se guarda: archivos/s, MB/s, tiempo de CPU, pico de RSS y
+ratio de salida. Las subidas se miden contra un Drive simulado local.
+
+Uso (desde la raíz del repositorio):
+    python src/benchmarks/backup_bench.py --escala 0.1 --salida bench.json
+    python src/benchmarks/backup_bench.py --datasets texto media --modos paralelo zstd
+    python src/benchmarks/backup_bench.py --subidas --salida bench.json
+    python src/benchmarks/backup_bench.py --comparar base.json --salida nuevo.json
+    python src/benchmarks/backup_bench.py --sin-backups --memoria 10000 100000 1000000
+    python src/benchmarks/backup_bench.py --sin-backups --troceado
+
+Con --comparar se muestra, por caso, la diferencia de MB/s y ratio frente a
+un resultado anterior. Con --memoria se mide el pico de RSS del backup de
+árboles de N archivos diminutos, con el modo normal y con el de memoria
+baja, para ver cómo crece la memoria con el número de archivos. Con
+--troceado se mide la velocidad del troceado por contenido del repositorio
+deduplicado y se comprueba que corta igual que la versión de referencia.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parents[1]
+if str(SRC) not in sys.path:
+    sys.path.insert(0, str(SRC))
+
+from benchmarks.dataset import DATASETS, generar_dataset, tamano_dataset  # noqa: E402
+from core.backup_engine import obtener_codec  # noqa: E402
+
+NIVELES = ("Bajo", "Medio", "Alto")
+
+# modo -> (codec, workers, adaptativa, variante)
+MODOS = {
+    "secuencial": ("deflate", 1, False, None),
+    "paralelo": ("deflate", None, False, None),
+    "adaptativa": ("deflate", None, True, None),
+    "incremental": ("deflate", None, False, "incremental"),
+    "volumenes": ("deflate", None, False, "volumenes"),
+    "bzip2": ("bzip2", None, False, None),
+    "lzma": ("lzma", None, False, None),
+    "zstd": ("zstd", None, False, None),
+    "memoria_baja": ("deflate", None, False, "memoria_baja"),
+}
+# Un millón de archivos a escala 1: solo se mide si se pide (o con --memoria)
+DATASETS_POR_DEFECTO = [nombre for nombre in DATASETS if nombre != "diminutos"]
+
+TAMANO_VOLUMEN = 64 * 1024 * 1024
+PASSWORD = "benchmark"
+
+
+def _pico_rss():
+    """Pico de memoria residente del proceso en bytes (None si no se puede medir)."""
+    # En Linux ru_maxrss conserva el pico del proceso padre de antes del exec
+    # (el de "spawn" tiene la lista del dataset en memoria); VmHWM no
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for linea in f:
+                if linea.startswith("VmHWM:"):
+                    return int(linea.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        # peak_wset solo existe en Windows
+        return getattr(psutil.Process().memory_info(), "peak_wset", None)
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo da en KB y macOS en bytes
+    return pico if sys.platform == "darwin" else pico * 1024
+
+
+def _tamano_salida(destino: Path) -> int:
+    return sum(p.stat().st_size for p in destino.parent.iterdir() if p.is_file())
+
+
+def _ejecutar_caso(caso: dict) -> dict:
+    """Se ejecuta en un proceso hijo: hace un backup y mide."""
+    from core.backup_engine import crear_backup
+    from core.compression_policy import PoliticaCompresion
+    from core.encryption import ruta_contenedor
+    from core.integrity import verificar_backup
+    from core.volumes import verificar_volumenes
+
+    codec_nombre, workers, adaptativa, variante = MODOS[caso["modo"]]
+    codec = obtener_codec(codec_nombre)
+    nivel = codec.nivel(caso["nivel"])
+    politica = PoliticaCompresion(nivel, metodo=codec.metodo_zip) if adaptativa else None
+    origen = Path(caso["origen"])
+
+    salida = Path(tempfile.mkdtemp(prefix="bench-", dir=caso["carpeta_trabajo"]))
+    destino = salida / f"backup{codec.extension}"
+    if caso["cifrado"] == "contenedor":
+        destino = ruta_contenedor(destino)
+    comunes = dict(
+        carpeta_origen=origen,
+        destino_zip=destino,
+        nivel_compresion=nivel,
+        excluir_temporales=False,
+        encriptar=caso["encriptar"],
+        password=PASSWORD if caso["encriptar"] else None,
+        workers=workers,
+        politica=politica,
+        codec=codec_nombre,
+    )
+
+    cpu = time.process_time()
+    inicio = time.perf_counter()
+    try:
+        if variante == "incremental":
+            from core.incremental import crear_backup_incremental
+
+            archivos, _ = crear_backup_incremental(**comunes, forzar_completo=True)
+        elif variante == "volumenes":
+            from core.volumes import crear_backup_volumenes
+
+            archivos, indice = crear_backup_volumenes(**comunes, tamano_volumen=TAMANO_VOLUMEN)
+        else:
+            archivos = crear_backup(
+                **comunes, cifrado=caso["cifrado"] or "winzip", memoria_baja=variante == "memoria_baja"
+            )
+        segundos = time.perf_counter() - inicio
+        cpu = time.process_time() - cpu
+        bytes_salida = _tamano_salida(destino)
+        # La verificación lee el directorio central entero: el pico del backup se toma antes
+        pico_backup = _pico_rss()
+
+        # La verificación se mide aparte: es una etapa opcional del trabajo
+        inicio = time.perf_counter()
+        if variante == "volumenes":
+            _, errores = verificar_volumenes(indice, comunes["password"], workers)
+        else:
+            _, errores = verificar_backup(destino, comunes["password"], workers)
+        verificacion = time.perf_counter() - inicio
+        if errores:
+            raise RuntimeError(f"El backup no supera la verificación: {errores[0]}")
+    finally:
+        shutil.rmtree(salida, ignore_errors=True)
+
+    mb = caso["bytes"] / (1024 * 1024)
+    pico = _pico_rss()
+    return {
+        "archivos": archivos,
+        "segundos": round(segundos, 3),
+        "archivos_s": round(archivos / segundos, 1) if segundos else None,
+        "mb_s": round(mb / segundos, 2) if segundos else None,
+        "cpu_s": round(cpu, 3),
+        "verificacion_s": round(verificacion, 3),
+        "pico_rss_mb": round(pico / (1024 * 1024), 1) if pico else None,
+        "pico_rss_backup_mb": round(pico_backup / (1024 * 1024), 1) if pico_backup else None,
+        "bytes_salida": bytes_salida,
+        "ratio": round(bytes_salida / caso["bytes"], 4) if caso["bytes"] else None,
+    }
+
+
+def _clave(resultado: dict) -> str:
+    # "aes" es WinZip AES, el único cifrado de los historiales anteriores (sin "cifrado")
+    if resultado.get("cifrado") == "contenedor":
+        cifrado = "aes-gcm"
+    else:
+        cifrado = "aes" if resultado.get("encriptar") else "plano"
+    return f"{resultado['dataset']}/{resultado['modo']}/{resultado['nivel']}/{cifrado}"
+
+
+def _casos(args, carpetas: dict):
+    """Combinaciones a medir. Los niveles que el codec no distingue se miden una vez."""
+    for dataset in args.datasets:
+        archivos, tamano = tamano_dataset(carpetas[dataset])
+        for modo in args.modos:
+            codec = obtener_codec(MODOS[modo][0])
+            niveles_reales = set()
+            for nivel in args.niveles:
+                if codec.nivel(nivel) in niveles_reales:
+                    continue
+                niveles_reales.add(codec.nivel(nivel))
+                cifrados = [None] if args.sin_encriptacion else [None, "winzip", "contenedor"]
+                for cifrado in cifrados:
+                    if cifrado == "winzip" and not codec.es_zip:
+                        continue
+                    # El contenedor no se combina con incremental ni volúmenes
+                    if cifrado == "contenedor" and MODOS[modo][3]:
+                        continue
+                    yield {
+                        "dataset": dataset,
+                        "modo": modo,
+                        "nivel": nivel,
+                        "encriptar": cifrado is not None,
+                        "cifrado": cifrado,
+                        "origen": str(carpetas[dataset]),
+                        "archivos_origen": archivos,
+                        "bytes": tamano,
+                        "carpeta_trabajo": str(args.carpeta),
+                    }
+
+
+def _medir_caso(caso: dict) -> dict:
+    # "spawn" en todas las plataformas: cada caso empieza con la memoria limpia
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        try:
+            return pool.apply(_ejecutar_caso, (caso,))
+        except Exception as e:
+            return {"error": str(e)}
+
+
+def medir_backups(args, carpetas: dict) -> list:
+    resultados = []
+    casos = list(_casos(args, carpetas))
+    for i, caso in enumerate(casos, start=1):
+        medida = _medir_caso(caso)
+        resultado = {k: caso[k] for k in ("dataset", "modo", "nivel", "encriptar", "cifrado", "archivos_origen", "bytes")}
+        resultado.update(medida)
+        resultados.append(resultado)
+
+        if "error" in medida:
+            print(f"[{i}/{len(casos)}] {_clave(resultado)}: ERROR {medida['error']}")
+        else:
+            print(
+                f"[{i}/{len(casos)}] {_clave(resultado)}: {medida['mb_s']} MB/s, {medida['archivos_s']} archivos/s, "
+                f"CPU {medida['cpu_s']} s, RSS {medida['pico_rss_mb']} MB, ratio {medida['ratio']}, "
+                f"verificación {medida['verificacion_s']} s"
+            )
+    return resultados
+
+
+def medir_memoria(args) -> list:
+    """Pico de RSS del backup (sin la verificación) según el número de archivos, con y sin memoria baja."""
+    resultados = []
+    for cantidad in args.memoria:
+        print(f"Preparando {cantidad} archivos diminutos...")
+        # Cada cantidad en su carpeta: así se reutilizan entre ejecuciones
+        carpeta = generar_dataset("diminutos", args.carpeta / "datasets" / f"memoria-{cantidad}", cantidad / 1_000_000)
+        archivos, tamano = tamano_dataset(carpeta)
+        for modo in ("paralelo", "memoria_baja"):
+            caso = {
+                "dataset": "diminutos",
+                "modo": modo,
+                "nivel": "Bajo",
+                "encriptar": False,
+                "cifrado": None,
+                "origen": str(carpeta),
+                "archivos_origen": archivos,
+                "bytes": tamano,
+                "carpeta_trabajo": str(args.carpeta),
+            }
+            medida = _medir_caso(caso)
+            resultado = {"archivos_origen": archivos, "modo": modo, **medida}
+            resultados.append(resultado)
+            if "error" in medida:
+                print(f"  {archivos} archivos, {modo}: ERROR {medida['error']}")
+            else:
+                print(
+                    f"  {archivos} archivos, {modo}: RSS backup {medida['pico_rss_backup_mb']} MB, "
+                    f"con verificación {medida['pico_rss_mb']} MB, {medida['archivos_s']} archivos/s"
+                )
+    return resultados
+
+
+def _cortes_referencia(datos) -> list:
+    from core.chunk_store import TAMANO_MAX, TAMANO_MIN, _buscar_corte_python
+
+    cortes = []
+    resto = memoryview(datos)
+    while resto:
+        corte = _buscar_corte_python(resto, min(len(resto), TAMANO_MAX)) if len(resto) > TAMANO_MIN else len(resto)
+        cortes.append(corte)
+        resto = resto[corte:]
+    return cortes
+
+
+def medir_troceado(args) -> dict:
+    """MB/s de chunk_store.trocear y de la versión byte a byte, y si ambas dan los mismos cortes."""
+    import io
+
+    from core.chunk_store import _tabla_numpy, trocear
+
+    datos = os.urandom(max(32 * 1024 * 1024, int(256 * 1024 * 1024 * args.escala)))
+    inicio = time.perf_counter()
+    cortes = [len(trozo) for trozo in trocear(io.BytesIO(datos))]
+    segundos = time.perf_counter() - inicio
+
+    # La referencia va a unos pocos MB/s: basta con comparar el principio
+    muestra = 16 * 1024 * 1024
+    inicio = time.perf_counter()
+    referencia = _cortes_referencia(datos[:muestra])
+    segundos_referencia = time.perf_counter() - inicio
+    obtenidos = [len(trozo) for trozo in trocear(io.BytesIO(datos[:muestra]))]
+
+    mb = len(datos) / (1024 * 1024)
+    resultado = {
+        "numpy": _tabla_numpy() is not None,
+        "bytes": len(datos),
+        "trozos": len(cortes),
+        "segundos": round(segundos, 3),
+        "mb_s": round(mb / segundos, 2),
+        "mb_s_referencia": round(muestra / (1024 * 1024) / segundos_referencia, 2),
+        "cortes_iguales": obtenidos == referencia,
+    }
+    print(
+        f"Troceado: {resultado['mb_s']} MB/s (byte a byte {resultado['mb_s_referencia']} MB/s), "
+        f"{resultado['trozos']} trozos, cortes iguales: {'sí' if resultado['cortes_iguales'] else 'NO'}"
+    )
+    return resultado
+
+
+def _http_sin_redirecciones():
+    import httplib2
+
+    # Para Drive, 308 significa "trozo recibido", no una redirección
+    http = httplib2.Http()
+    http.redirect_codes = http.redirect_codes - {308}
+    return http
+
+
+def medir_subidas(args) -> list:
+    """Sube archivos generados al Drive simulado con varios tamaños de trozo y paralelismo."""
+    from benchmarks.mock_drive import DriveSimulado
+    from core.drive_upload import MULTIPLO_CHUNK, MotorSubida, SesionesSubida
+
+    carpeta = args.carpeta / "subidas"
+    carpeta.mkdir(parents=True, exist_ok=True)
+    tamano = max(MULTIPLO_CHUNK, int(64 * 1024 * 1024 * args.escala))
+    rutas = []
+    for i in range(3):
+        ruta = carpeta / f"subida{i}.bin"
+        if not ruta.exists() or ruta.stat().st_size != tamano:
+            with open(ruta, "wb") as f:
+                f.write(os.urandom(tamano))
+        rutas.append(ruta)
+
+    resultados = []
+    with DriveSimulado(latencia_s=args.latencia_ms / 1000) as drive:
+        for chunk_mb in (1, 4, 16):
+            for paralelas in (1, 3):
+                # Sesiones de otra ejecución apuntarían a un servidor que ya no existe
+                (carpeta / "sesiones.json").unlink(missing_ok=True)
+                sesiones = SesionesSubida(carpeta / "sesiones.json")
+                motor = MotorSubida(
+                    _http_sin_redirecciones, chunksize=chunk_mb * 4 * MULTIPLO_CHUNK, sesiones=sesiones, url_subida=drive.url_subida
+                )
+                inicio = time.perf_counter()
+                if paralelas == 1:
+                    for ruta in rutas:
+                        motor.subir(ruta)
+                else:
+                    errores = [r for r in motor.subir_varios(rutas, workers=paralelas).values() if isinstance(r, Exception)]
+                    if errores:
+                        raise errores[0]
+                segundos = time.perf_counter() - inicio
+
+                mb = len(rutas) * tamano / (1024 * 1024)
+                resultado = {
+                    "chunk_mb": chunk_mb,
+                    "paralelas": paralelas,
+                    "latencia_ms": args.latencia_ms,
+                    "bytes": len(rutas) * tamano,
+                    "segundos": round(segundos, 3),
+                    "mb_s": round(mb / segundos, 2),
+                }
+                resultados.append(resultado)
+                print(f"Subida trozos de {chunk_mb} MB x{paralelas}: {resultado['mb_s']} MB/s")
+    return resultados
+
+
+def comparar(anterior: dict, actual: dict):
+    base = {_clave(r): r for r in anterior.get("backups", []) if "error" not in r}
+    print(f"\nComparación con {anterior.get('version') or anterior.get('fecha')}:")
+    for r in actual["backups"]:
+        previo = base.get(_clave(r))
+        if previo is None or "error" in r:
+            continue
+        cambio = (r["mb_s"] / previo["mb_s"] - 1) * 100 if previo["mb_s"] else 0
+        print(f"  {_clave(r)}: {previo['mb_s']} -> {r['mb_s']} MB/s ({cambio:+.1f}%), ratio {previo['ratio']} -> {r['ratio']}")
+
+
+def _version() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=SRC, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de backups y subidas")
+    parser.add_argument("--datasets", nargs="+", choices=list(DATASETS), default=list(DATASETS_POR_DEFECTO))
+    parser.add_argument("--modos", nargs="+", choices=list(MODOS), default=list(MODOS))
+    parser.add_argument("--niveles", nargs="+", choices=NIVELES, default=list(NIVELES))
+    parser.add_argument("--escala", type=float, default=0.1, help="Tamaño de los datasets (1.0 = completo)")
+    parser.add_argument("--sin-encriptacion", action="store_true", help="No medir los casos con AES")
+    parser.add_argument("--sin-backups", action="store_true", help="Medir solo las subidas")
+    parser.add_argument("--subidas", action="store_true", help="Medir también la subida contra un Drive simulado")
+    parser.add_argument(
+        "--memoria", type=int, nargs="+", metavar="N",
+        help="Medir el pico de memoria con árboles de N archivos diminutos (modo normal y de memoria baja)",
+    )
+    parser.add_argument(
+        "--troceado", action="store_true", help="Medir el troceado por contenido del repositorio deduplicado"
+    )
+    parser.add_argument("--latencia-ms", type=float, default=0, help="Latencia simulada por petición de subida")
+    parser.add_argument("--carpeta", type=Path, default=Path(tempfile.gettempdir()) / "backtomatic-bench")
+    parser.add_argument("--salida", type=Path, help="Archivo JSON de resultados")
+    parser.add_argument("--comparar", type=Path, help="Resultados anteriores con los que comparar")
+    args = parser.parse_args(argv)
+
+    if "zstd" in args.modos:
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            print("zstandard no está instalado: se omite el modo zstd")
+            args.modos.remove("zstd")
+
+    args.carpeta.mkdir(parents=True, exist_ok=True)
+    resultado = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "version": _version(),
+        "python": sys.version.split()[0],
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+        "escala": args.escala,
+        "backups": [],
+        "subidas": [],
+        "memoria": [],
+        "troceado": None,
+    }
+
+    if not args.sin_backups:
+        carpetas = {}
+        for dataset in args.datasets:
+            print(f"Preparando dataset {dataset}...")
+            carpetas[dataset] = generar_dataset(dataset, args.carpeta / "datasets", args.escala)
+        resultado["backups"] = medir_backups(args, carpetas)
+
+    if args.subidas:
+        resultado["subidas"] = medir_subidas(args)
+
+    if args.memoria:
+        resultado["memoria"] = medir_memoria(args)
+
+    if args.troceado:
+        resultado["troceado"] = medir_troceado(args)
+
+    if args.comparar:
+        comparar(json.loads(args.comparar.read_text(encoding="utf-8")), resultado)
+
+    if args.salida:
+        args.salida.write_text(json.dumps(resultado, indent=2), encoding="utf-8")
+        print(f"\nResultados guardados en {args.salida}")
+    if resultado["troceado"] and not resultado["troceado"]["cortes_iguales"]:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
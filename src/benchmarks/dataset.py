@@ -0,0 +1,135 @@
+"""
+Generador de carpetas sintéticas y reproducibles para los benchmarks.
+
+La misma semilla y escala producen siempre los mismos archivos, así que los
+resultados de dos versiones del proyecto se pueden comparar. Cada carpeta
+guarda un `.dataset.json` y no se regenera si ya coincide.
+"""
+import json
+import random
+import shutil
+from pathlib import Path
+
+VERSION_DATASET = 1
+SEMILLA = 1234
+
+PALABRAS = (
+    "backup copia archivo carpeta error aviso usuario proceso servidor disco red "
+    "inicio fin tiempo datos bloque zip drive subida nivel compresión registro"
+).split()
+
+# Cabeceras reales para que la compresión adaptativa los reconozca por firma
+CABECERAS_MEDIA = {".jpg": b"\xff\xd8\xff\xe0", ".mp4": b"\x00\x00\x00\x18ftypmp42", ".png": b"\x89PNG\r\n\x1a\n"}
+
+
+def _texto(rng: random.Random, tamano: int) -> bytes:
+    """Texto tipo log: muy compresible."""
+    lineas = []
+    total = 0
+    while total < tamano:
+        linea = f"2024-01-{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d} " + " ".join(
+            rng.choices(PALABRAS, k=rng.randint(4, 12))
+        ) + "\n"
+        lineas.append(linea)
+        total += len(linea)
+    return "".join(lineas).encode("utf-8")[:tamano]
+
+
+def _aleatorio(rng: random.Random, tamano: int) -> bytes:
+    return rng.randbytes(tamano)
+
+
+def _pequenos(carpeta: Path, rng: random.Random, escala: float):
+    # Muchos archivos diminutos: mide el coste por archivo, no por byte
+    for i in range(int(20000 * escala)):
+        sub = carpeta / f"d{i // 500:03d}"
+        sub.mkdir(exist_ok=True)
+        (sub / f"f{i:06d}.txt").write_bytes(_texto(rng, rng.randint(0, 4096)))
+
+
+def _grandes(carpeta: Path, rng: random.Random, escala: float):
+    # Pocos archivos enormes, mitad texto y mitad aleatorio por bloques
+    tamano = int(256 * 1024 * 1024 * escala)
+    bloque = 1024 * 1024
+    for i in range(2):
+        with open(carpeta / f"grande{i}.bin", "wb") as f:
+            for j in range(max(1, tamano // bloque)):
+                f.write(_texto(rng, bloque) if j % 2 else _aleatorio(rng, bloque))
+
+
+def _media(carpeta: Path, rng: random.Random, escala: float):
+    # Ya comprimidos: deflate no gana nada
+    extensiones = list(CABECERAS_MEDIA)
+    for i in range(int(60 * escala) or 1):
+        ext = extensiones[i % len(extensiones)]
+        datos = CABECERAS_MEDIA[ext] + _aleatorio(rng, rng.randint(512 * 1024, 4 * 1024 * 1024))
+        (carpeta / f"media{i:04d}{ext}").write_bytes(datos)
+
+
+def _texto_compresible(carpeta: Path, rng: random.Random, escala: float):
+    for i in range(int(200 * escala) or 1):
+        (carpeta / f"log{i:04d}.log.txt").write_bytes(_texto(rng, 256 * 1024))
+
+
+def _profundo(carpeta: Path, rng: random.Random, escala: float):
+    # Anidamiento profundo: ramas de 40 niveles con pocos archivos por nivel
+    for rama in range(int(50 * escala) or 1):
+        ruta = carpeta
+        for nivel in range(40):
+            ruta = ruta / f"r{rama}n{nivel}"
+            ruta.mkdir()
+            (ruta / "dato.txt").write_bytes(_texto(rng, rng.randint(100, 2000)))
+
+
+def _diminutos(carpeta: Path, rng: random.Random, escala: float):
+    # Un millón de archivos de pocos bytes a escala 1: mide la memoria por archivo
+    for i in range(int(1_000_000 * escala) or 1):
+        sub = carpeta / f"d{i // 1000:04d}"
+        if i % 1000 == 0:
+            sub.mkdir()
+        (sub / f"f{i:07d}.txt").write_bytes(_texto(rng, rng.randint(0, 64)))
+
+
+DATASETS = {
+    "pequenos": _pequenos,
+    "grandes": _grandes,
+    "media": _media,
+    "texto": _texto_compresible,
+    "profundo": _profundo,
+    "diminutos": _diminutos,
+}
+
+
+def generar_dataset(nombre: str, carpeta_base: Path, escala: float = 1.0, semilla: int = SEMILLA) -> Path:
+    """Crea (o reutiliza) el dataset `nombre` en carpeta_base/nombre y devuelve su ruta."""
+    if nombre not in DATASETS:
+        raise ValueError(f"Dataset desconocido: {nombre}")
+
+    carpeta = Path(carpeta_base) / nombre
+    marca = carpeta / ".dataset.json"
+    descripcion = {"version": VERSION_DATASET, "nombre": nombre, "escala": escala, "semilla": semilla}
+    if marca.exists():
+        try:
+            if json.loads(marca.read_text(encoding="utf-8")) == descripcion:
+                return carpeta
+        except ValueError:
+            pass
+
+    shutil.rmtree(carpeta, ignore_errors=True)
+    carpeta.mkdir(parents=True)
+    # Cada dataset tiene su propia secuencia: no depende de cuáles se generen
+    rng = random.Random(f"{semilla}-{nombre}")
+    DATASETS[nombre](carpeta, rng, escala)
+    marca.write_text(json.dumps(descripcion), encoding="utf-8")
+    return carpeta
+
+
+def tamano_dataset(carpeta: Path) -> tuple:
+    """(archivos, bytes) del dataset, sin contar la marca."""
+    archivos = total = 0
+    # Sin lista: el dataset "diminutos" tiene un millón de archivos a escala 1
+    for p in Path(carpeta).rglob("*"):
+        if p.is_file() and p.name != ".dataset.json":
+            archivos += 1
+            total += p.stat().st_size
+    return archivos, total
@@ -0,0 +1,211 @@
+"""
+Servidor local que imita el protocolo de subida resumible de Google Drive.
+
+Solo implementa lo que usa MotorSubida: POST para abrir la sesión (responde
+con Location), PUT con Content-Range para cada trozo (308 con Range mientras
+falten bytes, 200 con {"id", "md5Checksum", "size"} al terminar) y la
+consulta de estado "bytes */total". No guarda los datos, solo su MD5.
+
+Para las descargas, `publicar(datos)` guarda un archivo y GET
+/files/ID?alt=media lo sirve respetando la cabecera Range ("bytes=a-b" o
+"bytes=-N"), como las que pide restore.ArchivoRemoto.
+
+`latencia_s` añade una espera a cada petición para simular la red.
+
+Para probar los reintentos, `inyectar(*fallos, metodo="PUT")` hace fallar
+las siguientes peticiones de ese método, una por fallo y en orden (None
+deja pasar una petición sin fallo):
+  - un código HTTP (503, 429...): se responde con él sin tocar la sesión;
+    404 o 410 además la borran, como una sesión caducada;
+  - "cortar": se cierra la conexión sin guardar el trozo ni responder;
+  - "perder_respuesta": se guarda el trozo y se cierra sin responder;
+  - "estancar": se descarta el trozo y se responde 308 sin avanzar.
+`caducar_sesiones()` descarta todas las sesiones abiertas.
+"""
+import hashlib
+import itertools
+import json
+import re
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Manejador(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _responder(self, codigo: int, cabeceras: dict = None, cuerpo: bytes = b""):
+        self.send_response(codigo)
+        for clave, valor in (cabeceras or {}).items():
+            self.send_header(clave, valor)
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def _leer_cuerpo(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _cortar(self):
+        # Sin respuesta: el cliente ve la conexión cerrada
+        self.close_connection = True
+
+    def do_POST(self):
+        servidor = self.server.drive
+        self._leer_cuerpo()
+        time.sleep(servidor.latencia_s)
+        servidor.peticiones["POST"] += 1
+        fallo = servidor.siguiente_fallo("POST")
+        if fallo == "cortar":
+            return self._cortar()
+        if fallo is not None:
+            return self._responder(fallo)
+        sesion = servidor.nueva_sesion(int(self.headers["X-Upload-Content-Length"]))
+        self._responder(200, {"Location": f"{servidor.url_base}/sesion/{sesion}"})
+
+    def do_PUT(self):
+        servidor = self.server.drive
+        datos = self._leer_cuerpo()
+        time.sleep(servidor.latencia_s)
+        servidor.peticiones["PUT"] += 1
+        servidor.bytes_recibidos += len(datos)
+
+        id_sesion = int(self.path.rsplit("/", 1)[1])
+        sesion = servidor.sesiones.get(id_sesion)
+        if sesion is None:
+            return self._responder(404)
+
+        fallo = servidor.siguiente_fallo("PUT")
+        if fallo == "cortar":
+            return self._cortar()
+        if fallo in (404, 410):
+            servidor.sesiones.pop(id_sesion, None)
+        if isinstance(fallo, int):
+            return self._responder(fallo)
+
+        rango = re.match(r"bytes (\d+)-(\d+)/(\d+)", self.headers.get("Content-Range", ""))
+        if rango and fallo != "estancar":
+            inicio = int(rango[1])
+            if inicio > sesion["recibidos"]:
+                return self._responder(400, cuerpo=b"offset incorrecto")
+            # Como Drive, lo que ya tenía de un trozo reenviado se ignora
+            nuevos = datos[sesion["recibidos"] - inicio:]
+            servidor.bytes_repetidos += len(datos) - len(nuevos)
+            sesion["md5"].update(nuevos)
+            sesion["recibidos"] += len(nuevos)
+        if fallo == "perder_respuesta":
+            return self._cortar()
+
+        if sesion["recibidos"] == sesion["total"]:
+            respuesta = {"id": f"mock-{id(sesion)}", "md5Checksum": sesion["md5"].hexdigest(), "size": str(sesion["total"])}
+            return self._responder(200, {"Content-Type": "application/json"}, json.dumps(respuesta).encode())
+
+        cabeceras = {"Range": f"bytes=0-{sesion['recibidos'] - 1}"} if sesion["recibidos"] else {}
+        self._responder(308, cabeceras)
+
+
+    def do_GET(self):
+        servidor = self.server.drive
+        time.sleep(servidor.latencia_s)
+
+        datos = servidor.archivos.get(self.path.split("?", 1)[0].rsplit("/", 1)[1])
+        if datos is None:
+            return self._responder(404)
+        servidor.peticiones_descarga += 1
+
+        rango = re.match(r"bytes=(\d*)-(\d*)$", self.headers.get("Range", ""))
+        if not rango:
+            servidor.bytes_servidos += len(datos)
+            return self._responder(200, cuerpo=datos)
+        if rango[1]:
+            inicio = int(rango[1])
+            fin = min(int(rango[2]), len(datos) - 1) if rango[2] else len(datos) - 1
+        else:
+            # Sufijo: los últimos N bytes
+            inicio, fin = max(0, len(datos) - int(rango[2])), len(datos) - 1
+        if inicio >= len(datos):
+            return self._responder(416, {"Content-Range": f"bytes */{len(datos)}"})
+        servidor.bytes_servidos += fin - inicio + 1
+        self._responder(206, {"Content-Range": f"bytes {inicio}-{fin}/{len(datos)}"}, datos[inicio:fin + 1])
+
+
+class DriveSimulado:
+    """
+    Arranca el servidor en un hilo (puerto libre en 127.0.0.1).
+
+        from googleapiclient.http import build_http
+
+        with DriveSimulado() as drive:
+            motor = MotorSubida(build_http, url_subida=drive.url_subida)
+
+    El cliente tiene que ser como el de drive_auth (build_http, que quita el
+    308 de redirect_codes): con httplib2.Http a secas el 308 de cada trozo se
+    toma por una redirección y falla con RedirectMissingLocation.
+    """
+
+    def __init__(self, latencia_s: float = 0.0):
+        self.latencia_s = latencia_s
+        self.sesiones = {}
+        self.archivos = {}
+        self.bytes_servidos = 0
+        self.peticiones_descarga = 0
+        # Subidas: peticiones por método, bytes de los PUT y los que Drive ya tenía
+        self.peticiones = Counter()
+        self.bytes_recibidos = 0
+        self.bytes_repetidos = 0
+        self._fallos = {"POST": deque(), "PUT": deque()}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._servidor = ThreadingHTTPServer(("127.0.0.1", 0), _Manejador)
+        self._servidor.daemon_threads = True
+        self._servidor.drive = self
+        self.url_base = f"http://127.0.0.1:{self._servidor.server_port}"
+        self.url_subida = f"{self.url_base}/upload"
+        self.url_descarga = f"{self.url_base}/files/{{}}?alt=media"
+        self._hilo = threading.Thread(target=self._servidor.serve_forever, daemon=True)
+        self._hilo.start()
+
+    def nueva_sesion(self, total: int) -> int:
+        with self._lock:
+            id_sesion = next(self._ids)
+            self.sesiones[id_sesion] = {"total": total, "recibidos": 0, "md5": hashlib.md5()}
+        return id_sesion
+
+    def inyectar(self, *fallos, metodo: str = "PUT"):
+        """Encola fallos para las próximas peticiones de `metodo` (ver el docstring del módulo)."""
+        with self._lock:
+            self._fallos[metodo].extend(fallos)
+
+    def siguiente_fallo(self, metodo: str):
+        with self._lock:
+            cola = self._fallos[metodo]
+            return cola.popleft() if cola else None
+
+    def pendientes(self) -> int:
+        """Fallos inyectados que aún no se han producido."""
+        with self._lock:
+            return sum(len(cola) for cola in self._fallos.values())
+
+    def caducar_sesiones(self):
+        with self._lock:
+            self.sesiones.clear()
+
+    def publicar(self, datos: bytes) -> str:
+        """Guarda un archivo para descargarlo; devuelve su ID."""
+        with self._lock:
+            id_archivo = f"archivo-{next(self._ids)}"
+            self.archivos[id_archivo] = datos
+        return id_archivo
+
+    def cerrar(self):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
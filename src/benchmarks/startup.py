@@ -0,0 +1,103 @@
+"""
+Benchmark de arranque de la interfaz.
+
+Mide, en un proceso nuevo cada vez (sin módulos ya importados):
+  - importacion_s: importar mainWin
+  - construccion_s: crear MainWin
+  - primer_pintado_s: desde el inicio del proceso hasta que la ventana es visible
+y anota qué librerías pesadas estaban cargadas en ese momento.
+
+Uso (desde la raíz del repositorio, necesita pantalla):
+    python src/benchmarks/startup.py --repeticiones 5 --salida bench_startup.json
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+from pathlib import Path
+
+RAIZ = Path(__file__).resolve().parents[2]
+SRC = RAIZ / "src"
+
+MODULOS_PESADOS = ("PIL", "googleapiclient", "google.auth", "google_auth_oauthlib")
+
+# Se ejecuta en el proceso hijo
+_HIJO = r"""
+import json, sys, time
+t0 = time.perf_counter()
+sys.path.insert(0, {src!r})
+import mainWin
+t1 = time.perf_counter()
+app = mainWin.MainWin()
+t2 = time.perf_counter()
+
+def medir():
+    app.wait_visibility()
+    app.update_idletasks()
+    t3 = time.perf_counter()
+    print(json.dumps({{
+        "importacion_s": t1 - t0,
+        "construccion_s": t2 - t1,
+        "primer_pintado_s": t3 - t0,
+        "modulos_cargados": [m for m in {modulos!r} if m in sys.modules],
+    }}))
+    app.destroy()
+
+app.after(0, medir)
+app.mainloop()
+"""
+
+
+def medir_una_vez() -> dict:
+    codigo = _HIJO.format(src=str(SRC), modulos=MODULOS_PESADOS)
+    # El cwd es la raíz del repositorio, como al lanzar la aplicación
+    salida = subprocess.run(
+        [sys.executable, "-c", codigo], cwd=RAIZ, capture_output=True, text=True, timeout=120
+    )
+    if salida.returncode != 0:
+        raise RuntimeError(f"El arranque falló:\n{salida.stderr.strip()}")
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Mide el tiempo de arranque de la interfaz")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--salida", type=Path, help="Archivo JSON al que se añaden los resultados")
+    args = parser.parse_args(argv)
+
+    medidas = []
+    for i in range(args.repeticiones):
+        medida = medir_una_vez()
+        medidas.append(medida)
+        print(f"[{i + 1}/{args.repeticiones}] primer pintado en {medida['primer_pintado_s'] * 1000:.0f} ms")
+
+    resultado = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "repeticiones": args.repeticiones,
+        # El primer arranque genera la caché del GIF; la mediana refleja los siguientes
+        "primer_arranque_s": medidas[0]["primer_pintado_s"],
+    }
+    for clave in ("importacion_s", "construccion_s", "primer_pintado_s"):
+        resultado[clave] = statistics.median(m[clave] for m in medidas)
+    resultado["modulos_cargados"] = medidas[-1]["modulos_cargados"]
+
+    print(
+        f"Mediana: importación {resultado['importacion_s'] * 1000:.0f} ms, "
+        f"construcción {resultado['construccion_s'] * 1000:.0f} ms, "
+        f"primer pintado {resultado['primer_pintado_s'] * 1000:.0f} ms"
+    )
+    if resultado["modulos_cargados"]:
+        print(f"Librerías pesadas cargadas al pintar: {', '.join(resultado['modulos_cargados'])}")
+
+    if args.salida:
+        historial = json.loads(args.salida.read_text(encoding="utf-8")) if args.salida.exists() else []
+        historial.append(resultado)
+        args.salida.write_text(json.dumps(historial, indent=2), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,655 @@
+"""
+BackTomatic sin interfaz gráfica.
+
+    python cli.py backup CARPETA [--destino backup.zip] [--subir] ...
+    python cli.py continuo CARPETA [--intervalo 30]
+    python cli.py subir backup.zip
+    python cli.py remotos [--trabajo NOMBRE]
+    python cli.py podar --retencion 7,4,12 [--simular]
+    python cli.py restaurar backup.zip CARPETA [--patron "docs/*"] [--punto N]
+    python cli.py restaurar backup.zip --puntos
+    python cli.py restaurar drive:ID_DE_DRIVE CARPETA [--patron "docs/*"]
+    python cli.py restaurar backup.zip.volumes.json CARPETA [--patron "docs/*"]
+    python cli.py descifrar backup.zip.btae [--destino backup.zip]
+    python cli.py verificar backup.zip
+    python cli.py repo snapshot CARPETA backup.repo
+    python cli.py repo listar backup.repo
+    python cli.py repo restaurar backup.repo CARPETA [--snapshot ID]
+    python cli.py repo borrar backup.repo ID
+    python cli.py repo limpiar backup.repo
+    python cli.py login
+    python cli.py codecs
+    python cli.py daemon --config trabajos.json
+
+No importa customtkinter ni PIL, así que funciona en servidores sin
+entorno gráfico.
+"""
+import argparse
+import os
+import signal
+import sys
+import threading
+from datetime import datetime
+from pathlib import Path
+
+from core.backup_engine import listar_codecs
+from core.progress import formatear_bytes, formatear_duracion
+
+
+_linea_progreso = False
+
+
+def log(texto: str):
+    global _linea_progreso
+    if _linea_progreso:
+        # Cierra la línea de progreso antes de escribir el mensaje
+        print(file=sys.stderr)
+        _linea_progreso = False
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] {texto}", flush=True)
+
+
+def _mostrar_progreso(texto: str):
+    global _linea_progreso
+    print(f"\r  {texto}", end="", file=sys.stderr, flush=True)
+    _linea_progreso = True
+
+
+def _progreso_consola(hechos, total):
+    if total:
+        _mostrar_progreso(f"{hechos}/{total} archivos")
+
+
+def _retencion(texto: str):
+    """Convierte "DIARIOS,SEMANALES,MENSUALES" (p. ej. "7,4,12") en una PoliticaRetencion."""
+    from core.retention import PoliticaRetencion
+
+    try:
+        diarios, semanales, mensuales = (int(n) for n in texto.split(","))
+        return PoliticaRetencion(diarios, semanales, mensuales)
+    except ValueError:
+        raise argparse.ArgumentTypeError("usa DIARIOS,SEMANALES,MENSUALES, p. ej. 7,4,12") from None
+
+
+def _aplicar_limites(args):
+    """Límites de velocidad y prioridad de las opciones comunes (--limite-lectura, --limite-subida, --baja-prioridad)."""
+    from core.throttle import bajar_prioridad, limitador_global
+
+    limitador = limitador_global()
+    limitador.fijar(getattr(args, "limite_lectura", None), getattr(args, "limite_subida", None))
+    if limitador.lectura.tasa or limitador.subida.tasa:
+        log(f"Límites de velocidad: {limitador.resumen()}")
+    if getattr(args, "baja_prioridad", False):
+        bajadas = bajar_prioridad()
+        log(f"Prioridad baja: {', '.join(bajadas) if bajadas else 'no se pudo cambiar'}")
+
+
+def _opciones_limites(p, lectura: bool = True):
+    if lectura:
+        p.add_argument("--limite-lectura", type=float, metavar="MB/S", help="Máximo de lectura de disco, compartido por todos los hilos")
+    p.add_argument("--limite-subida", type=float, metavar="MB/S", help="Máximo de subida a Drive")
+    p.add_argument("--baja-prioridad", action="store_true", help="Baja la prioridad de CPU y disco del proceso")
+
+
+def _eventos_consola(evento):
+    if evento.final:
+        velocidad = evento.bytes_leidos / evento.transcurrido if evento.transcurrido else 0
+        ratio = f", ratio {evento.ratio:.2f}" if evento.ratio is not None else ""
+        log(
+            f"Leídos {formatear_bytes(evento.bytes_leidos)}, escritos {formatear_bytes(evento.bytes_escritos)}"
+            f"{ratio}, {formatear_bytes(velocidad)}/s de media"
+        )
+        return
+    _mostrar_progreso(
+        f"{evento.archivos_hechos}/{evento.archivos_total} archivos - "
+        f"{formatear_bytes(evento.bytes_leidos)} de {formatear_bytes(evento.bytes_total or 0)} - "
+        f"{formatear_bytes(evento.velocidad_suavizada or 0)}/s - "
+        f"quedan {formatear_duracion(evento.restante)}   "
+    )
+
+
+def cmd_backup(args) -> int:
+    from core.checkpoint import BackupInterrumpido
+    from core.jobs import TrabajoBackup, admite_reanudar, ejecutar_trabajo
+
+    password = None
+    if args.password_env:
+        password = os.environ.get(args.password_env)
+        if not password:
+            log(f"La variable de entorno {args.password_env} está vacía")
+            return 2
+
+    trabajo = TrabajoBackup(
+        nombre=args.origen.name or "backup",
+        origen=args.origen,
+        destino=args.destino,
+        nivel=args.nivel,
+        formato=args.formato,
+        excluir_temporales=args.excluir_temporales,
+        incremental=args.incremental,
+        adaptativa=not args.sin_adaptativa,
+        subir=args.subir or args.streaming,
+        streaming=args.streaming,
+        password=password,
+        workers=args.workers,
+        volumen_mb=args.volumen_mb,
+        cifrado=args.cifrado,
+        verificar=not args.sin_verificar,
+        retencion=args.retencion,
+        reanudar=not args.desde_cero,
+        memoria_baja=args.memoria_baja,
+    )
+    detener = threading.Event()
+    if admite_reanudar(trabajo):
+        # Ctrl+C para al terminar el archivo en curso; el backup se reanuda en la próxima ejecución
+        def parar(signum, frame):
+            if detener.is_set():
+                raise KeyboardInterrupt
+            detener.set()
+            log("Parando en el siguiente punto seguro (Ctrl+C otra vez para salir ya)...")
+
+        signal.signal(signal.SIGINT, parar)
+        signal.signal(signal.SIGTERM, parar)
+
+    _aplicar_limites(args)
+    try:
+        ejecutar_trabajo(
+            trabajo, log_callback=log, eventos_callback=None if args.silencioso else _eventos_consola, detener=detener
+        )
+    except BackupInterrumpido as e:
+        log(str(e))
+        return 130
+    return 0
+
+
+def cmd_continuo(args) -> int:
+    from core.jobs import TrabajoBackup
+    from core.watcher import BackupContinuo
+
+    password = None
+    if args.password_env:
+        password = os.environ.get(args.password_env)
+        if not password:
+            log(f"La variable de entorno {args.password_env} está vacía")
+            return 2
+
+    trabajo = TrabajoBackup(
+        nombre=args.origen.name or "backup",
+        origen=args.origen,
+        destino=args.destino,
+        nivel=args.nivel,
+        excluir_temporales=args.excluir_temporales,
+        adaptativa=not args.sin_adaptativa,
+        password=password,
+        workers=args.workers,
+    )
+    continuo = BackupContinuo(
+        trabajo, intervalo_s=args.intervalo, espera_s=args.espera, sondeo=args.sondeo, log_callback=log
+    )
+
+    def detener(signum, frame):
+        continuo.parar()
+
+    signal.signal(signal.SIGINT, detener)
+    signal.signal(signal.SIGTERM, detener)
+
+    _aplicar_limites(args)
+    continuo.ejecutar()
+    return 0
+
+
+def cmd_subir(args) -> int:
+    from concurrent.futures import ThreadPoolExecutor
+
+    from core.drive_auth import get_drive_service
+    from core.drive_catalog import catalogo_compartido
+    from core.drive_upload import MULTIPLO_CHUNK, MotorSubida
+    from core.retention import marca_backup
+
+    faltan = [a for a in args.archivos if not a.is_file()]
+    if faltan:
+        log(f"No existe el archivo: {faltan[0]}")
+        return 2
+
+    _aplicar_limites(args)
+    service = get_drive_service(interactivo=False, permitir_login=False)
+    chunksize = max(1, round(args.chunk_mb * 1024 * 1024 / MULTIPLO_CHUNK)) * MULTIPLO_CHUNK
+    motor = MotorSubida.desde_servicio(service, chunksize=chunksize, reintentos=args.reintentos)
+    catalogo = catalogo_compartido(service)
+    # Los archivos de una misma orden (p. ej. volúmenes) cuentan como un solo backup
+    marca = marca_backup()
+
+    if len(args.archivos) == 1:
+        archivo = args.archivos[0]
+        log(f"Subiendo {archivo.name} a Google Drive...")
+        respuesta = catalogo.subir(
+            archivo,
+            args.trabajo,
+            marca,
+            progreso_callback=lambda hechos, total: _mostrar_progreso(f"{hechos * 100 // max(total, 1)}%"),
+            motor=motor,
+        )
+        log(f"Backup subido a Drive con ID: {respuesta['id']}")
+        return 0
+
+    def una(archivo):
+        try:
+            return archivo, catalogo.subir(archivo, args.trabajo, marca, motor=motor)
+        except Exception as e:
+            return archivo, e
+
+    log(f"Subiendo {len(args.archivos)} archivos a Google Drive ({args.paralelas} a la vez)...")
+    errores = 0
+    with ThreadPoolExecutor(max_workers=args.paralelas) as pool:
+        for archivo, respuesta in pool.map(una, args.archivos):
+            if isinstance(respuesta, Exception):
+                errores += 1
+                log(f"{archivo.name}: error: {respuesta}")
+            else:
+                log(f"{archivo.name}: subido con ID {respuesta['id']}")
+    return 1 if errores else 0
+
+
+def cmd_remotos(args) -> int:
+    from core.drive_auth import get_drive_service
+    from core.drive_catalog import catalogo_compartido
+
+    catalogo = catalogo_compartido(get_drive_service(interactivo=False, permitir_login=False))
+    cambios = catalogo.sincronizar()
+    log(f"Catálogo de Drive al día ({cambios} cambios)")
+    grupos = catalogo.backups(args.trabajo)
+    for (trabajo, marca), archivos in sorted(grupos.items(), key=lambda g: g[0][1]):
+        tamano = sum(a["tamano"] for a in archivos)
+        tipo = " incremental" if any(a["incremental"] for a in archivos) else ""
+        print(f"{marca}  {trabajo or '-':20} {len(archivos):3} archivos  {formatear_bytes(tamano):>10}{tipo}")
+    libre = catalogo.espacio_libre()
+    log(f"{len(grupos)} backups; espacio libre en Drive: {'sin límite' if libre is None else formatear_bytes(libre)}")
+    return 0
+
+
+def cmd_podar(args) -> int:
+    from core.drive_auth import get_drive_service
+    from core.drive_catalog import catalogo_compartido
+
+    catalogo = catalogo_compartido(get_drive_service(interactivo=False, permitir_login=False))
+    liberado, errores = catalogo.podar(args.retencion, args.trabajo, simular=args.simular, log_callback=log)
+    for error in errores:
+        log(f"Error: {error}")
+    accion = "Se liberarían" if args.simular else "Liberados"
+    log(f"{accion} {formatear_bytes(liberado)} en Drive (retención: {args.retencion.resumen()})")
+    return 1 if errores else 0
+
+
+def cmd_restaurar(args) -> int:
+    password = os.environ.get(args.password_env) if args.password_env else None
+    progreso = None if args.silencioso else _progreso_consola
+
+    if args.origen.endswith(".volumes.json"):
+        from core.volumes import restaurar_volumenes
+
+        restaurados, usados = restaurar_volumenes(
+            Path(args.origen), args.destino, patrones=args.patron or None, password=password, progreso_callback=progreso
+        )
+        log(f"Restaurados {restaurados} archivos en {args.destino} (volúmenes leídos: {', '.join(usados)})")
+        return 0
+
+    if not args.origen.startswith("drive:"):
+        from core.incremental import cargar_manifiesto
+
+        # Un backup.zip con backup.manifest.json es la base de una cadena incremental (o continua)
+        if not args.sin_cadena and cargar_manifiesto(Path(args.origen)) is not None:
+            return _restaurar_cadena(args, password, progreso)
+    if args.puntos or args.punto is not None:
+        log("--puntos y --punto solo sirven para el ZIP base de un backup incremental")
+        return 2
+
+    from core.restore import OrigenDrive, indice_drive, indice_local, restaurar_zip
+
+    origen = None
+    if args.origen.startswith("drive:"):
+        from core.drive_auth import get_drive_service
+
+        service = get_drive_service(interactivo=False, permitir_login=False)
+        origen = OrigenDrive.desde_servicio(service, args.origen[len("drive:"):])
+        indice = indice_drive(origen, password)
+        abrir = lambda: origen.abrir(indice.tamano_zip)
+    else:
+        ruta = Path(args.origen)
+        indice = indice_local(ruta, password)
+        abrir = lambda: open(ruta, "rb")
+
+    with indice:
+        if args.listar:
+            for i in indice.seleccionar(args.patron or None):
+                print(f"{formatear_bytes(indice.info(i).file_size):>10}  {indice.nombre(i)}")
+            return 0
+        restaurados, errores = restaurar_zip(
+            indice, abrir, args.destino, args.patron or None, password, args.workers, progreso
+        )
+
+    for error in errores:
+        log(f"Error: {error}")
+    descargado = f" (descargados {formatear_bytes(origen.descargados)})" if origen else ""
+    log(f"Restaurados {restaurados} archivos en {args.destino}{descargado}")
+    return 1 if errores else 0
+
+
+def _repositorio(ruta: Path):
+    from core.chunk_store import ChunkStore
+
+    # ChunkStore crea las carpetas: solo se deja para "repo snapshot"
+    if not (ruta / "snapshots").is_dir():
+        raise ValueError(f"No es un repositorio deduplicado: {ruta}")
+    return ChunkStore(ruta)
+
+
+def cmd_repo_snapshot(args) -> int:
+    from core.jobs import TrabajoBackup, ejecutar_trabajo
+
+    trabajo = TrabajoBackup(
+        nombre=args.origen.name or "backup",
+        origen=args.origen,
+        destino=args.repositorio,
+        nivel=args.nivel,
+        excluir_temporales=args.excluir_temporales,
+        workers=args.workers,
+        verificar=not args.sin_verificar,
+        repositorio=True,
+    )
+    ejecutar_trabajo(trabajo, progreso_callback=None if args.silencioso else _progreso_consola, log_callback=log)
+    return 0
+
+
+def cmd_repo_listar(args) -> int:
+    snapshots = _repositorio(args.repositorio).listar_snapshots()
+    for snapshot_id, fecha, archivos in snapshots:
+        print(f"{snapshot_id}  {fecha}  {archivos:8} archivos")
+    log(f"{len(snapshots)} snapshots en {args.repositorio}")
+    return 0
+
+
+def cmd_repo_restaurar(args) -> int:
+    repositorio = _repositorio(args.repositorio)
+    snapshot_id = args.snapshot
+    if snapshot_id is None:
+        snapshots = repositorio.listar_snapshots()
+        if not snapshots:
+            log(f"El repositorio {args.repositorio} no tiene snapshots")
+            return 1
+        # Los ids empiezan por la fecha: el último es el más reciente
+        snapshot_id = snapshots[-1][0]
+
+    progreso = None if args.silencioso else _progreso_consola
+    restaurados = repositorio.restaurar_snapshot(snapshot_id, args.destino, progreso)
+    log(f"Restaurados {restaurados} archivos del snapshot {snapshot_id} en {args.destino}")
+    return 0
+
+
+def cmd_repo_borrar(args) -> int:
+    _repositorio(args.repositorio).borrar_snapshot(args.snapshot)
+    log(f"Snapshot {args.snapshot} borrado; 'repo limpiar' libera sus trozos")
+    return 0
+
+
+def cmd_repo_limpiar(args) -> int:
+    borrados, liberados = _repositorio(args.repositorio).recolectar_basura()
+    log(f"Borrados {borrados} trozos sin snapshot ({formatear_bytes(liberados)} liberados)")
+    return 0
+
+
+def _restaurar_cadena(args, password, progreso) -> int:
+    from core.incremental import archivos_en_punto, listar_puntos, restaurar_incremental
+
+    ruta = Path(args.origen)
+    if args.puntos:
+        for indice, fecha, tipo in listar_puntos(ruta):
+            print(f"{indice:4}  {fecha}  {tipo}")
+        return 0
+    if args.listar:
+        for rel in archivos_en_punto(ruta, args.punto, args.patron or None):
+            print(rel)
+        return 0
+
+    if progreso is not None:
+        progreso = lambda hechos, total: _mostrar_progreso(f"{hechos}/{total} puntos")
+    aplicados = restaurar_incremental(ruta, args.destino, args.punto, password, progreso, args.patron or None)
+    punto = "el último punto" if args.punto is None else f"el punto {args.punto}"
+    log(f"Restaurado {punto} de la cadena incremental en {args.destino} ({aplicados} puntos aplicados)")
+    return 0
+
+
+def cmd_verificar(args) -> int:
+    from core.integrity import verificar_backup
+    from core.volumes import verificar_volumenes
+
+    password = os.environ.get(args.password_env) if args.password_env else None
+    progreso = None if args.silencioso else _progreso_consola
+    if args.backup.name.endswith(".volumes.json"):
+        verificados, errores = verificar_volumenes(args.backup, password, args.workers, progreso)
+    else:
+        verificados, errores = verificar_backup(args.backup, password, args.workers, progreso)
+
+    for error in errores:
+        log(f"Error: {error}")
+    if errores:
+        log(f"{args.backup.name}: {len(errores)} errores de verificación")
+        return 1
+    log(f"{args.backup.name}: {verificados} archivos verificados correctamente")
+    return 0
+
+
+def cmd_descifrar(args) -> int:
+    from core.encryption import EXTENSION_CONTENEDOR, descifrar_contenedor
+
+    password = os.environ.get(args.password_env)
+    if not password:
+        log(f"La variable de entorno {args.password_env} está vacía")
+        return 2
+
+    destino = args.destino
+    if destino is None:
+        if not args.contenedor.name.endswith(EXTENSION_CONTENEDOR):
+            log("Indica --destino: el archivo no termina en " + EXTENSION_CONTENEDOR)
+            return 2
+        destino = args.contenedor.with_name(args.contenedor.name[: -len(EXTENSION_CONTENEDOR)])
+
+    progreso = None if args.silencioso else lambda hechos, total: _mostrar_progreso(f"{hechos * 100 // max(total, 1)}%")
+    tamano = descifrar_contenedor(args.contenedor, destino, password, progreso)
+    log(f"Descifrado {destino} ({formatear_bytes(tamano)})")
+    return 0
+
+
+def cmd_login(args) -> int:
+    from core.drive_auth import TOKEN_PATH, get_drive_service
+
+    get_drive_service(interactivo=False)
+    log(f"Sesión iniciada. Token guardado en {TOKEN_PATH}")
+    return 0
+
+
+def cmd_codecs(args) -> int:
+    for codec in listar_codecs():
+        print(f"{codec.nombre:8} {codec.etiqueta:18} {codec.descripcion}")
+    return 0
+
+
+def cmd_daemon(args) -> int:
+    from core.scheduler import Planificador
+
+    planificador = Planificador.desde_config(args.config, log_callback=log)
+    for fecha, nombre in planificador.proximas():
+        log(f"Próxima ejecución de {nombre}: {fecha:%Y-%m-%d %H:%M}")
+
+    def detener(signum, frame):
+        planificador.parar()
+
+    signal.signal(signal.SIGINT, detener)
+    signal.signal(signal.SIGTERM, detener)
+
+    log(f"Planificador iniciado con {len(planificador.trabajos)} trabajos")
+    planificador.ejecutar()
+    return 0
+
+
+def crear_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="backtomatic", description="Backups automáticos con Google Drive, sin interfaz gráfica.")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p = sub.add_parser("backup", help="Crea un backup de una carpeta")
+    p.add_argument("origen", type=Path, help="Carpeta a respaldar")
+    p.add_argument("--destino", type=Path, help="Archivo de salida (por defecto backup.zip junto al origen)")
+    p.add_argument("--nivel", choices=["Bajo", "Medio", "Alto"], default="Alto", help="Nivel de compresión")
+    p.add_argument("--formato", choices=[c.nombre for c in listar_codecs()], default="deflate", help="Formato del backup")
+    p.add_argument("--excluir-temporales", action="store_true", help="Omite archivos temporales")
+    p.add_argument("--password-env", metavar="VARIABLE", help="Encripta con la contraseña de esta variable de entorno")
+    p.add_argument(
+        "--cifrado", choices=["winzip", "contenedor"], default="winzip",
+        help="winzip: AES por archivo, se abre con 7-Zip; contenedor: AES-GCM de todo el backup (.btae), más rápido",
+    )
+    p.add_argument("--incremental", action="store_true", help="Solo archiva lo nuevo o modificado")
+    p.add_argument("--sin-adaptativa", action="store_true", help="Comprime todos los archivos, aunque ya estén comprimidos")
+    p.add_argument("--subir", action="store_true", help="Sube el backup a Google Drive al terminar")
+    p.add_argument("--streaming", action="store_true", help="Comprime y sube a la vez, sin escribir el ZIP en disco")
+    p.add_argument("--workers", type=int, help="Hilos de compresión (1 = secuencial)")
+    p.add_argument("--volumen-mb", type=float, help="Divide el backup en volúmenes de este tamaño con un índice")
+    p.add_argument("--sin-verificar", action="store_true", help="No relee el backup para verificarlo al terminar")
+    p.add_argument(
+        "--desde-cero", action="store_true",
+        help="No continúa un backup interrumpido: descarta su punto de control y empieza de nuevo",
+    )
+    p.add_argument(
+        "--memoria-baja", action="store_true",
+        help="Memoria constante con millones de archivos: directorio central en un temporal, sin índice de escaneo",
+    )
+    p.add_argument(
+        "--retencion", type=_retencion, metavar="D,S,M",
+        help="Tras subir, conserva en Drive solo D diarios, S semanales y M mensuales de este trabajo",
+    )
+    _opciones_limites(p)
+    p.add_argument("--silencioso", action="store_true", help="No muestra el progreso")
+    p.set_defaults(funcion=cmd_backup)
+
+    p = sub.add_parser("continuo", help="Vigila una carpeta y añade cada cambio a un backup incremental continuo")
+    p.add_argument("origen", type=Path, help="Carpeta a vigilar")
+    p.add_argument("--destino", type=Path, help="ZIP base de la cadena (por defecto backup.zip junto al origen)")
+    p.add_argument("--nivel", choices=["Bajo", "Medio", "Alto"], default="Alto", help="Nivel de compresión")
+    p.add_argument("--excluir-temporales", action="store_true", help="Omite archivos temporales")
+    p.add_argument("--password-env", metavar="VARIABLE", help="Encripta con la contraseña de esta variable de entorno")
+    p.add_argument("--sin-adaptativa", action="store_true", help="Comprime todos los archivos, aunque ya estén comprimidos")
+    p.add_argument("--intervalo", type=float, default=30, help="Segundos entre cada añadido de cambios")
+    p.add_argument("--espera", type=float, default=2, help="Segundos sin cambios para dar un archivo por terminado")
+    p.add_argument("--sondeo", action="store_true", help="Recorre la carpeta periódicamente en lugar de usar inotify")
+    p.add_argument("--workers", type=int, help="Hilos de compresión (1 = secuencial)")
+    _opciones_limites(p)
+    p.set_defaults(funcion=cmd_continuo)
+
+    p = sub.add_parser(
+        "restaurar", help="Restaura todo o parte de un backup ZIP (o una cadena incremental), de Drive o por volúmenes"
+    )
+    p.add_argument("origen", help="backup.zip, drive:ID_DE_DRIVE o índice backup.zip.volumes.json")
+    p.add_argument("destino", type=Path, nargs="?", default=Path("."), help="Carpeta donde restaurar (por defecto, la actual)")
+    p.add_argument("--patron", action="append", help="Patrón glob o carpeta de los archivos a restaurar (repetible)")
+    p.add_argument("--password-env", metavar="VARIABLE", help="Variable de entorno con la contraseña")
+    p.add_argument("--workers", type=int, help="Hilos de extracción")
+    p.add_argument("--listar", action="store_true", help="Solo lista los archivos que se restaurarían")
+    p.add_argument(
+        "--punto", type=int, metavar="N",
+        help="Backup incremental: restaura el estado del punto N de la cadena (por defecto, el último)",
+    )
+    p.add_argument("--puntos", action="store_true", help="Backup incremental: lista los puntos de restauración")
+    p.add_argument(
+        "--sin-cadena", action="store_true",
+        help="Restaura solo este ZIP aunque sea la base de una cadena incremental",
+    )
+    p.add_argument("--silencioso", action="store_true", help="No muestra el progreso")
+    p.set_defaults(funcion=cmd_restaurar)
+
+    p = sub.add_parser("verificar", help="Comprueba que un backup se lee entero y coincide con los hashes guardados")
+    p.add_argument("backup", type=Path, help="Backup (.zip, .tar.zst, .btae) o índice .volumes.json")
+    p.add_argument("--password-env", metavar="VARIABLE", help="Variable de entorno con la contraseña")
+    p.add_argument("--workers", type=int, help="Hilos de verificación")
+    p.add_argument("--silencioso", action="store_true", help="No muestra el progreso")
+    p.set_defaults(funcion=cmd_verificar)
+
+    p = sub.add_parser("repo", help="Snapshots en un repositorio deduplicado (alternativa al ZIP único)")
+    repo = p.add_subparsers(dest="accion", required=True)
+
+    p = repo.add_parser("snapshot", help="Añade un snapshot de una carpeta al repositorio (lo crea si no existe)")
+    p.add_argument("origen", type=Path, help="Carpeta a respaldar")
+    p.add_argument("repositorio", type=Path, help="Carpeta del repositorio")
+    p.add_argument("--nivel", choices=["Bajo", "Medio", "Alto"], default="Alto", help="Nivel de compresión")
+    p.add_argument("--excluir-temporales", action="store_true", help="Omite archivos temporales")
+    p.add_argument("--workers", type=int, help="Hilos de troceado")
+    p.add_argument("--sin-verificar", action="store_true", help="No relee los trozos del snapshot al terminar")
+    p.add_argument("--silencioso", action="store_true", help="No muestra el progreso")
+    p.set_defaults(funcion=cmd_repo_snapshot)
+
+    p = repo.add_parser("listar", help="Lista los snapshots del repositorio")
+    p.add_argument("repositorio", type=Path, help="Carpeta del repositorio")
+    p.set_defaults(funcion=cmd_repo_listar)
+
+    p = repo.add_parser("restaurar", help="Restaura un snapshot")
+    p.add_argument("repositorio", type=Path, help="Carpeta del repositorio")
+    p.add_argument("destino", type=Path, nargs="?", default=Path("."), help="Carpeta donde restaurar (por defecto, la actual)")
+    p.add_argument("--snapshot", metavar="ID", help="Snapshot a restaurar (por defecto, el más reciente)")
+    p.add_argument("--silencioso", action="store_true", help="No muestra el progreso")
+    p.set_defaults(funcion=cmd_repo_restaurar)
+
+    p = repo.add_parser("borrar", help="Borra el índice de un snapshot (sus trozos se liberan con 'repo limpiar')")
+    p.add_argument("repositorio", type=Path, help="Carpeta del repositorio")
+    p.add_argument("snapshot", metavar="ID", help="Snapshot a borrar")
+    p.set_defaults(funcion=cmd_repo_borrar)
+
+    p = repo.add_parser("limpiar", help="Borra los trozos que ya no usa ningún snapshot")
+    p.add_argument("repositorio", type=Path, help="Carpeta del repositorio")
+    p.set_defaults(funcion=cmd_repo_limpiar)
+
+    p = sub.add_parser("descifrar", help="Descifra un backup en contenedor cifrado (.btae)")
+    p.add_argument("contenedor", type=Path, help="Archivo .btae")
+    p.add_argument("--destino", type=Path, help="Archivo de salida (por defecto, el nombre sin .btae)")
+    p.add_argument("--password-env", metavar="VARIABLE", required=True, help="Variable de entorno con la contraseña")
+    p.add_argument("--silencioso", action="store_true", help="No muestra el progreso")
+    p.set_defaults(funcion=cmd_descifrar)
+
+    p = sub.add_parser("subir", help="Sube uno o varios backups existentes a Google Drive")
+    p.add_argument("archivos", type=Path, nargs="+")
+    p.add_argument("--chunk-mb", type=float, default=16, help="Tamaño de cada trozo en MB (se redondea a múltiplos de 256 KB)")
+    p.add_argument("--reintentos", type=int, default=8, help="Reintentos con espera exponencial ante errores de red")
+    p.add_argument("--paralelas", type=int, default=3, help="Subidas simultáneas cuando hay varios archivos")
+    p.add_argument("--trabajo", help="Trabajo con el que se registran en Drive (para la retención)")
+    _opciones_limites(p, lectura=False)
+    p.set_defaults(funcion=cmd_subir)
+
+    p = sub.add_parser("remotos", help="Lista los backups guardados en Drive")
+    p.add_argument("--trabajo", help="Solo los de este trabajo")
+    p.set_defaults(funcion=cmd_remotos)
+
+    p = sub.add_parser("podar", help="Borra de Drive los backups que la política de retención no conserva")
+    p.add_argument("--retencion", type=_retencion, metavar="D,S,M", required=True, help="Diarios, semanales y mensuales a conservar")
+    p.add_argument("--trabajo", help="Solo los de este trabajo (por defecto, todos)")
+    p.add_argument("--simular", action="store_true", help="Solo muestra lo que se borraría")
+    p.set_defaults(funcion=cmd_podar)
+
+    p = sub.add_parser("login", help="Inicia sesión en Google Drive y guarda el token")
+    p.set_defaults(funcion=cmd_login)
+
+    p = sub.add_parser("codecs", help="Lista los formatos disponibles")
+    p.set_defaults(funcion=cmd_codecs)
+
+    p = sub.add_parser("daemon", help="Ejecuta los trabajos programados de un archivo de configuración")
+    p.add_argument("--config", type=Path, required=True, help="Archivo JSON con los trabajos")
+    p.set_defaults(funcion=cmd_daemon)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    args = crear_parser().parse_args(argv)
+    try:
+        return args.funcion(args)
+    except (RuntimeError, ValueError, OSError) as e:
+        log(f"Error: {e}")
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
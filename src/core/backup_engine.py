@@ -1,7 +1,24 @@
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import warnings
+from contextlib import closing, nullcontext
+from itertools import chain
 from pathlib import Path
 import zipfile
 
-import pyzipper
+from core.central_directory import DirectorioEnDisco
+from core.checkpoint import PuntoControl
+from core.compression_policy import TAMANO_SONDA
+from core.encryption import CIFRADOS, EscritorCifrado, ZipAESRapido
+from core.integrity import MIEMBRO_HASHES, CalculadorHashes, _leer_manifiesto
+from core.parallel_engine import comprimir_en_paralelo
+from core.progress import SeguimientoProgreso
+from core.scanner import Escaneo
+from core.small_files import por_adelantado
 
 EXTENSIONES_TEMP = {
     ".tmp",
@@ -9,6 +26,89 @@ EXTENSIONES_TEMP = {
     ".iso",
 }
 
+# Los archivos se leen por trozos para informar del avance dentro de cada uno
+TAMANO_LECTURA = 1024 * 1024
+
+
+class Codec:
+    """Formato de salida del backup y su compromiso entre velocidad y ratio."""
+
+    def __init__(self, nombre, etiqueta, extension, metodo_zip, niveles, velocidad, ratio, descripcion):
+        self.nombre = nombre
+        self.etiqueta = etiqueta
+        self.extension = extension
+        # None para formatos que no son ZIP (tar.zst)
+        self.metodo_zip = metodo_zip
+        # "Bajo" / "Medio" / "Alto" -> nivel real del compresor
+        self.niveles = niveles
+        self.velocidad = velocidad
+        self.ratio = ratio
+        self.descripcion = descripcion
+
+    @property
+    def es_zip(self) -> bool:
+        return self.metodo_zip is not None
+
+    def nivel(self, nivel_ui: str) -> int:
+        return self.niveles.get(nivel_ui, self.niveles["Medio"])
+
+
+CODECS = {
+    "deflate": Codec(
+        "deflate", "ZIP (Deflate)", ".zip", zipfile.ZIP_DEFLATED,
+        {"Bajo": 1, "Medio": 5, "Alto": 9},
+        velocidad="media", ratio="media",
+        descripcion="Compatible con cualquier sistema. Admite encriptación.",
+    ),
+    "bzip2": Codec(
+        "bzip2", "ZIP (BZIP2)", ".zip", zipfile.ZIP_BZIP2,
+        {"Bajo": 1, "Medio": 5, "Alto": 9},
+        velocidad="lenta", ratio="alta",
+        descripcion="Mejor ratio que deflate en texto, bastante más lento.",
+    ),
+    "lzma": Codec(
+        "lzma", "ZIP (LZMA)", ".zip", zipfile.ZIP_LZMA,
+        # zipfile usa siempre el preset por defecto de LZMA
+        {"Bajo": None, "Medio": None, "Alto": None},
+        velocidad="muy lenta", ratio="muy alta",
+        descripcion="Máximo ratio, pensado para archivo en frío.",
+    ),
+    "zstd": Codec(
+        "zstd", "TAR + Zstandard", ".tar.zst", None,
+        {"Bajo": 1, "Medio": 6, "Alto": 19},
+        velocidad="muy rápida", ratio="alta",
+        descripcion="Zstandard multihilo. Más rápido y con mejor ratio que deflate; sin encriptación.",
+    ),
+}
+
+
+def listar_codecs():
+    """Codecs disponibles con sus compromisos, para la UI o uso sin interfaz."""
+    return list(CODECS.values())
+
+
+def obtener_codec(nombre: str) -> Codec:
+    try:
+        return CODECS[nombre]
+    except KeyError:
+        raise ValueError(f"Codec desconocido: {nombre}") from None
+
+
+def _filtro_temporales(excluir_temporales: bool):
+    if not excluir_temporales:
+        return None
+    return lambda p: p.suffix.lower() not in EXTENSIONES_TEMP
+
+
+def escanear_archivos(carpeta_origen: Path, excluir_temporales: bool, ruta_indice: Path = None) -> Escaneo:
+    """Iterador de los archivos del backup, entregados según se descubren."""
+    return Escaneo(carpeta_origen, _filtro_temporales(excluir_temporales), ruta_indice)
+
+
+def listar_archivos(carpeta_origen: Path, excluir_temporales: bool, ruta_indice: Path = None):
+    """Devuelve los archivos de `carpeta_origen` que entran en el backup."""
+    return list(escanear_archivos(carpeta_origen, excluir_temporales, ruta_indice))
+
 
 def crear_backup(
     carpeta_origen: Path,
@@ -18,65 +118,392 @@ def crear_backup(
     encriptar: bool = False,
     password: str = None,
     progreso_callback=None,
+    workers: int = None,
+    ruta_indice_escaneo: Path = None,
+    politica=None,
+    codec: str = "deflate",
+    eventos_callback=None,
+    cifrado: str = "winzip",
+    reanudar: bool = False,
+    detener=None,
+    memoria_baja: bool = False,
 ):
     """
     Crea un ZIP y reporta progreso por archivo.
 
-    Si encriptar=True, usa AES-256 con la contraseña proporcionada.
-    """
+    Si encriptar=True, usa AES-256 con la contraseña proporcionada. Con
+    cifrado="winzip" (compatible con 7-Zip/WinZip) se cifra cada miembro del
+    ZIP; con "contenedor" el archivo entero (ZIP o tar.zst) se escribe dentro
+    de un contenedor AES-GCM (.btae, ver core.encryption), más rápido y que
+    oculta también los nombres de archivo. `destino_zip` debe llevar ya la
+    extensión .btae (ver ruta_contenedor).
+    `workers` es el número de hilos de compresión (None = todos los núcleos,
+    1 = modo secuencial clásico con zipf.write).
 
-    archivos = []
+    Los archivos se comprimen a medida que el escaneo los descubre; mientras
+    dura el escaneo, el total que recibe `progreso_callback` es una estimación.
+    Con `ruta_indice_escaneo` se reutiliza el listado de las carpetas que no
+    cambiaron desde la ejecución anterior. Con `politica` (PoliticaCompresion)
+    los archivos ya comprimidos (JPEG, MP4, ZIP...) se guardan sin deflate.
 
-    for p in carpeta_origen.rglob("*"):
-        if not p.is_file():
-            continue
+    `codec` es una clave de CODECS; con "zstd" se genera un .tar.zst.
 
-        if excluir_temporales and p.suffix.lower() in EXTENSIONES_TEMP:
-            continue
+    `eventos_callback(EventoProgreso)` recibe, varias veces por segundo, los
+    bytes leídos y escritos, el archivo en curso y la velocidad; a diferencia
+    de `progreso_callback`, avanza también dentro de un archivo grande.
 
-        archivos.append(p)
+    Con `reanudar` (solo ZIP en disco, sin contenedor) el progreso se
+    registra en un punto de control (ver core.checkpoint) y un backup que
+    quedó a medias se continúa donde se quedó. `detener` (threading.Event)
+    para en el siguiente punto seguro lanzando BackupInterrumpido.
+
+    Con `memoria_baja` la memoria no crece con el número de archivos: el
+    directorio central del ZIP y los hashes se guardan en temporales hasta
+    el final (ver core.central_directory) y no se usa el índice de escaneo,
+    que tendría en memoria el listado de todas las carpetas.
+    """
 
-    if not archivos:
+    formato = obtener_codec(codec)
+    if encriptar and cifrado not in CIFRADOS:
+        raise ValueError(f"Cifrado desconocido: {cifrado}")
+    if memoria_baja:
+        ruta_indice_escaneo = None
+    escaneo = escanear_archivos(carpeta_origen, excluir_temporales, ruta_indice_escaneo)
+    archivos = iter(escaneo)
+
+    primero = next(archivos, None)
+    if primero is None:
         raise RuntimeError("No hay archivos para comprimir.")
+    archivos = _ConTotal(chain([primero], archivos), escaneo)
+
+    if encriptar and cifrado == "contenedor":
+        # Se comprime sin cifrar y el contenedor cifra el resultado por trozos
+        with EscritorCifrado(destino_zip, password) as contenedor:
+            if not formato.es_zip:
+                return escribir_tar_zst(
+                    archivos, carpeta_origen, contenedor, nivel_compresion, progreso_callback, workers, eventos_callback,
+                    memoria_baja,
+                )
+            return escribir_zip(
+                archivos, carpeta_origen, contenedor, nivel_compresion, progreso_callback=progreso_callback,
+                workers=workers, politica=politica, metodo=formato.metodo_zip, eventos_callback=eventos_callback,
+                memoria_baja=memoria_baja,
+            )
+
+    if not formato.es_zip:
+        if encriptar:
+            raise ValueError(f"El formato {formato.etiqueta} solo admite encriptación con contenedor")
+        return escribir_tar_zst(
+            archivos, carpeta_origen, destino_zip, nivel_compresion, progreso_callback, workers, eventos_callback,
+            memoria_baja,
+        )
+
+    punto_control = None
+    if reanudar and isinstance(destino_zip, (str, Path)):
+        parametros = {
+            "origen": str(Path(carpeta_origen).resolve()),
+            "codec": codec,
+            "nivel": nivel_compresion,
+            "excluir_temporales": excluir_temporales,
+            "adaptativa": politica is not None,
+            "encriptar": encriptar,
+        }
+        punto_control = PuntoControl(destino_zip, parametros, password if encriptar else None, detener)
+
+    return escribir_zip(
+        archivos,
+        carpeta_origen,
+        destino_zip,
+        nivel_compresion,
+        encriptar=encriptar,
+        password=password,
+        progreso_callback=progreso_callback,
+        workers=workers,
+        politica=politica,
+        metodo=formato.metodo_zip,
+        eventos_callback=eventos_callback,
+        punto_control=punto_control,
+        memoria_baja=memoria_baja,
+    )
+
+
+class _ConTotal:
+    """Iterable que expone el total estimado de un Escaneo en curso."""
+
+    def __init__(self, iterable, escaneo: Escaneo):
+        self._iterable = iterable
+        self._escaneo = escaneo
+
+    def __iter__(self):
+        return iter(self._iterable)
+
+    @property
+    def encontrados(self):
+        return self._escaneo.encontrados
+
+    @property
+    def bytes_encontrados(self):
+        return self._escaneo.bytes_encontrados
+
+
+class _LectorContado:
+    """Envuelve un archivo abierto, anota en el seguimiento cada lectura y pasa los datos al hash."""
+
+    def __init__(self, f, seguimiento: SeguimientoProgreso, archivo: Path, hash_archivo=None):
+        self._f = f
+        self._seguimiento = seguimiento
+        self._archivo = archivo
+        self._hash = hash_archivo
+
+    def read(self, n=-1):
+        datos = self._f.read(n)
+        if datos:
+            self._seguimiento.leidos(len(datos), self._archivo)
+            if self._hash:
+                self._hash.update(datos)
+        return datos
+
+
+class _EscritorContado:
+    """Envuelve el destino y anota en el seguimiento los bytes comprimidos escritos."""
+
+    def __init__(self, f, seguimiento: SeguimientoProgreso):
+        self._f = f
+        self._seguimiento = seguimiento
+
+    def write(self, datos):
+        self._seguimiento.escritos(len(datos))
+        return self._f.write(datos)
+
+    def flush(self):
+        self._f.flush()
+
+
+def _escribir_miembro(
+    zipf, archivo: Path, arcname, seguimiento: SeguimientoProgreso, hashes: CalculadorHashes,
+    compress_type=None, compresslevel=None,
+):
+    """Igual que zipf.write, pero leyendo por trozos de TAMANO_LECTURA con seguimiento y hash."""
+    zipinfo_cls = getattr(zipf, "zipinfo_cls", zipfile.ZipInfo)
+    zinfo = zipinfo_cls.from_file(archivo, arcname)
+    zinfo.compress_type = zipf.compression if compress_type is None else compress_type
+    zinfo._compresslevel = zipf.compresslevel if compresslevel is None else compresslevel
+
+    hash_archivo = hashes.nuevo(zinfo.filename)
+    with open(archivo, "rb") as origen, zipf.open(zinfo, "w") as destino:
+        shutil.copyfileobj(_LectorContado(origen, seguimiento, archivo, hash_archivo), destino, TAMANO_LECTURA)
+    hash_archivo.terminar()
+    seguimiento.escritos(zinfo.compress_size)
+
+
+def _opciones_miembro(archivo: Path, politica) -> dict:
+    """Argumentos de compresión para zipf.write según la política (si hay)."""
+    if politica is None:
+        return {}
+
+    with open(archivo, "rb") as f:
+        cabecera = f.read(TAMANO_SONDA)
+        tamano = os.fstat(f.fileno()).st_size
+
+    decision = politica.decidir(archivo, cabecera, tamano)
+    return {"compress_type": decision.metodo, "compresslevel": decision.nivel}
+
+
+def escribir_zip(
+    archivos,
+    carpeta_origen: Path,
+    destino_zip: Path,
+    nivel_compresion: int,
+    encriptar: bool = False,
+    password: str = None,
+    progreso_callback=None,
+    workers: int = None,
+    politica=None,
+    metodo: int = zipfile.ZIP_DEFLATED,
+    eventos_callback=None,
+    modo: str = "w",
+    punto_control=None,
+    memoria_baja: bool = False,
+):
+    """
+    Comprime `archivos` (rutas dentro de `carpeta_origen`) en `destino_zip`.
+
+    `archivos` puede ser una lista o un iterable que se va llenando (escaneo).
+    `destino_zip` puede ser una ruta o un archivo abierto no posicionable.
+    El SHA-256 de cada archivo se calcula con los mismos datos que se leen
+    para comprimir y se guarda al final en el miembro MIEMBRO_HASHES (ver
+    core.integrity.verificar_backup). Devuelve el número de archivos escritos.
+
+    Con modo="a" los archivos se añaden a un ZIP existente: si un nombre ya
+    estaba, vale el último miembro con ese nombre, y el nuevo MIEMBRO_HASHES
+    incluye también los hashes anteriores.
+
+    Con `punto_control` (core.checkpoint.PuntoControl, solo modo="w" y
+    `destino_zip` en disco) se registra de vez en cuando qué miembros están
+    completos y, si hay un registro válido de una ejecución anterior
+    interrumpida, se continúa desde él en vez de empezar de cero.
+
+    Con `memoria_baja` el directorio central y los hashes van a temporales
+    (ver crear_backup).
+    """
+
+    seguimiento = SeguimientoProgreso(archivos, progreso_callback, eventos_callback)
+    reanudado = modo == "w" and punto_control is not None and punto_control.cargar()
+    if punto_control is not None and not reanudado:
+        # Un registro que no sirve describe un ZIP que se va a sobrescribir
+        punto_control.borrar()
+    salida = punto_control.abrir() if reanudado else nullcontext(destino_zip)
+    with salida as destino:
+        hechos = _escribir_zip_en(
+            archivos, carpeta_origen, destino, nivel_compresion, encriptar, password, workers, politica, metodo,
+            modo, seguimiento, punto_control, reanudado, memoria_baja,
+        )
+    if punto_control is not None:
+        punto_control.borrar()
+    return hechos
+
+
+def _escribir_zip_en(
+    archivos, carpeta_origen, destino_zip, nivel_compresion, encriptar, password, workers, politica, metodo,
+    modo, seguimiento, punto_control, reanudado, memoria_baja,
+):
+    """Cuerpo de escribir_zip, con `destino_zip` ya abierto si se reanuda."""
 
-    total = len(archivos)
-    
     # ← DECISIÓN: ¿ZIP normal o encriptado?
     if encriptar:
         if not password:
             raise ValueError("Se requiere contraseña para encriptar")
-        
+
         # Crear ZIP encriptado con AES
-        with pyzipper.AESZipFile(
+        zipf = ZipAESRapido(
             destino_zip,
-            'w',
-            compression=pyzipper.ZIP_DEFLATED,
+            modo,
+            compression=metodo,
             compresslevel=nivel_compresion,
-            encryption=pyzipper.WZ_AES  # AES-256
-        ) as zipf:
-            zipf.setpassword(password.encode('utf-8'))
-            
-            for i, archivo in enumerate(archivos, start=1):
-                zipf.write(archivo, archivo.relative_to(carpeta_origen))
-                
-                if progreso_callback:
-                    progreso_callback(i, total)
+        )
+        zipf.setpassword(password.encode('utf-8'))
     else:
-        with zipfile.ZipFile(
+        zipf = zipfile.ZipFile(
             destino_zip,
-            "w",
-            zipfile.ZIP_DEFLATED,
+            modo,
+            metodo,
             compresslevel=nivel_compresion,
-        ) as zipf:
+        )
 
-            for i, archivo in enumerate(archivos, start=1):
+    directorio = DirectorioEnDisco(zipf) if memoria_baja else nullcontext()
+    hashes = CalculadorHashes(en_disco=memoria_baja, seguir_nuevos=punto_control is not None)
+    with directorio, zipf, hashes, warnings.catch_warnings():
+        anteriores = {}
+        if modo == "a" or reanudado:
+            # Los nombres repetidos son versiones nuevas: zipfile avisa de cada uno
+            warnings.filterwarnings("ignore", "Duplicate name", UserWarning)
+        if modo == "a" and MIEMBRO_HASHES in zipf.NameToInfo:
+            anteriores = _leer_manifiesto(zipf.read(MIEMBRO_HASHES))
+        if reanudado:
+            # Los archivos que ya estaban (y no cambiaron) ni se leen
+            punto_control.reanudar(zipf)
+            anteriores = punto_control.hashes
+            archivos = punto_control.pendientes(archivos, carpeta_origen, seguimiento)
 
-                zipf.write(
+        if workers != 1:
+            hechos = comprimir_en_paralelo(
+                zipf, archivos, carpeta_origen, nivel_compresion, workers, politica=politica, metodo=metodo,
+                seguimiento=seguimiento, hashes=hashes, punto_control=punto_control,
+            )
+        else:
+            hechos = 0
+            for hechos, archivo in enumerate(archivos, start=1):
+
+                _escribir_miembro(
+                    zipf,
                     archivo,
-                    archivo.relative_to(carpeta_origen)
+                    archivo.relative_to(carpeta_origen),
+                    seguimiento,
+                    hashes,
+                    **_opciones_miembro(archivo, politica)
                 )
 
-                if progreso_callback:
-                    progreso_callback(i, total)
+                seguimiento.archivo_terminado(archivo)
+                if punto_control:
+                    punto_control.miembro_terminado(zipf, hashes)
+            seguimiento.terminar()
+
+        # Hashes de lo leído, para verificar el backup sin volver a leer el origen
+        if memoria_baja:
+            # Con millones de archivos el manifiesto no cabe de una vez en memoria
+            with zipf.open(MIEMBRO_HASHES, "w", force_zip64=True) as destino:
+                hashes.escribir_manifiesto(destino, anteriores)
+        else:
+            zipf.writestr(MIEMBRO_HASHES, hashes.manifiesto(anteriores))
+
+    return hechos + (punto_control.saltados if reanudado else 0)
+
+
+def escribir_tar_zst(
+    archivos,
+    carpeta_origen: Path,
+    destino: Path,
+    nivel_compresion: int,
+    progreso_callback=None,
+    workers: int = None,
+    eventos_callback=None,
+    memoria_baja: bool = False,
+):
+    """
+    Empaqueta `archivos` en un TAR comprimido con Zstandard. Al final va
+    MIEMBRO_HASHES con el SHA-256 de cada archivo.
+
+    zstd reparte la compresión entre `workers` hilos (None = todos los núcleos).
+    El TAR entero es un único flujo zstd (compresión sólida): los archivos
+    pequeños y parecidos comprimen mucho mejor que como miembros de un ZIP,
+    y se leen por adelantado en varios hilos (ver core.small_files).
+    `destino` puede ser una ruta o un archivo abierto no posicionable.
+    Con `memoria_baja` tarfile no guarda la lista de miembros y los hashes
+    van a un temporal.
+    """
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("El formato TAR + Zstandard requiere el paquete 'zstandard'.") from None
+
+    cctx = zstandard.ZstdCompressor(level=nivel_compresion, threads=workers or -1)
+    hechos = 0
+    seguimiento = SeguimientoProgreso(archivos, progreso_callback, eventos_callback)
+
+    salida = open(destino, "wb") if isinstance(destino, (str, Path)) else nullcontext(destino)
+    with salida as f, CalculadorHashes(en_disco=memoria_baja) as hashes:
+        with cctx.stream_writer(_EscritorContado(f, seguimiento), closefd=False) as comp:
+            tar = tarfile.open(fileobj=comp, mode="w|", format=tarfile.PAX_FORMAT)
+            with tar, closing(por_adelantado(archivos)) as leidos:
+                tar.copybufsize = TAMANO_LECTURA
+                for hechos, (archivo, prelectura) in enumerate(leidos, start=1):
+                    # gettarinfo no va a los hilos lectores: decide qué es enlace duro según el orden
+                    tarinfo = tar.gettarinfo(archivo, archivo.relative_to(carpeta_origen).as_posix())
+                    if tarinfo.isreg():
+                        hash_archivo = hashes.nuevo(tarinfo.name)
+                        ya_leido = prelectura.datos is not None and len(prelectura.datos) == tarinfo.size
+                        with io.BytesIO(prelectura.datos) if ya_leido else open(archivo, "rb") as origen:
+                            tar.addfile(tarinfo, _LectorContado(origen, seguimiento, archivo, hash_archivo))
+                        hash_archivo.terminar()
+                    else:
+                        tar.addfile(tarinfo)
+                    if memoria_baja:
+                        # En escritura la lista solo sirve para getmembers()
+                        tar.members.clear()
+                    seguimiento.archivo_terminado(archivo)
+
+                tarinfo = tarfile.TarInfo(MIEMBRO_HASHES)
+                tarinfo.mtime = int(time.time())
+                if memoria_baja:
+                    with tempfile.TemporaryFile() as manifiesto:
+                        hashes.escribir_manifiesto(manifiesto, None)
+                        tarinfo.size = manifiesto.tell()
+                        manifiesto.seek(0)
+                        tar.addfile(tarinfo, manifiesto)
+                else:
+                    manifiesto = hashes.manifiesto()
+                    tarinfo.size = len(manifiesto)
+                    tar.addfile(tarinfo, io.BytesIO(manifiesto))
 
-    return total
+    seguimiento.terminar()
+    return hechos
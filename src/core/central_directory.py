@@ -0,0 +1,106 @@
+import struct
+import tempfile
+import zipfile
+
+# Campos fijos de cada miembro (versiones, flags, método, fecha, CRC,
+# tamaños, posición, atributos, longitudes y extra AES de pyzipper); detrás
+# van el nombre, el extra y el comentario
+_REGISTRO = struct.Struct("<6H6HI3QHIH3HBH2sB")
+TAMANO_BUFFER = 1024 * 1024
+
+
+class _SinNombres(dict):
+    """NameToInfo que no guarda nada: sin él zipfile solo pierde el aviso de nombres repetidos."""
+
+    def __setitem__(self, nombre, zinfo):
+        pass
+
+
+class DirectorioEnDisco:
+    """
+    Sustituye a `zipf.filelist` en un ZIP que se está escribiendo para que
+    la memoria no crezca con el número de miembros.
+
+    zipfile guarda un ZipInfo por miembro hasta el close() para escribir el
+    directorio central; aquí cada uno se empaqueta en un registro binario de
+    72 bytes más el nombre y va a un archivo temporal. Al cerrar el ZIP,
+    zipfile recorre la lista y los ZipInfo se reconstruyen de uno en uno.
+    En memoria solo queda el último (filelist[-1]). Funciona igual con
+    zipfile.ZipFile y con pyzipper.AESZipFile.
+
+    Se instala con el ZIP ya abierto y se cierra después de cerrarlo:
+
+        with DirectorioEnDisco(zipf) as directorio, zipf:
+            ...
+    """
+
+    def __init__(self, zipf):
+        self._zipinfo_cls = getattr(zipf, "zipinfo_cls", zipfile.ZipInfo)
+        self._archivo = tempfile.TemporaryFile(buffering=TAMANO_BUFFER)
+        self._cantidad = 0
+        self._ultimo = None
+        # En modo "a" los miembros que ya había pasan también al temporal
+        anteriores = zipf.filelist
+        zipf.filelist = self
+        zipf.NameToInfo = _SinNombres()
+        for zinfo in anteriores:
+            self.append(zinfo)
+
+    def append(self, zinfo):
+        nombre = zinfo.filename.encode("utf-8")
+        aes = getattr(zinfo, "wz_aes_vendor_id", None) is not None
+        self._archivo.write(_REGISTRO.pack(
+            zinfo.create_version, zinfo.create_system, zinfo.extract_version, zinfo.reserved,
+            zinfo.flag_bits, zinfo.compress_type, *zinfo.date_time, zinfo.CRC,
+            zinfo.compress_size, zinfo.file_size, zinfo.header_offset, zinfo.internal_attr,
+            zinfo.external_attr, zinfo.volume, len(nombre), len(zinfo.extra), len(zinfo.comment),
+            aes, zinfo.wz_aes_version if aes else 0, zinfo.wz_aes_vendor_id if aes else b"\0\0",
+            zinfo.wz_aes_strength if aes else 0,
+        ))
+        self._archivo.write(nombre)
+        self._archivo.write(zinfo.extra)
+        self._archivo.write(zinfo.comment)
+        self._cantidad += 1
+        self._ultimo = zinfo
+
+    def __len__(self):
+        return self._cantidad
+
+    def __getitem__(self, indice):
+        if indice != -1 or self._ultimo is None:
+            raise IndexError("El directorio en disco solo conserva en memoria el último miembro")
+        return self._ultimo
+
+    def __iter__(self):
+        """Reconstruye los ZipInfo en orden. No se debe añadir nada mientras se recorre."""
+        self._archivo.flush()
+        self._archivo.seek(0)
+        try:
+            for _ in range(self._cantidad):
+                campos = _REGISTRO.unpack(self._archivo.read(_REGISTRO.size))
+                largo_nombre, largo_extra, largo_comentario = campos[19:22]
+                zinfo = self._zipinfo_cls(self._archivo.read(largo_nombre).decode("utf-8"), campos[6:12])
+                (
+                    zinfo.create_version, zinfo.create_system, zinfo.extract_version, zinfo.reserved,
+                    zinfo.flag_bits, zinfo.compress_type,
+                ) = campos[:6]
+                (
+                    zinfo.CRC, zinfo.compress_size, zinfo.file_size, zinfo.header_offset, zinfo.internal_attr,
+                    zinfo.external_attr, zinfo.volume,
+                ) = campos[12:19]
+                zinfo.extra = self._archivo.read(largo_extra)
+                zinfo.comment = self._archivo.read(largo_comentario)
+                if campos[22]:
+                    zinfo.wz_aes_version, zinfo.wz_aes_vendor_id, zinfo.wz_aes_strength = campos[23:26]
+                yield zinfo
+        finally:
+            self._archivo.seek(0, 2)
+
+    def cerrar(self):
+        self._archivo.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
@@ -0,0 +1,229 @@
+import hashlib
+import json
+import os
+import secrets
+import time
+import zipfile
+from pathlib import Path
+
+VERSION_PUNTO_CONTROL = 1
+EXTENSION_PUNTO_CONTROL = ".checkpoint.json"
+# Como mucho un guardado cada tanto: cada uno fuerza un fsync del ZIP
+INTERVALO_GUARDADO_S = 10
+# La contraseña no se guarda: solo una huella para no mezclar dos en un mismo ZIP
+ITERACIONES_HUELLA = 100_000
+
+# Lo que necesita ZipInfo.central_directory() para volver a escribir la
+# entrada de un miembro ya escrito
+CAMPOS_ZIPINFO = (
+    "filename", "date_time", "compress_type", "comment", "extra", "create_system", "create_version",
+    "extract_version", "reserved", "flag_bits", "volume", "internal_attr", "external_attr", "header_offset",
+    "CRC", "compress_size", "file_size",
+)
+# Extra de cifrado de pyzipper.AESZipInfo
+CAMPOS_AES = ("wz_aes_version", "wz_aes_vendor_id", "wz_aes_strength")
+CAMPOS_BYTES = {"comment", "extra", "wz_aes_vendor_id"}
+
+
+class BackupInterrumpido(RuntimeError):
+    """El backup se paró en un punto seguro; la próxima ejecución lo reanuda."""
+
+
+def ruta_punto_control(destino: Path) -> Path:
+    """backup.zip -> backup.zip.checkpoint.json"""
+    destino = Path(destino)
+    return destino.with_name(destino.name + EXTENSION_PUNTO_CONTROL)
+
+
+def _info_a_dict(zinfo) -> dict:
+    datos = {}
+    for campo in CAMPOS_ZIPINFO + CAMPOS_AES:
+        if not hasattr(zinfo, campo):
+            continue
+        valor = getattr(zinfo, campo)
+        datos[campo] = valor.hex() if campo in CAMPOS_BYTES and valor is not None else valor
+    return datos
+
+
+def _info_desde_dict(zipinfo_cls, datos: dict):
+    zinfo = zipinfo_cls(datos["filename"], tuple(datos["date_time"]))
+    for campo, valor in datos.items():
+        if campo in ("filename", "date_time"):
+            continue
+        setattr(zinfo, campo, bytes.fromhex(valor) if campo in CAMPOS_BYTES and valor is not None else valor)
+    return zinfo
+
+
+def _sin_cambios(archivo: Path, datos: dict) -> bool:
+    """El archivo sigue como cuando se escribió su miembro (tamaño y fecha, con la precisión del ZIP)."""
+    try:
+        actual = zipfile.ZipInfo.from_file(archivo)
+    except OSError:
+        return False
+    return actual.file_size == datos["file_size"] and list(actual.date_time) == list(datos["date_time"])
+
+
+class PuntoControl:
+    """
+    Punto de control de un ZIP en curso, para reanudarlo si el proceso muere
+    o se cancela a medias.
+
+    Junto al backup se mantiene backup.zip.checkpoint.json, un registro que
+    solo crece: una cabecera con los parámetros del backup y, por cada
+    guardado, una línea con los miembros que se terminaron desde el anterior
+    (los datos de su entrada en el directorio central y su SHA-256) y el
+    desplazamiento donde acaba el último. Antes de cada línea se hace fsync
+    del ZIP, así que lo que dice el registro está de verdad en disco; una
+    línea a medias (el proceso murió escribiéndola) se ignora.
+
+    Al reanudar, el ZIP se trunca en ese desplazamiento, se vuelven a añadir
+    al directorio central los miembros ya escritos y solo se comprimen los
+    archivos que faltan o que cambiaron desde entonces.
+
+    `detener` (threading.Event) pide parar: el motor lo mira al terminar
+    cada miembro, guarda y lanza BackupInterrumpido. Un archivo grande se
+    termina antes de parar.
+    """
+
+    def __init__(self, destino: Path, parametros: dict, password: str = None, detener=None,
+                 intervalo: float = INTERVALO_GUARDADO_S):
+        self.destino = Path(destino)
+        self.ruta = ruta_punto_control(self.destino)
+        # Solo tipos de JSON: se comparan con los de la ejecución anterior
+        self.parametros = json.loads(json.dumps(parametros))
+        self.detener = detener
+        self.intervalo = intervalo
+        self.miembros = []
+        self.hashes = {}
+        self.fin = 0
+        # Archivos que no hubo que volver a comprimir al reanudar
+        self.saltados = 0
+        self._password = password
+        self._huella = None
+        # Terminados desde el último guardado y hashes que aún no tienen miembro
+        self._nuevos = []
+        self._hashes_pendientes = {}
+        self._abierto = False
+        self._guardado = time.monotonic()
+
+    def _calcular_huella(self, sal: bytes) -> str:
+        return hashlib.pbkdf2_hmac("sha256", self._password.encode("utf-8"), sal, ITERACIONES_HUELLA).hex()
+
+    def _misma_password(self, huella) -> bool:
+        if huella is None or self._password is None:
+            return huella is None and self._password is None
+        return secrets.compare_digest(self._calcular_huella(bytes.fromhex(huella["sal"])), huella["huella"])
+
+    def cargar(self) -> bool:
+        """
+        Lee el registro de una ejecución anterior. Devuelve False si no hay
+        o no sirve para esta (otros parámetros, otra contraseña o un ZIP más
+        corto de lo registrado).
+        """
+        try:
+            lineas = self.ruta.read_text("utf-8").splitlines()
+            cabecera = json.loads(lineas[0])
+        except (OSError, ValueError, IndexError):
+            return False
+        if cabecera.get("version") != VERSION_PUNTO_CONTROL or cabecera.get("parametros") != self.parametros:
+            return False
+        if not self._misma_password(cabecera.get("password")):
+            return False
+
+        miembros, hashes, fin = [], {}, 0
+        for linea in lineas[1:]:
+            try:
+                guardado = json.loads(linea)
+            except ValueError:
+                break
+            miembros.extend(guardado["miembros"])
+            hashes.update(guardado["hashes"])
+            fin = guardado["fin"]
+        try:
+            if not miembros or self.destino.stat().st_size < fin:
+                return False
+        except OSError:
+            return False
+
+        self.miembros, self.hashes, self.fin = miembros, hashes, fin
+        self._huella = cabecera.get("password")
+        self._abierto = True
+        return True
+
+    def abrir(self):
+        """Abre el backup a medias truncado tras el último miembro completo (para zipfile en modo "w")."""
+        f = open(self.destino, "r+b")
+        f.truncate(self.fin)
+        f.seek(self.fin)
+        return f
+
+    def reanudar(self, zipf):
+        """Vuelve a poner en `zipf` los miembros ya escritos, para que entren en su directorio central."""
+        zipinfo_cls = getattr(zipf, "zipinfo_cls", zipfile.ZipInfo)
+        for datos in self.miembros:
+            zinfo = _info_desde_dict(zipinfo_cls, datos)
+            zipf.filelist.append(zinfo)
+            zipf.NameToInfo[zinfo.filename] = zinfo
+
+    def pendientes(self, archivos, carpeta_origen: Path, seguimiento):
+        """Filtra `archivos`: los que ya están en el ZIP sin cambios se cuentan como hechos y no se leen."""
+        hechos = {datos["filename"]: datos for datos in self.miembros}
+        for archivo in archivos:
+            datos = hechos.get(archivo.relative_to(carpeta_origen).as_posix())
+            if datos is not None and _sin_cambios(archivo, datos):
+                self.saltados += 1
+                seguimiento.saltado(archivo, datos["file_size"], datos["compress_size"])
+                continue
+            yield archivo
+
+    def miembro_terminado(self, zipf, hashes):
+        """
+        Punto seguro: se llama justo después de cerrar cada miembro. Guarda
+        si toca y, si se pidió parar, guarda y lanza BackupInterrumpido.
+        """
+        # Solo el último: con core.central_directory el resto ya no está en memoria
+        self._nuevos.append(_info_a_dict(zipf.filelist[-1]))
+        parar = self.detener is not None and self.detener.is_set()
+        if parar or time.monotonic() - self._guardado >= self.intervalo:
+            self.guardar(zipf, hashes)
+        if parar:
+            raise BackupInterrumpido(
+                f"Backup interrumpido con {len(zipf.filelist)} archivos escritos; la próxima ejecución lo reanudará"
+            )
+
+    def guardar(self, zipf, hashes):
+        """Añade al registro los miembros terminados desde el último guardado (con `zipf` entre dos miembros)."""
+        self._guardado = time.monotonic()
+        if not self._nuevos:
+            return
+        zipf.fp.flush()
+        os.fsync(zipf.fp.fileno())
+
+        # El hash de un archivo termina al leerlo, antes de que se escriba su miembro
+        self._hashes_pendientes.update(hashes.nuevos())
+        linea = {
+            "fin": zipf.start_dir,
+            "miembros": self._nuevos,
+            "hashes": {
+                datos["filename"]: self._hashes_pendientes.pop(datos["filename"])
+                for datos in self._nuevos if datos["filename"] in self._hashes_pendientes
+            },
+        }
+        with open(self.ruta, "a" if self._abierto else "w", encoding="utf-8") as f:
+            if not self._abierto:
+                f.write(json.dumps(self._cabecera()) + "\n")
+                self._abierto = True
+            f.write(json.dumps(linea) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._nuevos = []
+
+    def _cabecera(self) -> dict:
+        if self._password is not None and self._huella is None:
+            sal = secrets.token_bytes(16)
+            self._huella = {"sal": sal.hex(), "huella": self._calcular_huella(sal)}
+        return {"version": VERSION_PUNTO_CONTROL, "parametros": self.parametros, "password": self._huella}
+
+    def borrar(self):
+        """El backup terminó: el registro ya no hace falta."""
+        self.ruta.unlink(missing_ok=True)
@@ -0,0 +1,389 @@
+import hashlib
+import json
+import os
+import random
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from core.backup_engine import listar_archivos
+from core.parallel_engine import workers_por_defecto
+
+# Troceado por contenido (gear hash, estilo FastCDC). Los cortes dependen de
+# los datos, así que insertar bytes al principio de un archivo solo cambia
+# los trozos afectados y el resto sigue deduplicándose.
+TAMANO_MIN = 256 * 1024
+TAMANO_MEDIO = 1024 * 1024
+TAMANO_MAX = 4 * 1024 * 1024
+
+_M64 = (1 << 64) - 1
+# Se usan los bits altos del hash: dependen de los últimos 64 bytes leídos
+_BITS_MEDIO = TAMANO_MEDIO.bit_length() - 1
+_MASCARA = ((1 << _BITS_MEDIO) - 1) << (64 - _BITS_MEDIO)
+# Tabla fija: cambiarla invalidaría la deduplicación con repositorios existentes
+_rng = random.Random(0x4241434B)
+_GEAR = [_rng.getrandbits(64) for _ in range(256)]
+# Posiciones que se hashean de una vez con numpy: en tramos pequeños los
+# arrays intermedios caben en la caché y se hashea poco más allá del corte
+TRAMO_VECTORIZADO = 64 * 1024
+# Cada hash depende de los 64 bytes anteriores (incluido el propio)
+_VENTANA = 64
+_gear_numpy = None
+
+ARCHIVO_BLOQUEO = "repo.lock"
+# recolectar_basura no toca temporales más recientes: pueden estar escribiéndose
+GRACIA_TEMPORALES_S = 3600
+
+if os.name == "nt":
+    import msvcrt
+
+    def _bloquear(f):
+        f.seek(0)
+        # LK_LOCK se rinde tras 10 s; aquí se espera lo que haga falta
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                return
+            except OSError:
+                time.sleep(0.1)
+
+    def _desbloquear(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _bloquear(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+    def _desbloquear(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _tabla_numpy():
+    """La tabla gear como array de numpy, o None si numpy no está instalado."""
+    global _gear_numpy
+    if _gear_numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            _gear_numpy = False
+        else:
+            _gear_numpy = numpy.array(_GEAR, dtype=numpy.uint64)
+    return _gear_numpy if _gear_numpy is not False else None
+
+
+def _buscar_corte(datos) -> int:
+    n = len(datos)
+    if n <= TAMANO_MIN:
+        return n
+
+    limite = min(n, TAMANO_MAX)
+    gear = _tabla_numpy()
+    if gear is None:
+        return _buscar_corte_python(datos, limite)
+    return _buscar_corte_numpy(gear, datos, limite)
+
+
+def _buscar_corte_numpy(gear, datos, limite: int) -> int:
+    """
+    Mismos cortes que _buscar_corte_python, pero sin recorrer los bytes en
+    Python: el hash en la posición i es la suma de gear[datos[j]] << (i - j)
+    para los j de la ventana, y se calcula para un tramo entero en seis
+    pasadas que doblan la ventana (1, 2, 4... 64 bytes). numpy suelta el GIL
+    en esas pasadas, así que los hilos de crear_snapshot sí trocean a la vez.
+    """
+    import numpy
+
+    mascara = numpy.uint64(_MASCARA)
+    vista = numpy.frombuffer(datos, dtype=numpy.uint8, count=limite)
+    for inicio in range(TAMANO_MIN, limite, TRAMO_VECTORIZADO):
+        fin = min(inicio + TRAMO_VECTORIZADO, limite)
+        # El hash empieza en cero en TAMANO_MIN; después arrastra los bytes del tramo anterior
+        desde = max(TAMANO_MIN, inicio - _VENTANA + 1)
+        h = gear[vista[desde:fin]]
+        paso = 1
+        while paso < _VENTANA:
+            h[paso:] += h[:-paso] << numpy.uint64(paso)
+            paso *= 2
+        cortes = numpy.flatnonzero((h[inicio - desde:] & mascara) == 0)
+        if cortes.size:
+            return inicio + int(cortes[0]) + 1
+    return limite
+
+
+def _buscar_corte_python(datos, limite: int) -> int:
+    """Versión de referencia, byte a byte, para cuando no hay numpy."""
+    gear = _GEAR
+    mascara = _MASCARA
+    h = 0
+    # Los primeros TAMANO_MIN bytes nunca son corte: se saltan sin hashear
+    for i in range(TAMANO_MIN, limite):
+        h = ((h << 1) + gear[datos[i]]) & _M64
+        if not h & mascara:
+            return i + 1
+    return limite
+
+
+def trocear(f):
+    """Genera los trozos definidos por contenido de un archivo abierto en binario."""
+    buffer = bytearray()
+    eof = False
+
+    while True:
+        while not eof and len(buffer) < TAMANO_MAX:
+            leido = f.read(TAMANO_MAX)
+            if leido:
+                buffer += leido
+            else:
+                eof = True
+
+        if not buffer:
+            return
+
+        corte = _buscar_corte(buffer)
+        yield bytes(buffer[:corte])
+        del buffer[:corte]
+
+
+class ChunkStore:
+    """
+    Repositorio local de trozos direccionados por contenido.
+
+    Estructura en disco:
+        <raiz>/chunks/ab/abcdef...   trozo comprimido con zlib (nombre = sha256)
+        <raiz>/snapshots/<id>.json   índice del snapshot: archivo -> trozos
+        <raiz>/repo.lock             bloqueo entre crear_snapshot y recolectar_basura
+
+    crear_snapshot y recolectar_basura se excluyen (también entre procesos):
+    si no, la recolección borraría los trozos de un snapshot cuyo índice aún
+    no está escrito. Si otro proceso tiene el repositorio, se espera.
+    """
+
+    def __init__(self, raiz: Path):
+        self.raiz = Path(raiz)
+        self.dir_chunks = self.raiz / "chunks"
+        self.dir_snapshots = self.raiz / "snapshots"
+        self.dir_chunks.mkdir(parents=True, exist_ok=True)
+        self.dir_snapshots.mkdir(parents=True, exist_ok=True)
+
+    # -------------------- Trozos --------------------
+
+    @contextmanager
+    def _bloqueo(self):
+        # Bloqueo del sistema: si el proceso muere, se suelta solo
+        with open(self.raiz / ARCHIVO_BLOQUEO, "a+b") as f:
+            _bloquear(f)
+            try:
+                yield
+            finally:
+                _desbloquear(f)
+
+    def _ruta_chunk(self, digest: str) -> Path:
+        return self.dir_chunks / digest[:2] / digest
+
+    def guardar_chunk(self, datos: bytes, nivel_compresion: int = 6):
+        """Guarda un trozo si no existía. Devuelve (digest, bytes_escritos)."""
+        digest = hashlib.sha256(datos).hexdigest()
+        ruta = self._ruta_chunk(digest)
+        if ruta.exists():
+            return digest, 0
+
+        ruta.parent.mkdir(exist_ok=True)
+        comprimido = zlib.compress(datos, nivel_compresion)
+        # Nombre temporal único: dos hilos pueden escribir el mismo trozo
+        tmp = ruta.with_name(f"{digest}.{uuid.uuid4().hex}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(comprimido)
+        os.replace(tmp, ruta)
+        return digest, len(comprimido)
+
+    def leer_chunk(self, digest: str) -> bytes:
+        with open(self._ruta_chunk(digest), "rb") as f:
+            datos = zlib.decompress(f.read())
+        if hashlib.sha256(datos).hexdigest() != digest:
+            raise RuntimeError(f"Trozo corrupto: {digest}")
+        return datos
+
+    # -------------------- Snapshots --------------------
+
+    def crear_snapshot(
+        self,
+        carpeta_origen: Path,
+        excluir_temporales: bool,
+        nivel_compresion: int = 6,
+        progreso_callback=None,
+        workers: int = None,
+    ):
+        """
+        Trocea y guarda `carpeta_origen`. Devuelve (id_snapshot, estadisticas).
+
+        Los trozos ya presentes en el repositorio (de este u otros snapshots)
+        no se vuelven a escribir.
+        """
+        archivos = listar_archivos(carpeta_origen, excluir_temporales)
+        if not archivos:
+            raise RuntimeError("No hay archivos para comprimir.")
+
+        total = len(archivos)
+        stats = {"archivos": total, "bytes_leidos": 0, "bytes_escritos": 0,
+                 "chunks": 0, "chunks_nuevos": 0}
+
+        def procesar(archivo: Path):
+            trozos = []
+            leidos = escritos = nuevos = 0
+            with open(archivo, "rb") as f:
+                for datos in trocear(f):
+                    digest, n = self.guardar_chunk(datos, nivel_compresion)
+                    trozos.append(digest)
+                    leidos += len(datos)
+                    escritos += n
+                    nuevos += 1 if n else 0
+            return trozos, leidos, escritos, nuevos
+
+        indice = {}
+        # Hasta que el índice está escrito, sus trozos nuevos no los referencia nadie
+        with self._bloqueo():
+            with ThreadPoolExecutor(max_workers=workers or workers_por_defecto()) as pool:
+                resultados = pool.map(procesar, archivos)
+                for i, (archivo, (trozos, leidos, escritos, nuevos)) in enumerate(
+                    zip(archivos, resultados), start=1
+                ):
+                    st = archivo.stat()
+                    indice[archivo.relative_to(carpeta_origen).as_posix()] = {
+                        "size": leidos,
+                        "mtime": st.st_mtime_ns,
+                        "chunks": trozos,
+                    }
+                    stats["bytes_leidos"] += leidos
+                    stats["bytes_escritos"] += escritos
+                    stats["chunks"] += len(trozos)
+                    stats["chunks_nuevos"] += nuevos
+
+                    if progreso_callback:
+                        progreso_callback(i, total)
+
+            ahora = datetime.now()
+            snapshot_id = f"{ahora.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+            snapshot = {
+                "id": snapshot_id,
+                "fecha": ahora.isoformat(timespec="seconds"),
+                "origen": str(carpeta_origen),
+                "archivos": indice,
+            }
+            tmp = self.dir_snapshots / f"{snapshot_id}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp, self.dir_snapshots / f"{snapshot_id}.json")
+
+        return snapshot_id, stats
+
+    def cargar_snapshot(self, snapshot_id: str) -> dict:
+        ruta = self.dir_snapshots / f"{snapshot_id}.json"
+        if not ruta.exists():
+            raise RuntimeError(f"No existe el snapshot {snapshot_id}")
+        with open(ruta, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def listar_snapshots(self):
+        """Devuelve [(id, fecha, numero_de_archivos)] ordenados por fecha."""
+        snapshots = []
+        for ruta in sorted(self.dir_snapshots.glob("*.json")):
+            with open(ruta, "r", encoding="utf-8") as f:
+                snap = json.load(f)
+            snapshots.append((snap["id"], snap["fecha"], len(snap["archivos"])))
+        return snapshots
+
+    def borrar_snapshot(self, snapshot_id: str):
+        """Elimina el índice; sus trozos se liberan con recolectar_basura()."""
+        ruta = self.dir_snapshots / f"{snapshot_id}.json"
+        if not ruta.exists():
+            raise RuntimeError(f"No existe el snapshot {snapshot_id}")
+        ruta.unlink()
+
+    def restaurar_snapshot(self, snapshot_id: str, carpeta_destino: Path, progreso_callback=None):
+        snapshot = self.cargar_snapshot(snapshot_id)
+        archivos = snapshot["archivos"]
+        total = len(archivos)
+        carpeta_destino = Path(carpeta_destino)
+        carpeta_destino.mkdir(parents=True, exist_ok=True)
+        destino_real = carpeta_destino.resolve()
+
+        for i, (rel, info) in enumerate(archivos.items(), start=1):
+            salida = (carpeta_destino / rel).resolve()
+            # Nunca escribir fuera de la carpeta destino
+            if destino_real not in salida.parents:
+                raise RuntimeError(f"Ruta no válida en el snapshot: {rel}")
+            salida.parent.mkdir(parents=True, exist_ok=True)
+            with open(salida, "wb") as f:
+                for digest in info["chunks"]:
+                    f.write(self.leer_chunk(digest))
+            os.utime(salida, ns=(info["mtime"], info["mtime"]))
+
+            if progreso_callback:
+                progreso_callback(i, total)
+
+        return total
+
+    def verificar_snapshot(self, snapshot_id: str, progreso_callback=None):
+        """
+        Lee cada trozo del snapshot, comprueba su SHA-256 y que los trozos de
+        cada archivo sumen su tamaño. Un trozo compartido se lee una vez.
+        Devuelve (archivos_verificados, errores).
+        """
+        archivos = self.cargar_snapshot(snapshot_id)["archivos"]
+        total = len(archivos)
+        tamanos = {}
+        errores = []
+
+        for i, (rel, info) in enumerate(archivos.items(), start=1):
+            tamano = 0
+            try:
+                for digest in info["chunks"]:
+                    if digest not in tamanos:
+                        tamanos[digest] = len(self.leer_chunk(digest))
+                    tamano += tamanos[digest]
+            except (OSError, RuntimeError, zlib.error) as e:
+                errores.append(f"{rel}: {e}")
+            else:
+                if tamano != info["size"]:
+                    errores.append(f"{rel}: {tamano} bytes en los trozos, {info['size']} en el índice")
+
+            if progreso_callback:
+                progreso_callback(i, total)
+
+        return total - len(errores), errores
+
+    def recolectar_basura(self):
+        """
+        Borra los trozos que no referencia ningún snapshot.
+        Devuelve (trozos_borrados, bytes_liberados).
+
+        Espera a que termine cualquier crear_snapshot en curso. Los
+        temporales de escrituras interrumpidas se borran solo si tienen más
+        de GRACIA_TEMPORALES_S segundos.
+        """
+        with self._bloqueo():
+            vivos = set()
+            for ruta in self.dir_snapshots.glob("*.json"):
+                with open(ruta, "r", encoding="utf-8") as f:
+                    for info in json.load(f)["archivos"].values():
+                        vivos.update(info["chunks"])
+
+            borrados = liberados = 0
+            limite_temporales = time.time() - GRACIA_TEMPORALES_S
+            for ruta in self.dir_chunks.glob("*/*"):
+                if ruta.name in vivos:
+                    continue
+                st = ruta.stat()
+                if ruta.suffix == ".tmp" and st.st_mtime > limite_temporales:
+                    continue
+                liberados += st.st_size
+                ruta.unlink()
+                borrados += 1
+
+        return borrados, liberados
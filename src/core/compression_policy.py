@@ -0,0 +1,140 @@
+import threading
+import time
+import zipfile
+import zlib
+from pathlib import Path
+
+# Formatos que ya vienen comprimidos: deflate no gana casi nada con ellos
+EXTENSIONES_COMPRIMIDAS = {
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".avif",
+    ".mp4", ".m4v", ".mkv", ".avi", ".mov", ".webm",
+    ".mp3", ".m4a", ".aac", ".ogg", ".opus", ".flac",
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z", ".rar", ".zst", ".lz4",
+    ".jar", ".apk", ".docx", ".xlsx", ".pptx", ".odt", ".epub",
+    ".pdf", ".whl",
+}
+
+# (offset, firma) de formatos comprimidos, por si la extensión engaña
+FIRMAS_COMPRIMIDAS = (
+    (0, b"\xff\xd8\xff"),  # JPEG
+    (0, b"\x89PNG\r\n\x1a\n"),
+    (0, b"GIF8"),
+    (0, b"PK\x03\x04"),  # ZIP y derivados (docx, jar, apk...)
+    (0, b"\x1f\x8b"),  # gzip
+    (0, b"BZh"),
+    (0, b"\xfd7zXZ\x00"),
+    (0, b"7z\xbc\xaf\x27\x1c"),
+    (0, b"Rar!\x1a\x07"),
+    (0, b"\x28\xb5\x2f\xfd"),  # zstd
+    (0, b"OggS"),
+    (0, b"fLaC"),
+    (0, b"ID3"),  # mp3
+    (4, b"ftyp"),  # mp4/mov/heic
+    (0, b"\x1a\x45\xdf\xa3"),  # mkv/webm
+)
+
+# Por debajo de este tamaño no compensa sondear: se comprime sin más
+TAMANO_MIN_SONDA = 8 * 1024
+TAMANO_SONDA = 64 * 1024
+# Si la muestra comprimida ocupa más de este porcentaje, se guarda sin comprimir
+UMBRAL_RATIO = 0.95
+
+
+class DecisionCompresion:
+    __slots__ = ("metodo", "nivel", "motivo")
+
+    def __init__(self, metodo: int, nivel: int, motivo: str):
+        self.metodo = metodo
+        self.nivel = nivel
+        self.motivo = motivo
+
+    @property
+    def comprime(self) -> bool:
+        return self.metodo != zipfile.ZIP_STORED
+
+
+class PoliticaCompresion:
+    """
+    Decide por archivo si usar ZIP_STORED o el método del codec (deflate por
+    defecto) y con qué nivel.
+
+    El orden de la decisión es: extensión conocida, firma (magic bytes) y,
+    si no hay pistas, una sonda que comprime una muestra con el nivel 1.
+    Los archivos que se guardan sin comprimir se contabilizan por extensión
+    junto con el tiempo de CPU estimado que se ha ahorrado.
+    """
+
+    def __init__(self, nivel_compresion: int, umbral_ratio: float = UMBRAL_RATIO, metodo: int = zipfile.ZIP_DEFLATED):
+        self.nivel_compresion = nivel_compresion
+        self.metodo = metodo
+        self.umbral_ratio = umbral_ratio
+        self._lock = threading.Lock()
+        self._stats = {}
+        # Coste medido de deflate (segundos por byte) para estimar el ahorro
+        self._segundos_sonda = 0.0
+        self._bytes_sonda = 0
+
+    def decidir(self, archivo: Path, cabecera: bytes, tamano: int) -> DecisionCompresion:
+        """`cabecera` son los primeros bytes del archivo (basta con TAMANO_SONDA)."""
+        extension = archivo.suffix.lower()
+
+        if extension in EXTENSIONES_COMPRIMIDAS:
+            decision = DecisionCompresion(zipfile.ZIP_STORED, 0, "extension")
+        elif any(cabecera[o:o + len(firma)] == firma for o, firma in FIRMAS_COMPRIMIDAS):
+            decision = DecisionCompresion(zipfile.ZIP_STORED, 0, "firma")
+        elif tamano < TAMANO_MIN_SONDA:
+            decision = DecisionCompresion(self.metodo, self.nivel_compresion, "pequeno")
+        else:
+            decision = self._sondear(cabecera[:TAMANO_SONDA])
+
+        self._registrar(extension or "(sin extension)", tamano, decision)
+        return decision
+
+    def _sondear(self, muestra: bytes) -> DecisionCompresion:
+        inicio = time.perf_counter()
+        ratio = len(zlib.compress(muestra, 1)) / max(len(muestra), 1)
+        with self._lock:
+            self._segundos_sonda += time.perf_counter() - inicio
+            self._bytes_sonda += len(muestra)
+
+        if ratio > self.umbral_ratio:
+            return DecisionCompresion(zipfile.ZIP_STORED, 0, "sonda")
+        return DecisionCompresion(self.metodo, self.nivel_compresion, "sonda")
+
+    def _registrar(self, extension: str, tamano: int, decision: DecisionCompresion):
+        with self._lock:
+            stats = self._stats.setdefault(
+                extension, {"archivos": 0, "bytes": 0, "sin_comprimir": 0, "bytes_sin_comprimir": 0}
+            )
+            stats["archivos"] += 1
+            stats["bytes"] += tamano
+            if not decision.comprime:
+                stats["sin_comprimir"] += 1
+                stats["bytes_sin_comprimir"] += tamano
+
+    def estadisticas(self) -> dict:
+        """
+        Estadísticas por extensión. `cpu_ahorrada_s` estima el tiempo que
+        habría costado deflatear los bytes guardados sin comprimir, a partir
+        de la velocidad medida en las sondas (nivel 1, así que es una cota
+        inferior para niveles más altos).
+        """
+        with self._lock:
+            coste = self._segundos_sonda / self._bytes_sonda if self._bytes_sonda else 0.0
+            resultado = {}
+            for extension, stats in self._stats.items():
+                resultado[extension] = dict(stats, cpu_ahorrada_s=stats["bytes_sin_comprimir"] * coste)
+            return resultado
+
+    def resumen(self) -> str:
+        stats = self.estadisticas()
+        sin_comprimir = sum(s["sin_comprimir"] for s in stats.values())
+        ahorro = sum(s["cpu_ahorrada_s"] for s in stats.values())
+        lineas = [f"Archivos guardados sin comprimir: {sin_comprimir} (CPU ahorrada ~{ahorro:.1f} s)"]
+        for extension, s in sorted(stats.items(), key=lambda e: -e[1]["bytes_sin_comprimir"]):
+            if s["sin_comprimir"]:
+                lineas.append(
+                    f"  {extension}: {s['sin_comprimir']}/{s['archivos']} archivos, "
+                    f"{s['bytes_sin_comprimir'] / (1024 * 1024):.1f} MB, ~{s['cpu_ahorrada_s']:.1f} s"
+                )
+        return "\n".join(lineas)
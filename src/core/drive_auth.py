@@ -1,10 +1,15 @@
 from __future__ import print_function
+import threading
+from datetime import datetime, timezone
 from pathlib import Path
-from tkinter import filedialog, messagebox
+
+import requests
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
+from googleapiclient.http import HttpRequest, build_http
 
 SCOPES = ['https://www.googleapis.com/auth/drive.file']
 
@@ -13,8 +18,23 @@ APP_DIR = Path.cwd()
 CREDENTIALS_PATH = APP_DIR / "credentials.json"
 TOKEN_PATH = APP_DIR / "token.json"
 
+# El token se renueva en segundo plano este tiempo antes de caducar
+MARGEN_REFRESCO_S = 300
+REINTENTO_REFRESCO_S = 60
+
+# Servicio compartido: se construye una vez y lo usan todos los hilos
+_lock = threading.RLock()
+_servicio = None
+_credenciales = None
+_temporizador = None
+_sesion_refresco = requests.Session()
+_http_local = threading.local()
+
 def load_credentials_via_gui():
     """Permite al usuario seleccionar credentials.json y lo guarda en APP_DIR."""
+    # tkinter solo se importa en modo gráfico: la CLI funciona sin él
+    from tkinter import filedialog, messagebox
+
     file_path = filedialog.askopenfilename(
         title="Selecciona tu archivo credentials.json",
         filetypes=[("JSON files", "*.json")]
@@ -32,8 +52,7 @@ def load_credentials_via_gui():
         messagebox.showerror("Error", f"No se pudo guardar credenciales: {e}")
         return None
 
-def get_drive_service():
-    """Devuelve un servicio autenticado de Google Drive con persistencia."""
+def _obtener_credenciales(interactivo: bool, permitir_login: bool):
     creds = None
 
     # Si ya existe token.json, lo carga
@@ -43,10 +62,15 @@ def get_drive_service():
     # Si no hay credenciales válidas, inicia flujo OAuth
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
+            creds.refresh(Request(_sesion_refresco))
         else:
+            if not permitir_login:
+                raise RuntimeError("No hay un token válido. Inicia sesión con: python cli.py login")
+
             # Si no existe credentials.json, pedirlo desde GUI
             if not CREDENTIALS_PATH.exists():
+                if not interactivo:
+                    raise RuntimeError(f"No existe {CREDENTIALS_PATH}. Cópialo desde Google Cloud Console.")
                 cred_path = load_credentials_via_gui()
                 if not cred_path:
                     return None
@@ -57,13 +81,117 @@ def get_drive_service():
                 flow = InstalledAppFlow.from_client_secrets_file(
                     cred_path, SCOPES
                 )
-                creds = flow.run_local_server(port=0)
+                creds = flow.run_local_server(port=0, open_browser=interactivo)
             except Exception as e:
+                if not interactivo:
+                    raise RuntimeError(f"Credenciales inválidas: {e}") from e
+                from tkinter import messagebox
+
                 messagebox.showerror("Error", f"Credenciales inválidas: {e}")
                 return None
 
-        # Guarda el token para futuras ejecuciones (persistencia)
-        with open(TOKEN_PATH, 'w') as token:
-            token.write(creds.to_json())
+        _guardar_token(creds)
+
+    return creds
+
+
+def _guardar_token(creds):
+    # Guarda el token para futuras ejecuciones (persistencia)
+    with open(TOKEN_PATH, 'w') as token:
+        token.write(creds.to_json())
+
+
+def http_del_hilo(creds=None):
+    """
+    Cliente HTTP autorizado propio del hilo actual.
+
+    httplib2 no es seguro entre hilos, así que cada hilo tiene el suyo; se
+    reutiliza entre peticiones y mantiene abierta la conexión TLS.
+    """
+    creds = creds or _credenciales
+    clientes = getattr(_http_local, "clientes", None)
+    if clientes is None:
+        clientes = _http_local.clientes = {}
+    # Clave por objeto: tras un nuevo inicio de sesión no se reutiliza el cliente viejo
+    http = clientes.get(id(creds))
+    if http is None or http.credentials is not creds:
+        http = clientes[id(creds)] = AuthorizedHttp(creds, http=build_http())
+    return http
+
+
+def _construir_peticion(http, *args, **kwargs):
+    # Las peticiones del servicio compartido salen por el cliente del hilo que las ejecuta
+    return HttpRequest(http_del_hilo(http.credentials), *args, **kwargs)
+
+
+def _programar_refresco():
+    global _temporizador
+    if _temporizador:
+        _temporizador.cancel()
+    if _credenciales is None or _credenciales.expiry is None or not _credenciales.refresh_token:
+        return
+
+    # expiry es UTC sin zona horaria
+    restante = (_credenciales.expiry - datetime.now(timezone.utc).replace(tzinfo=None)).total_seconds()
+    _temporizador = threading.Timer(max(restante - MARGEN_REFRESCO_S, 0), _refrescar)
+    _temporizador.daemon = True
+    _temporizador.start()
+
+
+def _refrescar():
+    global _temporizador
+    with _lock:
+        if _credenciales is None:
+            return
+        try:
+            _credenciales.refresh(Request(_sesion_refresco))
+            _guardar_token(_credenciales)
+        except Exception:
+            # Sin red: se reintenta más tarde; AuthorizedHttp también renueva al recibir un 401
+            _temporizador = threading.Timer(REINTENTO_REFRESCO_S, _refrescar)
+            _temporizador.daemon = True
+            _temporizador.start()
+            return
+        _programar_refresco()
+
+
+def invalidar_servicio():
+    """Olvida el servicio en caché (p. ej. tras cargar otras credenciales)."""
+    global _servicio, _credenciales, _temporizador
+    with _lock:
+        if _temporizador:
+            _temporizador.cancel()
+        _servicio = _credenciales = _temporizador = None
+
+
+def get_drive_service(interactivo: bool = True, permitir_login: bool = True):
+    """
+    Devuelve un servicio autenticado de Google Drive con persistencia.
+
+    El servicio se construye una sola vez y se comparte entre hilos: cada
+    hilo hace sus peticiones con su propio cliente HTTP (ver http_del_hilo)
+    y el token se renueva en segundo plano antes de caducar.
+
+    Con interactivo=False (CLI, daemon) no se abre ningún diálogo: los errores
+    se lanzan como RuntimeError y el flujo OAuth muestra la URL en consola.
+    Con permitir_login=False nunca se inicia el flujo OAuth (trabajos
+    desatendidos): si no hay un token válido se lanza RuntimeError.
+    """
+    global _servicio, _credenciales
+    with _lock:
+        if _servicio is not None:
+            return _servicio
+
+        creds = _obtener_credenciales(interactivo, permitir_login)
+        if creds is None:
+            return None
 
-    return build('drive', 'v3', credentials=creds)
+        _credenciales = creds
+        _servicio = build(
+            'drive', 'v3',
+            http=AuthorizedHttp(creds, http=build_http()),
+            requestBuilder=_construir_peticion,
+            cache_discovery=False,
+        )
+        _programar_refresco()
+        return _servicio
@@ -0,0 +1,375 @@
+import json
+import threading
+from datetime import datetime
+from pathlib import Path
+
+from googleapiclient.errors import HttpError
+
+from core.drive_auth import APP_DIR
+from core.drive_upload import MotorSubida, mimetype_backup
+from core.progress import formatear_bytes
+from core.retention import FORMATO_MARCA, PoliticaRetencion, marca_backup
+
+# Todas las subidas van a esta carpeta de Drive, con fecha en el nombre y
+# appProperties que las identifican como backups de la aplicación
+CARPETA_DRIVE = "BackTomatic"
+MIME_CARPETA = "application/vnd.google-apps.folder"
+PROPIEDAD_APP = "backtomatic"
+
+RUTA_CATALOGO = APP_DIR / "catalogo_drive.json"
+VERSION_CATALOGO = 1
+
+CAMPOS_ARCHIVO = "id,name,size,createdTime,parents,trashed,appProperties"
+TAMANO_PAGINA = 1000
+# Drive admite como mucho 100 peticiones por lote
+TAMANO_LOTE = 100
+# Por debajo de este tamaño no se pregunta por la cuota antes de subir
+CUOTA_MINIMA = 64 * 1024 * 1024
+
+_lock_compartido = threading.Lock()
+_compartido = None
+
+
+class ErrorCuota(RuntimeError):
+    pass
+
+
+def nombre_remoto(ruta: Path, trabajo: str, marca: str) -> str:
+    return f"{trabajo}-{marca}-{ruta.name}" if trabajo else f"{marca}-{ruta.name}"
+
+
+class CatalogoDrive:
+    """
+    Copia local del listado de backups en Drive, para no recorrer la
+    carpeta cada vez.
+
+    La primera sincronización lista la carpeta CARPETA_DRIVE entera; las
+    siguientes solo piden a la API de cambios lo ocurrido desde el último
+    token (page token), que se guarda con el catálogo en `ruta`. Encima de
+    eso aplica políticas de retención (borrando en lotes), comprueba la
+    cuota antes de subir y registra cada subida sin esperar a los cambios.
+
+    Los backups de una cadena incremental no se borran nunca: cada eslabón
+    depende de los anteriores.
+    """
+
+    def __init__(self, service, ruta: Path = RUTA_CATALOGO):
+        self.service = service
+        self.ruta = Path(ruta)
+        self._lock = threading.RLock()
+        self._datos = None
+
+    # -------------------- Caché en disco --------------------
+
+    def _vacio(self) -> dict:
+        return {"version": VERSION_CATALOGO, "carpeta_id": None, "token": None, "archivos": {}}
+
+    def _cargar(self) -> dict:
+        if self._datos is None:
+            self._datos = self._vacio()
+            if self.ruta.exists():
+                try:
+                    with open(self.ruta, "r", encoding="utf-8") as f:
+                        datos = json.load(f)
+                    if datos.get("version") == VERSION_CATALOGO:
+                        self._datos = datos
+                except (OSError, ValueError):
+                    pass
+        return self._datos
+
+    def _guardar(self):
+        tmp = self.ruta.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._datos, f, indent=1)
+        tmp.replace(self.ruta)
+
+    @staticmethod
+    def _entrada(archivo: dict) -> dict:
+        propiedades = archivo.get("appProperties", {})
+        return {
+            "nombre": archivo["name"],
+            "tamano": int(archivo.get("size", 0)),
+            "trabajo": propiedades.get("trabajo", ""),
+            "marca": propiedades.get("marca", ""),
+            "incremental": propiedades.get("incremental") == "1",
+        }
+
+    def _es_backup(self, archivo: dict, carpeta_id: str) -> bool:
+        return (
+            not archivo.get("trashed")
+            and carpeta_id in archivo.get("parents", [])
+            and PROPIEDAD_APP in archivo.get("appProperties", {})
+        )
+
+    # -------------------- Sincronización --------------------
+
+    def carpeta_id(self) -> str:
+        """ID de la carpeta de backups; la crea si no existe."""
+        with self._lock:
+            datos = self._cargar()
+            if datos["carpeta_id"]:
+                return datos["carpeta_id"]
+            respuesta = (
+                self.service.files()
+                .list(
+                    q=f"name = '{CARPETA_DRIVE}' and mimeType = '{MIME_CARPETA}' and trashed = false",
+                    spaces="drive",
+                    fields="files(id)",
+                )
+                .execute()
+            )
+            if respuesta.get("files"):
+                carpeta = respuesta["files"][0]["id"]
+            else:
+                carpeta = (
+                    self.service.files()
+                    .create(body={"name": CARPETA_DRIVE, "mimeType": MIME_CARPETA}, fields="id")
+                    .execute()["id"]
+                )
+            # Otra carpeta: lo que hubiera en caché ya no vale
+            self._datos = {**self._vacio(), "carpeta_id": carpeta}
+            self._guardar()
+            return carpeta
+
+    def _listado_completo(self, carpeta: str):
+        datos = self._datos
+        # El token se pide antes de listar: lo que cambie mientras tanto llega luego como cambio
+        datos["token"] = self.service.changes().getStartPageToken().execute()["startPageToken"]
+        archivos = {}
+        pagina = None
+        while True:
+            respuesta = (
+                self.service.files()
+                .list(
+                    q=f"'{carpeta}' in parents and trashed = false",
+                    spaces="drive",
+                    pageSize=TAMANO_PAGINA,
+                    pageToken=pagina,
+                    fields=f"nextPageToken,files({CAMPOS_ARCHIVO})",
+                )
+                .execute()
+            )
+            for archivo in respuesta.get("files", []):
+                if self._es_backup(archivo, carpeta):
+                    archivos[archivo["id"]] = self._entrada(archivo)
+            pagina = respuesta.get("nextPageToken")
+            if not pagina:
+                break
+        datos["archivos"] = archivos
+
+    def _aplicar_cambios(self, carpeta: str) -> int:
+        datos = self._datos
+        archivos = datos["archivos"]
+        token = datos["token"]
+        aplicados = 0
+        while True:
+            respuesta = (
+                self.service.changes()
+                .list(
+                    pageToken=token,
+                    spaces="drive",
+                    pageSize=TAMANO_PAGINA,
+                    includeRemoved=True,
+                    fields=f"nextPageToken,newStartPageToken,changes(fileId,removed,file({CAMPOS_ARCHIVO}))",
+                )
+                .execute()
+            )
+            for cambio in respuesta.get("changes", []):
+                archivo = cambio.get("file")
+                if cambio["fileId"] == carpeta and (cambio.get("removed") or archivo.get("trashed")):
+                    # Sin carpeta no queda ningún backup: se empieza de cero en la próxima subida
+                    self._datos = self._vacio()
+                    return aplicados + 1
+                if not cambio.get("removed") and self._es_backup(archivo, carpeta):
+                    archivos[cambio["fileId"]] = self._entrada(archivo)
+                else:
+                    archivos.pop(cambio["fileId"], None)
+                aplicados += 1
+            if "newStartPageToken" in respuesta:
+                datos["token"] = respuesta["newStartPageToken"]
+                return aplicados
+            token = respuesta["nextPageToken"]
+
+    def sincronizar(self) -> int:
+        """Pone al día el catálogo. Devuelve los cambios aplicados (o los archivos, si se listó todo)."""
+        with self._lock:
+            carpeta = self.carpeta_id()
+            if self._datos["token"]:
+                try:
+                    aplicados = self._aplicar_cambios(carpeta)
+                    self._guardar()
+                    return aplicados
+                except HttpError as e:
+                    # Token caducado o inválido: se vuelve a listar todo
+                    if e.resp.status not in (400, 404, 410):
+                        raise
+            self._listado_completo(carpeta)
+            self._guardar()
+            return len(self._datos["archivos"])
+
+    def backups(self, trabajo: str = None) -> dict:
+        """
+        Backups del catálogo agrupados por ejecución: {(trabajo, marca): [archivos]},
+        donde cada archivo es {"id", "nombre", "tamano", ...}. No sincroniza.
+        """
+        with self._lock:
+            grupos = {}
+            for drive_id, entrada in self._cargar()["archivos"].items():
+                if trabajo is not None and entrada["trabajo"] != trabajo:
+                    continue
+                grupos.setdefault((entrada["trabajo"], entrada["marca"]), []).append({"id": drive_id, **entrada})
+            return grupos
+
+    # -------------------- Retención --------------------
+
+    def caducados(self, politica: PoliticaRetencion, trabajo: str = None) -> list:
+        """Grupos (trabajo, marca) que la política ya no conserva, del más reciente al más antiguo."""
+        por_trabajo = {}
+        for clave, archivos in self.backups(trabajo).items():
+            if any(a["incremental"] for a in archivos):
+                continue
+            try:
+                fecha = datetime.strptime(clave[1], FORMATO_MARCA)
+            except ValueError:
+                continue
+            por_trabajo.setdefault(clave[0], {})[clave] = fecha
+        caducados = []
+        for fechas in por_trabajo.values():
+            caducados.extend(politica.aplicar(fechas)[1])
+        return caducados
+
+    def borrar(self, ids: list) -> tuple:
+        """
+        Borra definitivamente (sin pasar por la papelera) los archivos `ids`
+        en lotes de TAMANO_LOTE peticiones. Un archivo que ya no existe
+        cuenta como borrado. Devuelve (borrados, errores).
+        """
+        borrados = []
+        errores = []
+
+        def al_responder(drive_id, respuesta, error):
+            if error is None or (isinstance(error, HttpError) and error.resp.status == 404):
+                borrados.append(drive_id)
+            else:
+                errores.append(f"{drive_id}: {error}")
+
+        for inicio in range(0, len(ids), TAMANO_LOTE):
+            lote = self.service.new_batch_http_request(callback=al_responder)
+            for drive_id in ids[inicio:inicio + TAMANO_LOTE]:
+                lote.add(self.service.files().delete(fileId=drive_id), request_id=drive_id)
+            lote.execute()
+
+        with self._lock:
+            archivos = self._cargar()["archivos"]
+            for drive_id in borrados:
+                archivos.pop(drive_id, None)
+            self._guardar()
+        return borrados, errores
+
+    def podar(self, politica: PoliticaRetencion, trabajo: str = None, simular: bool = False, log_callback=None) -> tuple:
+        """
+        Sincroniza y borra los backups que la política no conserva (de un
+        trabajo o de todos). Con `simular` solo los lista.
+        Devuelve (bytes liberados, errores).
+        """
+        self.sincronizar()
+        grupos = self.backups(trabajo)
+        caducados = self.caducados(politica, trabajo)
+        if not caducados:
+            return 0, []
+        tamanos = {}
+        for clave in caducados:
+            for archivo in grupos[clave]:
+                tamanos[archivo["id"]] = archivo["tamano"]
+            if log_callback:
+                nombres = ", ".join(sorted(a["nombre"] for a in grupos[clave]))
+                log_callback(f"{'Se borraría' if simular else 'Borrando'} {nombres}")
+        if simular:
+            return sum(tamanos.values()), []
+        borrados, errores = self.borrar(list(tamanos))
+        return sum(tamanos[i] for i in borrados), errores
+
+    # -------------------- Cuota y subidas --------------------
+
+    def espacio_libre(self):
+        """Bytes libres en Drive, o None si la cuenta no tiene límite."""
+        cuota = self.service.about().get(fields="storageQuota(limit,usage)").execute()["storageQuota"]
+        if "limit" not in cuota:
+            return None
+        return int(cuota["limit"]) - int(cuota["usage"])
+
+    def comprobar_cuota(self, tamano: int, politica: PoliticaRetencion = None, trabajo: str = None, log_callback=None):
+        """
+        Lanza ErrorCuota si `tamano` bytes no caben en Drive. Con `politica`,
+        antes de rendirse borra los backups caducados de `trabajo`.
+        """
+        if tamano < CUOTA_MINIMA:
+            return
+        libre = self.espacio_libre()
+        if libre is None or tamano <= libre:
+            return
+        if politica is not None:
+            liberado, _ = self.podar(politica, trabajo, log_callback=log_callback)
+            if liberado:
+                libre = self.espacio_libre()
+                if tamano <= libre:
+                    return
+        raise ErrorCuota(
+            f"No hay espacio en Drive para {formatear_bytes(tamano)}: quedan {formatear_bytes(max(libre, 0))}"
+        )
+
+    def metadatos(self, ruta: Path, trabajo: str = None, marca: str = None, incremental: bool = False) -> dict:
+        """Nombre, carpeta y appProperties con los que se sube un archivo de backup."""
+        marca = marca or marca_backup()
+        propiedades = {PROPIEDAD_APP: "1", "trabajo": trabajo or "", "marca": marca}
+        if incremental:
+            propiedades["incremental"] = "1"
+        return {"name": nombre_remoto(Path(ruta), trabajo, marca), "parents": [self.carpeta_id()], "appProperties": propiedades}
+
+    def registrar(self, drive_id: str, metadatos: dict, tamano: int):
+        """Añade al catálogo un archivo recién subido (la API de cambios lo confirmará después)."""
+        with self._lock:
+            archivo = {**metadatos, "size": tamano}
+            self._cargar()["archivos"][drive_id] = self._entrada(archivo)
+            self._guardar()
+
+    def subir(
+        self,
+        ruta: Path,
+        trabajo: str = None,
+        marca: str = None,
+        incremental: bool = False,
+        politica: PoliticaRetencion = None,
+        progreso_callback=None,
+        motor: MotorSubida = None,
+        log_callback=None,
+    ) -> dict:
+        """
+        Sube un backup a la carpeta de Drive con su nombre fechado, después
+        de comprobar la cuota, y lo registra en el catálogo. Devuelve la
+        respuesta de Drive (ver MotorSubida.subir).
+        """
+        ruta = Path(ruta)
+        tamano = ruta.stat().st_size
+        self.comprobar_cuota(tamano, politica, trabajo, log_callback)
+        metadatos = self.metadatos(ruta, trabajo, marca, incremental)
+        motor = motor or MotorSubida.desde_servicio(self.service)
+        respuesta = motor.subir(
+            ruta,
+            nombre=metadatos["name"],
+            mimetype=mimetype_backup(ruta),
+            carpeta_id=metadatos["parents"][0],
+            progreso_callback=progreso_callback,
+            propiedades=metadatos["appProperties"],
+        )
+        self.registrar(respuesta["id"], metadatos, tamano)
+        return respuesta
+
+
+def catalogo_compartido(service) -> CatalogoDrive:
+    """Catálogo único para toda la aplicación: varios hilos suben a la vez y comparten la caché."""
+    global _compartido
+    with _lock_compartido:
+        if _compartido is None or _compartido.service is not service:
+            _compartido = CatalogoDrive(service)
+        return _compartido
@@ -0,0 +1,366 @@
+import hashlib
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import httplib2
+
+from core.drive_auth import APP_DIR, http_del_hilo
+from core.throttle import limitador_global
+
+URL_SUBIDA = "https://www.googleapis.com/upload/drive/v3/files?uploadType=resumable&fields=id,md5Checksum,size"
+
+# Drive exige que los trozos de una subida resumible sean múltiplos de 256 KB
+MULTIPLO_CHUNK = 256 * 1024
+CHUNK_POR_DEFECTO = 64 * MULTIPLO_CHUNK  # 16 MB
+
+REINTENTOS = 8
+ESPERA_BASE = 1.0
+ESPERA_MAX = 60.0
+CODIGOS_REINTENTABLES = {408, 429, 500, 502, 503, 504}
+
+# Drive mantiene una sesión resumible una semana; se descarta antes por margen
+CADUCIDAD_SESION = timedelta(days=6)
+RUTA_SESIONES = APP_DIR / "subidas.json"
+
+
+class ErrorSubida(RuntimeError):
+    pass
+
+
+class _Reintentable(Exception):
+    pass
+
+
+def mimetype_backup(ruta: Path) -> str:
+    return "application/zstd" if ruta.name.endswith(".zst") else "application/zip"
+
+
+class SesionesSubida:
+    """
+    URIs de sesiones resumibles guardadas en disco, para continuar una
+    subida después de cerrar la aplicación.
+
+    La clave incluye tamaño y fecha de modificación: si el archivo cambió, la
+    sesión antigua no sirve y se empieza de nuevo.
+    """
+
+    def __init__(self, ruta: Path = RUTA_SESIONES):
+        self.ruta = Path(ruta)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _clave(archivo: Path) -> str:
+        st = archivo.stat()
+        return f"{archivo.resolve()}|{st.st_size}|{st.st_mtime_ns}"
+
+    def _cargar(self) -> dict:
+        if not self.ruta.exists():
+            return {}
+        try:
+            with open(self.ruta, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _guardar(self, sesiones: dict):
+        tmp = self.ruta.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(sesiones, f, indent=1)
+        tmp.replace(self.ruta)
+
+    def obtener(self, archivo: Path):
+        with self._lock:
+            sesion = self._cargar().get(self._clave(archivo))
+        if sesion is None:
+            return None
+        if datetime.now() - datetime.fromisoformat(sesion["creada"]) > CADUCIDAD_SESION:
+            self.borrar(archivo)
+            return None
+        return sesion["uri"]
+
+    def guardar(self, archivo: Path, uri: str):
+        with self._lock:
+            sesiones = self._cargar()
+            sesiones[self._clave(archivo)] = {"uri": uri, "creada": datetime.now().isoformat(timespec="seconds")}
+            self._guardar(sesiones)
+
+    def borrar(self, archivo: Path):
+        with self._lock:
+            sesiones = self._cargar()
+            if sesiones.pop(self._clave(archivo), None) is not None:
+                self._guardar(sesiones)
+
+
+def comprobar_md5(respuesta: dict, md5_local: str, nombre: str):
+    """Lanza ErrorSubida si Drive guardó algo distinto de lo que se envió."""
+    remoto = respuesta.get("md5Checksum")
+    if remoto and remoto != md5_local:
+        raise ErrorSubida(
+            f"El MD5 de {nombre} en Drive ({remoto}) no coincide con el local ({md5_local}); "
+            f"el archivo subido (ID {respuesta.get('id')}) está dañado"
+        )
+
+
+class _MD5Secuencial:
+    """
+    MD5 de un archivo que se envía por trozos y a veces se reenvía.
+
+    Solo cuenta cada byte una vez y en orden: los trozos repetidos tras un
+    reintento se ignoran, y si la subida se retoma más adelante (sesión
+    guardada) el tramo inicial se lee del disco con hasta().
+    """
+
+    def __init__(self):
+        self._md5 = hashlib.md5()
+        self.posicion = 0
+
+    def update(self, offset: int, datos: bytes):
+        if offset <= self.posicion < offset + len(datos):
+            self._md5.update(datos[self.posicion - offset:])
+            self.posicion = offset + len(datos)
+
+    def hasta(self, f, offset: int):
+        if self.posicion >= offset:
+            return
+        f.seek(self.posicion)
+        while self.posicion < offset:
+            datos = f.read(min(CHUNK_POR_DEFECTO, offset - self.posicion))
+            if not datos:
+                break
+            self.update(self.posicion, datos)
+
+    def hexdigest(self) -> str:
+        return self._md5.hexdigest()
+
+
+class MotorSubida:
+    """
+    Subidas resumibles a Drive con trozos configurables y reintentos.
+
+    Ante un error de red o un 5xx/429 espera con backoff exponencial (con
+    jitter), pregunta a Drive cuántos bytes tiene confirmados y continúa desde
+    ahí. La URI de cada sesión se guarda en `sesiones`, así que una subida
+    interrumpida se retoma aunque se reinicie la aplicación.
+
+    `fabrica_http()` crea un cliente HTTP con la interfaz de httplib2
+    (request(uri, method, body, headers) -> (resp, contenido)). Cada hilo usa
+    el suyo, porque httplib2 no es seguro entre hilos. `url_subida` se puede
+    cambiar para probar contra un servidor local. Cada trozo pasa antes por
+    el límite de subida de `limitador` (por defecto el global).
+    """
+
+    def __init__(
+        self,
+        fabrica_http,
+        chunksize: int = CHUNK_POR_DEFECTO,
+        reintentos: int = REINTENTOS,
+        espera_base: float = ESPERA_BASE,
+        espera_max: float = ESPERA_MAX,
+        sesiones: SesionesSubida = None,
+        url_subida: str = URL_SUBIDA,
+        limitador=None,
+    ):
+        if chunksize <= 0 or chunksize % MULTIPLO_CHUNK:
+            raise ValueError("chunksize debe ser múltiplo de 256 KB")
+        self.fabrica_http = fabrica_http
+        self.chunksize = chunksize
+        self.reintentos = reintentos
+        self.espera_base = espera_base
+        self.espera_max = espera_max
+        self.sesiones = sesiones if sesiones is not None else SesionesSubida()
+        self.url_subida = url_subida
+        self.limitador = limitador or limitador_global()
+        self._local = threading.local()
+
+    @classmethod
+    def desde_servicio(cls, service, **kwargs) -> "MotorSubida":
+        """Usa las credenciales del servicio con el cliente HTTP compartido de cada hilo."""
+        credenciales = service._http.credentials
+        return cls(lambda: http_del_hilo(credenciales), **kwargs)
+
+    def _http(self):
+        if not hasattr(self._local, "http"):
+            self._local.http = self.fabrica_http()
+        return self._local.http
+
+    # -------------------- Protocolo resumable --------------------
+
+    def _iniciar(self, nombre: str, total: int, mimetype: str, carpeta_id: str = None, propiedades: dict = None) -> str:
+        metadatos = {"name": nombre}
+        if carpeta_id:
+            metadatos["parents"] = [carpeta_id]
+        if propiedades:
+            metadatos["appProperties"] = propiedades
+        resp, contenido = self._http().request(
+            self.url_subida,
+            "POST",
+            body=json.dumps(metadatos),
+            headers={
+                "Content-Type": "application/json; charset=UTF-8",
+                "X-Upload-Content-Type": mimetype,
+                "X-Upload-Content-Length": str(total),
+            },
+        )
+        if resp.status in CODIGOS_REINTENTABLES:
+            raise _Reintentable(f"Drive respondió {resp.status}")
+        if resp.status != 200 or "location" not in resp:
+            raise ErrorSubida(f"No se pudo iniciar la subida ({resp.status}): {contenido[:200]!r}")
+        return resp["location"]
+
+    def _enviar(self, uri: str, offset: int, datos, total: int):
+        """
+        Envía un trozo (o, con datos=None, solo consulta el estado).
+        Devuelve (offset_confirmado, respuesta_final o None).
+        """
+        if datos is None:
+            rango = f"bytes */{total}"
+            datos = b""
+        elif datos:
+            rango = f"bytes {offset}-{offset + len(datos) - 1}/{total}"
+        else:
+            # Archivo vacío: no hay ningún byte que enviar
+            rango = f"bytes */{total}"
+
+        resp, contenido = self._http().request(
+            uri, "PUT", body=datos, headers={"Content-Length": str(len(datos)), "Content-Range": rango}
+        )
+        if resp.status in (200, 201):
+            return total, json.loads(contenido)
+        if resp.status == 308:
+            # "Range: bytes=0-N" indica lo que Drive tiene guardado
+            rango = resp.get("range")
+            return (int(rango.rsplit("-", 1)[1]) + 1 if rango else 0), None
+        if resp.status in (404, 410):
+            return None, None
+        if resp.status in CODIGOS_REINTENTABLES:
+            raise _Reintentable(f"Drive respondió {resp.status}")
+        raise ErrorSubida(f"Drive respondió {resp.status}: {contenido[:200]!r}")
+
+    def _esperar(self, intento: int):
+        espera = min(self.espera_max, self.espera_base * 2 ** (intento - 1))
+        time.sleep(espera * random.uniform(0.5, 1.0))
+
+    # -------------------- API --------------------
+
+    def subir(
+        self,
+        ruta: Path,
+        nombre: str = None,
+        mimetype: str = None,
+        carpeta_id: str = None,
+        progreso_callback=None,
+        propiedades: dict = None,
+    ) -> dict:
+        """
+        Sube `ruta` y devuelve la respuesta de Drive ({"id", "md5Checksum", "size"}).
+        `progreso_callback(bytes_confirmados, total)` se llama tras cada trozo.
+        `propiedades` se guardan como appProperties del archivo en Drive.
+
+        El MD5 del archivo se calcula con los mismos trozos que se envían y se
+        compara con el `md5Checksum` de Drive; si no coinciden lanza ErrorSubida.
+        """
+        ruta = Path(ruta)
+        total = ruta.stat().st_size
+        nombre = nombre or ruta.name
+        mimetype = mimetype or mimetype_backup(ruta)
+
+        uri = self.sesiones.obtener(ruta)
+        # Con una sesión guardada primero se pregunta por dónde iba
+        consultar = uri is not None
+        offset = 0
+        intentos = 0
+        md5 = _MD5Secuencial()
+
+        with open(ruta, "rb") as f:
+            while True:
+                try:
+                    if uri is None:
+                        uri = self._iniciar(nombre, total, mimetype, carpeta_id, propiedades)
+                        self.sesiones.guardar(ruta, uri)
+                        offset = 0
+
+                    if consultar:
+                        datos = None
+                    else:
+                        md5.hasta(f, offset)
+                        f.seek(offset)
+                        datos = f.read(self.chunksize)
+                        md5.update(offset, datos)
+                        self.limitador.subir(len(datos))
+
+                    confirmado, respuesta = self._enviar(uri, offset, datos, total)
+                except (_Reintentable, OSError, httplib2.HttpLib2Error) as e:
+                    intentos += 1
+                    if intentos > self.reintentos:
+                        raise ErrorSubida(f"La subida de {nombre} falló tras {self.reintentos} reintentos: {e}") from e
+                    self._esperar(intentos)
+                    consultar = uri is not None
+                    continue
+
+                if respuesta is not None:
+                    self.sesiones.borrar(ruta)
+                    md5.hasta(f, total)
+                    comprobar_md5(respuesta, md5.hexdigest(), nombre)
+                    if progreso_callback:
+                        progreso_callback(total, total)
+                    return respuesta
+
+                if confirmado is None:
+                    # La sesión caducó o Drive la descartó: se empieza de cero
+                    self.sesiones.borrar(ruta)
+                    uri = None
+                    consultar = False
+                    continue
+
+                if not consultar:
+                    if confirmado > offset:
+                        intentos = 0
+                    else:
+                        # Drive respondió 308 sin avanzar: reenviar el trozo sin límite no acabaría nunca
+                        intentos += 1
+                        if intentos > self.reintentos:
+                            raise ErrorSubida(
+                                f"La subida de {nombre} no avanza de {offset} bytes tras {self.reintentos} reintentos"
+                            )
+                        self._esperar(intentos)
+                consultar = False
+                offset = confirmado
+                if progreso_callback:
+                    progreso_callback(offset, total)
+
+    def subir_varios(self, rutas, workers: int = 3, progreso_callback=None) -> dict:
+        """
+        Sube varios archivos (p. ej. volúmenes) a la vez. Devuelve
+        {ruta: respuesta o excepción}; un fallo no detiene al resto.
+        `progreso_callback(ruta, bytes_confirmados, total)`.
+        """
+        def una(ruta):
+            callback = (lambda hechos, total: progreso_callback(ruta, hechos, total)) if progreso_callback else None
+            try:
+                return ruta, self.subir(ruta, progreso_callback=callback)
+            except Exception as e:
+                return ruta, e
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return dict(pool.map(una, rutas))
+
+
+def subir_archivo(service, ruta: Path, progreso_callback=None, motor: MotorSubida = None) -> str:
+    """
+    Sube `ruta` a Google Drive con una subida resumible.
+
+    `progreso_callback(progreso)` recibe un valor entre 0.0 y 1.0 tras cada
+    trozo confirmado. Devuelve el ID del archivo en Drive.
+    """
+    motor = motor or MotorSubida.desde_servicio(service)
+
+    def progreso(hechos: int, total: int):
+        if progreso_callback:
+            progreso_callback(hechos / total if total else 1.0)
+
+    return motor.subir(ruta, progreso_callback=progreso)["id"]
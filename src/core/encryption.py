@@ -0,0 +1,329 @@
+import hashlib
+import hmac
+import os
+import struct
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pyzipper
+from Cryptodome.Cipher import AES
+from Cryptodome.Util import Counter
+from pyzipper.zipfile_aes import AESZipEncrypter
+
+# "winzip": AES-256 por miembro dentro del ZIP (lo abre 7-Zip, WinZip...)
+# "contenedor": el backup entero va dentro de un flujo AES-GCM (.btae)
+CIFRADOS = ("winzip", "contenedor")
+
+# ---------------------------------------------------------------------------
+# WinZip AES (AE-2)
+# ---------------------------------------------------------------------------
+
+# Fijadas por el formato WinZip AES
+ITERACIONES_WINZIP = 1000
+LONGITUD_SAL_WINZIP = 16
+
+
+class CifradorWinZip(AESZipEncrypter):
+    """
+    Cifrador AES-256 de un miembro, compatible con el de pyzipper.
+
+    El formato exige una sal (y por tanto una clave) distinta en cada
+    miembro: reutilizarla repetiría el flujo de AES-CTR entre archivos. Por
+    eso la derivación PBKDF2 no se puede hacer una sola vez por archivo; lo
+    que se hace es derivarla con hashlib (libera el GIL) en los hilos de
+    compresión, junto con el cifrado.
+
+    Con `externo=True` los datos llegan ya cifrados con `cifrar_desde` (desde
+    cualquier hilo y en cualquier orden) y encrypt() solo calcula el HMAC,
+    que sí tiene que ir en orden.
+    """
+
+    def __init__(self, password: bytes, externo: bool = False):
+        # Misma configuración que AESZipEncrypter(nbits=256), sin su PBKDF2
+        self.force_wz_aes_version = None
+        self.conditionally_include_crc = None
+        self.min_bytes_to_include_crc = None
+        self.salt_length = LONGITUD_SAL_WINZIP
+        self.aes_strength = 3
+        self.salt = os.urandom(LONGITUD_SAL_WINZIP)
+        self.externo = externo
+
+        material = hashlib.pbkdf2_hmac("sha1", password, self.salt, ITERACIONES_WINZIP, 2 * 32 + 2)
+        self._clave = material[:32]
+        self.encpwdverify = material[64:]
+        self.encrypter = AES.new(self._clave, AES.MODE_CTR, counter=Counter.new(nbits=128, little_endian=True))
+        self.hmac = hmac.new(material[32:64], digestmod=hashlib.sha1)
+
+    def cifrar_desde(self, datos: bytes, desplazamiento: int) -> bytes:
+        """Cifra `datos`, que empiezan en la posición `desplazamiento` del miembro."""
+        bloque, resto = divmod(desplazamiento, 16)
+        # WinZip usa un contador little-endian que empieza en 1
+        cifrador = AES.new(
+            self._clave, AES.MODE_CTR, counter=Counter.new(nbits=128, little_endian=True, initial_value=bloque + 1)
+        )
+        if resto:
+            cifrador.encrypt(bytes(resto))
+        return cifrador.encrypt(datos)
+
+    def encrypt(self, data):
+        if self.externo:
+            self.hmac.update(data)
+            return data
+        return AESZipEncrypter.encrypt(self, data)
+
+
+class ZipAESRapido(pyzipper.AESZipFile):
+    """
+    AESZipFile (WinZip AES-256) que acepta cifradores ya preparados.
+
+    El motor paralelo asigna `cifrador_siguiente` (uno con externo=True)
+    justo antes de abrir cada miembro; si no hay ninguno se crea uno en el
+    momento y el cifrado se hace al escribir.
+    """
+
+    cifrado_paralelo = True
+
+    def __init__(self, *args, **kwargs):
+        kwargs["encryption"] = pyzipper.WZ_AES
+        super().__init__(*args, **kwargs)
+        self.cifrador_siguiente = None
+
+    def get_encrypter(self):
+        cifrador, self.cifrador_siguiente = self.cifrador_siguiente, None
+        return cifrador or CifradorWinZip(self.pwd)
+
+
+# ---------------------------------------------------------------------------
+# Contenedor AES-GCM
+# ---------------------------------------------------------------------------
+
+MAGIA = b"BTAE"
+VERSION_CONTENEDOR = 1
+EXTENSION_CONTENEDOR = ".btae"
+ITERACIONES_CONTENEDOR = 200_000
+TAMANO_TROZO = 4 * 1024 * 1024
+LONGITUD_TAG = 16
+
+# magia, versión, iteraciones PBKDF2, sal, tamaño de trozo
+_CABECERA = struct.Struct(">4sBI16sI")
+# Longitud del trozo cifrado (con tag); el bit alto marca el último
+_LONGITUD = struct.Struct(">I")
+_ULTIMO = 0x80000000
+
+
+class _GcmCryptodome:
+    """AES-GCM de pycryptodomex con la misma interfaz que AESGCM de cryptography."""
+
+    def __init__(self, clave: bytes):
+        self._clave = clave
+
+    def encrypt(self, nonce, datos, aad):
+        cifrador = AES.new(self._clave, AES.MODE_GCM, nonce=nonce)
+        cifrador.update(aad)
+        cifrado, tag = cifrador.encrypt_and_digest(datos)
+        return cifrado + tag
+
+    def decrypt(self, nonce, datos, aad):
+        cifrador = AES.new(self._clave, AES.MODE_GCM, nonce=nonce)
+        cifrador.update(aad)
+        return cifrador.decrypt_and_verify(datos[:-LONGITUD_TAG], datos[-LONGITUD_TAG:])
+
+
+def _aead(clave: bytes):
+    # cryptography (OpenSSL) es bastante más rápido; pycryptodomex siempre está (lo usa pyzipper)
+    try:
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    except ImportError:
+        return _GcmCryptodome(clave)
+    return AESGCM(clave)
+
+
+def _derivar_clave(password: str, sal: bytes, iteraciones: int) -> bytes:
+    return hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), sal, iteraciones, 32)
+
+
+def _nonce(indice: int) -> bytes:
+    # La clave es única por archivo (sal aleatoria): basta un contador como nonce
+    return b"\x00" * 4 + indice.to_bytes(8, "big")
+
+
+def _aad(cabecera: bytes, ultimo: bool) -> bytes:
+    # Marcar el último trozo impide truncar el archivo sin que se note
+    return cabecera + (b"\x01" if ultimo else b"\x00")
+
+
+def ruta_contenedor(destino: Path) -> Path:
+    return destino if destino.name.endswith(EXTENSION_CONTENEDOR) else destino.with_name(destino.name + EXTENSION_CONTENEDOR)
+
+
+def es_contenedor(ruta: Path) -> bool:
+    with open(ruta, "rb") as f:
+        return f.read(len(MAGIA)) == MAGIA
+
+
+class EscritorCifrado:
+    """
+    Archivo de solo escritura que cifra todo lo escrito con AES-256-GCM.
+
+    La clave se deriva una sola vez por archivo (PBKDF2-SHA256 con sal
+    aleatoria) y los datos se cifran en trozos de `tamano_trozo`, varios a
+    la vez en `workers` hilos; el orden de escritura se mantiene. Cada trozo
+    lleva su tag, así que al descifrar se detecta cualquier cambio, un
+    trozo de más o de menos y el archivo truncado.
+
+    `destino` puede ser una ruta o un archivo abierto no posicionable (por
+    ejemplo la tubería del modo streaming). Si algo falla antes de cerrar(),
+    el contenedor queda sin trozo final y no se puede descifrar.
+    """
+
+    def __init__(self, destino, password: str, tamano_trozo: int = TAMANO_TROZO, workers: int = None,
+                 iteraciones: int = ITERACIONES_CONTENEDOR):
+        if not password:
+            raise ValueError("Se requiere contraseña para encriptar")
+        self._propio = isinstance(destino, (str, Path))
+        self._f = open(destino, "wb") if self._propio else destino
+        self.tamano_trozo = tamano_trozo
+
+        sal = os.urandom(16)
+        self._cabecera = _CABECERA.pack(MAGIA, VERSION_CONTENEDOR, iteraciones, sal, tamano_trozo)
+        self._aead = _aead(_derivar_clave(password, sal, iteraciones))
+        self._f.write(self._cabecera)
+
+        self._buffer = bytearray()
+        self._indice = 0
+        self._workers = workers or os.cpu_count() or 1
+        self._pool = ThreadPoolExecutor(max_workers=self._workers)
+        self._pendientes = deque()
+        self._cerrado = False
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def tell(self):
+        raise OSError("El contenedor cifrado no es posicionable")
+
+    def flush(self):
+        pass
+
+    def _cifrar(self, indice: int, datos: bytes, ultimo: bool) -> bytes:
+        cifrado = self._aead.encrypt(_nonce(indice), datos, _aad(self._cabecera, ultimo))
+        return _LONGITUD.pack(len(cifrado) | (_ULTIMO if ultimo else 0)) + cifrado
+
+    def _encolar(self, datos: bytes, ultimo: bool):
+        self._pendientes.append(self._pool.submit(self._cifrar, self._indice, datos, ultimo))
+        self._indice += 1
+        # Como mucho dos trozos por hilo en memoria
+        while len(self._pendientes) > self._workers * 2:
+            self._f.write(self._pendientes.popleft().result())
+
+    def write(self, datos) -> int:
+        if self._cerrado:
+            raise ValueError("El contenedor ya está cerrado")
+        self._buffer += datos
+        while len(self._buffer) > self.tamano_trozo:
+            self._encolar(bytes(self._buffer[:self.tamano_trozo]), False)
+            del self._buffer[:self.tamano_trozo]
+        return len(datos)
+
+    def cerrar(self):
+        """Cifra lo que queda como último trozo y vacía la cola."""
+        if self._cerrado:
+            return
+        self._encolar(bytes(self._buffer), True)
+        self._buffer.clear()
+        while self._pendientes:
+            self._f.write(self._pendientes.popleft().result())
+        self._cerrado = True
+        self._cerrar_recursos()
+
+    def descartar(self):
+        for futuro in self._pendientes:
+            futuro.cancel()
+        self._pendientes.clear()
+        self._cerrado = True
+        self._cerrar_recursos()
+
+    def _cerrar_recursos(self):
+        self._pool.shutdown(wait=True)
+        if self._propio:
+            self._f.close()
+        else:
+            self._f.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        if tipo is None:
+            self.cerrar()
+        else:
+            self.descartar()
+
+
+def descifrar_contenedor(origen: Path, destino, password: str, progreso_callback=None, workers: int = None) -> int:
+    """
+    Descifra un contenedor .btae en `destino` (ruta o archivo abierto).
+
+    Lanza RuntimeError si la contraseña es incorrecta o el archivo fue
+    modificado o está incompleto. `progreso_callback(bytes_leidos, total)`.
+    Devuelve los bytes descifrados.
+    """
+    total = os.path.getsize(origen)
+    propio = isinstance(destino, (str, Path))
+    salida = open(destino, "wb") if propio else destino
+    workers = workers or os.cpu_count() or 1
+    escritos = 0
+
+    try:
+        with open(origen, "rb") as f, ThreadPoolExecutor(max_workers=workers) as pool:
+            cabecera = f.read(_CABECERA.size)
+            if len(cabecera) < _CABECERA.size:
+                raise RuntimeError("El archivo no es un contenedor cifrado de BackTomatic")
+            magia, version, iteraciones, sal, _ = _CABECERA.unpack(cabecera)
+            if magia != MAGIA:
+                raise RuntimeError("El archivo no es un contenedor cifrado de BackTomatic")
+            if version != VERSION_CONTENEDOR:
+                raise RuntimeError(f"Versión de contenedor no soportada: {version}")
+            aead = _aead(_derivar_clave(password, sal, iteraciones))
+
+            def descifrar(indice, datos, ultimo):
+                try:
+                    return aead.decrypt(_nonce(indice), datos, _aad(cabecera, ultimo))
+                except Exception:
+                    raise RuntimeError("Contraseña incorrecta o archivo dañado") from None
+
+            pendientes = deque()
+            indice = 0
+            ultimo = False
+            while not ultimo:
+                prefijo = f.read(_LONGITUD.size)
+                if len(prefijo) < _LONGITUD.size:
+                    raise RuntimeError("El contenedor está incompleto")
+                longitud = _LONGITUD.unpack(prefijo)[0]
+                ultimo = bool(longitud & _ULTIMO)
+                datos = f.read(longitud & ~_ULTIMO)
+                pendientes.append(pool.submit(descifrar, indice, datos, ultimo))
+                indice += 1
+
+                while len(pendientes) > workers * 2 or (ultimo and pendientes):
+                    claro = pendientes.popleft().result()
+                    salida.write(claro)
+                    escritos += len(claro)
+                if progreso_callback:
+                    progreso_callback(f.tell(), total)
+
+            if f.read(1):
+                raise RuntimeError("Hay datos después del final del contenedor")
+    except BaseException:
+        if propio:
+            salida.close()
+            Path(destino).unlink(missing_ok=True)
+        raise
+
+    if propio:
+        salida.close()
+    return escritos
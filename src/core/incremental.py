@@ -0,0 +1,405 @@
+import fnmatch
+import hashlib
+import itertools
+import json
+import os
+import shutil
+from datetime import datetime
+from pathlib import Path
+
+import pyzipper
+
+from core.backup_engine import EXTENSIONES_TEMP, escribir_zip, listar_archivos, obtener_codec
+from core.integrity import MIEMBRO_HASHES
+
+VERSION_MANIFIESTO = 1
+
+# El archivo continuo se cambia por uno nuevo al pasar de este tamaño o número de puntos
+# (cada añadido reescribe el directorio central entero)
+TAMANO_MAX_CONTINUO = 256 * 1024 * 1024
+PUNTOS_MAX_CONTINUO = 200
+
+
+def ruta_manifiesto(destino_zip: Path) -> Path:
+    """El manifiesto vive junto al ZIP base: backup.zip -> backup.manifest.json"""
+    return destino_zip.with_suffix(".manifest.json")
+
+
+def hash_archivo(ruta: Path, bloque: int = 1024 * 1024) -> str:
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for trozo in iter(lambda: f.read(bloque), b""):
+            h.update(trozo)
+    return h.hexdigest()
+
+
+def cargar_manifiesto(destino_zip: Path):
+    ruta = ruta_manifiesto(destino_zip)
+    if not ruta.exists():
+        return None
+
+    with open(ruta, "r", encoding="utf-8") as f:
+        manifiesto = json.load(f)
+
+    if manifiesto.get("version") != VERSION_MANIFIESTO:
+        raise RuntimeError(f"Versión de manifiesto no soportada: {manifiesto.get('version')}")
+    return manifiesto
+
+
+def guardar_manifiesto(destino_zip: Path, manifiesto: dict):
+    # Escritura atómica: un corte a mitad no deja el manifiesto corrupto
+    ruta = ruta_manifiesto(destino_zip)
+    tmp = ruta.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifiesto, f, indent=1)
+    os.replace(tmp, ruta)
+
+
+def _estado_archivo(archivo: Path, usar_hash: bool, anterior: dict = None) -> dict:
+    st = archivo.stat()
+    estado = {"size": st.st_size, "mtime": st.st_mtime_ns}
+    if usar_hash:
+        # Si tamaño y fecha no cambiaron se reutiliza el hash guardado
+        if anterior and anterior.get("hash") and \
+                anterior["size"] == estado["size"] and anterior["mtime"] == estado["mtime"]:
+            estado["hash"] = anterior["hash"]
+        else:
+            estado["hash"] = hash_archivo(archivo)
+    return estado
+
+
+def _ha_cambiado(anterior: dict, actual: dict) -> bool:
+    if anterior is None:
+        return True
+    if anterior["size"] != actual["size"]:
+        return True
+    if anterior["mtime"] == actual["mtime"]:
+        return False
+    # Fecha distinta: con hash se descartan los archivos solo "tocados"
+    if "hash" in anterior and "hash" in actual:
+        return anterior["hash"] != actual["hash"]
+    return True
+
+
+def crear_backup_incremental(
+    carpeta_origen: Path,
+    destino_zip: Path,
+    nivel_compresion: int,
+    excluir_temporales: bool,
+    encriptar: bool = False,
+    password: str = None,
+    progreso_callback=None,
+    workers: int = None,
+    usar_hash: bool = False,
+    forzar_completo: bool = False,
+    politica=None,
+    codec: str = "deflate",
+    eventos_callback=None,
+):
+    """
+    Backup incremental guiado por un manifiesto de estado de archivos.
+
+    La primera vez (o con forzar_completo=True) escribe un backup completo en
+    `destino_zip`. Las siguientes solo archivan los archivos nuevos o
+    modificados en `backup.inc-AAAAMMDD-HHMMSS.zip` y registran los borrados.
+
+    Devuelve (archivos_comprimidos, ruta_del_zip_generado). La ruta es None si
+    no hubo cambios que archivar. Solo admite codecs ZIP.
+    """
+
+    formato = obtener_codec(codec)
+    if not formato.es_zip:
+        raise ValueError(f"El backup incremental no admite el formato {formato.etiqueta}")
+
+    manifiesto = None if forzar_completo else cargar_manifiesto(destino_zip)
+    archivos = listar_archivos(carpeta_origen, excluir_temporales)
+
+    anteriores = manifiesto["archivos"] if manifiesto else {}
+    estados = {}
+    modificados = []
+
+    for archivo in archivos:
+        rel = archivo.relative_to(carpeta_origen).as_posix()
+        estado = _estado_archivo(archivo, usar_hash, anteriores.get(rel))
+        estados[rel] = estado
+        if _ha_cambiado(anteriores.get(rel), estado):
+            modificados.append(archivo)
+
+    eliminados = sorted(set(anteriores) - set(estados))
+    ahora = datetime.now()
+
+    if manifiesto is None:
+        if not archivos:
+            raise RuntimeError("No hay archivos para comprimir.")
+        destino = destino_zip
+        manifiesto = {"version": VERSION_MANIFIESTO, "origen": str(carpeta_origen), "cadena": []}
+        tipo = "completo"
+    else:
+        if not modificados and not eliminados:
+            return 0, None
+        destino = destino_zip.with_name(
+            f"{destino_zip.stem}.inc-{ahora.strftime('%Y%m%d-%H%M%S')}{destino_zip.suffix}"
+        )
+        tipo = "incremental"
+
+    total = 0
+    if modificados:
+        total = escribir_zip(
+            modificados,
+            carpeta_origen,
+            destino,
+            nivel_compresion,
+            encriptar=encriptar,
+            password=password,
+            progreso_callback=progreso_callback,
+            workers=workers,
+            politica=politica,
+            metodo=formato.metodo_zip,
+            eventos_callback=eventos_callback,
+        )
+
+    manifiesto["archivos"] = estados
+    manifiesto["cadena"].append({
+        "tipo": tipo,
+        "fecha": ahora.isoformat(timespec="seconds"),
+        # Las rutas se guardan relativas al manifiesto para poder mover la carpeta
+        "archivo": destino.name if modificados else None,
+        "modificados": [a.relative_to(carpeta_origen).as_posix() for a in modificados],
+        "eliminados": eliminados,
+    })
+    guardar_manifiesto(destino_zip, manifiesto)
+
+    return total, destino if modificados else None
+
+
+def _archivo_continuo(destino_zip: Path, manifiesto: dict, ahora: datetime) -> Path:
+    """Archivo continuo en uso, o uno nuevo si no hay o ya está lleno."""
+    actual = manifiesto.get("continuo")
+    if actual:
+        ruta = destino_zip.parent / actual
+        puntos = sum(1 for p in manifiesto["cadena"] if p["archivo"] == actual)
+        if ruta.exists() and ruta.stat().st_size < TAMANO_MAX_CONTINUO and puntos < PUNTOS_MAX_CONTINUO:
+            return ruta
+    return destino_zip.with_name(f"{destino_zip.stem}.cont-{ahora.strftime('%Y%m%d-%H%M%S')}{destino_zip.suffix}")
+
+
+def anadir_cambios(
+    carpeta_origen: Path,
+    destino_zip: Path,
+    nivel_compresion: int,
+    excluir_temporales: bool,
+    rutas=None,
+    encriptar: bool = False,
+    password: str = None,
+    progreso_callback=None,
+    workers: int = None,
+    usar_hash: bool = False,
+    politica=None,
+    codec: str = "deflate",
+    eventos_callback=None,
+):
+    """
+    Añade a la cadena incremental los cambios de `rutas`, sin recorrer toda
+    la carpeta (backup continuo, ver core.watcher).
+
+    `rutas` son rutas relativas a `carpeta_origen` que pueden haber cambiado:
+    archivos o carpetas, existan todavía o no; None revisa la carpeta entera.
+    Lo nuevo o modificado se añade al final de un archivo continuo
+    (`backup.cont-AAAAMMDD-HHMMSS.zip`), que se reutiliza en varios puntos
+    hasta que se llena, y cada llamada registra un punto en el manifiesto.
+    Requiere un backup incremental previo (crear_backup_incremental).
+
+    Devuelve (archivos_añadidos, ruta_del_zip o None si no hubo nada que añadir).
+    """
+    formato = obtener_codec(codec)
+    if not formato.es_zip:
+        raise ValueError(f"El backup incremental no admite el formato {formato.etiqueta}")
+
+    manifiesto = cargar_manifiesto(destino_zip)
+    if manifiesto is None:
+        raise RuntimeError("No existe manifiesto para este backup: crea antes un backup incremental.")
+    anteriores = manifiesto["archivos"]
+
+    candidatos = set()
+    eliminados = set()
+    if rutas is None:
+        candidatos = {a.relative_to(carpeta_origen).as_posix() for a in listar_archivos(carpeta_origen, excluir_temporales)}
+        eliminados = set(anteriores) - candidatos
+    for rel in rutas or ():
+        ruta = carpeta_origen / rel
+        if ruta.is_dir() and not ruta.is_symlink():
+            # Carpeta creada o movida aquí: se revisa lo que contiene
+            candidatos.update(a.relative_to(carpeta_origen).as_posix() for a in listar_archivos(ruta, excluir_temporales))
+        elif ruta.is_file():
+            if not (excluir_temporales and ruta.suffix.lower() in EXTENSIONES_TEMP):
+                candidatos.add(rel)
+            continue
+        if rel in anteriores:
+            eliminados.add(rel)
+        else:
+            # Carpeta borrada o movida fuera: todo lo que había dentro
+            prefijo = rel + "/"
+            eliminados.update(r for r in anteriores if r.startswith(prefijo) and not (carpeta_origen / r).is_file())
+
+    estados = {}
+    modificados = []
+    for rel in sorted(candidatos):
+        archivo = carpeta_origen / rel
+        try:
+            estado = _estado_archivo(archivo, usar_hash, anteriores.get(rel))
+        except FileNotFoundError:
+            # Borrado después del aviso
+            if rel in anteriores:
+                eliminados.add(rel)
+            continue
+        estados[rel] = estado
+        if _ha_cambiado(anteriores.get(rel), estado):
+            modificados.append(archivo)
+
+    if not modificados and not eliminados:
+        return 0, None
+
+    ahora = datetime.now()
+    destino = None
+    desde = 0
+    total = 0
+    if modificados:
+        destino = _archivo_continuo(destino_zip, manifiesto, ahora)
+        if destino.exists():
+            with pyzipper.AESZipFile(destino) as zipf:
+                desde = len(zipf.infolist())
+        total = escribir_zip(
+            modificados,
+            carpeta_origen,
+            destino,
+            nivel_compresion,
+            encriptar=encriptar,
+            password=password,
+            progreso_callback=progreso_callback,
+            workers=workers,
+            politica=politica,
+            metodo=formato.metodo_zip,
+            eventos_callback=eventos_callback,
+            modo="a" if desde else "w",
+        )
+        manifiesto["continuo"] = destino.name
+
+    anteriores.update(estados)
+    for rel in eliminados:
+        anteriores.pop(rel, None)
+    manifiesto["cadena"].append({
+        "tipo": "continuo",
+        "fecha": ahora.isoformat(timespec="seconds"),
+        "archivo": destino.name if destino else None,
+        # Posición del primer miembro de este punto dentro del archivo continuo
+        "desde": desde,
+        "modificados": [a.relative_to(carpeta_origen).as_posix() for a in modificados],
+        "eliminados": sorted(eliminados),
+    })
+    guardar_manifiesto(destino_zip, manifiesto)
+
+    return total, destino
+
+
+def listar_puntos(destino_zip: Path):
+    """Devuelve los puntos de restauración disponibles: [(indice, fecha, tipo)]."""
+    manifiesto = cargar_manifiesto(destino_zip)
+    if manifiesto is None:
+        return []
+    return [(i, p["fecha"], p["tipo"]) for i, p in enumerate(manifiesto["cadena"])]
+
+
+def _punto_valido(cadena: list, hasta) -> int:
+    if hasta is None:
+        return len(cadena) - 1
+    if not 0 <= hasta < len(cadena):
+        raise ValueError(f"Punto de restauración inválido: {hasta}")
+    return hasta
+
+
+def _seleccionado(rel: str, patrones) -> bool:
+    """Como IndiceZip.seleccionar: glob (fnmatchcase) o, sin comodines, también lo que hay dentro de la carpeta."""
+    if patrones is None:
+        return True
+    return any(fnmatch.fnmatchcase(rel, p) or rel.startswith(p.rstrip("/") + "/") for p in patrones)
+
+
+def archivos_en_punto(destino_zip: Path, hasta: int = None, patrones=None) -> list:
+    """
+    Archivos que había en el punto `hasta` de la cadena (None = el último),
+    ordenados. Sale del manifiesto, sin abrir ningún ZIP: cada punto guarda
+    lo que añadió y lo que se borró.
+    """
+    manifiesto = cargar_manifiesto(destino_zip)
+    if manifiesto is None:
+        raise RuntimeError("No existe manifiesto para este backup.")
+    cadena = manifiesto["cadena"]
+    presentes = set()
+    for punto in cadena[:_punto_valido(cadena, hasta) + 1]:
+        presentes.difference_update(punto["eliminados"])
+        presentes.update(punto["modificados"])
+    return sorted(rel for rel in presentes if _seleccionado(rel, patrones))
+
+
+def _ruta_en_destino(destino_real: Path, rel: str) -> Path:
+    """Ruta de `rel` dentro de la carpeta destino; nunca se escribe ni se borra fuera de ella."""
+    ruta = (destino_real / rel).resolve()
+    if destino_real not in ruta.parents:
+        raise RuntimeError(f"Ruta no válida en el backup: {rel}")
+    return ruta
+
+
+def restaurar_incremental(
+    destino_zip: Path,
+    carpeta_destino: Path,
+    hasta: int = None,
+    password: str = None,
+    progreso_callback=None,
+    patrones=None,
+):
+    """
+    Reconstruye en `carpeta_destino` el estado del punto `hasta` de la cadena
+    (None = el último) aplicando el ZIP base y luego cada delta en orden.
+    Con `patrones` (como en core.restore) solo se tocan los archivos que
+    coinciden. `progreso_callback(puntos_aplicados, total)`.
+    """
+    manifiesto = cargar_manifiesto(destino_zip)
+    if manifiesto is None:
+        raise RuntimeError("No existe manifiesto para este backup.")
+
+    cadena = manifiesto["cadena"]
+    hasta = _punto_valido(cadena, hasta)
+
+    carpeta_destino.mkdir(parents=True, exist_ok=True)
+    destino_real = carpeta_destino.resolve()
+    total = hasta + 1
+
+    for i, punto in enumerate(cadena[:total], start=1):
+        for rel in punto["eliminados"]:
+            if not _seleccionado(rel, patrones):
+                continue
+            ruta = _ruta_en_destino(destino_real, rel)
+            if ruta.is_file():
+                ruta.unlink()
+
+        if punto["archivo"]:
+            # AESZipFile también lee ZIPs sin cifrar
+            with pyzipper.AESZipFile(destino_zip.parent / punto["archivo"]) as zipf:
+                if password:
+                    zipf.setpassword(password.encode("utf-8"))
+                miembros = zipf.infolist()
+                if "desde" in punto:
+                    # Archivo continuo: el punto va desde "desde" hasta su manifiesto de hashes
+                    miembros = itertools.takewhile(lambda i: i.filename != MIEMBRO_HASHES, miembros[punto["desde"]:])
+                for info in miembros:
+                    if info.filename == MIEMBRO_HASHES or not _seleccionado(info.filename, patrones):
+                        continue
+                    salida = _ruta_en_destino(destino_real, info.filename)
+                    salida.parent.mkdir(parents=True, exist_ok=True)
+                    with zipf.open(info) as origen, open(salida, "wb") as f:
+                        shutil.copyfileobj(origen, f, 1024 * 1024)
+
+        if progreso_callback:
+            progreso_callback(i, total)
+
+    return total
@@ -0,0 +1,364 @@
+import hashlib
+import json
+import os
+import tarfile
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import chain
+from pathlib import Path
+
+import pyzipper
+
+# Miembro que guarda los hashes dentro del propio backup (ZIP o TAR)
+MIEMBRO_HASHES = ".backtomatic/hashes.json"
+VERSION_HASHES = 1
+ALGORITMO_HASH = "sha256"
+TAMANO_LECTURA = 1024 * 1024
+# Por debajo de esto el hash se calcula en el hilo que lee: pasarlo al pool
+# cuesta más que calcularlo (archivos pequeños)
+HASH_DIRECTO = 256 * 1024
+# Entradas del manifiesto que se escriben de una vez en escribir_manifiesto
+LOTE_MANIFIESTO = 1000
+
+MAGIA_ZSTD = b"\x28\xb5\x2f\xfd"
+
+
+def workers_hash() -> int:
+    # El hash va mucho más rápido que deflate: con pocos hilos basta
+    return min(4, os.cpu_count() or 1)
+
+
+class HashArchivo:
+    """Hash de un archivo en curso; los trozos se aplican en el orden en que llegan."""
+
+    def __init__(self, calculador: "CalculadorHashes", nombre: str):
+        self._calculador = calculador
+        self.nombre = nombre
+        self.tamano = 0
+        self._hash = hashlib.new(ALGORITMO_HASH)
+        self._ultimo = None
+
+    def update(self, datos: bytes):
+        self.tamano += len(datos)
+        if len(datos) < HASH_DIRECTO and (self._ultimo is None or self._ultimo.done()):
+            self._hash.update(datos)
+        else:
+            self._ultimo = self._calculador._encolar(self._hash.update, datos, self._ultimo)
+
+    def terminar(self):
+        self._calculador._terminar(self, self._ultimo)
+
+    def _resultado(self) -> dict:
+        return {ALGORITMO_HASH: self._hash.hexdigest(), "tamano": self.tamano}
+
+
+class CalculadorHashes:
+    """
+    Calcula el SHA-256 de cada archivo con los mismos trozos que lee el motor.
+
+    Así no hace falta una segunda lectura: quien lee un archivo pide un
+    HashArchivo con nuevo(), le pasa cada trozo con update() y llama a
+    terminar(). Los trozos grandes se calculan en un pool de hilos (hashlib
+    libera el GIL) mientras el motor sigue leyendo y comprimiendo; los trozos de un mismo
+    archivo se encadenan para respetar el orden y varios archivos avanzan a
+    la vez. Como mucho `max_pendientes` trozos esperan en memoria.
+
+    Con `en_disco` los resultados van a un temporal (una línea JSON por
+    archivo) cada LOTE_MANIFIESTO archivos y la memoria no crece con el
+    número de archivos. nuevos() solo se usa con `seguir_nuevos`.
+    """
+
+    def __init__(self, workers: int = None, max_pendientes: int = None, en_disco: bool = False,
+                 seguir_nuevos: bool = False):
+        workers = workers or workers_hash()
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._hueco = threading.BoundedSemaphore(max_pendientes or workers * 4)
+        self._lock = threading.Lock()
+        self._terminados = []
+        self._resultados = {}
+        self._disco = tempfile.TemporaryFile() if en_disco else None
+        # Terminados que aún no ha recogido nuevos()
+        self._por_entregar = {} if seguir_nuevos else None
+
+    def nuevo(self, nombre: str) -> HashArchivo:
+        return HashArchivo(self, nombre)
+
+    def _encolar(self, funcion, datos, anterior):
+        self._hueco.acquire()
+        return self._pool.submit(self._aplicar, funcion, datos, anterior)
+
+    def _aplicar(self, funcion, datos, anterior):
+        try:
+            # El trozo anterior se envió antes al pool, así que ya está en marcha o hecho
+            if anterior is not None:
+                anterior.result()
+            funcion(datos)
+        finally:
+            self._hueco.release()
+
+    def _terminar(self, archivo: HashArchivo, ultimo):
+        with self._lock:
+            self._terminados.append((archivo, ultimo))
+            volcar = self._disco is not None and len(self._terminados) >= LOTE_MANIFIESTO
+        if volcar:
+            self._recoger()
+
+    def _recoger(self):
+        """Espera a los hashes de los archivos terminados y los guarda (en memoria o en el temporal)."""
+        with self._lock:
+            terminados, self._terminados = self._terminados, []
+        nuevos = {}
+        for archivo, ultimo in terminados:
+            if ultimo is not None:
+                ultimo.result()
+            nuevos[archivo.nombre] = archivo._resultado()
+        with self._lock:
+            if self._disco is None:
+                self._resultados.update(nuevos)
+            else:
+                self._disco.writelines(
+                    json.dumps([nombre, datos]).encode("utf-8") + b"\n" for nombre, datos in nuevos.items()
+                )
+            if self._por_entregar is not None:
+                self._por_entregar.update(nuevos)
+
+    def nuevos(self) -> dict:
+        """Espera a los hashes pendientes y devuelve los terminados desde la llamada anterior."""
+        if self._por_entregar is None:
+            raise RuntimeError("nuevos() necesita un CalculadorHashes creado con seguir_nuevos=True")
+        self._recoger()
+        with self._lock:
+            nuevos, self._por_entregar = self._por_entregar, {}
+        return nuevos
+
+    def _todos(self):
+        self._recoger()
+        if self._disco is None:
+            yield from self._resultados.items()
+            return
+        self._disco.seek(0)
+        try:
+            for linea in self._disco:
+                yield tuple(json.loads(linea))
+        finally:
+            self._disco.seek(0, 2)
+
+    def resultados(self) -> dict:
+        """Espera a los hashes pendientes: {nombre: {"sha256", "tamano"}}."""
+        return dict(self._todos())
+
+    def manifiesto(self, anteriores: dict = None) -> bytes:
+        """Contenido del miembro MIEMBRO_HASHES; se conservan los `anteriores` que no se hayan recalculado."""
+        archivos = {**(anteriores or {}), **self.resultados()}
+        return json.dumps(
+            {"version": VERSION_HASHES, "algoritmo": ALGORITMO_HASH, "archivos": archivos},
+            indent=0,
+        ).encode("utf-8")
+
+    def escribir_manifiesto(self, destino, anteriores: dict = None):
+        """
+        Igual que manifiesto(), pero escrito por partes en `destino` (un
+        archivo binario) sin tenerlo entero en memoria. Un nombre repetido
+        aparece dos veces y al leerlo vale el último, como en manifiesto().
+        """
+        destino.write(f'{{"version": {VERSION_HASHES}, "algoritmo": "{ALGORITMO_HASH}", "archivos": {{'.encode("utf-8"))
+        lote = []
+        separador = b""
+        for nombre, datos in chain((anteriores or {}).items(), self._todos()):
+            lote.append(f"{json.dumps(nombre)}: {json.dumps(datos)}")
+            if len(lote) == LOTE_MANIFIESTO:
+                destino.write(separador + ",\n".join(lote).encode("utf-8"))
+                separador = b",\n"
+                lote = []
+        if lote:
+            destino.write(separador + ",\n".join(lote).encode("utf-8"))
+        destino.write(b"}}")
+
+    def cerrar(self):
+        self._pool.shutdown(wait=True)
+        if self._disco is not None:
+            self._disco.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+
+def _leer_manifiesto(datos: bytes) -> dict:
+    manifiesto = json.loads(datos)
+    if manifiesto.get("version") != VERSION_HASHES:
+        raise RuntimeError(f"Versión de manifiesto de hashes no soportada: {manifiesto.get('version')}")
+    return manifiesto["archivos"]
+
+
+def _hash_flujo(origen) -> tuple:
+    h = hashlib.new(ALGORITMO_HASH)
+    tamano = 0
+    for trozo in iter(lambda: origen.read(TAMANO_LECTURA), b""):
+        h.update(trozo)
+        tamano += len(trozo)
+    return h.hexdigest(), tamano
+
+
+def _comparar(nombre: str, esperado: dict, obtenido: tuple, errores: list):
+    if esperado is None:
+        errores.append(f"{nombre}: no figura en el manifiesto de hashes")
+    elif (esperado[ALGORITMO_HASH], esperado["tamano"]) != obtenido:
+        errores.append(f"{nombre}: el contenido no coincide con el original")
+
+
+def _repartir(miembros: list, grupos: int) -> list:
+    """Reparte los miembros en `grupos` listas de tamaño total parecido."""
+    repartos = [[] for _ in range(grupos)]
+    cargas = [0] * grupos
+    for info in sorted(miembros, key=lambda i: i.file_size, reverse=True):
+        menor = cargas.index(min(cargas))
+        repartos[menor].append(info)
+        cargas[menor] += info.file_size
+    return [r for r in repartos if r]
+
+
+def verificar_zip(abrir, password: str = None, workers: int = None, progreso_callback=None) -> tuple:
+    """
+    Lee y descomprime todos los miembros de un ZIP, como testzip(), en varios hilos.
+
+    `abrir()` devuelve un archivo binario posicionable con el ZIP; cada hilo
+    abre el suyo. zipfile comprueba el CRC (y pyzipper el HMAC de AES) al
+    leer cada miembro, y si el ZIP trae MIEMBRO_HASHES se compara además el
+    SHA-256 de cada archivo con el calculado al leer el original. Si un
+    nombre se repite (ZIP al que se han añadido archivos), el hash solo se
+    compara con el último miembro; los anteriores se comprueban por CRC.
+
+    Devuelve (miembros_verificados, errores).
+    """
+    pwd = password.encode("utf-8") if password else None
+
+    @contextmanager
+    def abrir_zip():
+        # zipfile no cierra los archivos que recibe ya abiertos
+        with abrir() as f, pyzipper.AESZipFile(f) as zipf:
+            if pwd:
+                zipf.setpassword(pwd)
+            yield zipf
+
+    with abrir_zip() as zipf:
+        miembros = [i for i in zipf.infolist() if not i.is_dir()]
+        vigentes = {i.header_offset for i in zipf.NameToInfo.values()}
+        esperados = None
+        if MIEMBRO_HASHES in zipf.NameToInfo:
+            try:
+                esperados = _leer_manifiesto(zipf.read(MIEMBRO_HASHES))
+            except (RuntimeError, ValueError, pyzipper.BadZipFile) as e:
+                # Sin manifiesto legible (p. ej. contraseña incorrecta) no hay nada que comparar
+                return 0, [f"{MIEMBRO_HASHES}: {e}"]
+    miembros = [i for i in miembros if i.filename != MIEMBRO_HASHES]
+
+    errores = []
+    hechos = [0]
+    lock = threading.Lock()
+
+    def verificar_grupo(grupo):
+        with abrir_zip() as zipf:
+            for info in grupo:
+                try:
+                    with zipf.open(info) as origen:
+                        obtenido = _hash_flujo(origen)
+                except (RuntimeError, ValueError, OSError, pyzipper.BadZipFile) as e:
+                    # Contraseña incorrecta, CRC/HMAC erróneo o datos truncados
+                    with lock:
+                        errores.append(f"{info.filename}: {e}")
+                else:
+                    if esperados is not None and info.header_offset in vigentes:
+                        with lock:
+                            _comparar(info.filename, esperados.get(info.filename), obtenido, errores)
+                with lock:
+                    hechos[0] += 1
+                    if progreso_callback:
+                        progreso_callback(hechos[0], len(miembros))
+
+    workers = workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(verificar_grupo, _repartir(miembros, workers)))
+
+    if esperados is not None:
+        faltan = set(esperados) - {i.filename for i in miembros}
+        errores.extend(f"{nombre}: falta en el backup" for nombre in sorted(faltan))
+    return len(miembros), errores
+
+
+def verificar_tar_zst(origen, progreso_callback=None) -> tuple:
+    """
+    Descomprime un .tar.zst de principio a fin y compara cada archivo con
+    MIEMBRO_HASHES (el último miembro). Un TAR comprimido solo se puede leer
+    en orden, así que aquí no hay reparto entre hilos.
+
+    `origen` es una ruta o un archivo abierto. Devuelve (verificados, errores).
+    """
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("El formato TAR + Zstandard requiere el paquete 'zstandard'.") from None
+
+    obtenidos = {}
+    esperados = None
+    errores = []
+    propio = isinstance(origen, (str, Path))
+    f = open(origen, "rb") if propio else origen
+    try:
+        lector = zstandard.ZstdDecompressor().stream_reader(f)
+        with tarfile.open(fileobj=lector, mode="r|") as tar:
+            for miembro in tar:
+                if not miembro.isreg():
+                    continue
+                if miembro.name == MIEMBRO_HASHES:
+                    esperados = _leer_manifiesto(tar.extractfile(miembro).read())
+                    continue
+                obtenidos[miembro.name] = _hash_flujo(tar.extractfile(miembro))
+                if progreso_callback:
+                    progreso_callback(len(obtenidos), None)
+    except (tarfile.TarError, zstandard.ZstdError, EOFError) as e:
+        errores.append(f"El archivo está dañado: {e}")
+    finally:
+        if propio:
+            f.close()
+
+    if esperados is not None:
+        for nombre, obtenido in obtenidos.items():
+            _comparar(nombre, esperados.get(nombre), obtenido, errores)
+        faltan = set(esperados) - set(obtenidos)
+        errores.extend(f"{nombre}: falta en el backup" for nombre in sorted(faltan))
+    return len(obtenidos), errores
+
+
+def verificar_backup(ruta: Path, password: str = None, workers: int = None, progreso_callback=None) -> tuple:
+    """
+    Verifica un backup en disco: ZIP, .tar.zst o contenedor cifrado (.btae).
+
+    El contenedor se descifra (comprobando cada trozo) a un archivo temporal
+    junto al backup y se verifica lo que contiene. Devuelve (verificados,
+    errores); `progreso_callback(hechos, total)`.
+    """
+    from core.encryption import descifrar_contenedor, es_contenedor
+
+    ruta = Path(ruta)
+    if es_contenedor(ruta):
+        if not password:
+            raise ValueError("El contenedor cifrado requiere contraseña para verificarse")
+        fd, temporal = tempfile.mkstemp(prefix=ruta.name + ".", suffix=".verificando", dir=ruta.parent)
+        os.close(fd)
+        temporal = Path(temporal)
+        try:
+            descifrar_contenedor(ruta, temporal, password, workers=workers)
+            return verificar_backup(temporal, workers=workers, progreso_callback=progreso_callback)
+        finally:
+            temporal.unlink(missing_ok=True)
+
+    with open(ruta, "rb") as f:
+        cabecera = f.read(len(MAGIA_ZSTD))
+    if cabecera == MAGIA_ZSTD:
+        return verificar_tar_zst(ruta, progreso_callback)
+    return verificar_zip(lambda: open(ruta, "rb"), password, workers, progreso_callback)
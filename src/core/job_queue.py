@@ -0,0 +1,367 @@
+import heapq
+import itertools
+import threading
+from pathlib import Path
+
+from core.checkpoint import BackupInterrumpido
+from core.jobs import (
+    TrabajoBackup,
+    admite_reanudar,
+    comprimir_trabajo,
+    necesita_subida,
+    necesita_verificacion,
+    servicio_desatendido,
+    subir_trabajo,
+    verificar_trabajo,
+)
+from core.retention import marca_backup
+
+PRIORIDAD_ALTA = 0
+PRIORIDAD_NORMAL = 1
+PRIORIDAD_BAJA = 2
+PRIORIDADES = {"Alta": PRIORIDAD_ALTA, "Normal": PRIORIDAD_NORMAL, "Baja": PRIORIDAD_BAJA}
+
+EN_COLA = "En cola"
+COMPRIMIENDO = "Comprimiendo"
+VERIFICANDO = "Verificando"
+ESPERANDO_SUBIDA = "Esperando subida"
+SUBIENDO = "Subiendo"
+COMPLETADO = "Completado"
+SIN_CAMBIOS = "Sin cambios"
+CANCELADO = "Cancelado"
+ERROR = "Error"
+ESTADOS_FINALES = {COMPLETADO, SIN_CAMBIOS, CANCELADO, ERROR}
+
+
+class TrabajoCancelado(Exception):
+    pass
+
+
+class EntradaCola:
+    """
+    Un trabajo dentro de la cola, con su estado y progreso (0.0 - 1.0).
+    `bytes_hechos`/`bytes_total` se rellenan cuando la etapa en curso conoce
+    el tamaño en bytes (0 si no).
+    """
+
+    def __init__(self, id: int, nombre: str, prioridad: int, trabajo: TrabajoBackup = None, archivo: Path = None):
+        self.id = id
+        self.nombre = nombre
+        self.prioridad = prioridad
+        self.trabajo = trabajo
+        # Solo para subidas de un archivo ya existente; `grupo` es el trabajo
+        # con el que se registra en Drive (p. ej. el de un volumen)
+        self.archivo = archivo
+        self.grupo = None
+        self.estado = EN_COLA
+        self.progreso = 0.0
+        self.bytes_hechos = 0
+        self.bytes_total = 0
+        self.mensaje = ""
+        self.resultado = None
+        self._cancelar = threading.Event()
+
+    @property
+    def cancelada(self) -> bool:
+        return self._cancelar.is_set()
+
+    @property
+    def terminada(self) -> bool:
+        return self.estado in ESTADOS_FINALES
+
+    def comprobar_cancelacion(self):
+        if self._cancelar.is_set():
+            raise TrabajoCancelado("Trabajo cancelado")
+
+
+class _Etapa:
+    """Hilos que atienden una cola con prioridad: (prioridad, orden de llegada)."""
+
+    def __init__(self, nombre: str, hilos: int, procesar):
+        self._heap = []
+        self._cond = threading.Condition()
+        self._cerrada = False
+        self._procesar = procesar
+        self._hilos = [
+            threading.Thread(target=self._bucle, name=f"{nombre}-{i}", daemon=True) for i in range(hilos)
+        ]
+        for hilo in self._hilos:
+            hilo.start()
+
+    def poner(self, entrada: EntradaCola):
+        with self._cond:
+            heapq.heappush(self._heap, (entrada.prioridad, entrada.id, entrada))
+            self._cond.notify()
+
+    def _bucle(self):
+        while True:
+            with self._cond:
+                while not self._heap and not self._cerrada:
+                    self._cond.wait()
+                if not self._heap:
+                    return
+                _, _, entrada = heapq.heappop(self._heap)
+            self._procesar(entrada)
+
+    def cerrar(self):
+        with self._cond:
+            self._cerrada = True
+            self._cond.notify_all()
+
+    def esperar(self):
+        for hilo in self._hilos:
+            hilo.join()
+
+
+class ColaTrabajos:
+    """
+    Cola de backups con prioridad y un número limitado de compresiones a la vez.
+
+    La compresión y la subida son etapas separadas: cuando un trabajo termina
+    de comprimir pasa a la cola de subida y su hilo empieza con el siguiente,
+    así la subida de un backup se solapa con la compresión del próximo. Como
+    mucho `subidas_concurrentes` archivos suben a la vez.
+
+    `al_cambiar(entrada)` se llama desde los hilos de trabajo cada vez que
+    cambia el estado o el progreso de una entrada; puede ser muy a menudo,
+    así que no debe bloquear. `bytes_procesados` acumula los bytes de todas
+    las etapas y solo crece, para medir la velocidad. `obtener_servicio()`
+    devuelve el servicio de Drive (por defecto, sin diálogos); se llama solo
+    cuando hace falta subir.
+    """
+
+    def __init__(
+        self,
+        max_concurrentes: int = 2,
+        obtener_servicio=None,
+        al_cambiar=None,
+        log_callback=None,
+        subidas_concurrentes: int = 1,
+    ):
+        if max_concurrentes < 1 or subidas_concurrentes < 1:
+            raise ValueError("max_concurrentes y subidas_concurrentes deben ser al menos 1")
+        self.obtener_servicio = obtener_servicio or servicio_desatendido
+        self.al_cambiar = al_cambiar
+        self.log_callback = log_callback
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._entradas = {}
+        self.bytes_procesados = 0
+        self._compresion = _Etapa("compresion", max_concurrentes, self._comprimir)
+        self._subida = _Etapa("subida", subidas_concurrentes, self._subir)
+
+    # -------------------- API --------------------
+
+    def encolar(self, trabajo: TrabajoBackup, prioridad: int = PRIORIDAD_NORMAL) -> EntradaCola:
+        trabajo.validar()
+        with self._lock:
+            # Dos trabajos pendientes no pueden escribir en el mismo archivo
+            for otra in self._entradas.values():
+                if otra.trabajo and not otra.terminada and otra.trabajo.destino == trabajo.destino:
+                    raise ValueError(f"Ya hay un trabajo pendiente que escribe en {trabajo.destino}")
+            entrada = EntradaCola(next(self._ids), trabajo.nombre, prioridad, trabajo=trabajo)
+            self._entradas[entrada.id] = entrada
+
+        self._notificar(entrada)
+        self._compresion.poner(entrada)
+        return entrada
+
+    def encolar_subida(
+        self, archivo: Path, prioridad: int = PRIORIDAD_NORMAL, grupo: str = None, marca: str = None
+    ) -> EntradaCola:
+        """
+        Encola la subida a Drive de un backup que ya existe en disco. Los
+        archivos de una misma ejecución (volúmenes) comparten `grupo` y `marca`.
+        """
+        with self._lock:
+            entrada = EntradaCola(next(self._ids), archivo.name, prioridad, archivo=Path(archivo))
+            entrada.estado = ESPERANDO_SUBIDA
+            entrada.grupo = grupo
+            entrada.resultado = {"archivos": 0, "ruta": entrada.archivo, "drive_id": None, "marca": marca or marca_backup()}
+            self._entradas[entrada.id] = entrada
+
+        self._notificar(entrada)
+        self._subida.poner(entrada)
+        return entrada
+
+    def cancelar(self, id: int):
+        """
+        Cancela una entrada. Si aún no ha empezado se descarta; si está en
+        marcha se detiene en el siguiente aviso de progreso o, si el backup
+        admite reanudar, al terminar el archivo en curso, con el ZIP a medias
+        listo para continuar en la próxima ejecución.
+        """
+        entrada = self._entradas.get(id)
+        if entrada is None or entrada.terminada:
+            return
+        entrada._cancelar.set()
+        if entrada.estado in (EN_COLA, ESPERANDO_SUBIDA):
+            self._actualizar(entrada, estado=CANCELADO, mensaje="Cancelado antes de empezar")
+
+    def detener(self, esperar: bool = True):
+        """Cancela todo lo pendiente y en curso y cierra la cola (p. ej. al salir de la aplicación)."""
+        for entrada in self.entradas():
+            self.cancelar(entrada.id)
+        self.cerrar(esperar)
+
+    def entradas(self) -> list:
+        with self._lock:
+            return list(self._entradas.values())
+
+    def activas(self) -> int:
+        return sum(1 for e in self.entradas() if not e.terminada)
+
+    def cerrar(self, esperar: bool = True):
+        """No admite más trabajos; con `esperar` bloquea hasta que terminen los pendientes."""
+        self._compresion.cerrar()
+        if esperar:
+            self._compresion.esperar()
+        self._subida.cerrar()
+        if esperar:
+            self._subida.esperar()
+
+    # -------------------- Interno --------------------
+
+    def _log(self, texto: str):
+        if self.log_callback:
+            self.log_callback(texto)
+
+    def _notificar(self, entrada: EntradaCola):
+        if self.al_cambiar:
+            self.al_cambiar(entrada)
+
+    def _actualizar(
+        self,
+        entrada: EntradaCola,
+        estado: str = None,
+        progreso: float = None,
+        mensaje: str = None,
+        bytes_hechos: int = None,
+        bytes_total: int = None,
+    ):
+        if estado is not None:
+            entrada.estado = estado
+            # Cada etapa cuenta sus propios bytes
+            entrada.bytes_hechos = entrada.bytes_total = 0
+        if progreso is not None:
+            entrada.progreso = progreso
+        if bytes_total is not None:
+            entrada.bytes_total = bytes_total
+        if bytes_hechos is not None:
+            with self._lock:
+                self.bytes_procesados += max(0, bytes_hechos - entrada.bytes_hechos)
+            entrada.bytes_hechos = bytes_hechos
+        if mensaje is not None:
+            entrada.mensaje = mensaje
+        self._notificar(entrada)
+
+    def _servicio(self):
+        service = self.obtener_servicio()
+        if service is None:
+            raise RuntimeError("No se pudo autenticar con Google Drive.")
+        return service
+
+    def _fallo(self, entrada: EntradaCola, error: Exception):
+        # Cancelar desde el callback de progreso puede llegar envuelto en otro
+        # error (p. ej. desde el hilo compresor del modo streaming)
+        if entrada.cancelada:
+            mensaje = str(error) if isinstance(error, BackupInterrumpido) else "Cancelado"
+            self._actualizar(entrada, estado=CANCELADO, mensaje=mensaje)
+            self._log(f"[{entrada.nombre}] {mensaje}.")
+        else:
+            self._actualizar(entrada, estado=ERROR, mensaje=str(error))
+            self._log(f"[{entrada.nombre}] Error: {error}")
+
+    def _comprimir(self, entrada: EntradaCola):
+        if entrada.cancelada:
+            return
+
+        trabajo = entrada.trabajo
+        # Con puntos de control el motor para solo en un punto seguro (ver cancelar)
+        reanudable = admite_reanudar(trabajo)
+
+        def progreso(hechos: int, total: int):
+            if not reanudable:
+                entrada.comprobar_cancelacion()
+
+        def eventos(evento):
+            # El avance se mide en bytes: un archivo grande no deja la barra parada
+            if not reanudable:
+                entrada.comprobar_cancelacion()
+            self._actualizar(
+                entrada,
+                progreso=evento.fraccion,
+                bytes_hechos=evento.bytes_leidos,
+                bytes_total=evento.bytes_total or 0,
+            )
+
+        self._actualizar(entrada, estado=SUBIENDO if trabajo.streaming else COMPRIMIENDO, progreso=0.0)
+        try:
+            service = self._servicio() if trabajo.streaming else None
+            volumen_callback = None
+            marca = marca_backup()
+            if trabajo.subir and trabajo.volumen_mb:
+                # Los volúmenes pasan a la etapa de subida según se cierran
+                def volumen_callback(ruta):
+                    self.encolar_subida(ruta, entrada.prioridad, trabajo.nombre, marca)
+            entrada.resultado = comprimir_trabajo(
+                trabajo, progreso, self.log_callback, service, volumen_callback, eventos, marca, entrada._cancelar
+            )
+            if necesita_verificacion(trabajo, entrada.resultado):
+                self._actualizar(entrada, estado=VERIFICANDO, progreso=0.0)
+
+                def progreso_verificacion(hechos: int, total: int):
+                    entrada.comprobar_cancelacion()
+                    self._actualizar(entrada, progreso=hechos / total if total else 0.0)
+
+                verificar_trabajo(trabajo, entrada.resultado, progreso_verificacion, self.log_callback)
+        except Exception as e:
+            # Un archivo a medio escribir no sirve como backup, salvo que se pueda reanudar.
+            # Los trozos de un snapshot a medias quedan huérfanos: los borra recolectar_basura
+            sin_archivo = trabajo.incremental or trabajo.streaming or trabajo.repositorio
+            if entrada.cancelada and not reanudable and not sin_archivo:
+                trabajo.destino.unlink(missing_ok=True)
+            self._fallo(entrada, e)
+            return
+
+        if necesita_subida(trabajo, entrada.resultado):
+            self._actualizar(entrada, estado=ESPERANDO_SUBIDA, progreso=0.0)
+            self._subida.poner(entrada)
+        elif entrada.resultado["ruta"] is None and not trabajo.streaming:
+            self._actualizar(entrada, estado=SIN_CAMBIOS, progreso=1.0)
+        else:
+            self._actualizar(entrada, estado=COMPLETADO, progreso=1.0, mensaje=str(entrada.resultado["ruta"] or ""))
+
+    def _subir(self, entrada: EntradaCola):
+        if entrada.cancelada:
+            return
+
+        ruta = entrada.archivo or entrada.resultado["ruta"]
+        tamano = ruta.stat().st_size if ruta and ruta.exists() else 0
+
+        def progreso(fraccion: float):
+            entrada.comprobar_cancelacion()
+            self._actualizar(entrada, progreso=fraccion, bytes_hechos=int(fraccion * tamano))
+
+        self._actualizar(entrada, estado=SUBIENDO, progreso=0.0, bytes_total=tamano)
+        try:
+            service = self._servicio()
+            if entrada.trabajo:
+                subir_trabajo(entrada.trabajo, entrada.resultado, service, progreso, self.log_callback)
+            else:
+                from core.drive_catalog import catalogo_compartido
+
+                self._log(f"Subiendo {entrada.archivo.name} a Google Drive...")
+                respuesta = catalogo_compartido(service).subir(
+                    entrada.archivo,
+                    entrada.grupo,
+                    entrada.resultado["marca"],
+                    progreso_callback=lambda hechos, total: progreso(hechos / total if total else 1.0),
+                )
+                entrada.resultado["drive_id"] = respuesta["id"]
+                self._log(f"Backup subido a Drive con ID: {respuesta['id']}")
+        except Exception as e:
+            self._fallo(entrada, e)
+            return
+
+        self._actualizar(entrada, estado=COMPLETADO, progreso=1.0, mensaje=f"Drive ID: {entrada.resultado['drive_id']}")
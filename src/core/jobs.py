@@ -0,0 +1,481 @@
+import os
+from pathlib import Path
+
+from core.backup_engine import crear_backup, obtener_codec
+from core.checkpoint import ruta_punto_control
+from core.compression_policy import PoliticaCompresion
+from core.encryption import CIFRADOS, ruta_contenedor
+from core.retention import PoliticaRetencion, marca_backup
+
+# Carpeta del repositorio deduplicado por defecto: backup.repo
+EXTENSION_REPOSITORIO = ".repo"
+
+
+class TrabajoBackup:
+    """
+    Configuración de un backup, independiente de la interfaz.
+
+    La usan la CLI y el planificador; los campos equivalen a las opciones de
+    la ventana principal. `nivel` es "Bajo", "Medio" o "Alto". `cifrado`
+    ("winzip" o "contenedor") solo cuenta si hay contraseña. Con `verificar`
+    el backup se relee al terminar (ver verificar_trabajo). `retencion`
+    ({"diarios", "semanales", "mensuales"} o una PoliticaRetencion) decide
+    qué backups del trabajo se conservan en Drive tras cada subida. Con
+    `reanudar`, un backup que quedó a medias (el proceso murió o se canceló)
+    se continúa en la siguiente ejecución (ver admite_reanudar). Con
+    `memoria_baja` el uso de memoria no crece con el número de archivos
+    (para árboles de millones de archivos, ver crear_backup). Con
+    `repositorio`, en vez de un ZIP se añade un snapshot al repositorio
+    deduplicado de la carpeta `destino` (core.chunk_store); por defecto
+    backup.repo junto al origen.
+    """
+
+    def __init__(
+        self,
+        nombre: str,
+        origen: Path,
+        destino: Path = None,
+        nivel: str = "Alto",
+        formato: str = "deflate",
+        excluir_temporales: bool = False,
+        incremental: bool = False,
+        adaptativa: bool = True,
+        subir: bool = False,
+        streaming: bool = False,
+        password: str = None,
+        workers: int = None,
+        cron: str = None,
+        volumen_mb: float = None,
+        cifrado: str = "winzip",
+        verificar: bool = True,
+        retencion=None,
+        reanudar: bool = True,
+        memoria_baja: bool = False,
+        repositorio: bool = False,
+    ):
+        self.nombre = nombre
+        self.origen = Path(origen)
+        self.codec = obtener_codec(formato)
+        extension = EXTENSION_REPOSITORIO if repositorio else self.codec.extension
+        self.destino = Path(destino) if destino else self.origen.parent / f"backup{extension}"
+        self.nivel = nivel
+        self.excluir_temporales = excluir_temporales
+        self.incremental = incremental
+        self.adaptativa = adaptativa
+        self.subir = subir
+        self.streaming = streaming
+        self.password = password
+        self.workers = workers
+        self.cron = cron
+        # Con volumen_mb el backup se divide en volúmenes de ese tamaño
+        self.volumen_mb = volumen_mb
+        self.cifrado = cifrado
+        self.verificar = verificar
+        self.retencion = PoliticaRetencion.desde_dict(retencion) if isinstance(retencion, dict) else retencion
+        self.reanudar = reanudar
+        self.memoria_baja = memoria_baja
+        self.repositorio = repositorio
+        if self.encriptar and cifrado == "contenedor":
+            self.destino = ruta_contenedor(self.destino)
+
+    @classmethod
+    def desde_dict(cls, datos: dict) -> "TrabajoBackup":
+        """
+        Crea un trabajo desde la configuración JSON. La contraseña no se
+        guarda en el archivo: `password_env` indica la variable de entorno.
+        """
+        datos = dict(datos)
+        variable = datos.pop("password_env", None)
+        if variable:
+            datos["password"] = os.environ.get(variable)
+            if not datos["password"]:
+                raise ValueError(f"La variable de entorno {variable} está vacía")
+        return cls(**datos)
+
+    @property
+    def encriptar(self) -> bool:
+        return self.password is not None
+
+    def validar(self):
+        if not self.origen.is_dir():
+            raise ValueError(f"La carpeta origen no existe: {self.origen}")
+        if self.streaming and not self.subir:
+            raise ValueError("El modo streaming requiere subir a Drive")
+        if self.streaming and self.incremental:
+            raise ValueError("La subida en streaming no admite backup incremental")
+        if self.cifrado not in CIFRADOS:
+            raise ValueError(f"Cifrado desconocido: {self.cifrado}")
+        contenedor = self.encriptar and self.cifrado == "contenedor"
+        if not self.codec.es_zip and (self.incremental or (self.encriptar and not contenedor)):
+            raise ValueError(f"El formato {self.codec.etiqueta} no admite incremental ni encriptación WinZip")
+        if contenedor and (self.incremental or self.volumen_mb):
+            raise ValueError("El contenedor cifrado no admite backup incremental ni volúmenes")
+        if self.volumen_mb:
+            if self.volumen_mb <= 0:
+                raise ValueError("El tamaño de volumen debe ser positivo")
+            if self.streaming or self.incremental or not self.codec.es_zip:
+                raise ValueError("Los volúmenes solo admiten backups ZIP completos, sin streaming")
+        if self.memoria_baja and (self.incremental or self.volumen_mb):
+            raise ValueError("El modo de memoria baja no admite backup incremental ni volúmenes")
+        if self.repositorio:
+            if self.codec.nombre != "deflate":
+                raise ValueError("El repositorio deduplicado comprime sus trozos con zlib: no admite otro formato")
+            if self.subir or self.incremental or self.volumen_mb or self.encriptar or self.memoria_baja:
+                raise ValueError(
+                    "El repositorio deduplicado no admite subir a Drive, incremental, volúmenes, encriptación "
+                    "ni memoria baja"
+                )
+
+
+def admite_reanudar(trabajo: TrabajoBackup) -> bool:
+    """Solo un ZIP completo en disco (sin streaming, volúmenes, incremental ni contenedor) guarda puntos de control."""
+    contenedor = trabajo.encriptar and trabajo.cifrado == "contenedor"
+    simple = not (trabajo.streaming or trabajo.incremental or trabajo.volumen_mb or contenedor or trabajo.repositorio)
+    return trabajo.reanudar and trabajo.codec.es_zip and simple
+
+
+def servicio_desatendido():
+    """Servicio de Drive sin diálogos ni flujo OAuth; sin token válido lanza RuntimeError."""
+    # Importación diferida: las librerías de Google solo hacen falta al subir
+    from core.drive_auth import get_drive_service
+
+    return get_drive_service(interactivo=False, permitir_login=False)
+
+
+def comprimir_trabajo(
+    trabajo: TrabajoBackup,
+    progreso_callback=None,
+    log_callback=None,
+    service=None,
+    volumen_callback=None,
+    eventos_callback=None,
+    marca: str = None,
+    detener=None,
+) -> dict:
+    """
+    Crea el backup de un trabajo. En modo streaming también lo sube (la
+    compresión y la subida son la misma operación); si no, la subida queda
+    para subir_trabajo().
+
+    Con volúmenes, `volumen_callback(ruta)` recibe cada volumen al cerrarse y
+    la "ruta" del resultado es el índice (backup.zip.volumes.json).
+    `eventos_callback(EventoProgreso)` recibe el avance en bytes del motor.
+
+    `marca` identifica la ejecución en Drive (ver core.retention.marca_backup).
+    Si el trabajo admite reanudar, `detener` (threading.Event) lo para en el
+    siguiente punto seguro con BackupInterrumpido (core.checkpoint).
+
+    Con `repositorio` la "ruta" es la carpeta del repositorio y el
+    resultado lleva además "snapshot" con el id del snapshot creado.
+
+    Devuelve {"archivos": n, "ruta": Path o None, "drive_id": str o None, "marca": str}.
+    """
+    def log(texto):
+        if log_callback:
+            log_callback(f"[{trabajo.nombre}] {texto}")
+
+    trabajo.validar()
+    nivel_real = trabajo.codec.nivel(trabajo.nivel)
+    politica = None
+    if trabajo.adaptativa and trabajo.codec.es_zip:
+        politica = PoliticaCompresion(nivel_real, metodo=trabajo.codec.metodo_zip)
+
+    resultado = {"archivos": 0, "ruta": None, "drive_id": None, "marca": marca or marca_backup()}
+
+    if trabajo.streaming:
+        from core.drive_catalog import catalogo_compartido
+        from core.streaming_upload import backup_y_subir
+
+        if service is None:
+            service = servicio_desatendido()
+
+        # Sin archivo en disco no se conoce el tamaño: no se puede comprobar la cuota
+        catalogo = catalogo_compartido(service)
+        metadatos = catalogo.metadatos(trabajo.destino, trabajo.nombre, resultado["marca"])
+        log("Comprimiendo y subiendo a Drive en streaming...")
+        resultado["archivos"], respuesta = backup_y_subir(
+            service,
+            carpeta_origen=trabajo.origen,
+            nombre_zip=trabajo.destino.name,
+            metadatos=metadatos,
+            nivel_compresion=nivel_real,
+            excluir_temporales=trabajo.excluir_temporales,
+            encriptar=trabajo.encriptar,
+            password=trabajo.password,
+            progreso_callback=progreso_callback,
+            eventos_callback=eventos_callback,
+            politica=politica,
+            codec=trabajo.codec.nombre,
+            cifrado=trabajo.cifrado,
+            memoria_baja=trabajo.memoria_baja,
+        )
+        resultado["drive_id"] = respuesta["id"]
+        catalogo.registrar(respuesta["id"], metadatos, int(respuesta.get("size", 0)))
+        log(f"Backup subido a Drive como {metadatos['name']} (ID: {resultado['drive_id']})")
+        aplicar_retencion(trabajo, service, log_callback)
+        return resultado
+
+    if trabajo.repositorio:
+        from core.chunk_store import ChunkStore
+        from core.progress import formatear_bytes
+
+        log(f"Creando snapshot de {trabajo.origen} en el repositorio {trabajo.destino}...")
+        resultado["snapshot"], stats = ChunkStore(trabajo.destino).crear_snapshot(
+            trabajo.origen,
+            trabajo.excluir_temporales,
+            nivel_compresion=nivel_real,
+            progreso_callback=progreso_callback,
+            workers=trabajo.workers,
+        )
+        resultado["archivos"] = stats["archivos"]
+        resultado["ruta"] = trabajo.destino
+        log(
+            f"Snapshot {resultado['snapshot']} creado: {stats['archivos']} archivos, "
+            f"{stats['chunks_nuevos']} de {stats['chunks']} trozos nuevos, "
+            f"{formatear_bytes(stats['bytes_escritos'])} escritos de {formatear_bytes(stats['bytes_leidos'])} leídos"
+        )
+        return resultado
+
+    log(f"Creando backup de {trabajo.origen}...")
+    if trabajo.incremental:
+        from core.incremental import crear_backup_incremental
+
+        resultado["archivos"], resultado["ruta"] = crear_backup_incremental(
+            carpeta_origen=trabajo.origen,
+            destino_zip=trabajo.destino,
+            nivel_compresion=nivel_real,
+            excluir_temporales=trabajo.excluir_temporales,
+            encriptar=trabajo.encriptar,
+            password=trabajo.password,
+            progreso_callback=progreso_callback,
+            eventos_callback=eventos_callback,
+            workers=trabajo.workers,
+            politica=politica,
+            codec=trabajo.codec.nombre,
+        )
+        if resultado["ruta"] is None:
+            log("No hay archivos nuevos ni modificados desde el último backup.")
+            return resultado
+    elif trabajo.volumen_mb:
+        from core.volumes import crear_backup_volumenes
+
+        resultado["archivos"], resultado["ruta"] = crear_backup_volumenes(
+            carpeta_origen=trabajo.origen,
+            destino_zip=trabajo.destino,
+            nivel_compresion=nivel_real,
+            excluir_temporales=trabajo.excluir_temporales,
+            tamano_volumen=int(trabajo.volumen_mb * 1024 * 1024),
+            encriptar=trabajo.encriptar,
+            password=trabajo.password,
+            progreso_callback=progreso_callback,
+            eventos_callback=eventos_callback,
+            volumen_callback=volumen_callback,
+            workers=trabajo.workers,
+            ruta_indice_escaneo=trabajo.destino.with_name(trabajo.destino.name + ".scan.json"),
+            politica=politica,
+            codec=trabajo.codec.nombre,
+        )
+    else:
+        if admite_reanudar(trabajo) and ruta_punto_control(trabajo.destino).exists():
+            log("Hay un backup a medias de una ejecución anterior: se intentará continuar.")
+        resultado["archivos"] = crear_backup(
+            carpeta_origen=trabajo.origen,
+            destino_zip=trabajo.destino,
+            nivel_compresion=nivel_real,
+            excluir_temporales=trabajo.excluir_temporales,
+            encriptar=trabajo.encriptar,
+            password=trabajo.password,
+            progreso_callback=progreso_callback,
+            eventos_callback=eventos_callback,
+            workers=trabajo.workers,
+            ruta_indice_escaneo=trabajo.destino.with_name(trabajo.destino.name + ".scan.json"),
+            politica=politica,
+            codec=trabajo.codec.nombre,
+            cifrado=trabajo.cifrado,
+            reanudar=admite_reanudar(trabajo),
+            detener=detener,
+            memoria_baja=trabajo.memoria_baja,
+        )
+        resultado["ruta"] = trabajo.destino
+
+    log(f"Backup creado: {resultado['ruta']} ({resultado['archivos']} archivos)")
+    if necesita_indice(trabajo, resultado):
+        from core.restore import indice_local
+
+        # Solo relee el directorio central: deja listo backup.zip.idx para restaurar por partes
+        with indice_local(resultado["ruta"], trabajo.password) as indice:
+            log(f"Índice de restauración: {indice.ruta.name} ({len(indice)} archivos)")
+    if politica:
+        log(politica.resumen())
+    return resultado
+
+
+def necesita_indice(trabajo: TrabajoBackup, resultado: dict) -> bool:
+    # Los volúmenes ya tienen su índice y el contenedor cifrado no se puede leer por partes.
+    # Con memoria baja se deja para la primera restauración: construirlo carga el directorio central entero
+    contenedor = trabajo.encriptar and trabajo.cifrado == "contenedor"
+    simple = not (trabajo.volumen_mb or contenedor or trabajo.memoria_baja or trabajo.repositorio)
+    return trabajo.codec.es_zip and simple and resultado["ruta"] is not None
+
+
+def necesita_verificacion(trabajo: TrabajoBackup, resultado: dict) -> bool:
+    # En streaming no hay copia local: la comprobación es el MD5 de Drive
+    return trabajo.verificar and not trabajo.streaming and resultado["ruta"] is not None
+
+
+def verificar_trabajo(trabajo: TrabajoBackup, resultado: dict, progreso_callback=None, log_callback=None) -> int:
+    """
+    Relee el backup recién creado en varios hilos: descomprime cada archivo
+    (CRC y, con AES, HMAC) y compara su SHA-256 con el calculado al leer el
+    original. `progreso_callback(hechos, total)`.
+
+    Lanza RuntimeError si algo no coincide. Devuelve los archivos verificados.
+    """
+    from core.integrity import verificar_backup
+
+    def log(texto):
+        if log_callback:
+            log_callback(f"[{trabajo.nombre}] {texto}")
+
+    ruta = resultado["ruta"]
+    if trabajo.repositorio:
+        from core.chunk_store import ChunkStore
+
+        log(f"Verificando el snapshot {resultado['snapshot']}...")
+        verificados, errores = ChunkStore(ruta).verificar_snapshot(resultado["snapshot"], progreso_callback)
+    elif trabajo.volumen_mb:
+        log(f"Verificando {ruta.name}...")
+        from core.volumes import verificar_volumenes
+
+        verificados, errores = verificar_volumenes(ruta, trabajo.password, trabajo.workers, progreso_callback)
+    else:
+        log(f"Verificando {ruta.name}...")
+        verificados, errores = verificar_backup(ruta, trabajo.password, trabajo.workers, progreso_callback)
+
+    if errores:
+        for error in errores[:10]:
+            log(f"Error de verificación: {error}")
+        raise RuntimeError(f"El backup {ruta.name} no supera la verificación ({len(errores)} errores)")
+    log(f"Verificación correcta: {verificados} archivos")
+    return verificados
+
+
+def subir_volumen(trabajo: TrabajoBackup, ruta: Path, marca: str, service) -> str:
+    """Sube un archivo más de la ejecución `marca` (p. ej. un volumen) a la carpeta de backups."""
+    from core.drive_catalog import catalogo_compartido
+
+    catalogo = catalogo_compartido(service)
+    return catalogo.subir(ruta, trabajo.nombre, marca, trabajo.incremental, trabajo.retencion)["id"]
+
+
+def subir_trabajo(trabajo: TrabajoBackup, resultado: dict, service=None, progreso_callback=None, log_callback=None) -> str:
+    """
+    Sube a Drive el archivo generado por comprimir_trabajo(), a la carpeta
+    de backups y con la fecha en el nombre, y aplica la retención del
+    trabajo. `progreso_callback` recibe 0.0 - 1.0. Si no cabe en Drive ni
+    borrando los backups caducados lanza ErrorCuota.
+    """
+    from core.drive_catalog import catalogo_compartido
+
+    if service is None:
+        service = servicio_desatendido()
+
+    def log(texto):
+        if log_callback:
+            log_callback(f"[{trabajo.nombre}] {texto}")
+
+    def progreso(hechos: int, total: int):
+        if progreso_callback:
+            progreso_callback(hechos / total if total else 1.0)
+
+    ruta = resultado["ruta"]
+    log(f"Subiendo {ruta.name} a Google Drive...")
+    respuesta = catalogo_compartido(service).subir(
+        ruta,
+        trabajo.nombre,
+        resultado.setdefault("marca", marca_backup()),
+        trabajo.incremental,
+        trabajo.retencion,
+        progreso,
+        log_callback=log,
+    )
+    resultado["drive_id"] = respuesta["id"]
+    log(f"Backup subido a Drive con ID: {resultado['drive_id']}")
+    aplicar_retencion(trabajo, service, log_callback)
+    return resultado["drive_id"]
+
+
+def aplicar_retencion(trabajo: TrabajoBackup, service, log_callback=None):
+    """
+    Borra de Drive los backups del trabajo que su política ya no conserva.
+    Un fallo aquí no invalida el backup recién subido: solo se avisa.
+    """
+    if trabajo.retencion is None:
+        return
+    from core.drive_catalog import catalogo_compartido
+    from core.progress import formatear_bytes
+
+    def log(texto):
+        if log_callback:
+            log_callback(f"[{trabajo.nombre}] {texto}")
+
+    try:
+        liberado, errores = catalogo_compartido(service).podar(trabajo.retencion, trabajo.nombre, log_callback=log)
+    except Exception as e:
+        log(f"No se pudo aplicar la retención en Drive: {e}")
+        return
+    for error in errores[:10]:
+        log(f"No se pudo borrar de Drive: {error}")
+    if liberado:
+        log(f"Retención ({trabajo.retencion.resumen()}): liberados {formatear_bytes(liberado)} en Drive")
+
+
+def necesita_subida(trabajo: TrabajoBackup, resultado: dict) -> bool:
+    return trabajo.subir and not trabajo.streaming and resultado["ruta"] is not None
+
+
+def ejecutar_trabajo(
+    trabajo: TrabajoBackup, progreso_callback=None, log_callback=None, service=None, eventos_callback=None, detener=None
+) -> dict:
+    """
+    Ejecuta un trabajo de principio a fin (backup, verificación y, si
+    procede, subida).
+
+    No abre diálogos: si Drive no tiene un token válido lanza RuntimeError.
+    Devuelve {"archivos": n, "ruta": Path o None, "drive_id": str o None}.
+    """
+    # Sin token no tiene sentido comprimir: se comprueba antes de empezar
+    if trabajo.subir and service is None:
+        trabajo.validar()
+        service = servicio_desatendido()
+
+    pendientes = []
+    pool = None
+    volumen_callback = None
+    marca = marca_backup()
+    if trabajo.subir and trabajo.volumen_mb:
+        # Cada volumen se sube en cuanto se cierra, mientras se comprime el siguiente
+        from concurrent.futures import ThreadPoolExecutor
+
+        pool = ThreadPoolExecutor(max_workers=2)
+
+        def volumen_callback(ruta):
+            if log_callback:
+                log_callback(f"[{trabajo.nombre}] Volumen {ruta.name} cerrado; subiendo...")
+            pendientes.append(pool.submit(subir_volumen, trabajo, ruta, marca, service))
+
+    try:
+        resultado = comprimir_trabajo(
+            trabajo, progreso_callback, log_callback, service, volumen_callback, eventos_callback, marca, detener
+        )
+    finally:
+        if pool:
+            pool.shutdown(wait=True)
+
+    for futuro in pendientes:
+        futuro.result()
+    if necesita_verificacion(trabajo, resultado):
+        verificar_trabajo(trabajo, resultado, log_callback=log_callback)
+    if necesita_subida(trabajo, resultado):
+        subir_trabajo(trabajo, resultado, service, log_callback=log_callback)
+    return resultado
@@ -0,0 +1,360 @@
+import os
+import shutil
+import tempfile
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from pathlib import Path
+
+from core.encryption import CifradorWinZip
+from core.progress import SeguimientoProgreso
+from core.small_files import Prelectura, escritura_por_lotes, leer_pequeno, por_adelantado, zipinfo_desde_stat
+
+# Tamaño de cada bloque que se comprime de forma independiente.
+# Los archivos grandes se parten en varios bloques para repartirlos entre hilos.
+TAMANO_BLOQUE = 4 * 1024 * 1024
+
+# Ventana de deflate: los últimos 32 KB del bloque anterior se usan como
+# diccionario del siguiente para no perder ratio al partir (igual que pigz).
+VENTANA_DEFLATE = 32 * 1024
+
+# BZIP2 y LZMA no se pueden partir en bloques independientes dentro del ZIP:
+# cada archivo se comprime entero en un hilo. Su salida pasa a disco a partir
+# de este tamaño para no retener archivos grandes en memoria.
+MAX_SPOOL_MEMORIA = 64 * 1024 * 1024
+
+
+def workers_por_defecto() -> int:
+    return os.cpu_count() or 1
+
+
+class _SinCompresion:
+    """Compresor nulo: los datos ya llegan comprimidos desde el pool."""
+
+    def compress(self, data):
+        return data
+
+    def flush(self):
+        return b""
+
+
+def _comprimir_bloque(datos: bytes, metodo: int, nivel: int, diccionario: bytes, final: bool) -> bytes:
+    """
+    Comprime un bloque como deflate crudo (o lo deja tal cual con ZIP_STORED).
+
+    Los bloques intermedios terminan con Z_SYNC_FLUSH (alineados a byte y sin
+    marca de final), así que concatenados forman un único stream válido.
+    """
+    if metodo == zipfile.ZIP_STORED:
+        return datos
+
+    if diccionario:
+        comp = zlib.compressobj(nivel, zlib.DEFLATED, -15, zdict=diccionario)
+    else:
+        comp = zlib.compressobj(nivel, zlib.DEFLATED, -15)
+
+    salida = comp.compress(datos)
+    salida += comp.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+    return salida
+
+
+def _comprimir_y_cifrar(datos: bytes, metodo: int, nivel: int, diccionario: bytes, final: bool, password: bytes, anterior):
+    """
+    _comprimir_bloque seguido de AES-CTR (WinZip) en la posición del miembro.
+
+    El primer bloque de cada archivo crea el cifrador (y deriva su clave);
+    los siguientes esperan al bloque `anterior` solo para saber en qué
+    posición empiezan. Devuelve (cifrado, cifrador, posición final).
+    """
+    comprimido = _comprimir_bloque(datos, metodo, nivel, diccionario, final)
+    if anterior is None:
+        cifrador, desplazamiento = CifradorWinZip(password, externo=True), 0
+    else:
+        _, cifrador, desplazamiento = anterior.result()
+    return cifrador.cifrar_desde(comprimido, desplazamiento), cifrador, desplazamiento + len(comprimido)
+
+
+def _comprimir_archivo(
+    archivo: Path, metodo: int, nivel: int, seguimiento: SeguimientoProgreso, password: bytes = None, hash_archivo=None
+):
+    """
+    Comprime un archivo completo con un método que no admite bloques (BZIP2, LZMA).
+
+    Con `password` la salida se cifra también aquí y se devuelve
+    ((spool, crc, tamaño), cifrador, None), igual que _comprimir_y_cifrar.
+    """
+    compresor = zipfile._get_compressor(metodo, nivel)
+    cifrador = CifradorWinZip(password, externo=True) if password else None
+    salida = tempfile.SpooledTemporaryFile(max_size=MAX_SPOOL_MEMORIA)
+    crc = 0
+    tamano = 0
+
+    def guardar(comprimido):
+        if cifrador:
+            comprimido = cifrador.cifrar_desde(comprimido, salida.tell())
+        salida.write(comprimido)
+
+    with open(archivo, "rb") as f:
+        for datos in iter(lambda: f.read(TAMANO_BLOQUE), b""):
+            crc = zlib.crc32(datos, crc)
+            tamano += len(datos)
+            guardar(compresor.compress(datos))
+            seguimiento.leidos(len(datos), archivo)
+            if hash_archivo:
+                hash_archivo.update(datos)
+    guardar(compresor.flush())
+    if hash_archivo:
+        hash_archivo.terminar()
+    salida.seek(0)
+    if cifrador:
+        return (salida, crc, tamano), cifrador, None
+    return salida, crc, tamano
+
+
+def _comprimir_entero(datos: bytes, metodo: int, nivel: int) -> bytes:
+    """Un archivo pequeño de una vez, con cualquier método del ZIP."""
+    if metodo in (zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED):
+        return _comprimir_bloque(datos, metodo, nivel, b"", True)
+    compresor = zipfile._get_compressor(metodo, nivel)
+    return compresor.compress(datos) + compresor.flush()
+
+
+class _Hecho:
+    """Resultado ya calculado con la interfaz de un Future."""
+
+    __slots__ = ("_valor",)
+
+    def __init__(self, valor):
+        self._valor = valor
+
+    def result(self):
+        return self._valor
+
+
+class _Pequeno:
+    """Archivo pequeño ya leído, con su hash y comprimido (y cifrado) en un hilo lector."""
+
+    __slots__ = ("arcname", "st", "resultado", "crc", "tamano", "metodo", "nivel")
+
+    def __init__(self, arcname, st, resultado, crc, tamano, metodo, nivel):
+        self.arcname = arcname
+        self.st = st
+        self.resultado = resultado
+        self.crc = crc
+        self.tamano = tamano
+        self.metodo = metodo
+        self.nivel = nivel
+
+
+class _Bloque:
+    __slots__ = ("archivo", "arcname", "st", "futuro", "primero", "final", "crc", "tamano", "metodo", "nivel")
+
+    def __init__(self, archivo, arcname, st, futuro, primero, final, crc, tamano, metodo, nivel):
+        self.archivo = archivo
+        self.st = st
+        self.arcname = arcname
+        self.futuro = futuro
+        self.primero = primero
+        self.final = final
+        self.crc = crc
+        self.tamano = tamano
+        self.metodo = metodo
+        self.nivel = nivel
+
+
+def comprimir_en_paralelo(
+    zipf,
+    archivos,
+    carpeta_origen: Path,
+    nivel_compresion: int,
+    workers: int = None,
+    progreso_callback=None,
+    politica=None,
+    metodo: int = zipfile.ZIP_DEFLATED,
+    eventos_callback=None,
+    seguimiento: SeguimientoProgreso = None,
+    hashes=None,
+    punto_control=None,
+):
+    """
+    Escribe `archivos` en `zipf` comprimiendo los bloques en un pool de hilos.
+
+    zlib libera el GIL al comprimir, así que varios hilos aprovechan todos los
+    núcleos. El hilo que llama lee los archivos, calcula el CRC y escribe los
+    bloques en orden, por lo que el ZIP resultante es idéntico en estructura
+    al de `zipf.write`. Funciona igual con `zipfile.ZipFile` y con
+    `pyzipper.AESZipFile` (el cifrado se aplica al escribir cada bloque).
+    Con `ZipAESRapido` el cifrado AES también se hace en el pool, justo
+    después de comprimir, y el hilo que escribe solo calcula el HMAC.
+
+    `archivos` puede ser un iterable que todavía se está llenando.
+    Con `politica` (PoliticaCompresion) cada archivo usa el método y nivel
+    que ella decida a partir de su primer bloque. Con `metodo` ZIP_BZIP2 o
+    ZIP_LZMA el reparto entre hilos es por archivo en vez de por bloque.
+
+    Los avisos de progreso van por `seguimiento` si se pasa uno; si no, se
+    crea con `progreso_callback` y `eventos_callback`. Con `hashes`
+    (CalculadorHashes) cada bloque leído se pasa también al hash del archivo.
+    Con `punto_control` (core.checkpoint.PuntoControl, requiere `hashes`)
+    cada miembro cerrado es un punto seguro para guardar o parar.
+
+    Los archivos pequeños (core.small_files) se leen, se resumen y se
+    comprimen enteros en hilos lectores, en lotes y por delante del hilo
+    que llama, y lo que se escribe en el ZIP se agrupa en escrituras de
+    TAMANO_LOTE_ESCRITURA: miles de archivos de pocos KB no pagan cada uno
+    la latencia de su open ni varias llamadas al sistema para escribirse.
+    """
+    workers = workers or workers_por_defecto()
+    if seguimiento is None:
+        seguimiento = SeguimientoProgreso(archivos, progreso_callback, eventos_callback)
+    pendientes = deque()
+    # Limita la memoria: como mucho dos bloques por hilo en vuelo
+    max_pendientes = workers * 2
+    estado = {"escritor": None, "hechos": 0}
+    password = zipf.pwd if getattr(zipf, "cifrado_paralelo", False) else None
+
+    def escribir_siguiente():
+        bloque = pendientes.popleft()
+        datos = bloque.futuro.result()
+        if password:
+            datos, cifrador, _ = datos
+
+        if bloque.primero:
+            if password:
+                zipf.cifrador_siguiente = cifrador
+            # pyzipper usa su propia subclase (AESZipInfo) para los extras AES
+            zipinfo_cls = getattr(zipf, "zipinfo_cls", zipfile.ZipInfo)
+            zinfo = zipinfo_desde_stat(zipinfo_cls, bloque.arcname, bloque.st)
+            zinfo.compress_type = bloque.metodo
+            zinfo._compresslevel = bloque.nivel
+            escritor = zipf.open(zinfo, "w")
+            escritor._compressor = _SinCompresion()
+            estado["escritor"] = escritor
+
+        escritor = estado["escritor"]
+        if bloque.crc is None:
+            # Archivo completo comprimido en un hilo: (spool, crc, tamaño)
+            spool, bloque.crc, bloque.tamano = datos
+            with spool:
+                shutil.copyfileobj(spool, escritor, TAMANO_BLOQUE)
+                seguimiento.escritos(spool.tell())
+        else:
+            escritor.write(datos)
+            seguimiento.escritos(len(datos))
+
+        if bloque.final:
+            # write() contó bytes comprimidos; se corrigen antes de cerrar
+            escritor._file_size = bloque.tamano
+            escritor._crc = bloque.crc
+            escritor.close()
+            estado["escritor"] = None
+            estado["hechos"] += 1
+            seguimiento.archivo_terminado(bloque.archivo)
+            if punto_control:
+                punto_control.miembro_terminado(zipf, hashes)
+
+    def preparar(archivo):
+        # En un hilo lector: un archivo grande solo se mira y se deja al hilo que llama
+        prelectura = leer_pequeno(archivo)
+        datos = prelectura.datos
+        if datos is None:
+            return prelectura
+
+        metodo_archivo, nivel = metodo, nivel_compresion
+        if politica:
+            decision = politica.decidir(archivo, datos, len(datos))
+            metodo_archivo, nivel = decision.metodo, decision.nivel
+        seguimiento.leidos(len(datos), archivo)
+        arcname = archivo.relative_to(carpeta_origen).as_posix()
+        if hashes:
+            hash_archivo = hashes.nuevo(arcname)
+            hash_archivo.update(datos)
+            hash_archivo.terminar()
+
+        comprimido = _comprimir_entero(datos, metodo_archivo, nivel)
+        resultado = comprimido
+        if password:
+            cifrador = CifradorWinZip(password, externo=True)
+            resultado = (cifrador.cifrar_desde(comprimido, 0), cifrador, len(comprimido))
+        return _Pequeno(arcname, prelectura.st, resultado, zlib.crc32(datos), len(datos), metodo_archivo, nivel)
+
+    prelecturas = closing(por_adelantado(archivos, preparar))
+    with ThreadPoolExecutor(max_workers=workers) as pool, prelecturas as preparados, escritura_por_lotes(zipf):
+        for archivo, preparado in preparados:
+            if not isinstance(preparado, Prelectura):
+                pendientes.append(_Bloque(
+                    archivo, preparado.arcname, preparado.st, _Hecho(preparado.resultado), True, True, preparado.crc,
+                    preparado.tamano, preparado.metodo, preparado.nivel,
+                ))
+                while len(pendientes) > max_pendientes:
+                    escribir_siguiente()
+                continue
+
+            arcname = archivo.relative_to(carpeta_origen).as_posix()
+            crc = 0
+            tamano = 0
+            diccionario = b""
+            primero = True
+            futuro = None
+            hash_archivo = hashes.nuevo(arcname) if hashes else None
+
+            with open(archivo, "rb") as f:
+                datos = f.read(TAMANO_BLOQUE)
+                st = os.fstat(f.fileno())
+
+                metodo_archivo, nivel = metodo, nivel_compresion
+                if politica:
+                    decision = politica.decidir(archivo, datos, st.st_size)
+                    metodo_archivo, nivel = decision.metodo, decision.nivel
+
+                if metodo_archivo not in (zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED):
+                    futuro = pool.submit(
+                        _comprimir_archivo, archivo, metodo_archivo, nivel, seguimiento, password, hash_archivo
+                    )
+                    pendientes.append(
+                        _Bloque(archivo, arcname, st, futuro, True, True, None, None, metodo_archivo, nivel)
+                    )
+                    while len(pendientes) > max_pendientes:
+                        escribir_siguiente()
+                    continue
+
+                while True:
+                    siguiente = f.read(TAMANO_BLOQUE) if len(datos) == TAMANO_BLOQUE else b""
+                    final = not siguiente
+
+                    crc = zlib.crc32(datos, crc)
+                    tamano += len(datos)
+                    seguimiento.leidos(len(datos), archivo)
+                    if hash_archivo:
+                        hash_archivo.update(datos)
+                    if password:
+                        futuro = pool.submit(
+                            _comprimir_y_cifrar, datos, metodo_archivo, nivel, diccionario, final, password,
+                            None if primero else futuro,
+                        )
+                    else:
+                        futuro = pool.submit(_comprimir_bloque, datos, metodo_archivo, nivel, diccionario, final)
+                    pendientes.append(
+                        _Bloque(archivo, arcname, st, futuro, primero, final, crc, tamano, metodo_archivo, nivel)
+                    )
+
+                    while len(pendientes) > max_pendientes:
+                        escribir_siguiente()
+
+                    if final:
+                        if hash_archivo:
+                            hash_archivo.terminar()
+                        break
+
+                    diccionario = datos[-VENTANA_DEFLATE:]
+                    datos = siguiente
+                    primero = False
+
+        while pendientes:
+            escribir_siguiente()
+
+    seguimiento.terminar()
+    return estado["hechos"]
+
@@ -0,0 +1,216 @@
+import os
+import threading
+import time
+
+from core.scanner import total_conocido
+from core.throttle import limitador_global
+
+
+def formatear_bytes(n: float) -> str:
+    for unidad in ("B", "KB", "MB", "GB"):
+        if abs(n) < 1024:
+            return f"{n:.0f} {unidad}" if unidad == "B" else f"{n:.1f} {unidad}"
+        n /= 1024
+    return f"{n:.1f} TB"
+
+
+def formatear_duracion(segundos) -> str:
+    if segundos is None:
+        return "--:--"
+    segundos = int(segundos)
+    horas, resto = divmod(segundos, 3600)
+    minutos, segundos = divmod(resto, 60)
+    return f"{horas}:{minutos:02d}:{segundos:02d}" if horas else f"{minutos:02d}:{segundos:02d}"
+
+
+class MedidorVelocidad:
+    """
+    Velocidad de un contador que crece (bytes, archivos...).
+
+    `instantanea` es la del último intervalo medido y `suavizada` una media
+    móvil exponencial, más estable para calcular el tiempo restante. Las
+    muestras más juntas que `intervalo_min` se acumulan en la siguiente para
+    que una ráfaga de avisos no dispare la velocidad.
+    """
+
+    def __init__(self, suavizado: float = 0.3, intervalo_min: float = 0.25, reloj=time.monotonic):
+        self.suavizado = suavizado
+        self.intervalo_min = intervalo_min
+        self._reloj = reloj
+        self.inicio = reloj()
+        self._t = self.inicio
+        self._valor = 0
+        self.instantanea = 0.0
+        self.suavizada = None
+
+    def actualizar(self, valor: float):
+        ahora = self._reloj()
+        dt = ahora - self._t
+        if dt < self.intervalo_min:
+            return
+        self.instantanea = max(0.0, valor - self._valor) / dt
+        if self.suavizada is None:
+            self.suavizada = self.instantanea
+        else:
+            self.suavizada += self.suavizado * (self.instantanea - self.suavizada)
+        self._t = ahora
+        self._valor = valor
+
+    def media(self) -> float:
+        """Velocidad media desde el inicio."""
+        transcurrido = self._t - self.inicio
+        return self._valor / transcurrido if transcurrido > 0 else 0.0
+
+    def restante(self, pendiente: float):
+        """Segundos estimados para `pendiente` unidades más, o None si aún no se sabe."""
+        if not self.suavizada:
+            return None
+        return pendiente / self.suavizada
+
+
+class EventoProgreso:
+    """
+    Estado de un backup en curso.
+
+    `bytes_total` es una estimación mientras el escaneo no termina (igual que
+    `archivos_total`). `ratio` es bytes_escritos / bytes_leidos; los bytes
+    escritos van algo por detrás de los leídos mientras hay bloques en vuelo.
+    Las velocidades son de lectura, en bytes por segundo.
+    """
+
+    __slots__ = (
+        "archivos_hechos", "archivos_total", "bytes_leidos", "bytes_total", "bytes_escritos",
+        "archivo_actual", "velocidad_instantanea", "velocidad_suavizada", "transcurrido", "final",
+    )
+
+    def __init__(self, **campos):
+        for nombre in self.__slots__:
+            setattr(self, nombre, campos.get(nombre))
+
+    @property
+    def ratio(self):
+        return self.bytes_escritos / self.bytes_leidos if self.bytes_leidos else None
+
+    @property
+    def fraccion(self) -> float:
+        if self.final:
+            return 1.0
+        if not self.bytes_total:
+            return 0.0
+        return min(1.0, self.bytes_leidos / self.bytes_total)
+
+    @property
+    def restante(self):
+        """Segundos estimados hasta terminar, o None si aún no se sabe."""
+        if not self.velocidad_suavizada or self.bytes_total is None:
+            return None
+        return max(0, self.bytes_total - self.bytes_leidos) / self.velocidad_suavizada
+
+    def como_dict(self) -> dict:
+        datos = {nombre: getattr(self, nombre) for nombre in self.__slots__}
+        datos["archivo_actual"] = str(self.archivo_actual) if self.archivo_actual else None
+        datos["ratio"] = self.ratio
+        return datos
+
+
+class SeguimientoProgreso:
+    """
+    Cuenta archivos y bytes de un backup y avisa a los callbacks.
+
+    `progreso_callback(hechos, total)` se sigue llamando una vez por archivo.
+    `eventos_callback(EventoProgreso)` recibe un evento como mucho cada
+    `intervalo` segundos (y siempre uno al terminar), de modo que un archivo
+    grande informa de su avance mientras se lee. Se puede llamar desde
+    varios hilos.
+
+    Cada lectura pasa también por el límite de lectura de `limitador`
+    (por defecto el global, ver core.throttle): el hilo que lee espera ahí
+    si el disco va por encima de los MB/s permitidos.
+    """
+
+    def __init__(self, archivos, progreso_callback=None, eventos_callback=None, intervalo: float = 0.25, limitador=None):
+        self.archivos = archivos
+        self.limitador = limitador or limitador_global()
+        self.progreso_callback = progreso_callback
+        self.eventos_callback = eventos_callback
+        self.intervalo = intervalo
+        self.archivos_hechos = 0
+        self.bytes_leidos = 0
+        self.bytes_escritos = 0
+        self.archivo_actual = None
+        self.medidor = MedidorVelocidad()
+        self._ultimo_evento = 0.0
+        self._bytes_lista = None
+        self._lock = threading.Lock()
+
+    def _bytes_total(self):
+        try:
+            len(self.archivos)
+        except TypeError:
+            # Escaneo en curso: lo descubierto hasta ahora
+            return getattr(self.archivos, "bytes_encontrados", None)
+        if self._bytes_lista is None:
+            self._bytes_lista = sum(_tamano(a) for a in self.archivos)
+        return self._bytes_lista
+
+    def leidos(self, n: int, archivo=None):
+        with self._lock:
+            self.bytes_leidos += n
+            if archivo is not None:
+                self.archivo_actual = archivo
+        self.limitador.leer(n)
+        self._emitir()
+
+    def escritos(self, n: int):
+        with self._lock:
+            self.bytes_escritos += n
+
+    def saltado(self, archivo, leidos: int, escritos: int = 0):
+        """Cuenta como hecho un archivo que no hace falta leer (ya estaba en el backup al reanudar)."""
+        with self._lock:
+            self.bytes_leidos += leidos
+            self.bytes_escritos += escritos
+        self.archivo_terminado(archivo)
+
+    def archivo_terminado(self, archivo=None):
+        with self._lock:
+            self.archivos_hechos += 1
+            hechos = self.archivos_hechos
+            if archivo is not None:
+                self.archivo_actual = archivo
+        if self.progreso_callback:
+            self.progreso_callback(hechos, total_conocido(self.archivos))
+        self._emitir()
+
+    def terminar(self):
+        self._emitir(final=True)
+
+    def _emitir(self, final: bool = False):
+        if not self.eventos_callback:
+            return
+        ahora = time.monotonic()
+        with self._lock:
+            if not final and ahora - self._ultimo_evento < self.intervalo:
+                return
+            self._ultimo_evento = ahora
+            self.medidor.actualizar(self.bytes_leidos)
+            evento = EventoProgreso(
+                archivos_hechos=self.archivos_hechos,
+                archivos_total=self.archivos_hechos if final else total_conocido(self.archivos),
+                bytes_leidos=self.bytes_leidos,
+                bytes_total=self.bytes_leidos if final else self._bytes_total(),
+                bytes_escritos=self.bytes_escritos,
+                archivo_actual=self.archivo_actual,
+                velocidad_instantanea=self.medidor.instantanea,
+                velocidad_suavizada=self.medidor.suavizada,
+                transcurrido=ahora - self.medidor.inicio,
+                final=final,
+            )
+        self.eventos_callback(evento)
+
+
+def _tamano(ruta) -> int:
+    try:
+        return os.path.getsize(ruta)
+    except OSError:
+        return 0
@@ -0,0 +1,586 @@
+import fnmatch
+import hashlib
+import io
+import mmap
+import os
+import random
+import re
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+import pyzipper
+from pyzipper.zipfile_aes import AESZipInfo
+
+from core.integrity import ALGORITMO_HASH, MAGIA_ZSTD, MIEMBRO_HASHES, TAMANO_LECTURA, _leer_manifiesto
+
+MAGIA_INDICE = b"BTIX"
+VERSION_INDICE = 1
+EXTENSION_INDICE = ".idx"
+
+# Cabecera: magia, versión, miembros, tamaño del ZIP, mtime_ns del ZIP (0 en Drive), inicio de la tabla de nombres
+_CABECERA = struct.Struct("<4sB3xIQQQ")
+# Miembro: nombre (offset, longitud), cabecera local, tamaños, CRC, método, flags, fecha DOS, AES (fuerza, versión), SHA-256
+_MIEMBRO = struct.Struct("<QHQQQIHHIBB32s")
+_SIN_HASH = bytes(32)
+
+URL_DESCARGA = "https://www.googleapis.com/drive/v3/files/{}?alt=media"
+CARPETA_INDICES_DRIVE = "indices"
+
+# Cada petición Range pide al menos esto (o lo que quede del tramo)
+BLOQUE_REMOTO = 4 * 1024 * 1024
+# Al indexar desde Drive se pide de una vez este final del ZIP (directorio central y hashes)
+FINAL_REMOTO = 1024 * 1024
+# Bytes sin pedir entre dos miembros que sale más barato descargar que abrir otra petición
+HUECO_MAX = 256 * 1024
+# Tamaño máximo de un tramo: los tramos se reparten entre los hilos
+TAMANO_TRAMO = 64 * 1024 * 1024
+# El directorio central no dice cuánto ocupa el extra de la cabecera local (AES, ZIP64...)
+MARGEN_CABECERA = 30 + 1024
+
+_COMODINES = re.compile(r"[*?\[]")
+
+
+def ruta_indice(ruta_zip: Path) -> Path:
+    """El índice vive junto al backup: backup.zip -> backup.zip.idx"""
+    return ruta_zip.with_name(ruta_zip.name + EXTENSION_INDICE)
+
+
+def _fecha_dos(fecha: tuple) -> int:
+    anio, mes, dia, hora, minuto, segundo = fecha
+    return (anio - 1980) << 25 | mes << 21 | dia << 16 | hora << 11 | minuto << 5 | segundo // 2
+
+
+def _desde_fecha_dos(valor: int) -> tuple:
+    return (
+        (valor >> 25) + 1980, (valor >> 21) & 0xF, (valor >> 16) & 0x1F,
+        (valor >> 11) & 0x1F, (valor >> 5) & 0x3F, (valor & 0x1F) * 2,
+    )
+
+
+def escribir_indice(zipf, destino: Path, tamano_zip: int, marca: int = 0) -> int:
+    """
+    Guarda el índice de restauración de un ZIP ya abierto (con la contraseña
+    puesta si está cifrado, para leer MIEMBRO_HASHES).
+
+    Los miembros se ordenan por ruta: cada uno ocupa un registro de tamaño
+    fijo y los nombres van en una tabla al final, así que el índice se
+    consulta con mmap y búsqueda binaria sin cargarlo entero. Devuelve el
+    número de miembros indexados.
+    """
+    hashes = {}
+    if MIEMBRO_HASHES in zipf.NameToInfo:
+        try:
+            hashes = _leer_manifiesto(zipf.read(MIEMBRO_HASHES))
+        except (RuntimeError, ValueError, pyzipper.BadZipFile):
+            # Sin contraseña no se lee el manifiesto: el índice queda sin hashes
+            hashes = {}
+
+    # NameToInfo guarda el último miembro de cada nombre (ZIP con archivos añadidos)
+    miembros = sorted(
+        (i for i in zipf.NameToInfo.values() if not i.is_dir() and i.filename != MIEMBRO_HASHES),
+        key=lambda i: i.filename.encode("utf-8"),
+    )
+    registros = []
+    nombres = bytearray()
+    for info in miembros:
+        nombre = info.filename.encode("utf-8")
+        esperado = hashes.get(info.filename)
+        registros.append(_MIEMBRO.pack(
+            len(nombres), len(nombre), info.header_offset, info.compress_size, info.file_size, info.CRC,
+            info.compress_type, info.flag_bits, _fecha_dos(info.date_time),
+            getattr(info, "wz_aes_strength", None) or 0, getattr(info, "wz_aes_version", None) or 0,
+            bytes.fromhex(esperado[ALGORITMO_HASH]) if esperado else _SIN_HASH,
+        ))
+        nombres += nombre
+
+    destino = Path(destino)
+    temporal = destino.with_name(destino.name + ".tmp")
+    with open(temporal, "wb") as f:
+        inicio_nombres = _CABECERA.size + len(registros) * _MIEMBRO.size
+        f.write(_CABECERA.pack(MAGIA_INDICE, VERSION_INDICE, len(registros), tamano_zip, marca, inicio_nombres))
+        f.write(b"".join(registros))
+        f.write(nombres)
+    os.replace(temporal, destino)
+    return len(registros)
+
+
+class IndiceRestauracion:
+    """
+    Índice de restauración de un ZIP leído con mmap (ver escribir_indice).
+
+    Da la ruta, la posición, los tamaños y el SHA-256 de cada miembro sin
+    tocar el ZIP: con él se abren directamente los miembros pedidos, aunque
+    el directorio central tenga millones de entradas.
+    """
+
+    def __init__(self, ruta: Path):
+        self.ruta = Path(ruta)
+        with open(self.ruta, "rb") as f:
+            if os.fstat(f.fileno()).st_size < _CABECERA.size:
+                raise RuntimeError(f"Índice de restauración no válido: {self.ruta}")
+            self._mapa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magia, version, self._total, self.tamano_zip, self.marca, self._nombres = _CABECERA.unpack_from(self._mapa)
+        if magia != MAGIA_INDICE or version != VERSION_INDICE:
+            self.cerrar()
+            raise RuntimeError(f"Índice de restauración no válido o de otra versión: {self.ruta}")
+
+    def __len__(self) -> int:
+        return self._total
+
+    def _registro(self, i: int) -> tuple:
+        return _MIEMBRO.unpack_from(self._mapa, _CABECERA.size + i * _MIEMBRO.size)
+
+    def _clave(self, i: int) -> bytes:
+        offset, longitud = struct.unpack_from("<QH", self._mapa, _CABECERA.size + i * _MIEMBRO.size)
+        inicio = self._nombres + offset
+        return self._mapa[inicio:inicio + longitud]
+
+    def nombre(self, i: int) -> str:
+        return self._clave(i).decode("utf-8")
+
+    def info(self, i: int) -> AESZipInfo:
+        """ZipInfo del miembro i, suficiente para abrirlo con zipfile."""
+        _, _, cabecera, comprimido, tamano, crc, metodo, flags, fecha, fuerza, version, _ = self._registro(i)
+        info = AESZipInfo(self.nombre(i), _desde_fecha_dos(fecha))
+        info.header_offset = cabecera
+        info.compress_size = comprimido
+        info.file_size = tamano
+        info.CRC = crc
+        info.compress_type = metodo
+        info.flag_bits = flags
+        if version:
+            info.wz_aes_strength = fuerza
+            info.wz_aes_version = version
+        return info
+
+    def sha256(self, i: int):
+        """Hash guardado al crear el backup, o None si el ZIP no lo tenía."""
+        valor = self._registro(i)[-1]
+        return None if valor == _SIN_HASH else valor.hex()
+
+    def _primero_desde(self, clave: bytes) -> int:
+        # Primer miembro con nombre >= clave
+        bajo, alto = 0, self._total
+        while bajo < alto:
+            medio = (bajo + alto) // 2
+            if self._clave(medio) < clave:
+                bajo = medio + 1
+            else:
+                alto = medio
+        return bajo
+
+    def _con_prefijo(self, prefijo: str):
+        clave = prefijo.encode("utf-8")
+        i = self._primero_desde(clave)
+        while i < self._total and self._clave(i).startswith(clave):
+            yield i
+            i += 1
+
+    def buscar(self, nombre: str):
+        """Posición del miembro `nombre`, o None."""
+        i = self._primero_desde(nombre.encode("utf-8"))
+        return i if i < self._total and self.nombre(i) == nombre else None
+
+    def seleccionar(self, patrones=None) -> list:
+        """
+        Posiciones de los miembros que coinciden con algún patrón glob
+        (fnmatchcase; None selecciona todo). Un patrón sin comodines también
+        selecciona lo que hay dentro si es una carpeta ("docs" o "docs/").
+        Solo se recorre el rango de nombres que empieza por la parte fija del
+        patrón.
+        """
+        if patrones is None:
+            return list(range(self._total))
+        elegidos = set()
+        for patron in patrones:
+            comodin = _COMODINES.search(patron)
+            if comodin is None:
+                carpeta = patron.rstrip("/") + "/"
+                elegidos.update(
+                    i for i in self._con_prefijo(patron.rstrip("/"))
+                    if self.nombre(i) == patron or self.nombre(i).startswith(carpeta)
+                )
+                continue
+            elegidos.update(
+                i for i in self._con_prefijo(patron[:comodin.start()]) if fnmatch.fnmatchcase(self.nombre(i), patron)
+            )
+        return sorted(elegidos)
+
+    def cerrar(self):
+        self._mapa.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+
+def _comprobar_zip(ruta: Path):
+    from core.encryption import es_contenedor
+
+    if es_contenedor(ruta):
+        raise ValueError("El contenedor cifrado no admite restauración selectiva: descífralo antes con 'descifrar'.")
+    with open(ruta, "rb") as f:
+        if f.read(len(MAGIA_ZSTD)) == MAGIA_ZSTD:
+            raise ValueError("Un .tar.zst solo se lee en orden: no admite restauración selectiva.")
+
+
+def indice_local(ruta_zip: Path, password: str = None) -> IndiceRestauracion:
+    """
+    Abre el índice de un ZIP en disco y lo (re)construye si falta o si el ZIP
+    ha cambiado desde que se creó (tamaño o fecha de modificación).
+    """
+    ruta_zip = Path(ruta_zip)
+    _comprobar_zip(ruta_zip)
+    estado = ruta_zip.stat()
+    ruta = ruta_indice(ruta_zip)
+    if ruta.exists():
+        try:
+            indice = IndiceRestauracion(ruta)
+        except RuntimeError:
+            indice = None
+        if indice is not None:
+            if (indice.tamano_zip, indice.marca) == (estado.st_size, estado.st_mtime_ns):
+                return indice
+            indice.cerrar()
+
+    with pyzipper.AESZipFile(ruta_zip) as zipf:
+        if password:
+            zipf.setpassword(password.encode("utf-8"))
+        escribir_indice(zipf, ruta, estado.st_size, estado.st_mtime_ns)
+    return IndiceRestauracion(ruta)
+
+
+# -------------------- Drive --------------------
+
+class ErrorDescarga(RuntimeError):
+    pass
+
+
+class ArchivoRemoto(io.RawIOBase):
+    """
+    Archivo de Drive de solo lectura y posicionable que descarga con
+    peticiones HTTP Range solo los bytes que se leen.
+
+    Cada petición trae al menos `bloque` bytes (sin pasar de `limite` si se
+    indica) y el último bloque queda en memoria. Sin `tamano`, la primera
+    consulta pide el final del archivo, donde zipfile busca el directorio
+    central. Los errores de red y los 5xx/429 se reintentan con backoff.
+    `http` tiene la interfaz de httplib2 y no se comparte entre hilos.
+    """
+
+    def __init__(self, http, url: str, tamano: int = None, bloque: int = BLOQUE_REMOTO, reintentos: int = None, espera_base: float = None):
+        from core.drive_upload import ESPERA_BASE, REINTENTOS
+
+        self._http = http
+        self.url = url
+        self._tamano = tamano
+        self.bloque = bloque
+        self.reintentos = REINTENTOS if reintentos is None else reintentos
+        self.espera_base = ESPERA_BASE if espera_base is None else espera_base
+        self.limite = None
+        self.descargados = 0
+        self.peticiones = 0
+        self._pos = 0
+        self._inicio_bloque = 0
+        self._datos = b""
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    @property
+    def tamano(self) -> int:
+        if self._tamano is None:
+            # Un sufijo "bytes=-N" da el tamaño total y deja en memoria el final del ZIP
+            self._pedir(f"bytes=-{FINAL_REMOTO}")
+        return self._tamano
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.tamano
+        if offset < 0:
+            raise ValueError("Posición negativa")
+        self._pos = offset
+        return self._pos
+
+    def _pedir(self, rango: str):
+        from core.drive_upload import CODIGOS_REINTENTABLES
+
+        import httplib2
+
+        intentos = 0
+        while True:
+            try:
+                resp, contenido = self._http.request(self.url, "GET", headers={"Range": rango})
+                if resp.status in CODIGOS_REINTENTABLES:
+                    raise ErrorDescarga(f"Drive respondió {resp.status}")
+            except (ErrorDescarga, OSError, httplib2.HttpLib2Error) as e:
+                intentos += 1
+                if intentos > self.reintentos:
+                    raise ErrorDescarga(f"La descarga falló tras {self.reintentos} reintentos: {e}") from e
+                espera = min(60.0, self.espera_base * 2 ** (intentos - 1))
+                time.sleep(espera * random.uniform(0.5, 1.0))
+                continue
+            break
+
+        self.peticiones += 1
+        if resp.status == 416:
+            # Rango fuera del archivo (p. ej. archivo vacío)
+            self._inicio_bloque, self._datos = self._pos, b""
+            return
+        if resp.status == 200:
+            # El servidor ignoró el Range y mandó el archivo entero
+            self._tamano = len(contenido)
+            self._inicio_bloque, self._datos = 0, contenido
+        elif resp.status == 206:
+            rango_respuesta = re.match(r"bytes (\d+)-(\d+)/(\d+)", resp.get("content-range", ""))
+            if not rango_respuesta:
+                raise ErrorDescarga(f"Respuesta parcial sin Content-Range: {rango}")
+            total = int(rango_respuesta[3])
+            if self._tamano is not None and total != self._tamano:
+                raise ErrorDescarga("El archivo de Drive no coincide con su índice: ha cambiado desde que se indexó")
+            self._tamano = total
+            self._inicio_bloque, self._datos = int(rango_respuesta[1]), contenido
+        else:
+            raise ErrorDescarga(f"Drive respondió {resp.status}: {contenido[:200]!r}")
+        self.descargados += len(contenido)
+
+    def readinto(self, b) -> int:
+        vista = memoryview(b)
+        leidos = 0
+        while leidos < len(vista):
+            desplazamiento = self._pos - self._inicio_bloque
+            if not 0 <= desplazamiento < len(self._datos):
+                if self._tamano is not None and self._pos >= self._tamano:
+                    break
+                fin = self._pos + max(len(vista) - leidos, self.bloque)
+                if self.limite is not None and self.limite > self._pos:
+                    fin = min(fin, max(self.limite, self._pos + len(vista) - leidos))
+                if self._tamano is not None:
+                    fin = min(fin, self._tamano)
+                self._pedir(f"bytes={self._pos}-{fin - 1}")
+                desplazamiento = self._pos - self._inicio_bloque
+                if not 0 <= desplazamiento < len(self._datos):
+                    break
+            n = min(len(vista) - leidos, len(self._datos) - desplazamiento)
+            vista[leidos:leidos + n] = self._datos[desplazamiento:desplazamiento + n]
+            leidos += n
+            self._pos += n
+        return leidos
+
+
+class OrigenDrive:
+    """
+    Backup en Drive para restaurar por rangos.
+
+    `fabrica_http()` crea un cliente con la interfaz de httplib2 y se llama
+    en cada hilo que abre el archivo (como en MotorSubida). `url_descarga`
+    (con "{}" en lugar del ID) se puede cambiar para probar contra un
+    servidor local.
+    """
+
+    def __init__(self, fabrica_http, drive_id: str, url_descarga: str = URL_DESCARGA):
+        self.fabrica_http = fabrica_http
+        self.drive_id = drive_id
+        self.url = url_descarga.format(drive_id)
+        self._lock = threading.Lock()
+        self._archivos = []
+
+    @classmethod
+    def desde_servicio(cls, service, drive_id: str, **kwargs) -> "OrigenDrive":
+        from core.drive_auth import http_del_hilo
+
+        credenciales = service._http.credentials
+        return cls(lambda: http_del_hilo(credenciales), drive_id, **kwargs)
+
+    def abrir(self, tamano: int = None) -> ArchivoRemoto:
+        archivo = ArchivoRemoto(self.fabrica_http(), self.url, tamano)
+        with self._lock:
+            self._archivos.append(archivo)
+        return archivo
+
+    @property
+    def descargados(self) -> int:
+        """Bytes descargados hasta ahora por todos los archivos abiertos."""
+        with self._lock:
+            return sum(a.descargados for a in self._archivos)
+
+    @property
+    def peticiones(self) -> int:
+        with self._lock:
+            return sum(a.peticiones for a in self._archivos)
+
+
+def indice_drive(origen: OrigenDrive, password: str = None, carpeta: Path = None) -> IndiceRestauracion:
+    """
+    Índice de un backup de Drive, guardado en `carpeta` (por defecto
+    APP_DIR/indices) con el ID del archivo como nombre. Si no existe se
+    construye descargando solo el final del ZIP: el directorio central y el
+    manifiesto de hashes.
+    """
+    if carpeta is None:
+        from core.drive_auth import APP_DIR
+
+        carpeta = APP_DIR / CARPETA_INDICES_DRIVE
+    ruta = Path(carpeta) / f"{origen.drive_id}{EXTENSION_INDICE}"
+    if ruta.exists():
+        try:
+            return IndiceRestauracion(ruta)
+        except RuntimeError:
+            pass
+
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+    with origen.abrir() as archivo:
+        try:
+            zipf = pyzipper.AESZipFile(archivo)
+        except pyzipper.BadZipFile:
+            raise ValueError("El archivo de Drive no es un ZIP: no admite restauración selectiva.") from None
+        with zipf:
+            if password:
+                zipf.setpassword(password.encode("utf-8"))
+            escribir_indice(zipf, ruta, archivo.tamano)
+    return IndiceRestauracion(ruta)
+
+
+# -------------------- Extracción --------------------
+
+class _ZipSinDirectorio(pyzipper.AESZipFile):
+    """AESZipFile que no lee el directorio central: los miembros vienen del índice."""
+
+    def _RealGetContents(self):
+        pass
+
+
+def _tramos(indice: IndiceRestauracion, seleccion: list) -> list:
+    """
+    Agrupa los miembros pedidos en tramos contiguos del ZIP: [(inicio, fin, [(i, info)])].
+
+    Dentro de un tramo los miembros se leen en orden, así que en Drive cada
+    tramo se descarga con unas pocas peticiones grandes en lugar de una por
+    archivo; los huecos pequeños entre miembros se descargan sin más.
+    """
+    miembros = sorted(((i, indice.info(i)) for i in seleccion), key=lambda m: m[1].header_offset)
+    tramos = []
+    for i, info in miembros:
+        inicio = info.header_offset
+        fin = inicio + MARGEN_CABECERA + len(info.filename.encode("utf-8")) + info.compress_size
+        if tramos and inicio - tramos[-1][1] <= HUECO_MAX and fin - tramos[-1][0] <= TAMANO_TRAMO:
+            tramos[-1][1] = max(tramos[-1][1], fin)
+            tramos[-1][2].append((i, info))
+        else:
+            tramos.append([inicio, fin, [(i, info)]])
+    return tramos
+
+
+def _repartir_tramos(tramos: list, grupos: int) -> list:
+    repartos = [[] for _ in range(grupos)]
+    cargas = [0] * grupos
+    for tramo in sorted(tramos, key=lambda t: t[1] - t[0], reverse=True):
+        menor = cargas.index(min(cargas))
+        repartos[menor].append(tramo)
+        cargas[menor] += tramo[1] - tramo[0]
+    # Cada hilo recorre sus tramos en orden del ZIP
+    return [sorted(r) for r in repartos if r]
+
+
+def _marca_tiempo(fecha: tuple) -> float:
+    return time.mktime(fecha + (0, 0, -1))
+
+
+def restaurar_zip(
+    indice: IndiceRestauracion,
+    abrir,
+    carpeta_destino: Path,
+    patrones=None,
+    password: str = None,
+    workers: int = None,
+    progreso_callback=None,
+) -> tuple:
+    """
+    Restaura en `carpeta_destino` los miembros del índice que coinciden con
+    `patrones` (glob; None restaura todo), en varios hilos.
+
+    `abrir()` devuelve un archivo binario posicionable con el ZIP (en disco o
+    un ArchivoRemoto de Drive) y cada hilo abre el suyo. Los miembros se
+    abren con la posición guardada en el índice, sin leer el directorio
+    central, y cada archivo restaurado se compara con su SHA-256 del índice.
+    Conserva la fecha de modificación. `progreso_callback(hechos, total)`.
+
+    Devuelve (archivos_restaurados, errores).
+    """
+    seleccion = indice.seleccionar(patrones)
+    if not seleccion:
+        raise ValueError("Ningún archivo del backup coincide con los patrones indicados.")
+
+    carpeta_destino = Path(carpeta_destino)
+    carpeta_destino.mkdir(parents=True, exist_ok=True)
+    destino_real = carpeta_destino.resolve()
+    pwd = password.encode("utf-8") if password else None
+
+    errores = []
+    hechos = [0]
+    lock = threading.Lock()
+
+    @contextmanager
+    def abrir_zip():
+        # zipfile no cierra los archivos que recibe ya abiertos
+        with abrir() as f, _ZipSinDirectorio(f) as zipf:
+            if pwd:
+                zipf.setpassword(pwd)
+            yield f, zipf
+
+    def restaurar_miembro(zipf, i, info):
+        salida = (carpeta_destino / info.filename).resolve()
+        # Nunca escribir fuera de la carpeta destino
+        if destino_real not in salida.parents:
+            return f"{info.filename}: ruta no válida en el backup"
+        salida.parent.mkdir(parents=True, exist_ok=True)
+        h = hashlib.new(ALGORITMO_HASH)
+        try:
+            with zipf.open(info) as origen, open(salida, "wb") as f:
+                for trozo in iter(lambda: origen.read(TAMANO_LECTURA), b""):
+                    f.write(trozo)
+                    h.update(trozo)
+        except (RuntimeError, ValueError, OSError, pyzipper.BadZipFile) as e:
+            # Contraseña incorrecta, CRC/HMAC erróneo, datos truncados o fallo de red
+            salida.unlink(missing_ok=True)
+            return f"{info.filename}: {e}"
+        esperado = indice.sha256(i)
+        if esperado is not None and h.hexdigest() != esperado:
+            return f"{info.filename}: el contenido no coincide con el original"
+        marca = _marca_tiempo(info.date_time)
+        os.utime(salida, (marca, marca))
+        return None
+
+    def restaurar_grupo(grupo):
+        with abrir_zip() as (archivo, zipf):
+            for _, fin, miembros in grupo:
+                if isinstance(archivo, ArchivoRemoto):
+                    archivo.limite = fin
+                for i, info in miembros:
+                    error = restaurar_miembro(zipf, i, info)
+                    with lock:
+                        if error:
+                            errores.append(error)
+                        hechos[0] += 1
+                        if progreso_callback:
+                            progreso_callback(hechos[0], len(seleccion))
+
+    workers = workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(restaurar_grupo, _repartir_tramos(_tramos(indice, seleccion), workers)))
+
+    return len(seleccion) - len(errores), errores
@@ -0,0 +1,64 @@
+from datetime import datetime
+
+PERIODOS = ("diarios", "semanales", "mensuales")
+FORMATO_MARCA = "%Y%m%d-%H%M%S"
+
+
+def marca_backup(fecha: datetime = None) -> str:
+    """Identifica una ejecución: todos sus archivos (volúmenes e índice) comparten la marca."""
+    return (fecha or datetime.now()).strftime(FORMATO_MARCA)
+
+
+def _clave_periodo(fecha: datetime, periodo: str):
+    if periodo == "diarios":
+        return fecha.date()
+    if periodo == "semanales":
+        return fecha.isocalendar()[:2]
+    return fecha.year, fecha.month
+
+
+class PoliticaRetencion:
+    """
+    Qué backups conservar: el más reciente de cada uno de los últimos
+    `diarios` días, `semanales` semanas y `mensuales` meses que tengan algún
+    backup (esquema abuelo-padre-hijo). Un mismo backup puede contar para
+    varios periodos. El más reciente se conserva siempre.
+    """
+
+    def __init__(self, diarios: int = 7, semanales: int = 4, mensuales: int = 12):
+        for nombre, valor in zip(PERIODOS, (diarios, semanales, mensuales)):
+            if valor < 0:
+                raise ValueError(f"La retención de {nombre} no puede ser negativa")
+        self.diarios = diarios
+        self.semanales = semanales
+        self.mensuales = mensuales
+
+    @classmethod
+    def desde_dict(cls, datos: dict) -> "PoliticaRetencion":
+        desconocidas = set(datos) - set(PERIODOS)
+        if desconocidas:
+            raise ValueError(f"Opciones de retención desconocidas: {', '.join(sorted(desconocidas))}")
+        return cls(**datos)
+
+    def aplicar(self, backups: dict) -> tuple:
+        """
+        `backups` es {clave: fecha}. Devuelve (conservar, caducados), dos
+        listas de claves ordenadas de la más reciente a la más antigua.
+        """
+        ordenados = sorted(backups, key=backups.get, reverse=True)
+        conservar = set(ordenados[:1])
+        for periodo in PERIODOS:
+            cantidad = getattr(self, periodo)
+            vistos = set()
+            for clave in ordenados:
+                marca = _clave_periodo(backups[clave], periodo)
+                if marca in vistos:
+                    continue
+                if len(vistos) == cantidad:
+                    break
+                vistos.add(marca)
+                conservar.add(clave)
+        return [c for c in ordenados if c in conservar], [c for c in ordenados if c not in conservar]
+
+    def resumen(self) -> str:
+        return f"{self.diarios} diarios, {self.semanales} semanales, {self.mensuales} mensuales"
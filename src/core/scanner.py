@@ -0,0 +1,152 @@
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+VERSION_INDICE = 2
+
+# El escaneo es casi todo espera de E/S (sobre todo en unidades de red),
+# así que se usan más hilos que núcleos.
+WORKERS_ESCANEO = 16
+# Listados en curso o esperando a que se consuman, por hilo: sin tope, con
+# miles de carpetas el escaneo iría muy por delante del compresor y tendría
+# en memoria los nombres de todos sus archivos
+LISTADOS_POR_WORKER = 2
+
+
+def total_conocido(archivos) -> int:
+    """Número de archivos de una lista o, si es un Escaneo en curso, los encontrados hasta ahora."""
+    try:
+        return len(archivos)
+    except TypeError:
+        return getattr(archivos, "encontrados", 0)
+
+
+class Escaneo:
+    """
+    Recorre una carpeta con os.scandir en varios hilos y entrega los archivos
+    según se descubren, sin esperar a tener la lista completa.
+
+    Con `ruta_indice`, guarda el contenido de cada carpeta junto a su mtime.
+    En la siguiente pasada, las carpetas cuyo mtime no cambió (no se añadió,
+    borró ni renombró nada dentro) no se vuelven a listar.
+
+    `encontrados` y `bytes_encontrados` crecen durante la iteración; sirven
+    como totales estimados para el progreso. Los tamaños de las carpetas
+    reutilizadas son los de la pasada anterior: solo son una estimación.
+    """
+
+    def __init__(self, carpeta_origen: Path, filtro=None, ruta_indice: Path = None, workers: int = None):
+        self.carpeta_origen = Path(carpeta_origen)
+        self.filtro = filtro
+        self.ruta_indice = ruta_indice
+        self.workers = workers or WORKERS_ESCANEO
+        self.encontrados = 0
+        self.bytes_encontrados = 0
+        self.carpetas_reutilizadas = 0
+        self.carpetas_listadas = 0
+        self.terminado = False
+
+    # -------------------- Índice en disco --------------------
+
+    def _cargar_indice(self) -> dict:
+        if not self.ruta_indice or not Path(self.ruta_indice).exists():
+            return {}
+        try:
+            with open(self.ruta_indice, "r", encoding="utf-8") as f:
+                indice = json.load(f)
+        except (OSError, ValueError):
+            # Un índice dañado solo obliga a escanear todo de nuevo
+            return {}
+        if indice.get("version") != VERSION_INDICE or indice.get("raiz") != str(self.carpeta_origen):
+            return {}
+        return indice["carpetas"]
+
+    def _guardar_indice(self, carpetas: dict):
+        if not self.ruta_indice:
+            return
+        tmp = Path(self.ruta_indice).with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": VERSION_INDICE, "raiz": str(self.carpeta_origen), "carpetas": carpetas}, f)
+        os.replace(tmp, self.ruta_indice)
+
+    # -------------------- Recorrido --------------------
+
+    @staticmethod
+    def _listar(ruta: str, rel: str, previo: dict):
+        try:
+            mtime = os.stat(ruta).st_mtime_ns
+        except OSError:
+            return rel, None, [], [], [], False
+
+        cache = previo.get(rel)
+        if cache and cache["mtime"] == mtime:
+            return rel, mtime, cache["archivos"], cache["tamanos"], cache["carpetas"], True
+
+        archivos = []
+        tamanos = []
+        carpetas = []
+        try:
+            with os.scandir(ruta) as it:
+                for entry in it:
+                    # DirEntry trae el tipo del propio listado: sin stat extra.
+                    # Igual que rglob, no se siguen enlaces a carpetas.
+                    if entry.is_dir(follow_symlinks=False):
+                        carpetas.append(entry.name)
+                    elif entry.is_file():
+                        archivos.append(entry.name)
+                        # En Windows el tamaño viene en el listado; en Linux es un stat
+                        try:
+                            tamanos.append(entry.stat().st_size)
+                        except OSError:
+                            tamanos.append(0)
+        except PermissionError:
+            pass
+
+        return rel, mtime, archivos, tamanos, carpetas, False
+
+    def __iter__(self):
+        previo = self._cargar_indice()
+        nuevo = {}
+        raiz = str(self.carpeta_origen)
+
+        max_listados = self.workers * LISTADOS_POR_WORKER
+        por_listar = []
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pendientes = {pool.submit(self._listar, raiz, "", previo)}
+
+            while pendientes or por_listar:
+                while por_listar and len(pendientes) < max_listados:
+                    ruta, rel = por_listar.pop()
+                    pendientes.add(pool.submit(self._listar, ruta, rel, previo))
+                hechos, pendientes = wait(pendientes, return_when=FIRST_COMPLETED)
+
+                for futuro in hechos:
+                    rel, mtime, archivos, tamanos, carpetas, reutilizada = futuro.result()
+                    if mtime is None:
+                        continue
+
+                    if self.ruta_indice:
+                        # Sin índice no se guarda nada: la memoria no crece con el árbol
+                        nuevo[rel] = {"mtime": mtime, "archivos": archivos, "tamanos": tamanos, "carpetas": carpetas}
+                    if reutilizada:
+                        self.carpetas_reutilizadas += 1
+                    else:
+                        self.carpetas_listadas += 1
+
+                    base = os.path.join(raiz, rel) if rel else raiz
+                    por_listar.extend(
+                        (os.path.join(base, nombre), f"{rel}/{nombre}" if rel else nombre) for nombre in carpetas
+                    )
+
+                    for nombre, tamano in zip(archivos, tamanos):
+                        ruta = Path(base, nombre)
+                        if self.filtro and not self.filtro(ruta):
+                            continue
+                        self.encontrados += 1
+                        self.bytes_encontrados += tamano
+                        yield ruta
+
+        self.terminado = True
+        self._guardar_indice(nuevo)
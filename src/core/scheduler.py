@@ -0,0 +1,246 @@
+import heapq
+import json
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from core.checkpoint import BackupInterrumpido
+from core.jobs import TrabajoBackup, ejecutar_trabajo
+from core.throttle import bajar_prioridad, limitador_global
+
+# (mínimo, máximo) de cada campo: minuto, hora, día del mes, mes, día de la semana
+_RANGOS_CRON = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+# Ninguna expresión válida tarda más de unos años en repetirse (29 de febrero)
+_MAX_DIAS_BUSQUEDA = 366 * 5
+
+
+def _parsear_campo(texto: str, minimo: int, maximo: int) -> set:
+    valores = set()
+    for parte in texto.split(","):
+        rango, _, paso = parte.partition("/")
+        paso = int(paso) if paso else 1
+        if paso <= 0:
+            raise ValueError(f"Paso inválido en '{parte}'")
+
+        if rango == "*":
+            inicio, fin = minimo, maximo
+        elif "-" in rango:
+            inicio, fin = (int(v) for v in rango.split("-", 1))
+        else:
+            inicio = int(rango)
+            # "5/15" equivale a "5-max/15", como en cron
+            fin = maximo if paso > 1 else inicio
+
+        if not minimo <= inicio <= fin <= maximo:
+            raise ValueError(f"Valor fuera de rango en '{parte}' ({minimo}-{maximo})")
+        valores.update(range(inicio, fin + 1, paso))
+    return valores
+
+
+class ExpresionCron:
+    """
+    Expresión cron de 5 campos: "minuto hora día-mes mes día-semana".
+
+    Admite `*`, listas (`1,15`), rangos (`1-5`) y pasos (`*/10`, `8-18/2`).
+    El día de la semana va de 0 (domingo) a 6; 7 también es domingo. Como en
+    cron, si se restringen el día del mes y el de la semana basta con que
+    coincida uno de los dos.
+    """
+
+    def __init__(self, texto: str):
+        campos = texto.split()
+        if len(campos) != 5:
+            raise ValueError(f"La expresión cron debe tener 5 campos: '{texto}'")
+
+        try:
+            valores = [_parsear_campo(c, lo, hi) for c, (lo, hi) in zip(campos, _RANGOS_CRON)]
+        except ValueError as e:
+            raise ValueError(f"Expresión cron inválida '{texto}': {e}") from e
+
+        self.texto = texto
+        self.minutos, self.horas, self.dias, self.meses, dias_semana = valores
+        self.dias_semana = {d % 7 for d in dias_semana}
+        self._dia_libre = campos[2] == "*"
+        self._semana_libre = campos[4] == "*"
+
+    def _coincide_dia(self, fecha: datetime) -> bool:
+        en_mes = fecha.day in self.dias
+        # isoweekday: lunes=1 ... domingo=7 -> cron: domingo=0
+        en_semana = fecha.isoweekday() % 7 in self.dias_semana
+        if self._dia_libre or self._semana_libre:
+            return en_mes and en_semana
+        return en_mes or en_semana
+
+    def siguiente(self, desde: datetime) -> datetime:
+        """Primer instante estrictamente posterior a `desde` que cumple la expresión."""
+        fecha = desde.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limite = fecha + timedelta(days=_MAX_DIAS_BUSQUEDA)
+
+        while fecha < limite:
+            if fecha.month not in self.meses:
+                # Salta al día 1 del mes siguiente
+                fecha = (fecha.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+                continue
+            if not self._coincide_dia(fecha):
+                fecha = fecha.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if fecha.hour not in self.horas:
+                fecha = fecha.replace(minute=0) + timedelta(hours=1)
+                continue
+            if fecha.minute not in self.minutos:
+                fecha += timedelta(minutes=1)
+                continue
+            return fecha
+
+        raise ValueError(f"La expresión cron '{self.texto}' nunca se cumple")
+
+
+class Planificador:
+    """
+    Daemon que lanza trabajos de backup según su expresión cron.
+
+    Las próximas ejecuciones se guardan en un heap ordenado por fecha. Como
+    mucho `max_concurrentes` trabajos se ejecutan a la vez; el resto espera
+    en la cola del pool. `jitter_s` retrasa cada ejecución un tiempo
+    aleatorio para que los trabajos con el mismo horario no arranquen todos
+    en el mismo segundo. Si una ejecución sigue en marcha cuando toca la
+    siguiente, esta se omite.
+
+    `limites` configura el limitador global de lectura y subida, con sus
+    franjas horarias (ver core.throttle.Limitador.desde_dict), y con
+    `baja_prioridad` el proceso baja su prioridad de CPU y disco al empezar.
+    """
+
+    def __init__(
+        self,
+        trabajos,
+        max_concurrentes: int = 1,
+        jitter_s: float = 0,
+        log_callback=None,
+        limites: dict = None,
+        baja_prioridad: bool = False,
+    ):
+        if max_concurrentes < 1:
+            raise ValueError("max_concurrentes debe ser al menos 1")
+        self.trabajos = list(trabajos)
+        self.max_concurrentes = max_concurrentes
+        self.jitter_s = jitter_s
+        self.log_callback = log_callback
+        self.baja_prioridad = baja_prioridad
+        if limites:
+            limitador_global().configurar(limites)
+        self._crones = {}
+        for trabajo in self.trabajos:
+            if not trabajo.cron:
+                raise ValueError(f"El trabajo '{trabajo.nombre}' no tiene expresión cron")
+            self._crones[trabajo.nombre] = ExpresionCron(trabajo.cron)
+        self._en_curso = set()
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        # Compartido por los trabajos en curso: parar() los detiene en su próximo punto seguro
+        self._detener = threading.Event()
+
+    @classmethod
+    def desde_config(cls, ruta: Path, log_callback=None) -> "Planificador":
+        """
+        Carga la configuración JSON:
+        {"max_concurrentes": 2, "jitter_s": 60, "baja_prioridad": true, "limites": {...},
+         "trabajos": [{"nombre": ..., "cron": ..., "origen": ...}]}
+        """
+        with open(ruta, "r", encoding="utf-8") as f:
+            config = json.load(f)
+
+        trabajos = [TrabajoBackup.desde_dict(t) for t in config.get("trabajos", [])]
+        if not trabajos:
+            raise ValueError("La configuración no define ningún trabajo")
+        nombres = [t.nombre for t in trabajos]
+        if len(set(nombres)) != len(nombres):
+            raise ValueError("Los nombres de los trabajos deben ser únicos")
+
+        return cls(
+            trabajos,
+            max_concurrentes=config.get("max_concurrentes", 1),
+            jitter_s=config.get("jitter_s", 0),
+            log_callback=log_callback,
+            limites=config.get("limites"),
+            baja_prioridad=config.get("baja_prioridad", False),
+        )
+
+    def log(self, texto: str):
+        if self.log_callback:
+            self.log_callback(texto)
+
+    def _programar(self, heap, trabajo: TrabajoBackup, desde: datetime):
+        cuando = self._crones[trabajo.nombre].siguiente(desde)
+        retraso = random.uniform(0, self.jitter_s) if self.jitter_s else 0
+        # El índice desempata trabajos con la misma fecha sin comparar objetos
+        heapq.heappush(heap, (cuando + timedelta(seconds=retraso), cuando, self.trabajos.index(trabajo), trabajo))
+
+    def _ejecutar(self, trabajo: TrabajoBackup):
+        try:
+            ejecutar_trabajo(trabajo, log_callback=self.log_callback, detener=self._detener)
+        except BackupInterrumpido as e:
+            self.log(f"[{trabajo.nombre}] {e}")
+        except Exception as e:
+            self.log(f"[{trabajo.nombre}] Error: {e}")
+        finally:
+            with self._lock:
+                self._en_curso.discard(trabajo.nombre)
+
+    def ejecutar(self):
+        """Bucle principal; vuelve cuando se llama a parar()."""
+        if self.baja_prioridad:
+            # Antes de crear el pool: los hilos nuevos heredan la prioridad
+            bajadas = bajar_prioridad()
+            self.log(f"Prioridad baja: {', '.join(bajadas) if bajadas else 'no se pudo cambiar'}")
+        limitador = limitador_global()
+        if limitador.franjas or limitador.lectura.tasa or limitador.subida.tasa:
+            self.log(f"Límites de velocidad: {limitador.resumen()} ({len(limitador.franjas)} franjas horarias)")
+        heap = []
+        ahora = datetime.now()
+        for trabajo in self.trabajos:
+            self._programar(heap, trabajo, ahora)
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrentes) as pool:
+            while not self._parar.is_set():
+                lanzar, cuando, _, trabajo = heap[0]
+                espera = (lanzar - datetime.now()).total_seconds()
+                if espera > 0:
+                    # Se despierta como mucho cada minuto por si el reloj cambia
+                    self._parar.wait(min(espera, 60))
+                    continue
+
+                heapq.heappop(heap)
+                with self._lock:
+                    ocupado = trabajo.nombre in self._en_curso
+                    if not ocupado:
+                        self._en_curso.add(trabajo.nombre)
+
+                if ocupado:
+                    self.log(f"[{trabajo.nombre}] Sigue en ejecución; se omite la de las {cuando:%H:%M}")
+                else:
+                    self.log(f"[{trabajo.nombre}] Inicio programado ({cuando:%Y-%m-%d %H:%M})")
+                    pool.submit(self._ejecutar, trabajo)
+
+                self._programar(heap, trabajo, cuando)
+
+            self.log("Deteniendo el planificador; esperando a que los trabajos en curso lleguen a un punto seguro...")
+
+    def parar(self):
+        """Deja de lanzar trabajos y pide a los que están en curso que se detengan (los reanudables, en su próximo punto seguro)."""
+        self._detener.set()
+        self._parar.set()
+
+    def proximas(self, n: int = 5, desde: datetime = None) -> list:
+        """Próximas `n` ejecuciones (sin jitter) de cada trabajo: [(fecha, nombre)]."""
+        desde = desde or datetime.now()
+        resultado = []
+        for trabajo in self.trabajos:
+            fecha = desde
+            for _ in range(n):
+                fecha = self._crones[trabajo.nombre].siguiente(fecha)
+                resultado.append((fecha, trabajo.nombre))
+        return sorted(resultado)[:n]
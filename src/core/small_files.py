@@ -0,0 +1,183 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# Hasta este tamaño un archivo se lee entero en un hilo lector, por adelantado
+LIMITE_PEQUENO = 64 * 1024
+# Leer es casi todo espera de E/S (como el escaneo): más hilos que núcleos
+HILOS_LECTURA = 16
+# Cada tarea de un hilo lector lleva varios archivos: con archivos de pocos
+# bytes, pasar cada uno de un hilo a otro costaría más que leerlo
+ARCHIVOS_POR_LOTE = 32
+# Lotes en vuelo por hilo: con LIMITE_PEQUENO, como mucho 64 MB leídos
+LOTES_POR_HILO = 2
+# Lo escrito en el ZIP se junta hasta este tamaño antes de ir al archivo
+TAMANO_LOTE_ESCRITURA = 1024 * 1024
+
+
+class Prelectura:
+    """Lo que un hilo lector sabe de un archivo: su stat y, si es pequeño, su contenido (si no, None)."""
+
+    __slots__ = ("st", "datos")
+
+    def __init__(self, st, datos):
+        self.st = st
+        self.datos = datos
+
+
+def leer_pequeno(archivo, limite: int = LIMITE_PEQUENO) -> Prelectura:
+    """Un open, un fstat y, si cabe en `limite`, un read del archivo entero."""
+    with open(archivo, "rb") as f:
+        st = os.fstat(f.fileno())
+        if st.st_size > limite:
+            return Prelectura(st, None)
+        datos = f.read(limite + 1)
+    # Creció mientras se leía: se trata como uno grande
+    return Prelectura(st, datos if len(datos) <= limite else None)
+
+
+def _preparar_lote(preparar, lote: list) -> list:
+    resultados = []
+    for archivo in lote:
+        try:
+            resultados.append((preparar(archivo), None))
+        except Exception as e:
+            resultados.append((None, e))
+    return resultados
+
+
+def por_adelantado(archivos, preparar=leer_pequeno, hilos: int = HILOS_LECTURA, por_lote: int = ARCHIVOS_POR_LOTE):
+    """
+    Recorre `archivos` devolviendo (archivo, preparar(archivo)) en el mismo
+    orden, con `preparar` ejecutándose en `hilos` hilos por delante del
+    consumidor, en tareas de `por_lote` archivos. Así la latencia de abrir
+    y leer miles de archivos pequeños se solapa en vez de sumarse. Como
+    mucho hay hilos * LOTES_POR_HILO lotes en vuelo. Un error de `preparar`
+    sale al llegar a su archivo, como si se hubiera leído en el hilo que
+    consume.
+    """
+    ventana = hilos * LOTES_POR_HILO
+    en_vuelo = deque()
+
+    def entregar():
+        lote, futuro = en_vuelo.popleft()
+        for archivo, (valor, error) in zip(lote, futuro.result()):
+            if error is not None:
+                raise error
+            yield archivo, valor
+
+    with ThreadPoolExecutor(max_workers=hilos) as pool:
+        try:
+            lote = []
+            for archivo in archivos:
+                lote.append(archivo)
+                if len(lote) < por_lote:
+                    continue
+                en_vuelo.append((lote, pool.submit(_preparar_lote, preparar, lote)))
+                lote = []
+                if len(en_vuelo) >= ventana:
+                    yield from entregar()
+            if lote:
+                en_vuelo.append((lote, pool.submit(_preparar_lote, preparar, lote)))
+            while en_vuelo:
+                yield from entregar()
+        finally:
+            # Si el consumidor para antes (error, BackupInterrumpido) no se leen los que faltan
+            for _, futuro in en_vuelo:
+                futuro.cancel()
+
+
+def zipinfo_desde_stat(zipinfo_cls, arcname: str, st):
+    """Igual que ZipInfo.from_file para un archivo regular, pero con un stat que ya se tiene."""
+    zinfo = zipinfo_cls(arcname, time.localtime(st.st_mtime)[0:6])
+    zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+    zinfo.file_size = st.st_size
+    return zinfo
+
+
+class LoteEscritura:
+    """
+    Sustituye a `zipf.fp` mientras se escriben muchos miembros pequeños.
+
+    Por cada miembro zipfile escribe la cabecera local, los datos y, en un
+    archivo posicionable, vuelve atrás a reescribir la cabecera con el CRC y
+    los tamaños: al menos cuatro llamadas al sistema y dos seeks. Aquí todo
+    eso ocurre en un buffer en memoria, que va al archivo real de una vez
+    cada `tamano` bytes. Solo lo usa el hilo que escribe el ZIP.
+    """
+
+    def __init__(self, fp, tamano: int = TAMANO_LOTE_ESCRITURA):
+        self._fp = fp
+        self._tamano = tamano
+        # Posición en el archivo real del primer byte del buffer
+        self._base = fp.tell()
+        self._buffer = bytearray()
+        self._pos = self._base
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, pos: int, whence: int = 0) -> int:
+        if whence == 1:
+            pos += self._pos
+        elif whence == 2:
+            pos += self._base + len(self._buffer)
+        self._pos = pos
+        return pos
+
+    def write(self, datos) -> int:
+        n = len(datos)
+        fin = self._base + len(self._buffer)
+        if self._pos == fin:
+            if len(self._buffer) + n > self._tamano:
+                self._volcar()
+                if n >= self._tamano:
+                    # Un bloque grande va directo: copiarlo al buffer no ahorra nada
+                    self._fp.write(datos)
+                    self._base += n
+                    self._pos = self._base
+                    return n
+            self._buffer += datos
+        elif self._pos >= self._base:
+            # Cabecera reescrita dentro del buffer
+            inicio = self._pos - self._base
+            self._buffer[inicio:inicio + n] = datos
+        else:
+            # Cabecera de un miembro grande que ya pasó al archivo
+            self._volcar()
+            self._fp.seek(self._pos)
+            self._fp.write(datos)
+            self._fp.seek(self._base)
+        self._pos += n
+        return n
+
+    def _volcar(self):
+        if self._buffer:
+            self._fp.write(self._buffer)
+            self._base += len(self._buffer)
+            self._buffer = bytearray()
+
+    def flush(self):
+        self._volcar()
+        self._fp.flush()
+
+    def fileno(self) -> int:
+        return self._fp.fileno()
+
+    def seekable(self) -> bool:
+        return self._fp.seekable()
+
+
+@contextmanager
+def escritura_por_lotes(zipf, tamano: int = TAMANO_LOTE_ESCRITURA):
+    """Con zipf.fp sustituido por un LoteEscritura; al salir se vuelca y se restaura."""
+    original = zipf.fp
+    lote = LoteEscritura(original, tamano)
+    zipf.fp = lote
+    try:
+        yield lote
+    finally:
+        zipf.fp = original
+        lote._volcar()
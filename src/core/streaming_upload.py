@@ -0,0 +1,263 @@
+import hashlib
+import io
+import queue
+import threading
+
+from googleapiclient.http import MediaUpload
+
+from core.backup_engine import crear_backup, obtener_codec
+from core.drive_upload import CHUNK_POR_DEFECTO, MULTIPLO_CHUNK, REINTENTOS, comprobar_md5
+from core.throttle import limitador_global
+
+
+class SubidaCancelada(Exception):
+    pass
+
+
+class TuberiaAcotada:
+    """
+    Tubería en memoria entre el compresor (escribe) y la subida (lee).
+
+    Se comporta como un archivo de solo escritura no posicionable, así que
+    zipfile/pyzipper escriben descriptores de datos en lugar de volver atrás.
+    La cola tiene un tamaño máximo: si la red va más lenta que la compresión,
+    el compresor se bloquea en lugar de acumular el ZIP entero en memoria.
+    """
+
+    def __init__(self, max_bloques: int = 16, tamano_bloque: int = 1024 * 1024):
+        self._cola = queue.Queue(maxsize=max_bloques)
+        self._tamano_bloque = tamano_bloque
+        self._acumulado = bytearray()
+        self._pendiente = b""
+        self._fin = False
+        self._error = None
+        self._cancelada = threading.Event()
+        self.bytes_escritos = 0
+
+    # -------------------- Lado del compresor --------------------
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def tell(self):
+        raise io.UnsupportedOperation("La tubería no es posicionable")
+
+    def flush(self):
+        pass
+
+    def write(self, data) -> int:
+        n = len(data)
+        self._acumulado += data
+        self.bytes_escritos += n
+        # zipfile hace muchas escrituras pequeñas (cabeceras): se agrupan
+        if len(self._acumulado) >= self._tamano_bloque:
+            self._encolar(bytes(self._acumulado))
+            self._acumulado.clear()
+        return n
+
+    def cerrar_escritura(self, error: Exception = None):
+        """Marca el final del stream. Con `error`, el lector lo recibirá en vez de EOF."""
+        self._error = error
+        if self._acumulado and error is None:
+            self._encolar(bytes(self._acumulado))
+        self._acumulado.clear()
+        self._encolar(None)
+
+    def _encolar(self, item):
+        while True:
+            if self._cancelada.is_set():
+                raise SubidaCancelada("La subida se canceló")
+            try:
+                self._cola.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    # -------------------- Lado de la subida --------------------
+
+    def cancelar(self):
+        """Desbloquea al compresor si la subida falla."""
+        self._cancelada.set()
+
+    def leer(self, n: int) -> bytes:
+        """Lee hasta `n` bytes; devuelve b"" al final del stream."""
+        partes = []
+        faltan = n
+        while faltan > 0 and not self._fin:
+            if not self._pendiente:
+                item = self._cola.get()
+                if item is None:
+                    self._fin = True
+                    if self._error is not None:
+                        # Nunca cerrar la subida con un ZIP truncado
+                        raise RuntimeError(f"Fallo al comprimir: {self._error}")
+                    break
+                self._pendiente = item
+
+            trozo = self._pendiente[:faltan]
+            self._pendiente = self._pendiente[faltan:]
+            partes.append(trozo)
+            faltan -= len(trozo)
+
+        return b"".join(partes)
+
+
+class MediaTuberiaUpload(MediaUpload):
+    """
+    Origen de datos para una subida resumible de tamaño desconocido.
+
+    Guarda en memoria solo lo que Drive aún no ha confirmado, para poder
+    reenviar un trozo si la petición falla. `md5` acumula todo lo leído de la
+    tubería, para compararlo con el `md5Checksum` de Drive al terminar.
+    Cada trozo que se entrega pasa por el límite de subida de `limitador`.
+    """
+
+    def __init__(self, tuberia: TuberiaAcotada, mimetype="application/zip", chunksize=CHUNK_POR_DEFECTO, limitador=None):
+        super().__init__()
+        if chunksize <= 0 or chunksize % MULTIPLO_CHUNK:
+            raise ValueError("chunksize debe ser múltiplo de 256 KB")
+        self._tuberia = tuberia
+        self._mimetype = mimetype
+        self._chunksize = chunksize
+        self._buffer = bytearray()
+        self._inicio = 0  # offset del primer byte de _buffer
+        self._siguiente = 0  # offset que se espera pedir a continuación
+        self._total = None
+        self._eof = False
+        self.md5 = hashlib.md5()
+        self.limitador = limitador or limitador_global()
+
+    def chunksize(self):
+        return self._chunksize
+
+    def mimetype(self):
+        return self._mimetype
+
+    def resumable(self):
+        return True
+
+    def has_stream(self):
+        return False
+
+    def _rellenar(self, hasta: int):
+        while not self._eof and len(self._buffer) < hasta:
+            datos = self._tuberia.leer(hasta - len(self._buffer))
+            if not datos:
+                self._eof = True
+                self._total = self._inicio + len(self._buffer)
+            self.md5.update(datos)
+            self._buffer += datos
+
+    def size(self):
+        # googleapiclient consulta size() antes de cada trozo. Leyendo un byte
+        # más allá del siguiente trozo se sabe si será el último, y así la
+        # petición final lleva el tamaño total en Content-Range.
+        self._rellenar(self._siguiente - self._inicio + self._chunksize + 1)
+        return self._total
+
+    def getbytes(self, begin, length):
+        if begin < self._inicio:
+            raise RuntimeError("Drive pidió datos que ya se descartaron")
+        del self._buffer[:begin - self._inicio]
+        self._inicio = begin
+
+        self._rellenar(length)
+        datos = bytes(self._buffer[:length])
+        self._siguiente = begin + len(datos)
+        self.limitador.subir(len(datos))
+        return datos
+
+    def to_json(self):
+        raise NotImplementedError("Una subida en streaming no se puede serializar")
+
+
+def backup_y_subir(
+    service,
+    carpeta_origen,
+    nombre_zip: str,
+    nivel_compresion: int,
+    excluir_temporales: bool,
+    encriptar: bool = False,
+    password: str = None,
+    progreso_callback=None,
+    subida_callback=None,
+    chunksize: int = CHUNK_POR_DEFECTO,
+    max_bloques: int = 16,
+    politica=None,
+    codec: str = "deflate",
+    eventos_callback=None,
+    cifrado: str = "winzip",
+    metadatos: dict = None,
+    memoria_baja: bool = False,
+):
+    """
+    Comprime y sube a Drive a la vez, sin escribir el ZIP en disco.
+
+    El compresor corre en un hilo y escribe en una TuberiaAcotada; este hilo
+    envía los trozos a Drive a medida que llegan. `subida_callback(bytes)`
+    recibe los bytes confirmados por Drive. Al terminar se compara el MD5 de
+    lo enviado con el que calcula Drive (ErrorSubida si no coinciden).
+    `metadatos` (nombre, carpeta, appProperties) sustituye al simple
+    {"name": nombre_zip}. `memoria_baja` se pasa a crear_backup.
+
+    Devuelve (archivos_comprimidos, respuesta de Drive {"id", "md5Checksum", "size"}).
+    """
+    tuberia = TuberiaAcotada(max_bloques=max_bloques)
+    resultado = {}
+
+    def comprimir():
+        try:
+            resultado["total"] = crear_backup(
+                carpeta_origen=carpeta_origen,
+                destino_zip=tuberia,
+                nivel_compresion=nivel_compresion,
+                excluir_temporales=excluir_temporales,
+                encriptar=encriptar,
+                password=password,
+                progreso_callback=progreso_callback,
+                politica=politica,
+                codec=codec,
+                eventos_callback=eventos_callback,
+                cifrado=cifrado,
+                memoria_baja=memoria_baja,
+            )
+            tuberia.cerrar_escritura()
+        except SubidaCancelada:
+            # La subida ya falló y se informa desde el hilo principal
+            pass
+        except Exception as e:
+            try:
+                tuberia.cerrar_escritura(error=e)
+            except SubidaCancelada:
+                pass
+
+    hilo = threading.Thread(target=comprimir, daemon=True)
+    hilo.start()
+
+    try:
+        if encriptar and cifrado == "contenedor":
+            mimetype = "application/octet-stream"
+        else:
+            mimetype = "application/zip" if obtener_codec(codec).es_zip else "application/zstd"
+        media = MediaTuberiaUpload(tuberia, mimetype=mimetype, chunksize=chunksize)
+        request = service.files().create(
+            body=metadatos or {"name": nombre_zip}, media_body=media, fields="id,md5Checksum,size"
+        )
+
+        response = None
+        while response is None:
+            # Los trozos ya leídos de la tubería se reenvían tal cual si hay un fallo
+            status, response = request.next_chunk(num_retries=REINTENTOS)
+            if status and subida_callback:
+                subida_callback(status.resumable_progress)
+    except BaseException:
+        tuberia.cancelar()
+        raise
+    finally:
+        hilo.join()
+
+    comprobar_md5(response, media.md5.hexdigest(), nombre_zip)
+    return resultado["total"], response
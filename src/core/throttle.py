@@ -0,0 +1,247 @@
+import ctypes
+import ctypes.util
+import os
+import platform
+import sys
+import threading
+import time
+from datetime import datetime
+
+MB = 1024 * 1024
+# Capacidad de cada cubo: lo que se acumula en este tiempo a la tasa fijada
+RAFAGA_S = 0.5
+# Espera máxima de cada vuelta: un cambio de límite se nota enseguida
+ESPERA_MAX_S = 0.25
+# Cada cuánto se comprueba si empezó otra franja horaria
+REVISION_FRANJAS_S = 30
+
+# Prioridad baja: nice 10 y clase de E/S "best effort" en su nivel más bajo
+NICE_BAJA = 10
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_BE = 2
+IOPRIO_NIVEL_BAJO = 7
+IOPRIO_CLASS_SHIFT = 13
+# Número de la llamada ioprio_set, que no tiene envoltorio en libc
+_SYSCALL_IOPRIO_SET = {"x86_64": 251, "i386": 289, "i686": 289, "aarch64": 30, "armv7l": 314, "armv6l": 314}
+# Modo "en segundo plano" de Windows: baja a la vez CPU, E/S y memoria
+PROCESS_MODE_BACKGROUND_BEGIN = 0x00100000
+
+
+class CuboTokens:
+    """
+    Cubo de tokens (bytes) compartido entre hilos; `tasa` en bytes/s o
+    None para no limitar.
+
+    consumir(n) se lleva lo que haya en el cubo y, si no basta, espera a que
+    se rellene en vueltas de como mucho ESPERA_MAX_S. Así varios hilos se
+    reparten la tasa, ninguno se queda sin turno y un ajustar() en mitad de
+    una espera se aplica en la vuelta siguiente.
+    """
+
+    def __init__(self, tasa: float = None, reloj=time.monotonic):
+        self._reloj = reloj
+        self._cambio = threading.Condition()
+        self._tasa = None
+        self._tokens = 0.0
+        self._t = reloj()
+        self.ajustar(tasa)
+
+    @property
+    def tasa(self):
+        return self._tasa
+
+    def ajustar(self, tasa: float = None):
+        if tasa is not None and tasa <= 0:
+            raise ValueError("El límite debe ser positivo")
+        with self._cambio:
+            self._tasa = tasa
+            self._t = self._reloj()
+            self._tokens = min(self._tokens, self._capacidad())
+            self._cambio.notify_all()
+
+    def _capacidad(self) -> float:
+        return self._tasa * RAFAGA_S if self._tasa else 0.0
+
+    def _rellenar(self):
+        ahora = self._reloj()
+        self._tokens = min(self._capacidad(), self._tokens + (ahora - self._t) * self._tasa)
+        self._t = ahora
+
+    def consumir(self, n: int):
+        if self._tasa is None:
+            return
+        pendiente = n
+        with self._cambio:
+            while True:
+                if self._tasa is None:
+                    return
+                self._rellenar()
+                tomado = min(pendiente, self._tokens)
+                self._tokens -= tomado
+                pendiente -= tomado
+                if pendiente <= 0:
+                    return
+                self._cambio.wait(min(pendiente / self._tasa, ESPERA_MAX_S))
+
+
+def _mb_a_bytes(mb):
+    return mb * MB if mb else None
+
+
+class Franja:
+    """
+    Límites para una franja horaria: de `desde` a `hasta` ("HH:MM"; si
+    `hasta` es anterior, la franja cruza la medianoche) los días `dias`
+    (como el campo de día de la semana de cron: "1-5" es de lunes a viernes).
+    Un límite None significa sin límite.
+    """
+
+    def __init__(self, desde: str, hasta: str, lectura_mb: float = None, subida_mb: float = None, dias: str = "*"):
+        from core.scheduler import _parsear_campo
+
+        try:
+            self.desde = datetime.strptime(desde, "%H:%M").time()
+            self.hasta = datetime.strptime(hasta, "%H:%M").time()
+        except ValueError:
+            raise ValueError(f"Franja horaria inválida: {desde}-{hasta} (usa HH:MM)") from None
+        self.dias = {d % 7 for d in _parsear_campo(str(dias), 0, 7)}
+        self.lectura_mb = lectura_mb
+        self.subida_mb = subida_mb
+
+    def activa(self, fecha: datetime) -> bool:
+        hora = fecha.time()
+        if self.desde <= self.hasta:
+            # El día que cuenta es el del inicio de la franja
+            return self.desde <= hora < self.hasta and fecha.isoweekday() % 7 in self.dias
+        if hora >= self.desde:
+            return fecha.isoweekday() % 7 in self.dias
+        return hora < self.hasta and (fecha.isoweekday() - 1) % 7 in self.dias
+
+
+class Limitador:
+    """
+    Límites de lectura de disco y de subida a Drive, compartidos por todos
+    los trabajos en curso (ver limitador_global).
+
+    Los límites base (`fijar`, en MB/s) se aplican fuera de las franjas; la
+    primera franja activa los sustituye. Se pueden cambiar en cualquier
+    momento y los trabajos en marcha los notan en menos de un segundo.
+    """
+
+    def __init__(self, lectura_mb: float = None, subida_mb: float = None, franjas=(), reloj=datetime.now):
+        self.lectura = CuboTokens()
+        self.subida = CuboTokens()
+        self._reloj = reloj
+        self._lock = threading.Lock()
+        self._base = (lectura_mb, subida_mb)
+        self.franjas = list(franjas)
+        self._revision = 0.0
+        self.actualizar()
+
+    @classmethod
+    def desde_dict(cls, datos: dict) -> "Limitador":
+        """
+        {"lectura_mb": null, "subida_mb": 10,
+         "franjas": [{"desde": "08:00", "hasta": "20:00", "dias": "1-5", "lectura_mb": 20, "subida_mb": 2}]}
+        """
+        limitador = cls()
+        limitador.configurar(datos)
+        return limitador
+
+    def configurar(self, datos: dict):
+        franjas = [Franja(**f) for f in datos.get("franjas", [])]
+        with self._lock:
+            self._base = (datos.get("lectura_mb"), datos.get("subida_mb"))
+            self.franjas = franjas
+        self.actualizar()
+
+    def fijar(self, lectura_mb: float = None, subida_mb: float = None):
+        """Cambia los límites base (p. ej. desde la ventana) con los trabajos en marcha."""
+        with self._lock:
+            self._base = (lectura_mb, subida_mb)
+        self.actualizar()
+
+    def vigentes(self, fecha: datetime = None) -> tuple:
+        """(lectura_mb, subida_mb) que tocan en `fecha`."""
+        fecha = fecha or self._reloj()
+        for franja in self.franjas:
+            if franja.activa(fecha):
+                return franja.lectura_mb, franja.subida_mb
+        return self._base
+
+    def actualizar(self) -> tuple:
+        with self._lock:
+            lectura_mb, subida_mb = self.vigentes()
+            self._revision = time.monotonic()
+        self.lectura.ajustar(_mb_a_bytes(lectura_mb))
+        self.subida.ajustar(_mb_a_bytes(subida_mb))
+        return lectura_mb, subida_mb
+
+    def _revisar(self):
+        if self.franjas and time.monotonic() - self._revision >= REVISION_FRANJAS_S:
+            self.actualizar()
+
+    def leer(self, n: int):
+        self._revisar()
+        self.lectura.consumir(n)
+
+    def subir(self, n: int):
+        self._revisar()
+        self.subida.consumir(n)
+
+    def resumen(self) -> str:
+        def texto(tasa):
+            return "sin límite" if tasa is None else f"{tasa / MB:g} MB/s"
+
+        return f"lectura {texto(self.lectura.tasa)}, subida {texto(self.subida.tasa)}"
+
+
+_limitador = Limitador()
+
+
+def limitador_global() -> Limitador:
+    """Limitador único del proceso: todos los trabajos comparten los mismos cubos."""
+    return _limitador
+
+
+def _bajar_linux() -> list:
+    hechos = []
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    numero = _SYSCALL_IOPRIO_SET.get(platform.machine())
+    ioprio = (IOPRIO_CLASS_BE << IOPRIO_CLASS_SHIFT) | IOPRIO_NIVEL_BAJO
+    # En Linux la prioridad es de cada hilo: se bajan todos los que ya
+    # existen y los nuevos la heredan de quien los crea
+    cpu = io = True
+    for tid in os.listdir("/proc/self/task"):
+        tid = int(tid)
+        try:
+            os.setpriority(os.PRIO_PROCESS, tid, max(NICE_BAJA, os.getpriority(os.PRIO_PROCESS, tid)))
+        except OSError:
+            cpu = False
+        if numero is None or libc.syscall(numero, IOPRIO_WHO_PROCESS, tid, ioprio) != 0:
+            io = False
+    if cpu:
+        hechos.append(f"CPU (nice {NICE_BAJA})")
+    if io:
+        hechos.append("disco (best effort, nivel 7)")
+    return hechos
+
+
+def bajar_prioridad() -> list:
+    """
+    Baja la prioridad de CPU y de E/S de todo el proceso para molestar lo
+    menos posible a otros servicios. No se puede deshacer sin privilegios.
+    Devuelve lo que se consiguió bajar (p. ej. ["CPU (nice 10)", ...]).
+    """
+    if sys.platform == "win32":
+        kernel32 = ctypes.windll.kernel32
+        if kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), PROCESS_MODE_BACKGROUND_BEGIN):
+            return ["CPU, disco y memoria (modo segundo plano)"]
+        return []
+    if sys.platform.startswith("linux"):
+        return _bajar_linux()
+    try:
+        os.setpriority(os.PRIO_PROCESS, 0, max(NICE_BAJA, os.getpriority(os.PRIO_PROCESS, 0)))
+    except OSError:
+        return []
+    return [f"CPU (nice {NICE_BAJA})"]
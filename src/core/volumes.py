@@ -0,0 +1,372 @@
+import bisect
+import fnmatch
+import hashlib
+import io
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pyzipper
+
+from core.backup_engine import TAMANO_LECTURA, crear_backup, obtener_codec
+from core.integrity import MIEMBRO_HASHES, verificar_zip
+
+VERSION_INDICE = 1
+TAMANO_VOLUMEN_POR_DEFECTO = 1024 * 1024 * 1024  # 1 GB
+
+
+def ruta_indice_volumenes(destino_zip: Path) -> Path:
+    """El índice vive junto a los volúmenes: backup.zip -> backup.zip.volumes.json"""
+    return destino_zip.with_name(destino_zip.name + ".volumes.json")
+
+
+def nombre_volumen(destino_zip: Path, numero: int) -> str:
+    # Mismo esquema que 7-Zip (.001, .002...): concatenados forman el ZIP completo
+    return f"{destino_zip.name}.{numero:03d}"
+
+
+class EscritorVolumenes:
+    """
+    Archivo de solo escritura que reparte lo escrito en volúmenes de tamaño fijo.
+
+    No es posicionable, así que zipfile escribe descriptores de datos y nunca
+    vuelve atrás: cada volumen se cierra definitivamente al llenarse y se
+    avisa con `volumen_callback(ruta)`, por ejemplo para subirlo mientras se
+    comprime el siguiente. En memoria solo está el buffer del archivo abierto.
+    """
+
+    def __init__(self, destino_zip: Path, tamano_volumen: int = TAMANO_VOLUMEN_POR_DEFECTO, volumen_callback=None):
+        if tamano_volumen <= 0:
+            raise ValueError("El tamaño de volumen debe ser positivo")
+        self.destino_zip = Path(destino_zip)
+        self.tamano_volumen = tamano_volumen
+        self.volumen_callback = volumen_callback
+        self.volumenes = []  # [{"nombre", "tamano", "sha256"}]
+        self._actual = None
+        self._hash = None
+        self._escritos = 0
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def tell(self):
+        raise io.UnsupportedOperation("Los volúmenes no son posicionables")
+
+    def flush(self):
+        if self._actual:
+            self._actual.flush()
+
+    def _abrir(self):
+        ruta = self.destino_zip.with_name(nombre_volumen(self.destino_zip, len(self.volumenes) + 1))
+        self._actual = open(ruta, "wb")
+        self._hash = hashlib.sha256()
+        self._escritos = 0
+
+    def _cerrar_actual(self):
+        ruta = Path(self._actual.name)
+        self._actual.close()
+        self._actual = None
+        self.volumenes.append({"nombre": ruta.name, "tamano": self._escritos, "sha256": self._hash.hexdigest()})
+        if self.volumen_callback:
+            self.volumen_callback(ruta)
+
+    def write(self, data) -> int:
+        vista = memoryview(data)
+        while vista:
+            if self._actual is None:
+                self._abrir()
+            trozo = vista[:self.tamano_volumen - self._escritos]
+            self._actual.write(trozo)
+            self._hash.update(trozo)
+            self._escritos += len(trozo)
+            vista = vista[len(trozo):]
+            if self._escritos == self.tamano_volumen:
+                self._cerrar_actual()
+        return len(data)
+
+    def cerrar(self):
+        if self._actual is not None:
+            self._cerrar_actual()
+
+    def descartar(self):
+        """Borra los volúmenes locales de un backup que falló."""
+        if self._actual is not None:
+            self._actual.close()
+            Path(self._actual.name).unlink(missing_ok=True)
+            self._actual = None
+        for volumen in self.volumenes:
+            self.destino_zip.with_name(volumen["nombre"]).unlink(missing_ok=True)
+
+
+class LectorVolumenes(io.RawIOBase):
+    """
+    Vista de solo lectura y posicionable sobre los volúmenes como si fueran un
+    único ZIP. Solo abre (y pide a `obtener_volumen`) los volúmenes que se
+    leen de verdad, así que extraer un archivo no necesita el resto.
+    """
+
+    def __init__(self, volumenes: list, obtener_volumen):
+        super().__init__()
+        self._nombres = [v["nombre"] for v in volumenes]
+        self._inicios = []
+        inicio = 0
+        for v in volumenes:
+            self._inicios.append(inicio)
+            inicio += v["tamano"]
+        self._total = inicio
+        self._obtener_volumen = obtener_volumen
+        self._abiertos = {}
+        self._pos = 0
+
+    @property
+    def usados(self) -> list:
+        return sorted(self._abiertos)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        else:
+            self._pos = self._total + offset
+        return self._pos
+
+    def _volumen(self, indice: int):
+        nombre = self._nombres[indice]
+        if nombre not in self._abiertos:
+            self._abiertos[nombre] = open(self._obtener_volumen(nombre), "rb")
+        return self._abiertos[nombre]
+
+    def readinto(self, buffer) -> int:
+        # zipfile espera lecturas completas: se sigue en el volumen siguiente
+        vista = memoryview(buffer).cast("B")
+        leidos = 0
+        while leidos < len(vista) and self._pos < self._total:
+            indice = bisect.bisect_right(self._inicios, self._pos) - 1
+            f = self._volumen(indice)
+            f.seek(self._pos - self._inicios[indice])
+            n = f.readinto(vista[leidos:])
+            if not n:
+                raise RuntimeError(f"El volumen {self._nombres[indice]} está incompleto")
+            leidos += n
+            self._pos += n
+        return leidos
+
+    def close(self):
+        for f in self._abiertos.values():
+            f.close()
+        super().close()
+
+
+def crear_backup_volumenes(
+    carpeta_origen: Path,
+    destino_zip: Path,
+    nivel_compresion: int,
+    excluir_temporales: bool,
+    tamano_volumen: int = TAMANO_VOLUMEN_POR_DEFECTO,
+    encriptar: bool = False,
+    password: str = None,
+    progreso_callback=None,
+    volumen_callback=None,
+    workers: int = None,
+    ruta_indice_escaneo: Path = None,
+    politica=None,
+    codec: str = "deflate",
+    eventos_callback=None,
+):
+    """
+    Crea el backup en volúmenes backup.zip.001, .002... de `tamano_volumen`
+    bytes (el último puede ser menor) y un índice backup.zip.volumes.json.
+
+    `volumen_callback(ruta)` se llama en cuanto se cierra cada volumen. El
+    índice guarda dónde empieza cada archivo para que una restauración
+    parcial solo necesite los volúmenes que lo contienen.
+
+    Devuelve (archivos_comprimidos, ruta_del_indice). Solo admite codecs ZIP.
+    """
+    formato = obtener_codec(codec)
+    if not formato.es_zip:
+        raise ValueError(f"El backup por volúmenes no admite el formato {formato.etiqueta}")
+
+    # Volúmenes de una ejecución anterior con más partes confundirían la restauración
+    for viejo in destino_zip.parent.glob(f"{destino_zip.name}.[0-9][0-9][0-9]"):
+        viejo.unlink()
+
+    escritor = EscritorVolumenes(destino_zip, tamano_volumen, volumen_callback)
+    try:
+        total = crear_backup(
+            carpeta_origen=carpeta_origen,
+            destino_zip=escritor,
+            nivel_compresion=nivel_compresion,
+            excluir_temporales=excluir_temporales,
+            encriptar=encriptar,
+            password=password,
+            progreso_callback=progreso_callback,
+            workers=workers,
+            ruta_indice_escaneo=ruta_indice_escaneo,
+            politica=politica,
+            codec=codec,
+            eventos_callback=eventos_callback,
+        )
+        escritor.cerrar()
+    except BaseException:
+        escritor.descartar()
+        raise
+
+    ruta_indice = ruta_indice_volumenes(destino_zip)
+    indice = _construir_indice(destino_zip, escritor.volumenes, tamano_volumen)
+    tmp = ruta_indice.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(indice, f)
+    os.replace(tmp, ruta_indice)
+
+    return total, ruta_indice
+
+
+def _construir_indice(destino_zip: Path, volumenes: list, tamano_volumen: int) -> dict:
+    # Se relee el directorio central del final: solo toca el último volumen
+    with LectorVolumenes(volumenes, lambda nombre: destino_zip.with_name(nombre)) as lector:
+        with pyzipper.AESZipFile(lector) as zipf:
+            miembros = {
+                info.filename: {"offset": info.header_offset, "tamano": info.file_size, "comprimido": info.compress_size}
+                for info in zipf.infolist()
+            }
+            inicio_directorio = zipf.start_dir
+
+    return {
+        "version": VERSION_INDICE,
+        "archivo": destino_zip.name,
+        "tamano_volumen": tamano_volumen,
+        "volumenes": volumenes,
+        "inicio_directorio": inicio_directorio,
+        "miembros": miembros,
+    }
+
+
+def cargar_indice_volumenes(ruta_indice: Path) -> dict:
+    with open(ruta_indice, "r", encoding="utf-8") as f:
+        indice = json.load(f)
+    if indice.get("version") != VERSION_INDICE:
+        raise RuntimeError(f"Versión de índice no soportada: {indice.get('version')}")
+    return indice
+
+
+def verificar_volumenes(ruta_indice: Path, password: str = None, workers: int = None, progreso_callback=None) -> tuple:
+    """
+    Comprueba el SHA-256 de cada volumen contra el índice y después lee
+    todos los miembros (CRC y hashes del backup) con core.integrity.verificar_zip.
+
+    Devuelve (miembros_verificados, errores).
+    """
+    ruta_indice = Path(ruta_indice)
+    indice = cargar_indice_volumenes(ruta_indice)
+
+    def comprobar(volumen):
+        h = hashlib.sha256()
+        with open(ruta_indice.with_name(volumen["nombre"]), "rb") as f:
+            for trozo in iter(lambda: f.read(TAMANO_LECTURA), b""):
+                h.update(trozo)
+        if h.hexdigest() != volumen["sha256"]:
+            return f"{volumen['nombre']}: el volumen no coincide con el índice"
+
+    workers = workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        errores = [e for e in pool.map(comprobar, indice["volumenes"]) if e]
+    if errores:
+        return 0, errores
+
+    def abrir():
+        lector = LectorVolumenes(indice["volumenes"], lambda nombre: ruta_indice.with_name(nombre))
+        return io.BufferedReader(lector, TAMANO_LECTURA)
+
+    return verificar_zip(abrir, password, workers, progreso_callback)
+
+
+def volumenes_necesarios(indice: dict, nombres) -> list:
+    """Volúmenes que contienen los miembros `nombres` más los del directorio central."""
+    inicios = []
+    acumulado = 0
+    for volumen in indice["volumenes"]:
+        inicios.append(acumulado)
+        acumulado += volumen["tamano"]
+
+    # Un miembro acaba donde empieza el siguiente (incluye descriptor de datos)
+    offsets = sorted(m["offset"] for m in indice["miembros"].values())
+    rangos = [(indice["inicio_directorio"], acumulado)]
+    for nombre in nombres:
+        inicio = indice["miembros"][nombre]["offset"]
+        siguiente = bisect.bisect_right(offsets, inicio)
+        fin = offsets[siguiente] if siguiente < len(offsets) else indice["inicio_directorio"]
+        rangos.append((inicio, fin))
+
+    usados = set()
+    for inicio, fin in rangos:
+        primero = bisect.bisect_right(inicios, inicio) - 1
+        ultimo = bisect.bisect_right(inicios, max(fin - 1, inicio)) - 1
+        usados.update(range(primero, ultimo + 1))
+    return [indice["volumenes"][i]["nombre"] for i in sorted(usados)]
+
+
+def restaurar_volumenes(
+    ruta_indice: Path,
+    carpeta_destino: Path,
+    patrones=None,
+    password: str = None,
+    obtener_volumen=None,
+    progreso_callback=None,
+):
+    """
+    Restaura un backup por volúmenes en `carpeta_destino`.
+
+    `patrones` es una lista de patrones glob (fnmatch) sobre las rutas dentro
+    del backup; None restaura todo. `obtener_volumen(nombre) -> Path` entrega
+    cada volumen (por ejemplo, descargándolo de Drive) y solo se llama para
+    los volúmenes que contienen lo pedido; por defecto se buscan junto al índice.
+
+    Devuelve (archivos_restaurados, volumenes_usados).
+    """
+    ruta_indice = Path(ruta_indice)
+    indice = cargar_indice_volumenes(ruta_indice)
+    obtener_volumen = obtener_volumen or (lambda nombre: ruta_indice.with_name(nombre))
+
+    nombres = [
+        n for n in indice["miembros"]
+        if n != MIEMBRO_HASHES and (patrones is None or any(fnmatch.fnmatch(n, p) for p in patrones))
+    ]
+    if not nombres:
+        raise ValueError("Ningún archivo del backup coincide con los patrones indicados.")
+
+    carpeta_destino.mkdir(parents=True, exist_ok=True)
+    destino_real = carpeta_destino.resolve()
+
+    with LectorVolumenes(indice["volumenes"], obtener_volumen) as lector:
+        with pyzipper.AESZipFile(lector) as zipf:
+            if password:
+                zipf.setpassword(password.encode("utf-8"))
+            for i, nombre in enumerate(nombres, start=1):
+                salida = (carpeta_destino / nombre).resolve()
+                # Nunca escribir fuera de la carpeta destino
+                if destino_real not in salida.parents:
+                    raise RuntimeError(f"Ruta no válida en el backup: {nombre}")
+                salida.parent.mkdir(parents=True, exist_ok=True)
+                with zipf.open(nombre) as origen, open(salida, "wb") as f:
+                    shutil.copyfileobj(origen, f, 1024 * 1024)
+                if progreso_callback:
+                    progreso_callback(i, len(nombres))
+        usados = lector.usados
+
+    return len(nombres), usados
@@ -0,0 +1,436 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from pathlib import Path
+
+from core.backup_engine import EXTENSIONES_TEMP
+
+# Una ráfaga de cambios se da por terminada tras este tiempo sin avisos
+ESPERA_REBOTE_S = 2.0
+# Un archivo que no deja de cambiar (un log, una descarga) se guarda igualmente pasado este tiempo
+ESPERA_MAX_S = 60.0
+# Cada cuánto se añaden los cambios al archivo continuo
+INTERVALO_S = 30.0
+# Sin inotify, cada cuánto se recorre la carpeta buscando cambios
+INTERVALO_SONDEO_S = 10.0
+
+# Constantes de <sys/inotify.h>
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_DONT_FOLLOW = 0x02000000
+_IN_EXCL_UNLINK = 0x04000000
+_IN_ISDIR = 0x40000000
+_MASCARA = (
+    _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+    | _IN_ONLYDIR | _IN_DONT_FOLLOW | _IN_EXCL_UNLINK
+)
+_EVENTO = struct.Struct("iIII")
+
+_libc = None
+
+
+def _cargar_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    return _libc
+
+
+def inotify_disponible() -> bool:
+    if not sys.platform.startswith("linux"):
+        return False
+    try:
+        return hasattr(_cargar_libc(), "inotify_init1")
+    except OSError:
+        return False
+
+
+class AgrupadorCambios:
+    """
+    Junta los avisos de cambios y los entrega por ráfagas.
+
+    Un archivo se entrega cuando lleva `espera_s` sin cambiar (así no se
+    guarda a medio escribir) o cuando lleva `espera_max_s` cambiando sin
+    parar. `revisar_todo()` pide revisar la carpeta entera, por ejemplo si se
+    han perdido avisos.
+    """
+
+    def __init__(self, espera_s: float = ESPERA_REBOTE_S, espera_max_s: float = ESPERA_MAX_S, reloj=time.monotonic):
+        self.espera_s = espera_s
+        self.espera_max_s = espera_max_s
+        self._reloj = reloj
+        self._lock = threading.Lock()
+        self._pendientes = {}  # ruta relativa -> (primer aviso, último aviso)
+        self._todo = False
+
+    def registrar(self, rel: str):
+        with self._lock:
+            ahora = self._reloj()
+            primero = self._pendientes.get(rel, (ahora,))[0]
+            self._pendientes[rel] = (primero, ahora)
+
+    def revisar_todo(self):
+        with self._lock:
+            self._todo = True
+
+    def pendientes(self) -> int:
+        with self._lock:
+            return len(self._pendientes)
+
+    def recoger(self, forzar: bool = False):
+        """
+        Rutas listas para guardar (y las quita de la espera), o None si hay
+        que revisar la carpeta entera. Con forzar=True entrega todo lo pendiente.
+        """
+        with self._lock:
+            if self._todo:
+                self._todo = False
+                self._pendientes.clear()
+                return None
+            ahora = self._reloj()
+            listas = [
+                rel for rel, (primero, ultimo) in self._pendientes.items()
+                if forzar or ahora - ultimo >= self.espera_s or ahora - primero >= self.espera_max_s
+            ]
+            for rel in listas:
+                del self._pendientes[rel]
+            return listas
+
+
+class VigilanteInotify:
+    """
+    Vigila una carpeta y sus subcarpetas con inotify (Linux), sin dependencias.
+
+    Cada carpeta lleva su propio watch; las carpetas nuevas o movidas dentro
+    se vigilan al aparecer y se avisan enteras. Si la cola del kernel se
+    desborda se pide revisar todo. Lanza OSError si no se puede vigilar (por
+    ejemplo, límite fs.inotify.max_user_watches alcanzado).
+    """
+
+    def __init__(self, carpeta: Path, agrupador: AgrupadorCambios, filtro=None):
+        self.carpeta = str(carpeta)
+        self.agrupador = agrupador
+        self.filtro = filtro
+        self._libc = _cargar_libc()
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            codigo = ctypes.get_errno()
+            raise OSError(codigo, f"No se pudo iniciar inotify: {os.strerror(codigo)}")
+        self._rutas = {}  # watch -> carpeta relativa
+        self._watches = {}  # carpeta relativa -> watch
+        self._parar = threading.Event()
+        self._hilo = threading.Thread(target=self._bucle, name="vigilante-inotify", daemon=True)
+        try:
+            self._vigilar_arbol("")
+        except OSError:
+            os.close(self._fd)
+            raise
+
+    def _vigilar(self, rel: str) -> bool:
+        ruta = os.path.join(self.carpeta, rel) if rel else self.carpeta
+        watch = self._libc.inotify_add_watch(self._fd, os.fsencode(ruta), _MASCARA)
+        if watch < 0:
+            codigo = ctypes.get_errno()
+            if codigo == errno.ENOSPC:
+                raise OSError(codigo, "Se alcanzó el límite de carpetas vigiladas (fs.inotify.max_user_watches)")
+            # Borrada entretanto o sin permiso
+            return False
+        self._rutas[watch] = rel
+        self._watches[rel] = watch
+        return True
+
+    def _vigilar_arbol(self, rel: str):
+        pendientes = [rel]
+        while pendientes:
+            actual = pendientes.pop()
+            if not self._vigilar(actual):
+                continue
+            try:
+                with os.scandir(os.path.join(self.carpeta, actual) if actual else self.carpeta) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            pendientes.append(f"{actual}/{entry.name}" if actual else entry.name)
+            except OSError:
+                pass
+
+    def _olvidar_arbol(self, rel: str):
+        prefijo = rel + "/"
+        for actual in [r for r in self._watches if r == rel or r.startswith(prefijo)]:
+            watch = self._watches.pop(actual)
+            self._rutas.pop(watch, None)
+            self._libc.inotify_rm_watch(self._fd, watch)
+
+    def _procesar(self, datos: bytes):
+        pos = 0
+        while pos < len(datos):
+            watch, mascara, _, longitud = _EVENTO.unpack_from(datos, pos)
+            nombre = datos[pos + _EVENTO.size:pos + _EVENTO.size + longitud].rstrip(b"\0")
+            pos += _EVENTO.size + longitud
+
+            if mascara & _IN_Q_OVERFLOW:
+                self.agrupador.revisar_todo()
+                continue
+            if mascara & _IN_IGNORED:
+                rel = self._rutas.pop(watch, None)
+                if rel is not None and self._watches.get(rel) == watch:
+                    del self._watches[rel]
+                continue
+            base = self._rutas.get(watch)
+            if base is None or not nombre:
+                # Avisos de la propia carpeta: la carpeta padre ya avisa del cambio
+                continue
+
+            nombre = os.fsdecode(nombre)
+            rel = f"{base}/{nombre}" if base else nombre
+            if mascara & _IN_ISDIR:
+                if mascara & (_IN_CREATE | _IN_MOVED_TO):
+                    self._vigilar_arbol(rel)
+                elif mascara & (_IN_MOVED_FROM | _IN_DELETE):
+                    self._olvidar_arbol(rel)
+                # La revisión de la carpeta decide qué archivos cambiaron dentro
+                self.agrupador.registrar(rel)
+            elif self.filtro is None or self.filtro(rel):
+                self.agrupador.registrar(rel)
+
+    def _bucle(self):
+        while not self._parar.is_set():
+            listos, _, _ = select.select([self._fd], [], [], 0.5)
+            if not listos:
+                continue
+            try:
+                datos = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            self._procesar(datos)
+
+    def iniciar(self):
+        self._hilo.start()
+
+    def cerrar(self):
+        self._parar.set()
+        if self._hilo.is_alive():
+            self._hilo.join()
+        # Los avisos que quedaban en la cola también cuentan
+        while True:
+            try:
+                datos = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            self._procesar(datos)
+        os.close(self._fd)
+
+
+class VigilanteSondeo:
+    """
+    Alternativa a inotify (otros sistemas, unidades de red, límite de watches):
+    recorre la carpeta cada `intervalo_s` y avisa de los archivos cuyo tamaño
+    o fecha cambiaron, y de los que desaparecieron. Solo hace stat, no lee
+    ningún archivo.
+    """
+
+    def __init__(self, carpeta: Path, agrupador: AgrupadorCambios, filtro=None, intervalo_s: float = INTERVALO_SONDEO_S):
+        self.carpeta = str(carpeta)
+        self.agrupador = agrupador
+        self.filtro = filtro
+        self.intervalo_s = intervalo_s
+        self._parar = threading.Event()
+        self._hilo = threading.Thread(target=self._bucle, name="vigilante-sondeo", daemon=True)
+        self._estado = self._recorrer()
+
+    def _recorrer(self) -> dict:
+        estado = {}
+        pendientes = [""]
+        while pendientes:
+            rel = pendientes.pop()
+            try:
+                with os.scandir(os.path.join(self.carpeta, rel) if rel else self.carpeta) as it:
+                    for entry in it:
+                        sub = f"{rel}/{entry.name}" if rel else entry.name
+                        if entry.is_dir(follow_symlinks=False):
+                            pendientes.append(sub)
+                        elif entry.is_file() and (self.filtro is None or self.filtro(sub)):
+                            try:
+                                st = entry.stat()
+                            except OSError:
+                                continue
+                            estado[sub] = (st.st_size, st.st_mtime_ns)
+            except OSError:
+                pass
+        return estado
+
+    def _sondear(self):
+        nuevo = self._recorrer()
+        for rel, estado in nuevo.items():
+            if self._estado.get(rel) != estado:
+                self.agrupador.registrar(rel)
+        for rel in self._estado.keys() - nuevo.keys():
+            self.agrupador.registrar(rel)
+        self._estado = nuevo
+
+    def _bucle(self):
+        while not self._parar.wait(self.intervalo_s):
+            self._sondear()
+
+    def iniciar(self):
+        self._hilo.start()
+
+    def cerrar(self):
+        self._parar.set()
+        if self._hilo.is_alive():
+            self._hilo.join()
+        # Una última pasada para no perder lo cambiado desde la anterior
+        self._sondear()
+
+
+def crear_vigilante(
+    carpeta: Path,
+    agrupador: AgrupadorCambios,
+    filtro=None,
+    sondeo: bool = False,
+    intervalo_sondeo_s: float = INTERVALO_SONDEO_S,
+    log_callback=None,
+):
+    """VigilanteInotify si se puede; si no (o con sondeo=True), VigilanteSondeo."""
+    if not sondeo and inotify_disponible():
+        try:
+            return VigilanteInotify(carpeta, agrupador, filtro)
+        except OSError as e:
+            if log_callback:
+                log_callback(f"inotify no disponible ({e}); se vigila por sondeo")
+    return VigilanteSondeo(carpeta, agrupador, filtro, intervalo_sondeo_s)
+
+
+class BackupContinuo:
+    """
+    Backup continuo de la carpeta de un TrabajoBackup (siempre incremental).
+
+    Al empezar hace una pasada incremental normal (la primera vez, el backup
+    completo) para recoger lo que cambió mientras no se vigilaba. Después
+    solo guarda lo que avisa el vigilante: cada `intervalo_s`, los archivos
+    que llevan `espera_s` sin cambiar se añaden al archivo continuo (ver
+    core.incremental.anadir_cambios), sin recorrer la carpeta entera. Al
+    parar se guarda todo lo pendiente.
+    """
+
+    def __init__(
+        self,
+        trabajo,
+        intervalo_s: float = INTERVALO_S,
+        espera_s: float = ESPERA_REBOTE_S,
+        sondeo: bool = False,
+        log_callback=None,
+    ):
+        # Es una cadena incremental: se aplican sus mismas restricciones
+        trabajo.incremental = True
+        trabajo.validar()
+        self.trabajo = trabajo
+        self.intervalo_s = intervalo_s
+        self.sondeo = sondeo
+        self.log_callback = log_callback
+        self.agrupador = AgrupadorCambios(espera_s)
+        self.puntos = 0
+        self._politica = None
+        if trabajo.adaptativa:
+            from core.compression_policy import PoliticaCompresion
+
+            self._politica = PoliticaCompresion(trabajo.codec.nivel(trabajo.nivel), metodo=trabajo.codec.metodo_zip)
+        self._parar = threading.Event()
+
+    def _log(self, texto: str):
+        if self.log_callback:
+            self.log_callback(f"[{self.trabajo.nombre}] {texto}")
+
+    def _filtro(self, rel: str) -> bool:
+        trabajo = self.trabajo
+        ruta = trabajo.origen / rel
+        if trabajo.excluir_temporales and ruta.suffix.lower() in EXTENSIONES_TEMP:
+            return False
+        # Si el destino está dentro del origen, sus propios archivos no cuentan como cambios
+        return not (ruta.parent == trabajo.destino.parent and ruta.name.startswith(trabajo.destino.stem + "."))
+
+    def _anadir(self, rutas):
+        from core.incremental import anadir_cambios
+
+        trabajo = self.trabajo
+        try:
+            archivos, ruta = anadir_cambios(
+                carpeta_origen=trabajo.origen,
+                destino_zip=trabajo.destino,
+                nivel_compresion=trabajo.codec.nivel(trabajo.nivel),
+                excluir_temporales=trabajo.excluir_temporales,
+                rutas=rutas,
+                encriptar=trabajo.encriptar,
+                password=trabajo.password,
+                workers=trabajo.workers,
+                politica=self._politica,
+                codec=trabajo.codec.nombre,
+            )
+        except (RuntimeError, ValueError, OSError) as e:
+            # Se reintenta en el siguiente intervalo
+            self._log(f"No se pudieron guardar los cambios: {e}")
+            if rutas is None:
+                self.agrupador.revisar_todo()
+            else:
+                for rel in rutas:
+                    self.agrupador.registrar(rel)
+            return
+        if ruta is not None or archivos:
+            self.puntos += 1
+            self._log(f"{archivos} archivos añadidos a {ruta.name}" if ruta else "Borrados registrados")
+
+    def ejecutar(self):
+        """Bloquea hasta que se llame a parar()."""
+        from core.incremental import crear_backup_incremental
+
+        trabajo = self.trabajo
+        # Sondear más a menudo de lo que se guarda no adelanta nada
+        vigilante = crear_vigilante(
+            trabajo.origen, self.agrupador, self._filtro, self.sondeo, min(INTERVALO_SONDEO_S, self.intervalo_s), self._log
+        )
+        # Se vigila antes de la pasada inicial: lo que cambie durante ella tampoco se pierde
+        vigilante.iniciar()
+        tipo = "inotify" if isinstance(vigilante, VigilanteInotify) else "sondeo"
+        try:
+            archivos, ruta = crear_backup_incremental(
+                carpeta_origen=trabajo.origen,
+                destino_zip=trabajo.destino,
+                nivel_compresion=trabajo.codec.nivel(trabajo.nivel),
+                excluir_temporales=trabajo.excluir_temporales,
+                encriptar=trabajo.encriptar,
+                password=trabajo.password,
+                workers=trabajo.workers,
+                politica=self._politica,
+                codec=trabajo.codec.nombre,
+            )
+            if ruta is not None:
+                self._log(f"Pasada inicial: {archivos} archivos en {ruta.name}")
+            self._log(f"Vigilando {trabajo.origen} ({tipo}); cambios cada {self.intervalo_s:g} s")
+
+            while not self._parar.wait(self.intervalo_s):
+                rutas = self.agrupador.recoger()
+                if rutas != []:
+                    self._anadir(rutas)
+        finally:
+            vigilante.cerrar()
+
+        rutas = self.agrupador.recoger(forzar=True)
+        if rutas != []:
+            self._anadir(rutas)
+        self._log("Backup continuo detenido")
+
+    def parar(self):
+        self._parar.set()
@@ -1,25 +1,135 @@
 import threading
-import os
 from pathlib import Path
 from typing import Optional
 
-from googleapiclient.http import MediaFileUpload
-
-from core.drive_auth import get_drive_service
-from core.backup_engine import crear_backup
+from core.backup_engine import listar_codecs
+from core.job_queue import COMPLETADO, ERROR, PRIORIDADES, SUBIENDO, ColaTrabajos
+from core.jobs import EXTENSION_REPOSITORIO, TrabajoBackup
+from core.progress import MedidorVelocidad, formatear_bytes, formatear_duracion
+from core.throttle import bajar_prioridad, limitador_global
+from core.watcher import BackupContinuo
 from core_ui.password_dialog import PasswordDialog
+from core_ui.progress_aggregator import AgregadorProgreso
+
+# Compresiones simultáneas; las subidas son otra etapa con su propio límite
+MAX_TRABAJOS_SIMULTANEOS = 2
+MAX_SUBIDAS_SIMULTANEAS = 2
+
+# Tamaño de volumen en MB de cada opción (None = un solo archivo)
+VOLUMENES_UI = {"No dividir": None, "100 MB": 100, "1 GB": 1024, "4 GB": 4096}
+# Opción del combo de formato que, en vez de un archivo, crea un snapshot en un repositorio deduplicado
+FORMATO_REPOSITORIO = "Repositorio deduplicado"
+CIFRADOS_UI = {"AES por archivo (WinZip)": "winzip", "Contenedor AES-GCM": "contenedor"}
+# Límites de velocidad en MB/s de cada opción (None = sin límite)
+LECTURA_UI = {"Lectura sin límite": None, "Lectura 100 MB/s": 100, "Lectura 50 MB/s": 50, "Lectura 20 MB/s": 20, "Lectura 5 MB/s": 5}
+SUBIDA_UI = {"Subida sin límite": None, "Subida 10 MB/s": 10, "Subida 5 MB/s": 5, "Subida 2 MB/s": 2, "Subida 0.5 MB/s": 0.5}
+
+
+def _servicio_drive():
+    # Las librerías de Google se importan la primera vez que hacen falta, no al arrancar
+    from core.drive_auth import get_drive_service
+
+    return get_drive_service()
 
 
 class UIController:
     """
     Controlador de la UI: coordina backups y subidas a Google Drive.
     Actualiza la UI mediante self.ui.after(...) para ejecutar cambios en el hilo principal.
+
+    Los backups y las subidas pasan por una ColaTrabajos: se pueden encolar
+    varias carpetas, cada una con su progreso, prioridad y botón de cancelar.
+    Los avisos de la cola pasan por un AgregadorProgreso, que los junta y
+    refresca la ventana a un ritmo fijo por muchos archivos que se procesen.
     """
 
     def __init__(self, ui):
         self.ui = ui
-        self._ejecutando = False
-        self._upload_lock = threading.Lock()
+        self.agregador = AgregadorProgreso(ui, self._refrescar_lote)
+        self._medidor = None
+        self._base_bytes = 0
+        # Backups continuos en marcha: {carpeta: (BackupContinuo, hilo)}
+        self._continuos = {}
+        self.cola = ColaTrabajos(
+            max_concurrentes=MAX_TRABAJOS_SIMULTANEOS,
+            obtener_servicio=_servicio_drive,
+            al_cambiar=self.agregador.cambio,
+            log_callback=self.agregador.log,
+            subidas_concurrentes=MAX_SUBIDAS_SIMULTANEAS,
+        )
+
+    # -------------------- Cola de trabajos --------------------
+
+    def _refrescar_lote(self, entradas, lineas, descartadas):
+        # En el hilo de Tk: un solo insert para todo el log acumulado
+        if descartadas:
+            self.ui.append_log(f"({descartadas} mensajes omitidos)")
+        if lineas:
+            self.ui.append_logs(lineas)
+        for entrada in entradas:
+            self._refrescar(entrada)
+        self._actualizar_resumen()
+
+    def _refrescar(self, entrada):
+        self.ui.job_panel.actualizar(entrada)
+
+        if entrada.estado == SUBIENDO:
+            self.ui.drive_status.configure(text="● Subiendo a Google Drive")
+        elif entrada.estado == COMPLETADO and entrada.resultado and entrada.resultado.get("drive_id"):
+            self.ui.drive_status.configure(text="● Conectado a Google Drive")
+        elif entrada.estado == ERROR and entrada.trabajo is None:
+            self.ui.drive_status.configure(text="● Error de subida")
+
+        # Un backup local recién creado (de un solo archivo) queda listo para subirlo a mano
+        local = entrada.estado == COMPLETADO and entrada.resultado and not entrada.resultado.get("drive_id")
+        un_archivo = entrada.trabajo and not (entrada.trabajo.volumen_mb or entrada.trabajo.repositorio)
+        if local and entrada.resultado.get("ruta") and un_archivo:
+            self.ui.zip_entry.delete(0, "end")
+            self.ui.zip_entry.insert(0, str(entrada.resultado["ruta"]))
+            self.ui.drive_btn.configure(state="normal")
+
+    def _actualizar_resumen(self):
+        """
+        La barra global muestra la media de los trabajos que siguen activos;
+        los bytes, la velocidad y el tiempo restante salen de las etapas que
+        conocen su tamaño.
+        """
+        activas = [e for e in self.cola.entradas() if not e.terminada]
+        if not activas:
+            self._medidor = None
+            self.ui.progress_bar.set(1.0 if self.cola.entradas() else 0.0)
+            self.ui.progress_text.configure(text="Cola vacía - En espera")
+            self.ui.time_lbl.configure(text="Tiempo restante: --:--")
+            return
+
+        progreso = sum(e.progreso for e in activas) / len(activas)
+        self.ui.progress_bar.set(progreso)
+        self.ui.progress_text.configure(text=f"{int(progreso * 100)}% - {len(activas)} trabajo(s) activo(s)")
+
+        if self._medidor is None:
+            self._medidor = MedidorVelocidad()
+            self._base_bytes = self.cola.bytes_procesados
+        self._medidor.actualizar(self.cola.bytes_procesados - self._base_bytes)
+
+        hechos = sum(e.bytes_hechos for e in activas)
+        total = sum(e.bytes_total for e in activas)
+        velocidad = self._medidor.suavizada or 0.0
+        self.ui.bytes_lbl.configure(
+            text=f"{formatear_bytes(hechos)} de {formatear_bytes(total)} - {formatear_bytes(velocidad)}/s"
+        )
+        self.ui.time_lbl.configure(
+            text=f"Tiempo restante: {formatear_duracion(self._medidor.restante(total - hechos) if total else None)}"
+        )
+
+    def cancelar_trabajo(self, id: int):
+        self.cola.cancelar(id)
+        self.ui.append_log("Cancelando trabajo (un ZIP para al terminar el archivo en curso y se podrá reanudar)...")
+
+    def limpiar_terminados(self):
+        self.ui.job_panel.limpiar_terminados(self.cola.entradas())
+
+    def _prioridad(self) -> int:
+        return PRIORIDADES.get(self.ui.priority_combo.get(), PRIORIDADES["Normal"])
 
     # -------------------- Subida a Google Drive --------------------
 
@@ -34,97 +144,142 @@ class UIController:
             self.ui.append_log("El archivo ZIP no existe.")
             return
 
-        if self._upload_lock.locked():
-            self.ui.append_log("Ya hay una subida en curso.")
-            return
+        self.cola.encolar_subida(zip_path, prioridad=self._prioridad())
+        self.ui.append_log(f"Subida de {zip_path.name} añadida a la cola.")
 
-        hilo = threading.Thread(target=self._upload_thread, args=(zip_path,), daemon=True)
-        hilo.start()
+    # -------------------- Límites y prioridad --------------------
+
+    def ajustar_limites(self):
+        limitador = limitador_global()
+        limitador.fijar(LECTURA_UI.get(self.ui.read_limit_combo.get()), SUBIDA_UI.get(self.ui.upload_limit_combo.get()))
+        self.ui.append_log(f"Límites de velocidad: {limitador.resumen()}")
 
-    def _upload_thread(self, zip_path: Path):
-        with self._upload_lock:
-            # Indicadores iniciales en UI
-            self.ui.after(0, self.ui.append_log, f"Iniciando subida de {zip_path.name} a Google Drive...")
-            self.ui.after(0, self.ui.drive_status.configure, {"text": "● Subiendo a Google Drive"})
-            self.ui.after(0, self.ui.drive_btn.configure, {"state": "disabled"})
-            # Inicializar barra de progreso para la subida
-            self.ui.after(0, self.ui.progress_bar.set, 0.0)
-            self.ui.after(0, self.ui.progress_text.configure, {"text": "0% - Subiendo a Drive"})
+    def bajar_prioridad(self):
+        bajadas = bajar_prioridad()
+        self.ui.append_log(f"Prioridad baja: {', '.join(bajadas) if bajadas else 'no se pudo cambiar'}")
 
+    # -------------------- Backup continuo --------------------
+
+    def _iniciar_continuo(self, trabajo: TrabajoBackup):
+        if trabajo.origen in self._continuos:
+            self.ui.append_log(f"{trabajo.nombre} ya tiene un backup continuo en marcha.")
+            return
+        try:
+            continuo = BackupContinuo(trabajo, log_callback=self.agregador.log)
+        except ValueError as e:
+            self.ui.append_log(f"No se pudo iniciar el backup continuo de {trabajo.nombre}: {e}")
+            return
+
+        def ejecutar():
             try:
-                service = get_drive_service()
-                if not service:
-                    self.ui.after(0, self.ui.append_log, "No se pudo autenticar con Google Drive.")
-                    self.ui.after(0, self.ui.drive_status.configure, {"text": "● No conectado a Google Drive"})
-                    return
-
-                media = MediaFileUpload(str(zip_path), mimetype="application/zip", resumable=True)
-                file_metadata = {"name": zip_path.name}
-                request = service.files().create(body=file_metadata, media_body=media, fields="id")
-
-                response = None
-                # Subida resumible: next_chunk devuelve (status, response)
-                while response is None:
-                    status, response = request.next_chunk()
-                    if status:
-                        progreso = float(status.progress())  # 0.0 - 1.0
-                        porcentaje = int(progreso * 100)
-                        # Actualizar barra de progreso y texto en UI con el texto solicitado
-                        self.ui.after(0, self.ui.progress_bar.set, progreso)
-                        self.ui.after(0, self.ui.progress_text.configure, {"text": f"{porcentaje}% - Subiendo a Drive"})
-                        self.ui.after(0, self.ui.append_log, f"Subida {porcentaje}%")
-
-                file_id = response.get("id")
-                self.ui.after(0, self.ui.append_log, f"Backup subido a Drive con ID: {file_id}")
-                self.ui.after(0, self.ui.drive_status.configure, {"text": "● Conectado a Google Drive"})
-                # Finalizar barra de progreso
-                self.ui.after(0, self.ui.progress_bar.set, 1.0)
-                self.ui.after(0, self.ui.progress_text.configure, {"text": "100% - Subida completada"})
+                continuo.ejecutar()
             except Exception as e:
-                self.ui.after(0, self.ui.append_log, f"Error al subir a Drive: {e}")
-                self.ui.after(0, self.ui.drive_status.configure, {"text": "● Error de subida"})
-                self.ui.after(0, self.ui.progress_text.configure, {"text": "Error durante la subida"})
+                self.agregador.log(f"[{trabajo.nombre}] Backup continuo detenido por un error: {e}")
             finally:
-                # Restaurar estado del botón de Drive según si hay ZIP seleccionado
-                def _restore_button():
-                    if self.ui.zip_entry.get().strip():
-                        self.ui.drive_btn.configure(state="normal")
-                    else:
-                        self.ui.drive_btn.configure(state="disabled")
+                self._continuos.pop(trabajo.origen, None)
 
-                self.ui.after(0, _restore_button)
+        hilo = threading.Thread(target=ejecutar, daemon=True)
+        self._continuos[trabajo.origen] = (continuo, hilo)
+        hilo.start()
+        self.ui.append_log(f"Backup continuo de {trabajo.nombre} iniciado.")
+
+    def detener_continuos(self, esperar: bool = False):
+        """Para los backups continuos; cada uno guarda antes lo que tenga pendiente."""
+        continuos = list(self._continuos.values())
+        for continuo, _ in continuos:
+            continuo.parar()
+        if esperar:
+            for _, hilo in continuos:
+                hilo.join()
+
+    # -------------------- Salida --------------------
+
+    def salir(self, al_terminar):
+        """
+        Para todo antes de cerrar la ventana: los backups continuos guardan lo
+        pendiente y los trabajos de la cola paran en un punto seguro (ver
+        ColaTrabajos.cancelar). Se espera en otro hilo para que la ventana
+        siga atendiendo los avisos; `al_terminar` se ejecuta en el hilo de Tk.
+        """
+        if self.cola.activas() or self._continuos:
+            self.ui.append_log("Cerrando: esperando a que los trabajos lleguen a un punto seguro...")
+
+        def esperar():
+            self.detener_continuos(esperar=True)
+            self.cola.detener(esperar=True)
+            self.ui.after(0, al_terminar)
+
+        threading.Thread(target=esperar, daemon=True).start()
 
     # -------------------- Proceso de backup --------------------
 
-    def iniciar_backup(self):
-        if self._ejecutando:
-            self.ui.append_log("Ya hay un backup en ejecución.")
-            return
-
-        carpeta = self.ui.source_entry.get().strip()
-        if not carpeta:
-            self.ui.append_log("Debes seleccionar una carpeta.")
-            return
-
-        ruta = Path(carpeta)
+    def _validar_carpeta(self, ruta: Path) -> bool:
         if not ruta.exists():
-            self.ui.append_log("La ruta ingresada no existe.")
-            return
+            self.ui.append_log(f"La ruta ingresada no existe: {ruta}")
+            return False
         if not ruta.is_dir():
-            self.ui.append_log("La ruta no es una carpeta válida.")
-            return
+            self.ui.append_log(f"La ruta no es una carpeta válida: {ruta}")
+            return False
         try:
             iterator = next(ruta.iterdir(), None)
             if iterator is None:
-                self.ui.append_log("La carpeta está vacía.")
-                return
+                self.ui.append_log(f"La carpeta está vacía: {ruta}")
+                return False
         except Exception:
-            self.ui.append_log("No se pudo leer la carpeta seleccionada.")
+            self.ui.append_log(f"No se pudo leer la carpeta seleccionada: {ruta}")
+            return False
+        return True
+
+    def iniciar_backup(self):
+        # Varias carpetas separadas por ';' generan un trabajo cada una
+        carpetas = [c.strip() for c in self.ui.source_entry.get().split(";") if c.strip()]
+        if not carpetas:
+            self.ui.append_log("Debes seleccionar una carpeta.")
+            return
+
+        rutas = [Path(c) for c in carpetas]
+        if not all(self._validar_carpeta(ruta) for ruta in rutas):
             return
 
         nivel_ui = self.ui.compress_combo.get()
+        etiqueta_codec = self.ui.codec_combo.get()
+        # El repositorio guarda sus trozos con zlib: usa el codec por defecto (deflate)
+        repositorio = etiqueta_codec == FORMATO_REPOSITORIO
+        codec = next((c for c in listar_codecs() if c.etiqueta == etiqueta_codec), listar_codecs()[0])
         excluir_temporales = bool(self.ui.exclude_tmp.get())
         encriptar = bool(self.ui.encrypt_check.get())
+        incremental = bool(self.ui.incremental_check.get())
+        streaming = bool(self.ui.stream_check.get())
+        subir = streaming or bool(self.ui.upload_check.get())
+        adaptativa = bool(self.ui.adaptive_check.get())
+        volumen_mb = VOLUMENES_UI.get(self.ui.volume_combo.get())
+        cifrado = CIFRADOS_UI.get(self.ui.cipher_combo.get(), "winzip")
+        verificar = bool(self.ui.verify_check.get())
+        continuo = bool(self.ui.continuous_check.get())
+
+        if repositorio and (subir or encriptar or incremental or volumen_mb or continuo):
+            self.ui.append_log(
+                "El repositorio deduplicado no admite subir a Drive, encriptación, incremental, volúmenes ni backup continuo."
+            )
+            return
+        if continuo and (streaming or volumen_mb or not codec.es_zip or (encriptar and cifrado == "contenedor")):
+            self.ui.append_log("El backup continuo solo admite ZIP en disco, sin volúmenes ni contenedor cifrado.")
+            return
+        if streaming and incremental:
+            self.ui.append_log("La subida en streaming no admite backup incremental.")
+            return
+        if incremental and not codec.es_zip:
+            self.ui.append_log(f"El backup incremental no admite el formato {codec.etiqueta}.")
+            return
+        if encriptar and cifrado == "winzip" and not codec.es_zip:
+            self.ui.append_log(f"El formato {codec.etiqueta} solo admite encriptación con contenedor AES-GCM.")
+            return
+        if encriptar and cifrado == "contenedor" and (incremental or volumen_mb):
+            self.ui.append_log("El contenedor cifrado no admite backup incremental ni volúmenes.")
+            return
+        if volumen_mb and (streaming or incremental or not codec.es_zip):
+            self.ui.append_log("Los volúmenes solo admiten backups ZIP completos, sin streaming.")
+            return
 
         password: Optional[str] = None
         if encriptar:
@@ -137,63 +292,46 @@ class UIController:
         self.ui.append_log("Preparando backup...")
         self.ui.append_log(f"Excluir temporales: {'Sí' if excluir_temporales else 'No'}")
         self.ui.append_log(f"Nivel de compresión: {nivel_ui}")
-        self.ui.append_log(f"Encriptación: {'Sí (AES-256)' if encriptar else 'No'}")
-
-        self._ejecutando = True
-        hilo = threading.Thread(
-            target=self._backup_real,
-            args=(ruta, nivel_ui, excluir_temporales, encriptar, password),
-            daemon=True,
-        )
-        hilo.start()
-
-    def _backup_real(self, ruta: Path, nivel_ui: str, excluir_temporales: bool, encriptar: bool, password: Optional[str]):
-        self.ui.after(0, self.ui.start_btn.configure, {"state": "disabled"})
-        self.ui.after(0, self.ui.drive_btn.configure, {"state": "disabled"})
-
-        try:
-            mapa_nivel = {"Bajo (ZIP)": 1, "Medio (ZIP)": 5, "Alto (ZIP)": 9}
-            nivel_real = mapa_nivel.get(nivel_ui, 5)
-
-            destino_zip = ruta.parent / "backup.zip"
-
-            def progreso(actual: int, total: int):
-                porcentaje = actual / total if total else 0.0
-                texto = "Haciendo backup"
-                # Actualizar la UI con el texto "Haciendo backup"
-                self.ui.after(0, self.ui.actualizar_estado, texto, porcentaje)
-
-            total_archivos = crear_backup(
-                carpeta_origen=ruta,
-                destino_zip=destino_zip,
-                nivel_compresion=nivel_real,
+        self.ui.append_log(f"Formato: {etiqueta_codec if repositorio else codec.etiqueta}")
+        self.ui.append_log(f"Encriptación: {self.ui.cipher_combo.get() if encriptar else 'No'}")
+        self.ui.append_log(f"Incremental: {'Sí' if incremental else 'No'}")
+        self.ui.append_log(f"Compresión adaptativa: {'Sí' if adaptativa else 'No'}")
+        self.ui.append_log(f"Verificar al terminar: {'Sí' if verificar else 'No'}")
+        if streaming:
+            self.ui.append_log("Modo streaming: el ZIP se sube a Drive sin guardarse en disco.")
+        elif subir:
+            self.ui.append_log("El backup se subirá a Drive al terminar.")
+        if volumen_mb:
+            self.ui.append_log(f"Volúmenes de {self.ui.volume_combo.get()}.")
+
+        prioridad = self._prioridad()
+        for ruta in rutas:
+            # Con una sola carpeta se mantiene el nombre de siempre (backup.zip)
+            extension = EXTENSION_REPOSITORIO if repositorio else codec.extension
+            nombre_archivo = f"backup{extension}" if len(rutas) == 1 else f"backup-{ruta.name}{extension}"
+            trabajo = TrabajoBackup(
+                nombre=ruta.name,
+                origen=ruta,
+                destino=ruta.parent / nombre_archivo,
+                nivel=nivel_ui,
+                formato=codec.nombre,
                 excluir_temporales=excluir_temporales,
-                encriptar=encriptar,
+                incremental=incremental,
+                adaptativa=adaptativa,
+                subir=subir,
+                streaming=streaming,
                 password=password,
-                progreso_callback=progreso,
+                volumen_mb=volumen_mb,
+                cifrado=cifrado,
+                verificar=verificar,
+                repositorio=repositorio,
             )
-
-            self.ui.after(0, self.ui.actualizar_estado, "Backup completado", 1.0)
-            self.ui.after(0, self.ui.append_log, "Backup creado correctamente.")
-            self.ui.after(0, self.ui.append_log, f"Archivos comprimidos: {total_archivos}")
-            self.ui.after(0, self.ui.append_log, f"Ubicación: {destino_zip}")
-            if encriptar:
-                self.ui.after(0, self.ui.append_log, "Backup protegido con AES-256")
-
-            if destino_zip.exists():
-                self.ui.after(0, self.ui.drive_btn.configure, {"state": "normal"})
-
-        except Exception as e:
-            self.ui.after(0, self.ui.append_log, f"Error durante el backup: {e}")
-            self.ui.after(0, self.ui.progress_text.configure, {"text": "Error durante el backup"})
-        finally:
-            self.ui.after(0, self.ui.start_btn.configure, {"state": "normal"})
-
-            def _maybe_enable_drive():
-                if self.ui.zip_entry.get().strip():
-                    self.ui.drive_btn.configure(state="normal")
-                else:
-                    self.ui.drive_btn.configure(state="disabled")
-
-            self.ui.after(0, _maybe_enable_drive)
-            self._ejecutando = False
+            if continuo:
+                self._iniciar_continuo(trabajo)
+                continue
+            try:
+                self.cola.encolar(trabajo, prioridad=prioridad)
+            except ValueError as e:
+                self.ui.append_log(f"No se pudo encolar {ruta.name}: {e}")
+                continue
+            self.ui.append_log(f"Backup de {ruta.name} añadido a la cola.")
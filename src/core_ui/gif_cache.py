@@ -0,0 +1,62 @@
+import os
+import shutil
+import sys
+from pathlib import Path
+
+
+def _carpeta_cache_usuario() -> Path:
+    """Caché del usuario según el sistema, fuera de la carpeta desde la que se arranca."""
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or Path.home() / "AppData" / "Local"
+    elif sys.platform == "darwin":
+        base = Path.home() / "Library" / "Caches"
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "backtomatic"
+
+
+CARPETA_CACHE = _carpeta_cache_usuario() / "gif"
+
+
+def _carpeta_para(origen: Path, tamano: tuple) -> Path:
+    # La clave incluye la fecha de modificación: si el GIF cambia, se regenera
+    st = origen.stat()
+    return CARPETA_CACHE / f"{origen.stem}-{st.st_mtime_ns}-{st.st_size}-{tamano[0]}x{tamano[1]}"
+
+
+def frames_en_cache(origen: Path, tamano: tuple):
+    """Rutas de los fotogramas ya redimensionados, o None si no hay caché válida."""
+    carpeta = _carpeta_para(origen, tamano)
+    if not carpeta.is_dir():
+        return None
+    return sorted(carpeta.glob("frame_*.png")) or None
+
+
+def generar_cache(origen: Path, tamano: tuple) -> list:
+    """
+    Redimensiona cada fotograma del GIF y lo guarda como PNG.
+
+    Es la única parte que necesita Pillow; Tk carga los PNG por sí mismo, así
+    que en los siguientes arranques no se importa PIL. Se puede ejecutar en un
+    hilo aparte: no toca ningún widget.
+    """
+    from PIL import Image, ImageSequence
+
+    carpeta = _carpeta_para(origen, tamano)
+    tmp = carpeta.with_name(carpeta.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+
+    with Image.open(origen) as gif:
+        for i, frame in enumerate(ImageSequence.Iterator(gif)):
+            redimensionado = frame.convert("RGBA").resize(tamano, Image.Resampling.LANCZOS)
+            # Nivel bajo de compresión: se prima la velocidad de carga
+            redimensionado.save(tmp / f"frame_{i:04d}.png", compress_level=1)
+
+    # Las versiones anteriores del mismo GIF ya no sirven
+    for vieja in CARPETA_CACHE.glob(f"{origen.stem}-*"):
+        if vieja != tmp:
+            shutil.rmtree(vieja, ignore_errors=True)
+    tmp.rename(carpeta)
+
+    return sorted(carpeta.glob("frame_*.png"))
@@ -0,0 +1,64 @@
+import customtkinter as ctk
+
+
+class PanelTrabajos(ctk.CTkScrollableFrame):
+    """Lista de trabajos de la cola con su propia barra de progreso y botón de cancelar."""
+
+    def __init__(self, master, al_cancelar, **kwargs):
+        super().__init__(master, **kwargs)
+        self.al_cancelar = al_cancelar
+        self._filas = {}
+        self.grid_columnconfigure(1, weight=1)
+
+    def actualizar(self, entrada):
+        """Crea o actualiza la fila de una EntradaCola. Llamar desde el hilo de Tk."""
+        fila = self._filas.get(entrada.id)
+        if fila is None:
+            fila = self._crear_fila(entrada)
+
+        nombre, barra, estado, boton = fila
+        barra.set(entrada.progreso)
+        texto = f"{int(entrada.progreso * 100)}% - {entrada.estado}"
+        if entrada.terminada and entrada.mensaje:
+            texto = f"{entrada.estado}: {entrada.mensaje}"
+        estado.configure(text=texto)
+        if entrada.terminada:
+            boton.configure(state="disabled")
+
+    def _crear_fila(self, entrada):
+        fila_grid = len(self._filas)
+        nombre = ctk.CTkLabel(self, text=entrada.nombre, width=110, anchor="w")
+        nombre.grid(row=fila_grid * 2, column=0, padx=(5, 5), sticky="w")
+
+        barra = ctk.CTkProgressBar(self, height=10)
+        barra.grid(row=fila_grid * 2, column=1, padx=5, sticky="ew")
+        barra.set(0)
+
+        boton = ctk.CTkButton(self, text="✕", width=28, command=lambda: self.al_cancelar(entrada.id))
+        boton.grid(row=fila_grid * 2, column=2, padx=5, pady=2)
+
+        estado = ctk.CTkLabel(self, text="", anchor="w", font=("Segoe UI", 11))
+        estado.grid(row=fila_grid * 2 + 1, column=0, columnspan=3, padx=5, sticky="w")
+
+        self._filas[entrada.id] = (nombre, barra, estado, boton)
+        return self._filas[entrada.id]
+
+    def limpiar_terminados(self, entradas):
+        """Quita las filas de los trabajos ya terminados y recoloca el resto."""
+        vivas = []
+        for entrada in entradas:
+            fila = self._filas.pop(entrada.id, None)
+            if fila is None:
+                continue
+            if entrada.terminada:
+                for widget in fila:
+                    widget.destroy()
+            else:
+                vivas.append((entrada.id, fila))
+
+        for i, (id, (nombre, barra, estado, boton)) in enumerate(vivas):
+            nombre.grid(row=i * 2)
+            barra.grid(row=i * 2)
+            boton.grid(row=i * 2)
+            estado.grid(row=i * 2 + 1)
+            self._filas[id] = (nombre, barra, estado, boton)
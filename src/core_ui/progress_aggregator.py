@@ -0,0 +1,60 @@
+import threading
+from collections import deque
+from datetime import datetime
+
+# Frecuencia máxima de refresco de la ventana
+INTERVALO_MS = 100
+# Líneas de log pendientes de pintar; si llegan más, se descartan las más antiguas
+MAX_LOG_PENDIENTE = 1000
+
+
+class AgregadorProgreso:
+    """
+    Junta los avisos que llegan desde los hilos de trabajo y los entrega al
+    hilo de Tk como mucho una vez cada `intervalo_ms`.
+
+    De cada entrada de la cola solo interesa su último estado, así que mil
+    avisos de progreso entre dos refrescos se quedan en uno. Las líneas de
+    log se acumulan (con la hora en que se produjeron) y se pintan de una vez.
+
+    `al_refrescar(entradas, lineas, descartadas)` se ejecuta en el hilo de Tk.
+    """
+
+    def __init__(self, ui, al_refrescar, intervalo_ms: int = INTERVALO_MS, max_log_pendiente: int = MAX_LOG_PENDIENTE):
+        self.ui = ui
+        self.al_refrescar = al_refrescar
+        self.intervalo_ms = intervalo_ms
+        self._lock = threading.Lock()
+        self._entradas = {}
+        self._lineas = deque(maxlen=max_log_pendiente)
+        self._descartadas = 0
+        self._programado = False
+
+    def cambio(self, entrada):
+        with self._lock:
+            self._entradas[entrada.id] = entrada
+            self._programar()
+
+    def log(self, texto: str):
+        with self._lock:
+            if len(self._lineas) == self._lineas.maxlen:
+                self._descartadas += 1
+            self._lineas.append((datetime.now(), texto))
+            self._programar()
+
+    def _programar(self):
+        # Con el lock tomado: un único refresco pendiente a la vez
+        if not self._programado:
+            self._programado = True
+            self.ui.after(self.intervalo_ms, self._vaciar)
+
+    def _vaciar(self):
+        with self._lock:
+            entradas = list(self._entradas.values())
+            lineas = list(self._lineas)
+            descartadas = self._descartadas
+            self._entradas.clear()
+            self._lineas.clear()
+            self._descartadas = 0
+            self._programado = False
+        self.al_refrescar(entradas, lineas, descartadas)
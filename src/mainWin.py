@@ -1,13 +1,18 @@
 import customtkinter as ctk
+import threading
+import tkinter as tk
 import tkinter.filedialog as filedialog
 from datetime import datetime
 from pathlib import Path
 
-from PIL import Image, ImageTk, ImageSequence
-
-from core_ui.controller import UIController
+from core_ui.controller import CIFRADOS_UI, FORMATO_REPOSITORIO, LECTURA_UI, SUBIDA_UI, VOLUMENES_UI, UIController
+from core_ui.gif_cache import frames_en_cache, generar_cache
+from core_ui.job_panel import PanelTrabajos
 from core_ui.tooltip import ToolTip
-from core.drive_auth import get_drive_service
+from core.backup_engine import listar_codecs
+
+TAMANO_GIF = (900, 80)
+MAX_LINEAS_LOG = 2000
 
 
 class MainWin(ctk.CTk):
@@ -29,26 +34,46 @@ class MainWin(ctk.CTk):
         except Exception:
             pass
 
-        self.geometry("920x690")
+        self.geometry("920x840")
         self.resizable(False, False)
+        # Cerrar con la X de la ventana también espera a que los trabajos paren
+        self._cerrando = False
+        self.protocol("WM_DELETE_WINDOW", self.on_exit)
         
         # Construir UI y controlador
         self.build_ui()
         self.controller = UIController(self)
 
-        # Intento de conexión automática a Google Drive al iniciar
-        service = get_drive_service()
-        if service:
+        # Conexión automática a Google Drive en segundo plano: la ventana
+        # aparece sin esperar a la red ni a la renovación del token
+        self.drive_status.configure(text="● Conectando con Google Drive...")
+        threading.Thread(target=self._conectar_drive, daemon=True).start()
+
+    # ----------------- Eventos relacionados con Drive -----------------
+
+    def _conectar_drive(self):
+        try:
+            from core.drive_auth import get_drive_service
+
+            # Sin diálogos: al arrancar solo se reutiliza un token existente
+            service = get_drive_service(interactivo=False, permitir_login=False)
+        except Exception:
+            service = None
+        self.after(0, self._drive_conectado, service is not None)
+
+    def _drive_conectado(self, conectado: bool):
+        if conectado:
             self.drive_status.configure(text="● Conectado a Google Drive")
             self.drive_btn.configure(state="normal")
             self.append_log("Conexión automática a Google Drive establecida.")
         else:
+            self.drive_status.configure(text="● No conectado a Google Drive")
             self.append_log("No se encontraron credenciales válidas. Cárgalas desde la GUI.")
 
-    # ----------------- Eventos relacionados con Drive -----------------
-
     def on_load_credentials(self):
         """Abrir diálogo para cargar credentials.json y actualizar estado."""
+        from core.drive_auth import get_drive_service
+
         service = get_drive_service()  # si no hay credentials, abrirá diálogo
         if service:
             self.append_log("Credenciales cargadas correctamente. Conectado a Google Drive.")
@@ -85,26 +110,10 @@ class MainWin(ctk.CTk):
         self.header = ctk.CTkFrame(self, height=90, corner_radius=8)
         self.header.pack(fill="x", padx=10, pady=(10, 5))
 
-        # GIF animado ancho y bajo
-        try:
-            gif = Image.open(gifPth)
-            self.gif_frames = [
-                ImageTk.PhotoImage(frame.copy().resize((900, 80), Image.Resampling.LANCZOS))
-                for frame in ImageSequence.Iterator(gif)
-            ]
-            self.gif_lbl = ctk.CTkLabel(self.header, text="", image=self.gif_frames[0])
-            self.gif_lbl.pack(side="left", padx=20, pady=10)
-
-            def update_gif(ind=0):
-                frame = self.gif_frames[ind]
-                self.gif_lbl.configure(image=frame)
-                ind = (ind + 1) % len(self.gif_frames)
-                self.after(100, update_gif, ind)
-
-            update_gif()
-        except Exception:
-            # Si falla el GIF, no interrumpe la app
-            ctk.CTkLabel(self.header, text="BackTomatic", font=("Montserrat", 20, "bold")).pack(padx=20, pady=20)
+        # Texto provisional hasta que el GIF esté listo
+        self.gif_lbl = ctk.CTkLabel(self.header, text="BackTomatic", font=("Montserrat", 20, "bold"))
+        self.gif_lbl.pack(side="left", padx=20, pady=10)
+        self.iniciar_gif(gifPth)
 
         # ---------- CARPETA ORIGEN ----------
         self.source_frame = ctk.CTkFrame(self)
@@ -115,6 +124,8 @@ class MainWin(ctk.CTk):
         self.source_entry = ctk.CTkEntry(self.source_frame, width=520)
         self.source_entry.grid(row=0, column=1, padx=5, pady=5)
 
+        ToolTip(self.source_entry, "Para respaldar varias carpetas, sepáralas con ';'.\nCada una se añade a la cola como un trabajo.")
+
         ctk.CTkButton(self.source_frame, text="Explorar...", width=100, command=self.on_browse).grid(
             row=0, column=2, padx=5, pady=5
         )
@@ -142,8 +153,8 @@ class MainWin(ctk.CTk):
 
         ctk.CTkLabel(inner, text="Nivel de compresión:").grid(row=0, column=0, sticky="w")
 
-        self.compress_combo = ctk.CTkComboBox(inner, values=["Bajo (ZIP)", "Medio (ZIP)", "Alto (ZIP)"], width=160)
-        self.compress_combo.set("Alto (ZIP)")
+        self.compress_combo = ctk.CTkComboBox(inner, values=["Bajo", "Medio", "Alto"], width=160)
+        self.compress_combo.set("Alto")
         self.compress_combo.configure(state="readonly")
         self.compress_combo.grid(row=0, column=1, padx=10)
         ToolTip(
@@ -154,12 +165,138 @@ class MainWin(ctk.CTk):
             "Recomendado: Alto",
         )
 
+        ctk.CTkLabel(inner, text="Formato:").grid(row=1, column=0, sticky="w")
+
+        codecs = listar_codecs()
+        self.codec_combo = ctk.CTkComboBox(inner, values=[c.etiqueta for c in codecs] + [FORMATO_REPOSITORIO], width=160)
+        self.codec_combo.set(codecs[0].etiqueta)
+        self.codec_combo.configure(state="readonly")
+        self.codec_combo.grid(row=1, column=1, padx=10)
+        ToolTip(
+            self.codec_combo,
+            "\n".join(
+                f"{c.etiqueta}: velocidad {c.velocidad}, ratio {c.ratio}.\n{c.descripcion}"
+                for c in codecs
+            )
+            + f"\n{FORMATO_REPOSITORIO}: snapshots en la carpeta backup.repo; cada trozo repetido\n"
+            "(entre archivos o entre snapshots) se guarda una sola vez.\n"
+            "Se listan, restauran y limpian con 'python cli.py repo'.",
+        )
+
         self.exclude_tmp = ctk.CTkCheckBox(inner, text="Excluir archivos temporales")
         self.exclude_tmp.grid(row=0, column=2, padx=20, sticky="w")
 
         self.encrypt_check = ctk.CTkCheckBox(inner, text="Habilitar encriptación")
         self.encrypt_check.grid(row=1, column=2, padx=20, pady=5, sticky="w")
 
+        self.cipher_combo = ctk.CTkComboBox(inner, values=list(CIFRADOS_UI), width=200)
+        self.cipher_combo.set(next(iter(CIFRADOS_UI)))
+        self.cipher_combo.configure(state="readonly")
+        self.cipher_combo.grid(row=1, column=3, pady=5, sticky="w")
+        ToolTip(
+            self.cipher_combo,
+            "AES por archivo: ZIP cifrado estándar, se abre con 7-Zip o WinZip.\n"
+            "Contenedor AES-GCM: cifra el backup entero (también los nombres);\n"
+            "más rápido, se descifra con 'python cli.py descifrar'.",
+        )
+
+        self.adaptive_check = ctk.CTkCheckBox(inner, text="Compresión adaptativa")
+        self.adaptive_check.grid(row=2, column=2, padx=20, pady=5, sticky="w")
+        self.adaptive_check.select()
+        ToolTip(
+            self.adaptive_check,
+            "Guarda sin comprimir los archivos que ya vienen comprimidos\n"
+            "(JPEG, MP4, ZIP...) para no gastar CPU sin ganar espacio.",
+        )
+
+        self.verify_check = ctk.CTkCheckBox(inner, text="Verificar al terminar")
+        self.verify_check.grid(row=2, column=3, pady=5, sticky="w")
+        self.verify_check.select()
+        ToolTip(
+            self.verify_check,
+            "Relee el backup y compara cada archivo con el hash calculado\n"
+            "al comprimirlo. Tras subir a Drive se compara además el MD5.",
+        )
+
+        self.incremental_check = ctk.CTkCheckBox(inner, text="Backup incremental")
+        self.incremental_check.grid(row=2, column=0, columnspan=2, pady=5, sticky="w")
+        ToolTip(
+            self.incremental_check,
+            "Solo guarda los archivos nuevos o modificados desde el último backup.\n"
+            "La primera vez se crea un backup completo y un manifiesto junto al ZIP.",
+        )
+
+        self.stream_check = ctk.CTkCheckBox(inner, text="Subir a Drive mientras se comprime")
+        self.stream_check.grid(row=3, column=0, columnspan=2, pady=5, sticky="w")
+        ToolTip(
+            self.stream_check,
+            "Envía el ZIP a Google Drive a medida que se genera,\n"
+            "sin guardar una copia completa en disco.",
+        )
+
+        self.upload_check = ctk.CTkCheckBox(inner, text="Subir a Drive al terminar")
+        self.upload_check.grid(row=3, column=2, padx=20, pady=5, sticky="w")
+        ToolTip(
+            self.upload_check,
+            "Sube el backup en cuanto termina de comprimirse.\n"
+            "Mientras sube, la cola sigue comprimiendo el siguiente trabajo.",
+        )
+
+        self.continuous_check = ctk.CTkCheckBox(inner, text="Backup continuo", command=self.on_toggle_continuous)
+        self.continuous_check.grid(row=3, column=3, pady=5, sticky="w")
+        ToolTip(
+            self.continuous_check,
+            "Tras el backup incremental, vigila la carpeta y añade cada\n"
+            "cambio a un archivo continuo (backup.cont-*.zip) en segundo plano.\n"
+            "Desmárcalo para dejar de vigilar.",
+        )
+
+        ctk.CTkLabel(inner, text="Prioridad:").grid(row=4, column=0, sticky="w")
+
+        self.priority_combo = ctk.CTkComboBox(inner, values=["Alta", "Normal", "Baja"], width=160)
+        self.priority_combo.set("Normal")
+        self.priority_combo.configure(state="readonly")
+        self.priority_combo.grid(row=4, column=1, padx=10)
+        ToolTip(self.priority_combo, "Los trabajos con más prioridad se atienden antes\nque los que ya esperan en la cola.")
+
+        self.volume_combo = ctk.CTkComboBox(inner, values=list(VOLUMENES_UI), width=160)
+        self.volume_combo.set("No dividir")
+        self.volume_combo.configure(state="readonly")
+        self.volume_combo.grid(row=4, column=2, padx=20, pady=5, sticky="w")
+        ToolTip(
+            self.volume_combo,
+            "Divide el backup en volúmenes (backup.zip.001, .002...) con un índice.\n"
+            "Cada volumen se sube a Drive en cuanto se cierra, y restaurar\n"
+            "unos pocos archivos solo necesita los volúmenes que los contienen.",
+        )
+
+        self.low_priority_check = ctk.CTkCheckBox(inner, text="Baja prioridad", command=self.on_low_priority)
+        self.low_priority_check.grid(row=4, column=3, pady=5, sticky="w")
+        ToolTip(
+            self.low_priority_check,
+            "Baja la prioridad de CPU y disco de la aplicación para no\n"
+            "molestar a otros programas. Se mantiene hasta cerrarla.",
+        )
+
+        # Los límites se aplican al momento, también a los trabajos en marcha
+        ctk.CTkLabel(inner, text="Velocidad máx.:").grid(row=5, column=0, sticky="w")
+
+        self.read_limit_combo = ctk.CTkComboBox(
+            inner, values=list(LECTURA_UI), width=160, command=lambda _: self.on_limits_changed()
+        )
+        self.read_limit_combo.set(next(iter(LECTURA_UI)))
+        self.read_limit_combo.configure(state="readonly")
+        self.read_limit_combo.grid(row=5, column=1, padx=10, pady=5)
+        ToolTip(self.read_limit_combo, "Lectura de disco máxima, repartida entre\ntodos los trabajos en curso.")
+
+        self.upload_limit_combo = ctk.CTkComboBox(
+            inner, values=list(SUBIDA_UI), width=160, command=lambda _: self.on_limits_changed()
+        )
+        self.upload_limit_combo.set(next(iter(SUBIDA_UI)))
+        self.upload_limit_combo.configure(state="readonly")
+        self.upload_limit_combo.grid(row=5, column=2, padx=20, pady=5, sticky="w")
+        ToolTip(self.upload_limit_combo, "Subida a Drive máxima, repartida entre\ntodas las subidas en curso.")
+
         # ---------- BOTONES PRINCIPALES ----------
         self.start_btn = ctk.CTkButton(
             self.options_frame,
@@ -198,19 +335,30 @@ class MainWin(ctk.CTk):
             anchor="w", padx=10, pady=5
         )
 
-        self.progress_text = ctk.CTkLabel(self.progress_frame, text="0% - En espera")
+        self.progress_text = ctk.CTkLabel(self.progress_frame, text="Cola vacía - En espera")
         self.progress_text.pack()
 
         self.progress_bar = ctk.CTkProgressBar(self.progress_frame)
         self.progress_bar.pack(fill="x", padx=10, pady=10)
         self.progress_bar.set(0)
 
-        self.bytes_lbl = ctk.CTkLabel(self.progress_frame, text="0 MB de 0 MB")
+        self.bytes_lbl = ctk.CTkLabel(self.progress_frame, text="0 B de 0 B")
         self.bytes_lbl.pack(anchor="w", padx=10)
 
         self.time_lbl = ctk.CTkLabel(self.progress_frame, text="Tiempo restante: --:--")
         self.time_lbl.pack(anchor="w", padx=10)
 
+        # Cola de trabajos: una fila con progreso y botón de cancelar por trabajo
+        jobs_header = ctk.CTkFrame(self.progress_frame, fg_color="transparent")
+        jobs_header.pack(fill="x", padx=10, pady=(5, 0))
+        ctk.CTkLabel(jobs_header, text="Cola de trabajos", font=("Segoe UI", 13, "bold")).pack(side="left")
+        ctk.CTkButton(jobs_header, text="Limpiar terminados", width=120, height=24, command=self.on_clear_jobs).pack(
+            side="right"
+        )
+
+        self.job_panel = PanelTrabajos(self.progress_frame, al_cancelar=self.on_cancel_job, height=120)
+        self.job_panel.pack(fill="both", expand=True, padx=10, pady=5)
+
         # Logs
         self.log_frame = ctk.CTkFrame(self.center)
         self.log_frame.pack(side="left", fill="both", expand=True, padx=(5, 0))
@@ -241,12 +389,50 @@ class MainWin(ctk.CTk):
         self.cred_btn.grid(row=0, column=1, sticky="e", padx=5)
 
         # Botón salir (siempre visible)
-        self.exit_btn = ctk.CTkButton(self.status_frame, text="Salir", width=80, command=self.destroy)
+        self.exit_btn = ctk.CTkButton(self.status_frame, text="Salir", width=80, command=self.on_exit)
         self.exit_btn.grid(row=0, column=2, sticky="e", padx=5)
 
         # Asegurar que la barra de estado quede encima si algo la tapa
         self.status_frame.lift()
 
+    # ----------------- GIF de cabecera -----------------
+
+    def iniciar_gif(self, ruta: Path):
+        """
+        Anima la cabecera con los fotogramas ya redimensionados en caché.
+        Si no hay caché (primer arranque o GIF nuevo), se genera en un hilo y
+        la animación empieza cuando termina, sin retrasar la ventana.
+        """
+        try:
+            rutas = frames_en_cache(ruta, TAMANO_GIF)
+        except OSError:
+            return  # Si falta el GIF, se queda el texto
+        if rutas:
+            self._animar_gif(rutas)
+            return
+
+        def generar():
+            try:
+                frames = generar_cache(ruta, TAMANO_GIF)
+            except Exception:
+                return  # Si falla el GIF, no interrumpe la app
+            self.after(0, self._animar_gif, frames)
+
+        threading.Thread(target=generar, daemon=True).start()
+
+    def _animar_gif(self, rutas):
+        # Cada fotograma se carga la primera vez que se muestra
+        self.gif_frames = [None] * len(rutas)
+
+        def update_gif(ind=0):
+            if self.gif_frames[ind] is None:
+                self.gif_frames[ind] = tk.PhotoImage(file=str(rutas[ind]))
+            self.gif_lbl.configure(image=self.gif_frames[ind], text="")
+            ind = (ind + 1) % len(self.gif_frames)
+            self.after(100, update_gif, ind)
+
+        update_gif()
+
     # ----------------- Otros eventos -----------------
 
     def on_browse(self):
@@ -255,29 +441,54 @@ class MainWin(ctk.CTk):
             self.source_entry.delete(0, "end")
             self.source_entry.insert(0, carpeta)
 
+    def on_exit(self):
+        # Los trabajos paran en un punto seguro antes de cerrar (ver UIController.salir)
+        if self._cerrando:
+            return
+        self._cerrando = True
+        self.exit_btn.configure(state="disabled")
+        self.controller.salir(self.destroy)
+
     def on_start(self):
         self.controller.iniciar_backup()
 
-    # ----------------- Actualizaciones UI -----------------
+    def on_limits_changed(self):
+        self.controller.ajustar_limites()
 
-    def actualizar_estado(self, texto, progreso):
-        """Actualizar barra de progreso y log."""
-        porcentaje = int(progreso * 100)
-        self.progress_text.configure(text=f"{porcentaje}% - {texto}")
-        self.progress_bar.set(progreso)
+    def on_low_priority(self):
+        if self.low_priority_check.get():
+            self.controller.bajar_prioridad()
+            # No se puede volver a subir sin privilegios
+            self.low_priority_check.configure(state="disabled")
 
-        if progreso >= 1:
-            self.append_log("Backup finalizado.")
-        else:
-            self.append_log(texto)
+    def on_toggle_continuous(self):
+        if not self.continuous_check.get():
+            self.controller.detener_continuos()
+
+    def on_cancel_job(self, id):
+        self.controller.cancelar_trabajo(id)
+
+    def on_clear_jobs(self):
+        self.controller.limpiar_terminados()
 
     # ----------------- Utilidades -----------------
 
     def append_log(self, texto):
         """Añade una línea al registro con timestamp."""
-        ahora = datetime.now().strftime("%H:%M")
+        self.append_logs([(datetime.now(), texto)])
+
+    def append_logs(self, lineas):
+        """
+        Añade varias líneas (momento, texto) con un único insert. El registro
+        guarda como mucho MAX_LINEAS_LOG líneas: las más antiguas se borran.
+        """
+        bloque = "".join(f"{momento.strftime('%H:%M')}: {texto}\n" for momento, texto in lineas)
         self.log_box.configure(state="normal")
-        self.log_box.insert("end", f"{ahora}: {texto}\n")
+        self.log_box.insert("end", bloque)
+        # "end" es la línea vacía tras el último salto
+        sobrantes = int(self.log_box.index("end").split(".")[0]) - 2 - MAX_LINEAS_LOG
+        if sobrantes > 0:
+            self.log_box.delete("1.0", f"{sobrantes + 1}.0")
         self.log_box.see("end")
         self.log_box.configure(state="disabled")
 
@@ -0,0 +1,171 @@
+"""
+Reintentos y reanudación de MotorSubida contra el Drive simulado
+(benchmarks/mock_drive.py) con fallos inyectados.
+
+Desde src/:
+    python -m unittest discover tests
+"""
+import hashlib
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from pathlib import Path
+from unittest import mock
+
+from googleapiclient.http import build_http
+
+from benchmarks.mock_drive import DriveSimulado
+from core.drive_upload import CADUCIDAD_SESION, MULTIPLO_CHUNK, ErrorSubida, MotorSubida, SesionesSubida
+from core.throttle import Limitador
+
+TROZOS = 5
+TAMANO = TROZOS * MULTIPLO_CHUNK + 1234
+
+
+class PruebaSubida(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.carpeta = Path(self._tmp.name)
+        self.archivo = self.carpeta / "backup.zip"
+        self.archivo.write_bytes(os.urandom(TAMANO))
+        self.md5 = hashlib.md5(self.archivo.read_bytes()).hexdigest()
+        self.sesiones = SesionesSubida(self.carpeta / "subidas.json")
+        self.drive = DriveSimulado()
+
+    def tearDown(self):
+        self.drive.cerrar()
+        self._tmp.cleanup()
+
+    def motor(self, reintentos: int = 8) -> MotorSubida:
+        # Cada motor nuevo hace de una ejecución nueva de la aplicación: solo comparten el archivo de sesiones
+        return MotorSubida(
+            build_http,
+            chunksize=MULTIPLO_CHUNK,
+            reintentos=reintentos,
+            espera_base=0.001,
+            espera_max=0.01,
+            sesiones=SesionesSubida(self.sesiones.ruta),
+            url_subida=self.drive.url_subida,
+            limitador=Limitador(),
+        )
+
+    def comprobar_subido(self, respuesta: dict):
+        self.assertEqual(respuesta["md5Checksum"], self.md5)
+        self.assertEqual(int(respuesta["size"]), TAMANO)
+        self.assertEqual(self.drive.pendientes(), 0)
+        self.assertIsNone(self.sesiones.obtener(self.archivo))
+
+    def test_sin_fallos(self):
+        self.comprobar_subido(self.motor().subir(self.archivo))
+        self.assertEqual(self.drive.peticiones["POST"], 1)
+        self.assertEqual(self.drive.bytes_recibidos, TAMANO)
+
+    # -------------------- Reintentos --------------------
+
+    def test_reintenta_5xx_y_429_con_backoff(self):
+        self.drive.inyectar(503, metodo="POST")
+        self.drive.inyectar(503, 429, 500)
+        motor = self.motor()
+        esperas = []
+        motor._esperar = esperas.append
+
+        self.comprobar_subido(motor.subir(self.archivo))
+        # Los fallos seguidos alargan la espera; el primer trozo confirmado la reinicia
+        self.assertEqual(esperas, [1, 2, 3, 4])
+        self.assertEqual(self.drive.peticiones["POST"], 2)
+        # El trozo rechazado con 503 se envía otra vez; las consultas de estado no llevan datos
+        self.assertEqual(self.drive.bytes_recibidos, TAMANO + MULTIPLO_CHUNK)
+
+    def test_se_rinde_tras_los_reintentos(self):
+        self.drive.inyectar(*[503] * 4)
+        with self.assertRaisesRegex(ErrorSubida, "tras 3 reintentos"):
+            self.motor(reintentos=3).subir(self.archivo)
+        # La sesión queda guardada para la próxima vez
+        self.assertIsNotNone(self.sesiones.obtener(self.archivo))
+
+    def test_espera_exponencial_con_jitter_y_tope(self):
+        motor = MotorSubida(build_http, espera_base=1.0, espera_max=4.0, sesiones=self.sesiones)
+        with mock.patch("core.drive_upload.time.sleep") as dormir:
+            for intento in range(1, 6):
+                motor._esperar(intento)
+        for (espera,), maxima in zip((c.args for c in dormir.call_args_list), (1, 2, 4, 4, 4)):
+            self.assertGreaterEqual(espera, maxima / 2)
+            self.assertLessEqual(espera, maxima)
+
+    def test_conexion_cortada(self):
+        # httplib2 repite una vez por su cuenta la petición cortada: dos cortes seguidos llegan al motor
+        self.drive.inyectar(None, "cortar", "cortar")
+        self.comprobar_subido(self.motor().subir(self.archivo))
+        self.assertEqual(self.drive.peticiones["POST"], 1)
+
+    def test_respuesta_perdida_tras_guardar_el_trozo(self):
+        self.drive.inyectar(None, "perder_respuesta", "perder_respuesta")
+        self.comprobar_subido(self.motor().subir(self.archivo))
+        # El motor pregunta por dónde va en lugar de reenviar a ciegas
+        self.assertLessEqual(self.drive.bytes_repetidos, MULTIPLO_CHUNK)
+
+    def test_308_sin_avanzar_se_reintenta(self):
+        self.drive.inyectar(None, "estancar", "estancar")
+        self.comprobar_subido(self.motor().subir(self.archivo))
+
+    def test_308_sin_avanzar_no_se_repite_sin_fin(self):
+        self.drive.inyectar(*["estancar"] * 4)
+        with self.assertRaisesRegex(ErrorSubida, "no avanza de 0 bytes"):
+            self.motor(reintentos=3).subir(self.archivo)
+        self.assertEqual(self.drive.peticiones["PUT"], 4)
+
+    # -------------------- Reanudación y caducidad --------------------
+
+    def _interrumpir_tras(self, trozos: int):
+        self.drive.inyectar(*[None] * trozos, 503)
+        with self.assertRaises(ErrorSubida):
+            self.motor(reintentos=0).subir(self.archivo)
+        self.assertIsNotNone(self.sesiones.obtener(self.archivo))
+
+    def test_reanuda_tras_reiniciar_desde_lo_confirmado(self):
+        self._interrumpir_tras(2)
+        progreso = []
+        respuesta = self.motor().subir(self.archivo, progreso_callback=lambda hechos, total: progreso.append(hechos))
+
+        self.comprobar_subido(respuesta)
+        self.assertEqual(progreso[0], 2 * MULTIPLO_CHUNK)
+        # Misma sesión, y de lo que Drive ya tenía no se reenvía nada (solo el trozo rechazado)
+        self.assertEqual(self.drive.peticiones["POST"], 1)
+        self.assertEqual(self.drive.bytes_repetidos, 0)
+        self.assertEqual(self.drive.bytes_recibidos, TAMANO + MULTIPLO_CHUNK)
+
+    def test_sesion_caducada_al_reanudar(self):
+        self._interrumpir_tras(2)
+        self.drive.caducar_sesiones()
+
+        self.comprobar_subido(self.motor().subir(self.archivo))
+        self.assertEqual(self.drive.peticiones["POST"], 2)
+        # Los tres trozos de la sesión caducada se pierden y se sube todo otra vez
+        self.assertEqual(self.drive.bytes_recibidos, 3 * MULTIPLO_CHUNK + TAMANO)
+
+    def test_sesion_caducada_durante_la_subida(self):
+        for codigo in (404, 410):
+            with self.subTest(codigo=codigo):
+                self.drive.peticiones.clear()
+                self.drive.inyectar(None, None, codigo)
+                self.comprobar_subido(self.motor().subir(self.archivo))
+                self.assertEqual(self.drive.peticiones["POST"], 2)
+
+    def test_sesion_guardada_demasiado_antigua(self):
+        self._interrumpir_tras(2)
+        sesiones = json.loads(self.sesiones.ruta.read_text(encoding="utf-8"))
+        for sesion in sesiones.values():
+            creada = datetime.now() - CADUCIDAD_SESION - timedelta(hours=1)
+            sesion["creada"] = creada.isoformat(timespec="seconds")
+        self.sesiones.ruta.write_text(json.dumps(sesiones), encoding="utf-8")
+
+        self.comprobar_subido(self.motor().subir(self.archivo))
+        # Ni se pregunta por la sesión vieja: se abre otra directamente
+        self.assertEqual(self.drive.peticiones["POST"], 2)
+        self.assertEqual(self.drive.peticiones["PUT"], 3 + TROZOS + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()